@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Асинхронний режим сервера рев'ю (opt-in): python async_web_server.py
+
+Ті ж маршрути, що й у QAReviewHandler, але з'єднання обслуговує asyncio:
+- мережеве I/O (читання запиту, відправка відповіді, keep-alive) — у циклі подій;
+- побудова відповіді (JSON, пошук, оцінки) — тим самим QAReviewHandler у
+  обмеженому пулі потоків (ASYNC_WORKERS), на буфері в пам'яті замість сокета;
+- тіла відео/зображень: обробник лише формує заголовки (Range/ETag/304 як завжди),
+  а сам файл віддає цикл подій через loop.sendfile — робочий потік не чекає клієнта;
+- /api/events (SSE) обслуговується прямо в циклі подій, без потоку на вкладку.
+"""
+import asyncio
+import io
+import os
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, Tuple
+
+from eva_state.store import get_state_store
+from eva_state.output_catalog import get_output_catalog
+from eva_state.rating_journal import get_rating_journal
+from simple_web_server import (
+    QAReviewHandler, SSE_KEEPALIVE_S, get_event_feed, _sse_message,
+)
+
+# Розмір пулу для CPU-роботи обробників (JSON, пошук); з'єднань може бути скільки завгодно більше
+ASYNC_WORKERS = int(os.environ.get('ASYNC_WORKERS', str(min(8, (os.cpu_count() or 1) + 2))))
+ASYNC_BACKLOG = 512
+MAX_HEADER_BYTES = 64 * 1024
+MAX_BODY_BYTES = 32 * 1024 * 1024
+# Скільки тримати простоюче keep-alive з'єднання
+KEEPALIVE_IDLE_S = 30.0
+
+
+class _BufferedConnection:
+    """Сокет для обробника в пам'яті: запит з буфера, відповідь у буфер.
+
+    sendfile() не копіює файл, а лише запам'ятовує (дублікат fd, offset, count):
+    тіло потім віддає цикл подій.
+    """
+
+    def __init__(self, request: bytes):
+        self._request = request
+        self.sent = bytearray()
+        self.deferred: Optional[Tuple[io.BufferedReader, int, int]] = None
+
+    def makefile(self, mode, *args, **kwargs):
+        return io.BytesIO(self._request)
+
+    def sendall(self, data):
+        self.sent += data
+
+    def sendfile(self, f, offset=0, count=None):
+        self.deferred = (os.fdopen(os.dup(f.fileno()), 'rb'), offset, count)
+
+    def settimeout(self, *_):
+        pass
+
+    def close(self):
+        pass
+
+
+class _ServerInfo:
+    """Те, що обробник читає з self.server."""
+
+    def __init__(self, port: int):
+        self.server_name = 'localhost'
+        self.server_port = port
+
+
+def _parse_head(head: bytes):
+    """(method, target, version), {header: value} з сирого заголовка запиту; None якщо зіпсований."""
+    lines = head.decode('latin-1').split('\r\n')
+    parts = lines[0].split()
+    if len(parts) != 3 or not parts[2].startswith('HTTP/'):
+        return None, {}
+    headers: Dict[str, str] = {}
+    for line in lines[1:]:
+        name, sep, value = line.partition(':')
+        if sep:
+            headers[name.strip().lower()] = value.strip()
+    return tuple(parts), headers
+
+
+def _keep_alive(version: str, request_headers: Dict[str, str], response: bytes) -> bool:
+    """Чи можна читати з цього з'єднання наступний запит після такої відповіді."""
+    if version != 'HTTP/1.1' or 'close' in request_headers.get('connection', '').lower():
+        return False
+    lines = response.split(b'\r\n\r\n', 1)[0].decode('latin-1').split('\r\n')
+    status = lines[0].split()
+    if len(status) < 2 or status[0] != 'HTTP/1.1':
+        return False
+    headers = {}
+    for line in lines[1:]:
+        name, _, value = line.partition(':')
+        headers[name.strip().lower()] = value.strip().lower()
+    if 'close' in headers.get('connection', ''):
+        return False
+    return 'content-length' in headers or status[1] in ('204', '304')
+
+
+def _simple_response(status: int, reason: str, body: bytes = b'') -> bytes:
+    return (f'HTTP/1.1 {status} {reason}\r\nContent-Type: text/plain; charset=utf-8\r\n'
+            f'Content-Length: {len(body)}\r\nConnection: close\r\n\r\n').encode('latin-1') + body
+
+
+class AsyncReviewServer:
+    """asyncio-сервер поверх QAReviewHandler з обмеженим пулом для CPU-роботи."""
+
+    def __init__(self, handler_class=QAReviewHandler, workers: int = ASYNC_WORKERS):
+        self.handler_class = handler_class
+        self.workers = max(1, int(workers))
+        self.executor: Optional[ThreadPoolExecutor] = None
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self._server_info = _ServerInfo(0)
+        self._feed = None
+        self._bus_wakeup: Optional[asyncio.Event] = None
+
+    async def serve(self, host: str, port: int):
+        self.loop = asyncio.get_running_loop()
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='review-worker')
+        self._server_info = _ServerInfo(port)
+        self._bus_wakeup = asyncio.Event()
+        server = await asyncio.start_server(
+            self._serve_connection, host, port,
+            limit=MAX_HEADER_BYTES, backlog=ASYNC_BACKLOG, reuse_address=True,
+        )
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+    # ---- з'єднання ----
+    async def _serve_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        peer = writer.get_extra_info('peername') or ('', 0)
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), KEEPALIVE_IDLE_S)
+                except asyncio.LimitOverrunError:
+                    writer.write(_simple_response(431, 'Request Header Fields Too Large'))
+                    break
+                except (asyncio.IncompleteReadError, asyncio.TimeoutError):
+                    break
+                request_line, headers = _parse_head(head)
+                if request_line is None:
+                    writer.write(_simple_response(400, 'Bad Request'))
+                    break
+                method, target, version = request_line
+                try:
+                    length = int(headers.get('content-length') or 0)
+                except ValueError:
+                    length = -1
+                if length < 0 or length > MAX_BODY_BYTES:
+                    writer.write(_simple_response(413 if length > 0 else 400, 'Bad Request'))
+                    break
+                body = await reader.readexactly(length) if length else b''
+
+                if method == 'GET' and urllib.parse.urlparse(target).path == '/api/events':
+                    await self._serve_events(writer, headers, target)
+                    break
+
+                try:
+                    response, deferred = await self.loop.run_in_executor(
+                        self.executor, self._run_handler, head + body, peer)
+                except Exception as e:
+                    print(f"❌ Помилка обробки {method} {target}: {e}")
+                    writer.write(_simple_response(500, 'Internal Server Error'))
+                    break
+                try:
+                    writer.write(response)
+                    if deferred is not None:
+                        f, offset, count = deferred
+                        await writer.drain()
+                        await self.loop.sendfile(writer.transport, f, offset, count)
+                    await writer.drain()
+                finally:
+                    if deferred is not None:
+                        deferred[0].close()
+                if not _keep_alive(version, headers, response):
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            # Браузер перериває завантаження відео при перемотуванні — це нормально
+            pass
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except (ConnectionError, OSError):
+                pass
+
+    def _run_handler(self, raw_request: bytes, peer):
+        """Виконується в пулі: звичайний QAReviewHandler на буфері в пам'яті."""
+        conn = _BufferedConnection(raw_request)
+        self.handler_class(conn, peer, self._server_info)
+        return bytes(conn.sent), conn.deferred
+
+    # ---- /api/events ----
+    def _event_feed(self):
+        if self._feed is None:
+            video_dir = os.environ.get("COMFY_OUTPUT_DIR", "/workspace/ComfyUI/output/")
+            workspace_dir = os.environ.get("AGENT_T2I2V_DIR", "/workspace/Agent_T2I2V/")
+            auto_state_dir = os.path.join(workspace_dir, "auto_state")
+            os.makedirs(auto_state_dir, exist_ok=True)
+            feed = get_event_feed(get_state_store(auto_state_dir), get_output_catalog(video_dir),
+                                  get_rating_journal(auto_state_dir), auto_state_dir)
+            feed.bus.add_listener(self._on_bus_event)
+            self._feed = feed
+        return self._feed
+
+    def _on_bus_event(self, _event):
+        # Викликається з потоку, що опублікував подію: будимо цикл подій
+        self.loop.call_soon_threadsafe(self._wake_subscribers)
+
+    def _wake_subscribers(self):
+        wakeup, self._bus_wakeup = self._bus_wakeup, asyncio.Event()
+        wakeup.set()
+
+    async def _serve_events(self, writer: asyncio.StreamWriter, headers: Dict[str, str], target: str):
+        """SSE як у EnhancedVideoReviewHandler.serve_events, але корутиною, а не потоком."""
+        feed = await self.loop.run_in_executor(self.executor, self._event_feed)
+        bus = feed.bus
+        last_id = headers.get('last-event-id')
+        if last_id is None:
+            query = urllib.parse.parse_qs(urllib.parse.urlparse(target).query)
+            last_id = query.get('last_id', [None])[0]
+        try:
+            last_id = int(last_id) if last_id is not None else None
+        except ValueError:
+            last_id = None
+
+        writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: text/event-stream; charset=utf-8\r\n'
+                     b'Cache-Control: no-cache\r\nX-Accel-Buffering: no\r\n'
+                     b'Access-Control-Allow-Origin: *\r\nConnection: close\r\n\r\nretry: 3000\n\n')
+        bus.subscribe()
+        try:
+            backlog = bus.since(last_id) if last_id is not None and last_id <= bus.last_id else None
+            if backlog is None:
+                last_id = bus.last_id
+                stats = await self.loop.run_in_executor(self.executor, feed.current_stats)
+                writer.write(_sse_message('resync' if 'last-event-id' in headers else 'stats', stats, last_id))
+                backlog = []
+            while True:
+                for event in backlog:
+                    writer.write(_sse_message(event.type, event.data, event.id))
+                    last_id = event.id
+                await writer.drain()
+                # Спершу беремо подію пробудження, потім перевіряємо шину: публікація між ними не загубиться
+                wakeup = self._bus_wakeup
+                backlog = bus.since(last_id)
+                if backlog is None:
+                    last_id = bus.last_id
+                    stats = await self.loop.run_in_executor(self.executor, feed.current_stats)
+                    writer.write(_sse_message('resync', stats, last_id))
+                    backlog = []
+                    continue
+                if backlog:
+                    continue
+                try:
+                    await asyncio.wait_for(wakeup.wait(), SSE_KEEPALIVE_S)
+                except asyncio.TimeoutError:
+                    writer.write(b': keepalive\n\n')
+                backlog = []
+        finally:
+            bus.unsubscribe()
+
+
+if __name__ == '__main__':
+    PORT = int(os.environ.get('SERVER_PORT', os.environ.get('PORT', '8189')))
+    print("🚀 Запуск Enhanced Video Review System (async) для RunPod...")
+    print(f"🎬 Директорія відео: {os.environ.get('COMFY_OUTPUT_DIR', '/workspace/ComfyUI/output/')}")
+    print(f"🧵 Потоків для обробки запитів: {ASYNC_WORKERS}")
+    print(f"🌐 Сервер запущено на порту {PORT}")
+    try:
+        asyncio.run(AsyncReviewServer().serve('', PORT))
+    except KeyboardInterrupt:
+        print("\n🛑 Сервер зупинено")
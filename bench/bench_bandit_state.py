@@ -0,0 +1,152 @@
+"""Lost updates in bandit_state.json with concurrent writers: plain overwrite vs VersionedState.
+
+Runs, in separate processes against one file,
+
+  agents  – the agent's bandit: state kept in memory, one reward update per
+            iteration (N/S/scores, t) and a ban every 25th iteration, then save
+  server  – the review server's journal fold: t += 1 and one new banned combo
+            per rating
+  reader  – the review server's snapshot: json.load in a loop
+
+in two modes:
+
+  overwrite – what the writers did before: load at start (agent) or per write
+              (server), then json.dump over the file
+  versioned – MultiDimensionalBandit-style `commit` (compare-and-swap + merge)
+              for agents, `update` under the lock for the server
+
+and checks the final file against what was written: total pulls (sum N),
+``t`` and the set of banned combos. Also reports the mean write latency and
+the slowest read seen by the reader (writers never block it).
+
+Usage: python bench/bench_bandit_state.py [--agents 2] [--updates 300] [--bans 300]
+"""
+import argparse
+import copy
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from eva_state.rating_journal import atomic_write_json  # noqa: E402
+from eva_state.versioned_state import VersionedState, get_bandit_state, merge_bandit_state  # noqa: E402
+
+SAMPLERS = ["euler", "dpmpp_2m", "dpmpp_sde", "uni_pc"]
+
+
+def _plain_read(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"combo_stats": {}, "t": 0, "banned_combos": []}
+
+
+def agent(mode, path, worker, updates, out):
+    rnd = random.Random(worker)
+    state = get_bandit_state(path)
+    version, base = state.read()
+    doc = copy.deepcopy(base) if mode == "versioned" else _plain_read(path)
+    doc.setdefault("combo_stats", {})
+    doc.setdefault("banned_combos", [])
+    spent = 0.0
+    for i in range(updates):
+        key = f"{rnd.choice(SAMPLERS)}|normal|24|7.0|25|768x1344"
+        arm = doc["combo_stats"].setdefault(key, {"N": 0, "S": 0.0, "scores": []})
+        reward = rnd.random()
+        arm["N"] += 1
+        arm["S"] += reward
+        arm["scores"] = (arm["scores"] + [reward])[-20:]
+        doc["t"] = doc.get("t", 0) + 1
+        if i % 25 == 0:
+            doc["banned_combos"].append(f"agent{worker}-ban{i}")
+        t0 = time.perf_counter()
+        if mode == "versioned":
+            version, merged = state.commit(version, base, doc, merge_bandit_state)
+            base, doc = merged, copy.deepcopy(merged)
+        else:
+            atomic_write_json(path, doc)
+        spent += time.perf_counter() - t0
+    out.put(("agent", spent / updates))
+
+
+def server(mode, path, bans, out):
+    state = get_bandit_state(path)
+    spent = 0.0
+    for i in range(bans):
+        def fold(bandit, i=i):
+            bandit["t"] = bandit.get("t", 0) + 1
+            bandit.setdefault("banned_combos", []).append(f"server-ban{i}")
+        t0 = time.perf_counter()
+        if mode == "versioned":
+            state.update(fold)
+        else:
+            bandit = _plain_read(path)
+            fold(bandit)
+            atomic_write_json(path, bandit)
+        spent += time.perf_counter() - t0
+    out.put(("server", spent / bans))
+
+
+def reader(path, stop, out):
+    worst, reads = 0.0, 0
+    while not stop.is_set():
+        t0 = time.perf_counter()
+        _plain_read(path)
+        worst = max(worst, time.perf_counter() - t0)
+        reads += 1
+    out.put(("reader", (worst, reads)))
+
+
+def run(mode, args):
+    root = tempfile.mkdtemp(prefix="bench_bandit_")
+    try:
+        path = os.path.join(root, "bandit_state.json")
+        VersionedState(path).update(lambda d: {"combo_stats": {}, "t": 0, "banned_combos": []})
+        out, stop = multiprocessing.Queue(), multiprocessing.Event()
+        procs = [multiprocessing.Process(target=agent, args=(mode, path, w, args.updates, out))
+                 for w in range(args.agents)]
+        procs.append(multiprocessing.Process(target=server, args=(mode, path, args.bans, out)))
+        read_proc = multiprocessing.Process(target=reader, args=(path, stop, out))
+        read_proc.start()
+        for p in procs:
+            p.start()
+        for p in procs:
+            p.join()
+        stop.set()
+        read_proc.join()
+        results = [out.get() for _ in range(len(procs) + 1)]
+
+        final = _plain_read(path)
+        pulls = sum(a["N"] for a in final.get("combo_stats", {}).values())
+        expected_bans = args.bans + args.agents * len(range(0, args.updates, 25))
+        agent_ms = [v * 1000 for k, v in results if k == "agent"]
+        server_ms = [v * 1000 for k, v in results if k == "server"]
+        worst_read, reads = next(v for k, v in results if k == "reader")
+        print(f"{mode:10}{pulls:>7}/{args.agents * args.updates:<7}{final.get('t', 0):>7}/{args.agents * args.updates + args.bans:<7}"
+              f"{len(set(final.get('banned_combos', []))):>7}/{expected_bans:<7}"
+              f"{sum(agent_ms) / len(agent_ms):>10.2f}{server_ms[0]:>11.2f}{worst_read * 1000:>13.2f}{reads:>8}")
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--agents", type=int, default=2)
+    ap.add_argument("--updates", type=int, default=300)
+    ap.add_argument("--bans", type=int, default=300)
+    args = ap.parse_args()
+    print(f"{args.agents} agents x {args.updates} reward updates, server {args.bans} bans, 1 reader")
+    print(f"{'mode':10}{'pulls':>14}{'t':>14}{'bans':>14}{'agent ms':>10}{'server ms':>11}{'max read ms':>13}{'reads':>8}")
+    for mode in ("overwrite", "versioned"):
+        run(mode, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""ComfyClientPool over stub ComfyUI backends (qa/stub_comfyui.py, real HTTP, no GPU).
+
+A thin agent whose render stage is `pool.queue` / `pool.poll` is driven by the
+real `GenerationPipeline` with two jobs in flight per backend:
+
+  scaling  – 1, 2, 3 ... backends: iterations/hour and jobs per backend
+  faults   – 3 backends, one failing --fail-rate of its jobs, another one shut
+             down after a third of the iterations: every iteration must still
+             end with a video (retried elsewhere), retries are counted
+
+Durations are given in real seconds and run scaled down by --scale; the
+report converts back, so iterations/hour are per real hour.
+
+Usage: python bench/bench_comfy_pool.py [--iterations 24] [--render 90] [--backends 1 2 3] [--fail-rate 0.3]
+"""
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import threading
+
+os.environ.setdefault("EVA_SKIP_HEAVY_IMPORTS", "1")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from eva_p1.comfy_pool import ComfyClientPool  # noqa: E402
+from eva_p1.pipeline import GenerationPipeline, RenderedJob  # noqa: E402
+from qa.stub_comfyui import StubComfyUI  # noqa: E402
+
+logging.getLogger("enhanced-video-agent-v4").setLevel(logging.ERROR)
+
+
+class PoolAgent:
+    def __init__(self, pool, on_done=None):
+        self.client = pool
+        self.state_lock = threading.RLock()
+        self._renders = {}
+        self.videos = []
+        self.on_done = on_done
+
+    def attach_render(self, job):
+        with self.state_lock:
+            self._renders[id(job.params)] = job
+
+    def submit_v4(self, params):
+        job = RenderedJob(params=params, prefix=f"gen_{params['i']}")
+        job.workflow = {"80": {"class_type": "VHS_VideoCombine", "inputs": {"filename_prefix": job.prefix}}}
+        job.prompt_id = self.client.queue(job.workflow)
+        return job
+
+    def poll_v4(self, job, exclusive=True):
+        entry = self.client.poll(job.prompt_id)
+        if entry is None:
+            return False
+        files = self.client.output_files(entry)
+        job.video_path = os.path.join(self.client.output_dir, files[0]["filename"]) if files else None
+        return True
+
+    def run_iteration_v4(self, params):
+        with self.state_lock:
+            job = self._renders.pop(id(params))
+            ok = bool(job.video_path and os.path.exists(job.video_path))
+            self.videos.append(job.video_path if ok else None)
+            if self.on_done:
+                self.on_done(len(self.videos))
+        return (1.0 if ok else 0.0), {}, job.video_path if ok else None, job.workflow
+
+
+def params_source(n):
+    for i in range(n):
+        yield "", {"i": i}
+
+
+def run_pool(args, stubs, on_done=None):
+    s = args.scale
+    pool = ComfyClientPool([st.url for st in stubs], output_dir=tempfile.mkdtemp(prefix="bench_pool_"),
+                           health_ttl_s=5 * s, cooldown_s=30 * s, lost_after_s=60 * s, local=False)
+    agent = PoolAgent(pool, on_done)
+    pipeline = GenerationPipeline(agent, pipelined=False, queue_depth=2 * len(stubs), poll_s=2 * s)
+    stats = pipeline.run(params_source(args.iterations), args.iterations)
+    return pool, agent, stats
+
+
+def scaling(args):
+    s = args.scale
+    print(f"scaling: {args.iterations} iterations, render {args.render:g}s, 2 jobs in flight per backend")
+    base = None
+    for n in args.backends:
+        stubs = [StubComfyUI(render_s=args.render * s, seed=i).start() for i in range(n)]
+        try:
+            pool, agent, stats = run_pool(args, stubs)
+        finally:
+            for st in stubs:
+                st.stop()
+        per_hour = stats.iterations * 3600 / (stats.wall_s / s)
+        base = base or per_hour
+        ok = sum(1 for v in agent.videos if v)
+        print(f"  {n} backend(s){per_hour:>10.1f} it/h   x{per_hour / base:.2f}   videos {ok}/{args.iterations}   "
+              f"jobs per backend {[b.jobs for b in pool.backends]}")
+
+
+def faults(args):
+    s = args.scale
+    stubs = [StubComfyUI(render_s=args.render * s, seed=0).start(),
+             StubComfyUI(render_s=args.render * s, seed=1).start(),
+             StubComfyUI(render_s=args.render * s, fail_rate=args.fail_rate, seed=2).start()]
+    killed = []
+
+    def on_done(done):
+        if not killed and done >= args.iterations // 3:
+            stubs[1].stop()
+            killed.append(done)
+
+    try:
+        pool, agent, stats = run_pool(args, stubs, on_done)
+    finally:
+        for st in (stubs[0], stubs[2]):
+            st.stop()
+    ok = sum(1 for v in agent.videos if v)
+    per_hour = stats.iterations * 3600 / (stats.wall_s / s)
+    print(f"faults: 3 backends, #3 fails {args.fail_rate:.0%} of its jobs, #2 shut down after {killed[0] if killed else '-'} "
+          f"iterations")
+    print(f"  videos {ok}/{args.iterations}   retries {pool.retries}   {per_hour:.1f} it/h   "
+          f"jobs per backend {[b.jobs for b in pool.backends]}   stub failures {stubs[2].failed}")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--iterations", type=int, default=24)
+    ap.add_argument("--render", type=float, default=90.0, help="ComfyUI render, s")
+    ap.add_argument("--backends", type=int, nargs="+", default=[1, 2, 3])
+    ap.add_argument("--fail-rate", type=float, default=0.3, help="failing backend in the fault run")
+    ap.add_argument("--scale", type=float, default=0.005, help="simulated seconds per real second")
+    args = ap.parse_args()
+    scaling(args)
+    faults(args)
+
+
+if __name__ == "__main__":
+    main()
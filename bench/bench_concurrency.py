@@ -0,0 +1,199 @@
+"""Threaded vs async review server under 50 concurrent clients.
+
+Starts each server as a subprocess on the same synthetic workspace and runs a
+mixed load for a fixed time: a few clients download large videos (reading
+slowly, like a browser buffering playback) while the rest hammer the JSON API
+(/api/search, /api/videos, /api/stats) over persistent connections (or a new
+connection per request with --no-keepalive). Reports API latency percentiles,
+throughput, failed requests, and the server's peak thread count / RSS / CPU.
+
+Usage: python bench/bench_concurrency.py [--clients 50] [--video-clients 8] [--duration 15] [--no-keepalive]
+"""
+import argparse
+import http.client
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_json_responses import build_workspace  # noqa: E402
+
+API_PATHS = [
+    "/api/search?rated=all&offset=0&limit=50",
+    "/api/search?q=euler&offset=0&limit=50",
+    "/api/videos?cursor=&limit=50",
+    "/api/stats",
+]
+BIG_VIDEO_MB = 40
+
+
+def _proc_status(pid: int):
+    threads = rss_kb = 0
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("Threads:"):
+                threads = int(line.split()[1])
+            elif line.startswith("VmRSS:"):
+                rss_kb = int(line.split()[1])
+    return threads, rss_kb
+
+
+def _proc_cpu(pid: int) -> float:
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def _wait_port(port: int, timeout: float = 15.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=2)
+            conn.request("GET", "/api/stats")
+            conn.getresponse().read()
+            conn.close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"server on port {port} did not start")
+
+
+def run_load(port: int, pid: int, clients: int, video_clients: int, duration: float, videos, keepalive: bool = True):
+    stop = time.time() + duration
+    latencies, errors, video_bytes = [], [0], [0]
+    lock = threading.Lock()
+    peak = {"threads": 0, "rss_kb": 0}
+
+    def api_client(seed):
+        rnd = random.Random(seed)
+        conn = None
+        while time.time() < stop:
+            path = rnd.choice(API_PATHS)
+            t0 = time.perf_counter()
+            try:
+                if conn is None or not keepalive:
+                    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+                conn.request("GET", path, headers={"Accept-Encoding": "gzip"})
+                resp = conn.getresponse()
+                resp.read()
+                if resp.will_close:
+                    conn.close()
+                    conn = None
+                ok = resp.status == 200
+            except (OSError, http.client.HTTPException):
+                conn = None
+                ok = False
+            with lock:
+                if ok:
+                    latencies.append((time.perf_counter() - t0) * 1000)
+                else:
+                    errors[0] += 1
+
+    def video_client(seed):
+        rnd = random.Random(seed)
+        while time.time() < stop:
+            try:
+                conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+                conn.request("GET", "/video/" + rnd.choice(videos))
+                resp = conn.getresponse()
+                while time.time() < stop:
+                    chunk = resp.read(256 * 1024)
+                    if not chunk:
+                        break
+                    with lock:
+                        video_bytes[0] += len(chunk)
+                    time.sleep(0.01)  # player consumes the stream at a finite rate
+                conn.close()
+            except OSError:
+                with lock:
+                    errors[0] += 1
+
+    def sampler():
+        while time.time() < stop:
+            try:
+                threads, rss_kb = _proc_status(pid)
+            except OSError:
+                return
+            peak["threads"] = max(peak["threads"], threads)
+            peak["rss_kb"] = max(peak["rss_kb"], rss_kb)
+            time.sleep(0.1)
+
+    workers = [threading.Thread(target=video_client, args=(i,)) for i in range(video_clients)]
+    workers += [threading.Thread(target=api_client, args=(i,)) for i in range(clients - video_clients)]
+    workers.append(threading.Thread(target=sampler))
+    cpu0 = _proc_cpu(pid)
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    cpu = _proc_cpu(pid) - cpu0
+    lat = sorted(latencies)
+
+    def pct(p):
+        return lat[min(len(lat) - 1, int(len(lat) * p))] if lat else float("nan")
+
+    return {
+        "api_ok": len(lat),
+        "api_rps": len(lat) / duration,
+        "p50": statistics.median(lat) if lat else float("nan"),
+        "p95": pct(0.95),
+        "p99": pct(0.99),
+        "errors": errors[0],
+        "video_mb_s": video_bytes[0] / duration / 1e6,
+        "peak_threads": peak["threads"],
+        "peak_rss_mb": peak["rss_kb"] / 1024,
+        "server_cpu_s": cpu,
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--clients", type=int, default=50)
+    ap.add_argument("--video-clients", type=int, default=8)
+    ap.add_argument("--duration", type=float, default=15.0)
+    ap.add_argument("--videos", type=int, default=400)
+    ap.add_argument("--history", type=int, default=3000)
+    ap.add_argument("--port", type=int, default=18231)
+    ap.add_argument("--no-keepalive", action="store_true", help="new TCP connection for every API request")
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        build_workspace(root, args.videos, args.history)
+        out_dir = os.environ["COMFY_OUTPUT_DIR"]
+        big = []
+        for i in range(4):
+            name = f"big_{i}.mp4"
+            with open(os.path.join(out_dir, name), "wb") as f:
+                f.write(os.urandom(BIG_VIDEO_MB * 1024 * 1024))
+            big.append(name)
+
+        results = []
+        for label, script in (("threaded", "simple_web_server.py"), ("async", "async_web_server.py")):
+            env = dict(os.environ, PORT=str(args.port))
+            proc = subprocess.Popen([sys.executable, os.path.join(ROOT, script)], cwd=ROOT, env=env,
+                                    stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            try:
+                _wait_port(args.port)
+                results.append((label, run_load(args.port, proc.pid, args.clients, args.video_clients,
+                                                 args.duration, big, not args.no_keepalive)))
+            finally:
+                proc.terminate()
+                proc.wait(10)
+            args.port += 1
+
+    print(f"{args.clients} clients ({args.video_clients} streaming {BIG_VIDEO_MB} MB videos), {args.duration:.0f} s each")
+    cols = ("api_ok", "api_rps", "p50", "p95", "p99", "errors", "video_mb_s", "peak_threads", "peak_rss_mb", "server_cpu_s")
+    print(f"{'server':9}" + "".join(f"{c:>13}" for c in cols))
+    for label, r in results:
+        print(f"{label:9}" + "".join(f"{r[c]:>13.1f}" if isinstance(r[c], float) else f"{r[c]:>13}" for c in cols))
+
+
+if __name__ == "__main__":
+    main()
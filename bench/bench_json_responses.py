@@ -0,0 +1,165 @@
+"""Bytes on the wire and server CPU per request for the review API JSON endpoints.
+
+Builds a synthetic workspace (knowledge history with full prompts, ratings,
+dummy mp4 files), drives the real handler in-process through an in-memory
+socket and compares:
+
+  before   – the old send_json_response (indent=2, no gzip, no ETag)
+  compact  – compact JSON, client without Accept-Encoding
+  gzip     – compact JSON + gzip
+  304      – revalidation with the ETag from a previous response
+
+Usage: python bench/bench_json_responses.py [--videos 400] [--history 3000] [--repeat 30]
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class _MemorySocket:
+    """Just enough of a socket for StreamRequestHandler: one request in, bytes out."""
+
+    def __init__(self, request: bytes):
+        self._request = request
+        self.sent = bytearray()
+
+    def makefile(self, mode, *args, **kwargs):
+        return io.BytesIO(self._request)
+
+    def sendall(self, data):
+        self.sent += data
+
+    def settimeout(self, *_):
+        pass
+
+    def close(self):
+        pass
+
+
+class _Server:
+    server_name = "bench"
+    server_port = 0
+
+
+def build_workspace(root: str, n_videos: int, n_history: int):
+    out_dir = os.path.join(root, "out")
+    ws_dir = os.path.join(root, "ws")
+    state_dir = os.path.join(ws_dir, "auto_state")
+    os.makedirs(out_dir)
+    os.makedirs(state_dir)
+    rnd = random.Random(7)
+    words = ("cinematic portrait woman golden hour soft light bokeh 35mm film grain "
+             "detailed skin natural pose wind hair city street night neon rain").split()
+
+    def text(n):
+        return " ".join(rnd.choice(words) for _ in range(n))
+
+    base_ts = 1757500000
+    history = []
+    for i in range(n_history):
+        name = f"gen_{base_ts + i * 90}_00001_.mp4"
+        history.append({
+            "video": os.path.join(out_dir, name),
+            "timestamp": base_ts + i * 90,
+            "iteration": i,
+            "prompt": text(120),
+            "negative_prompt": text(80),
+            "photo_prompt": text(100),
+            "photo_negative": text(60),
+            "source_image": f"/workspace/images/img_{i}.png",
+            "params": {"fps": 20, "width": 768, "height": 432, "seconds": 5, "seed": rnd.randint(0, 2**31),
+                       "sampler": "euler", "scheduler": "normal", "steps": 25, "cfg_scale": 7.0},
+            "combo": ["euler", "normal"],
+            "metrics": {"overall": rnd.random(), "blur": rnd.random(), "exposure": rnd.random()},
+        })
+    for i, entry in enumerate(history[-n_videos:]):
+        path = entry["video"]
+        with open(path, "wb") as f:
+            f.write(b"\0" * 1024)
+        os.utime(path, (entry["timestamp"], entry["timestamp"]))
+    ratings = {os.path.basename(e["video"]): {"rating": {"overall_quality": rnd.randint(1, 10)}}
+               for e in history[:n_history // 2]}
+    with open(os.path.join(state_dir, "knowledge.json"), "w", encoding="utf-8") as f:
+        json.dump({"best_score": 0.9, "best_params": {}, "history": history}, f)
+    with open(os.path.join(state_dir, "manual_ratings.json"), "w", encoding="utf-8") as f:
+        json.dump(ratings, f)
+    os.environ["COMFY_OUTPUT_DIR"] = out_dir + "/"
+    os.environ["AGENT_T2I2V_DIR"] = ws_dir + "/"
+
+
+def legacy_send_json_response(self, data, etag=None):
+    """send_json_response as it was before compact/gzip/ETag."""
+    self.send_response(200)
+    self.send_header('Content-type', 'application/json; charset=utf-8')
+    self.send_header('Access-Control-Allow-Origin', '*')
+    self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
+    self.send_header('Access-Control-Allow-Headers', 'Content-Type')
+    self.end_headers()
+    self.wfile.write(json.dumps(data, ensure_ascii=False, indent=2).encode('utf-8'))
+
+
+def request(handler_cls, path: str, headers: dict):
+    raw = f"GET {path} HTTP/1.1\r\nHost: bench\r\n" + "".join(f"{k}: {v}\r\n" for k, v in headers.items()) + "\r\n"
+    sock = _MemorySocket(raw.encode("latin-1"))
+    handler_cls(sock, ("127.0.0.1", 0), _Server())
+    head, _, _body = bytes(sock.sent).partition(b"\r\n\r\n")
+    status = int(head.split(b" ", 2)[1])
+    etag = None
+    for line in head.split(b"\r\n")[1:]:
+        k, _, v = line.decode("latin-1").partition(":")
+        if k.strip().lower() == "etag":
+            etag = v.strip()
+    return status, len(sock.sent), etag
+
+
+def measure(handler_cls, path: str, headers: dict, repeat: int):
+    request(handler_cls, path, headers)  # warm caches (state store, knowledge index, catalog)
+    t0 = time.process_time()
+    for _ in range(repeat):
+        status, size, etag = request(handler_cls, path, headers)
+    cpu_ms = (time.process_time() - t0) * 1000 / repeat
+    return status, size, etag, cpu_ms
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--videos", type=int, default=400)
+    ap.add_argument("--history", type=int, default=3000)
+    ap.add_argument("--repeat", type=int, default=30)
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        build_workspace(root, args.videos, args.history)
+        import simple_web_server as sws
+
+        class Before(sws.QAReviewHandler):
+            send_json_response = legacy_send_json_response
+
+            def _json_not_modified(self, etag):
+                return False
+
+        After = sws.QAReviewHandler
+        paths = ["/api/videos?offset=0&limit=50", "/api/search?rated=all&offset=0&limit=50", "/api/stats"]
+        print(f"{'endpoint':42} {'variant':8} {'status':>6} {'bytes':>9} {'cpu ms/req':>11}")
+        with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+            rows = []
+            for path in paths:
+                rows.append((path, "before") + measure(Before, path, {}, args.repeat))
+                rows.append((path, "compact") + measure(After, path, {}, args.repeat))
+                gz = measure(After, path, {"Accept-Encoding": "gzip"}, args.repeat)
+                rows.append((path, "gzip") + gz)
+                rows.append((path, "304") + measure(After, path, {"Accept-Encoding": "gzip", "If-None-Match": gz[2]}, args.repeat))
+        for path, variant, status, size, _etag, cpu_ms in rows:
+            print(f"{path:42} {variant:8} {status:>6} {size:>9} {cpu_ms:>11.2f}")
+
+
+if __name__ == "__main__":
+    main()
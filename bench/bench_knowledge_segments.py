@@ -0,0 +1,115 @@
+"""Cost of persisting / re-reading knowledge history: monolithic knowledge.json vs per-day segments.
+
+For N synthetic history entries (same generator as bench_search_index) times:
+
+  append  – agent records one generation: json.dump of the whole document
+            (indent=2, as _save_knowledge does) vs KnowledgeSegments.append
+  reload  – a reader picks the new entry up: json.load of knowledge.json vs
+            KnowledgeSegments.document() (manifest + grown tail segment only)
+  fold    – journal compaction with one rating: load + rewrite knowledge.json
+            vs KnowledgeSegments.fold (rewrites the one segment holding the video)
+
+Usage: python bench/bench_knowledge_segments.py [--videos 10000 100000] [--repeat 5]
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_search_index import build_state  # noqa: E402
+from eva_state.knowledge_segments import KnowledgeSegments  # noqa: E402
+from eva_state.rating_journal import RatingJournal  # noqa: E402
+
+
+def _ms(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - t0) * 1000)
+    return statistics.median(times)
+
+
+def _entry(history, i):
+    last = history[-1]
+    ts = last["timestamp"] + 13 * (i + 1)
+    return dict(last, timestamp=ts, video=f"/workspace/ComfyUI/output/gen_{ts}_new{i}_.mp4")
+
+
+def run(n, repeat):
+    history, _manual, _files = build_state(n)
+    for entry in history:
+        entry["video_path"] = entry["video"]
+    knowledge = {"best_score": 0.9, "best_params": {}, "history": history}
+    root = tempfile.mkdtemp(prefix="bench_segments_")
+    try:
+        path = os.path.join(root, "knowledge.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(knowledge, f, ensure_ascii=False, indent=2)
+        size_mb = os.path.getsize(path) / 1e6
+
+        segments = KnowledgeSegments(root)
+        t0 = time.perf_counter()
+        segments.migrate_from_json()
+        migrate_ms = (time.perf_counter() - t0) * 1000
+        t0 = time.perf_counter()
+        KnowledgeSegments(root).document()
+        cold_ms = (time.perf_counter() - t0) * 1000
+
+        counter = iter(range(10 ** 9))
+
+        def mono_append():
+            knowledge["history"].append(_entry(history, next(counter)))
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(knowledge, f, ensure_ascii=False, indent=2)
+
+        def seg_append():
+            segments.append(_entry(history, next(counter)))
+
+        def mono_reload():
+            with open(path, "r", encoding="utf-8") as f:
+                json.load(f)
+
+        def seg_reload():
+            seg_append()
+            segments.document()
+
+        journal = RatingJournal(root, segments=None, compact_interval_s=3600)
+        seg_journal = RatingJournal(root, segments=segments, compact_interval_s=3600)
+        video = os.path.basename(history[n // 2]["video"])
+        rates = [{"op": "rate", "video": video, "entry": {"rating": {"overall_quality": 5}}}]
+
+        results = [
+            ("append", _ms(mono_append, repeat), _ms(seg_append, repeat)),
+            ("reload after append", _ms(mono_reload, repeat), _ms(seg_reload, repeat) - _ms(seg_append, repeat)),
+            ("fold 1 rating", _ms(lambda: journal._fold_knowledge(rates), repeat),
+             _ms(lambda: seg_journal._fold_knowledge(rates), repeat)),
+        ]
+        print(f"{n} entries: knowledge.json {size_mb:.1f} MB, {segments.stats()['segments']} segments, "
+              f"migrate {migrate_ms:.0f} ms, cold segment load {cold_ms:.0f} ms")
+        print(f"  {'operation':24}{'json ms':>10}{'segments ms':>13}")
+        for name, mono, seg in results:
+            print(f"  {name:24}{mono:>10.1f}{seg:>13.1f}")
+        print(f"  {segments.stats()}")
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--videos", type=int, nargs="+", default=[10000, 100000])
+    ap.add_argument("--repeat", type=int, default=5)
+    args = ap.parse_args()
+    for n in args.videos:
+        run(n, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+"""search_v4 loop: sequential vs pipelined vs K jobs in flight (simulated ComfyUI and analyzer).
+
+A stand-in agent with the EnhancedVideoAgentV4 stage contract
+(`render_v4`, `submit_v4`, `poll_v4`, `attach_render`, `run_iteration_v4`,
+`state_lock`) is driven by the real `GenerationPipeline`:
+
+  prepare  – prompt generation + artifacts (CPU, before queueing)
+  render   – ComfyUI job: a FIFO served by one GPU; a job that finds the GPU
+             idle first pays --warmup (models reloaded / caches cold)
+  poll     – /history checks every --poll seconds until the job is done
+  analyze  – decode + VideoAnalyzer + state updates (CPU, releases the GIL
+             like OpenCV does)
+
+Durations are given in real seconds and run scaled down by --scale; the
+report converts back, so iterations/hour are per real hour. GPU busy is the
+time the simulated GPU spent rendering (warmup excluded) over wall time.
+
+Usage: python bench/bench_pipeline.py [--iterations 20] [--render 90] [--analyze 25 60 120] [--workers 1 2] [--depth 1 2 3]
+"""
+import argparse
+import collections
+import itertools
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from eva_p1.pipeline import GenerationPipeline, RenderedJob  # noqa: E402
+
+
+class SimulatedComfy:
+    """One GPU serving a FIFO of prompts."""
+
+    def __init__(self, render_s, warmup_s, idle_s):
+        self.render_s, self.warmup_s, self.idle_s = render_s, warmup_s, idle_s
+        self.queue = collections.deque()
+        self.done = set()
+        self.busy_s = 0.0
+        self._cv = threading.Condition()
+        self._ids = itertools.count()
+        self._stop = False
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+        self._thread.start()
+
+    def queue_prompt(self):
+        with self._cv:
+            pid = f"p{next(self._ids)}"
+            self.queue.append(pid)
+            self._cv.notify()
+            return pid
+
+    def is_done(self, pid):
+        with self._cv:
+            return pid in self.done
+
+    def _serve(self):
+        idle_since = time.perf_counter()
+        while True:
+            with self._cv:
+                while not self.queue and not self._stop:
+                    self._cv.wait()
+                if self._stop:
+                    return
+                pid = self.queue[0]
+            if time.perf_counter() - idle_since >= self.idle_s:
+                time.sleep(self.warmup_s)
+            t0 = time.perf_counter()
+            time.sleep(self.render_s)
+            self.busy_s += time.perf_counter() - t0
+            with self._cv:
+                self.queue.popleft()
+                self.done.add(pid)
+                idle_since = time.perf_counter()
+
+    def stop(self):
+        with self._cv:
+            self._stop = True
+            self._cv.notify()
+
+
+class SimulatedAgent:
+    def __init__(self, comfy, prepare_s, analyze_s, poll_s):
+        self.comfy, self.prepare_s, self.analyze_s, self.poll_s = comfy, prepare_s, analyze_s, poll_s
+        self.state_lock = threading.RLock()
+        self._renders = {}
+        self.pulls = {}
+
+    def attach_render(self, job):
+        with self.state_lock:
+            self._renders[id(job.params)] = job
+
+    def submit_v4(self, params):
+        time.sleep(self.prepare_s)
+        job = RenderedJob(params=params, prefix=f"gen_{params['i']}")
+        job.prompt_id = self.comfy.queue_prompt()
+        job.submitted_at = time.perf_counter()
+        return job
+
+    def poll_v4(self, job, exclusive=True):
+        if not self.comfy.is_done(job.prompt_id):
+            return False
+        job.render_s = time.perf_counter() - job.submitted_at
+        job.video_path = f"/tmp/{job.prefix}.mp4"
+        return True
+
+    def render_v4(self, params):
+        job = self.submit_v4(params)
+        while not self.poll_v4(job):
+            time.sleep(self.poll_s)
+        return job
+
+    def run_iteration_v4(self, params):
+        with self.state_lock:
+            job = self._renders.pop(id(params), None)
+        if job is None:
+            job = self.render_v4(params)
+        time.sleep(self.analyze_s)
+        with self.state_lock:
+            self.pulls[params["combo"]] = self.pulls.get(params["combo"], 0) + 1
+        return 0.5, {"overall": 0.5}, job.video_path, None
+
+
+def params_source(n):
+    for i in range(n):
+        yield "", {"i": i, "combo": f"combo{i % 4}"}
+
+
+def run(args, analyze, workers):
+    s = args.scale
+    modes = [(False, 1)] + [(True, k) for k in args.depth]
+    rows = []
+    for pipelined, depth in modes:
+        comfy = SimulatedComfy(args.render * s, args.warmup * s, args.idle * s)
+        agent = SimulatedAgent(comfy, args.prepare * s, analyze * s, args.poll * s)
+        pipeline = GenerationPipeline(agent, pipelined=pipelined, analysis_workers=workers,
+                                      queue_depth=depth, poll_s=args.poll * s)
+        stats = pipeline.run(params_source(args.iterations), args.iterations)
+        comfy.stop()
+        assert stats.iterations == args.iterations and sum(agent.pulls.values()) == args.iterations
+        rows.append((stats.mode, comfy.busy_s / stats.wall_s, stats.iterations * 3600 / (stats.wall_s / s),
+                     stats.wall_s / s))
+    print(f"render {args.render:g}s (+{args.warmup:g}s warmup after {args.idle:g}s idle), analyze {analyze:g}s, "
+          f"prepare {args.prepare:g}s, poll {args.poll:g}s, {workers} analysis worker(s)")
+    for mode, busy, per_hour, wall in rows:
+        print(f"  {mode:16}{busy * 100:>8.0f}% GPU busy{per_hour:>10.1f} it/h{wall:>10.0f} s wall"
+              f"   x{per_hour / rows[0][2]:.2f}")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--iterations", type=int, default=20)
+    ap.add_argument("--prepare", type=float, default=2.0, help="prompt generation + artifacts, s")
+    ap.add_argument("--render", type=float, default=90.0, help="ComfyUI render, s")
+    ap.add_argument("--warmup", type=float, default=8.0, help="model reload when the GPU was idle, s")
+    ap.add_argument("--idle", type=float, default=1.0, help="idle time after which the warmup is paid, s")
+    ap.add_argument("--poll", type=float, default=2.0, help="/history poll interval, s")
+    ap.add_argument("--analyze", type=float, nargs="+", default=[25.0, 60.0, 120.0], help="analysis, s")
+    ap.add_argument("--workers", type=int, nargs="+", default=[1, 2])
+    ap.add_argument("--depth", type=int, nargs="+", default=[1, 2, 3], help="jobs in flight (pipelined)")
+    ap.add_argument("--scale", type=float, default=0.002, help="simulated seconds per real second")
+    args = ap.parse_args()
+    for analyze in args.analyze:
+        for workers in args.workers:
+            run(args, analyze, workers)
+
+
+if __name__ == "__main__":
+    main()
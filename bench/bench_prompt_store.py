@@ -0,0 +1,111 @@
+"""State-file size and load time with prompts inline vs in the content-addressed PromptStore.
+
+Builds agent-shaped records for N generations: a unique ~2.5 KB prompt and a
+negative made of one of a few generator negatives plus the fixed ~2 KB
+blacklist, each stored in the history entry and its `params`, and the same
+texts in a review queue item. Then for knowledge.json and review_queue.json
+measures file size and
+
+  inline  – json.load of the file as the agent writes it today
+  cold    – json.load of the compacted file + expand with an empty text cache
+            (a fresh process)
+  warm    – the same with the texts already cached (a reader re-loading after
+            the file changed, the common case in the review server)
+
+Usage: python bench/bench_prompt_store.py [--videos 10000] [--repeat 3]
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from eva_state.prompt_store import STORE_FILENAME, PromptStore  # noqa: E402
+
+WORDS = ("cinematic portrait woman golden hour soft light bokeh 35mm film grain detailed skin natural pose "
+         "wind hair city street night neon rain beach sunset studio backdrop dolly slow motion smile dress "
+         "linen silk denim jacket forest mist candle warm cold blue teal orange vintage lens flare").split()
+BLACKLIST = ", ".join(f"artifact {w} {i}" for i, w in enumerate(WORDS * 4))
+BASE_NEGATIVES = [", ".join(random.Random(i).sample(WORDS, 12)) for i in range(6)]
+
+
+def build(n, seed=11):
+    rnd = random.Random(seed)
+    history, queue = [], {"pending": [], "in_review": [], "completed": []}
+    for i in range(n):
+        prompt = " ".join(rnd.choice(WORDS) for _ in range(400)) + f" [id:{1757000000 + i}]"
+        negative = rnd.choice(BASE_NEGATIVES) + ", " + BLACKLIST
+        params = {"sampler": "euler", "scheduler": "karras", "fps": 24, "width": 768, "height": 1344,
+                  "prompt": prompt, "negative_prompt": negative, "prefix": f"gen_{1757000000 + i}"}
+        history.append({"video": f"/workspace/ComfyUI/output/gen_{1757000000 + i}_00001_.mp4",
+                        "timestamp": 1757000000 + i * 13, "params": params, "metrics": {"overall": rnd.random()},
+                        "score": rnd.random(), "prompt": prompt, "negative_prompt": negative,
+                        "combo": ["euler", "karras"]})
+        queue["pending"].append({"video_id": f"gen_{1757000000 + i}_00001_", "prompt": prompt,
+                                 "params": params, "combo": ["euler", "karras"], "priority": 2})
+    return {"best_score": 0.9, "best_params": {}, "history": history}, queue
+
+
+def _ms(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - t0) * 1000)
+    return statistics.median(times)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--videos", type=int, default=10000)
+    ap.add_argument("--repeat", type=int, default=3)
+    args = ap.parse_args()
+
+    knowledge, queue = build(args.videos)
+    root = tempfile.mkdtemp(prefix="bench_prompts_")
+    try:
+        store = PromptStore(os.path.join(root, STORE_FILENAME))
+        t0 = time.perf_counter()
+        compacted = {"knowledge.json": store.compact(knowledge), "review_queue.json": store.compact(queue)}
+        compact_ms = (time.perf_counter() - t0) * 1000
+        store_mb = os.path.getsize(store.path) / 1e6
+        print(f"{args.videos} generations: compact {compact_ms:.0f} ms, {store.stats()['texts']} distinct texts, "
+              f"prompt_store.jsonl {store_mb:.1f} MB")
+        print(f"{'file':20}{'inline MB':>10}{'refs MB':>9}{'inline ms':>11}{'cold ms':>9}{'warm ms':>9}")
+        for name, doc in (("knowledge.json", knowledge), ("review_queue.json", queue)):
+            inline_path = os.path.join(root, "inline_" + name)
+            refs_path = os.path.join(root, name)
+            for path, data in ((inline_path, doc), (refs_path, compacted[name])):
+                with open(path, "w", encoding="utf-8") as f:
+                    json.dump(data, f, ensure_ascii=False, indent=2)
+
+            def load(path, reader=None):
+                with open(path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                return reader.expand(data) if reader is not None else data
+
+            def cold():
+                reader = PromptStore(store.path)
+                load(refs_path, reader)
+
+            warm_reader = PromptStore(store.path)
+            expanded = load(refs_path, warm_reader)
+            key = "history" if name == "knowledge.json" else "pending"
+            assert expanded[key][-1]["prompt"] == doc[key][-1]["prompt"]
+            inline_ms = _ms(lambda: load(inline_path), args.repeat)
+            cold_ms = _ms(cold, args.repeat)
+            warm_ms = _ms(lambda: load(refs_path, warm_reader), args.repeat)
+            print(f"{name:20}{os.path.getsize(inline_path) / 1e6:>10.1f}{os.path.getsize(refs_path) / 1e6:>9.1f}"
+                  f"{inline_ms:>11.0f}{cold_ms:>9.0f}{warm_ms:>9.0f}")
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""Review queue: review_queue.json document vs the ReviewQueue log.
+
+For queues of N items (agent-shaped: auto_metrics, params with a prompt,
+combo, priority 1-3) times
+
+  push     – before: append to ``pending`` + `atomic_write_json` of the whole
+             document (what add_to_review_queue did); log: `ReviewQueue.push`
+  lookup   – before: the name map /api/videos rebuilt from ``pending`` per
+             request; log: `ReviewQueue.lookup` of one clip
+  lease    – reserve the most urgent free clip (no equivalent before)
+  complete – mark one clip reviewed (before: nothing ever left the queue)
+  open     – replay the log in a fresh process-like instance
+  compact  – rewrite the log after every item was completed once (evictions)
+
+then runs P reviewer processes that lease one clip at a time and complete it
+until the queue is empty, and checks that no clip was handed out twice.
+
+Usage: python bench/bench_review_queue.py [--items 1000 10000 100000] [--reviewers 4] [--repeat 20]
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from eva_state.rating_journal import atomic_write_json  # noqa: E402
+from eva_state.review_queue import ReviewQueue  # noqa: E402
+
+
+def _ms(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - t0) * 1000)
+    return statistics.median(times)
+
+
+def make_item(i, rnd):
+    score = rnd.random()
+    return {
+        "video_id": f"gen_{1757500000 + i}_00001_",
+        "video_path": f"/workspace/review/pending/gen_{1757500000 + i}_00001_.mp4",
+        "original_path": f"/workspace/ComfyUI/output/gen_{1757500000 + i}_00001_.mp4",
+        "thumbnail_path": f"/workspace/review/thumbs/gen_{1757500000 + i}_00001_.jpg",
+        "generated_at": "2025-09-10T12:00:00Z",
+        "auto_metrics": {"overall": score, "sharpness": rnd.random(), "motion": rnd.random()},
+        "prompt": f"cinematic portrait number {i}, soft light, 35mm, shallow depth of field",
+        "params": {"sampler": "euler", "scheduler": "normal", "fps": 24, "cfg_scale": 7.0, "steps": 25},
+        "combo": ["euler", "normal"],
+        "priority": 1 if score > 0.8 or score < 0.3 else 2 if score > 0.6 else 3,
+    }
+
+
+def reviewer(state_dir, worker, out):
+    queue = ReviewQueue(state_dir)
+    got = []
+    while True:
+        items = queue.lease(f"reviewer{worker}", 1)
+        if not items:
+            break
+        got.append(items[0]["video_id"])
+        queue.complete([items[0]["video_id"]])
+    out.put(got)
+
+
+def run(n, reviewers, repeat):
+    rnd = random.Random(n)
+    items = [make_item(i, rnd) for i in range(n)]
+    root = tempfile.mkdtemp(prefix="bench_queue_")
+    try:
+        # before: one document, rewritten per push
+        doc = {"pending": list(items), "in_review": [], "completed": []}
+        path = os.path.join(root, "review_queue.json")
+        extra = iter(range(n, n + 10 ** 6))
+        before_push = _ms(lambda: (doc["pending"].append(make_item(next(extra), rnd)),
+                                   atomic_write_json(path, doc)), max(3, repeat // 4))
+
+        def rq_map():
+            return {os.path.basename(e.get("original_path", "")): e for e in doc["pending"]}
+        before_lookup = _ms(rq_map, repeat)
+
+        state_dir = os.path.join(root, "log")
+        os.makedirs(state_dir)
+        queue = ReviewQueue(state_dir)
+        with queue._locked():
+            queue._write([{"op": "push", "id": it["video_id"], "item": it, "ts": 0} for it in items])
+        log_push = _ms(lambda: queue.push(make_item(next(extra), rnd)), repeat)
+        name = os.path.basename(items[n // 2]["original_path"])
+        log_lookup = _ms(lambda: queue.lookup(name), repeat * 50)
+        leased = []
+        log_lease = _ms(lambda: leased.extend(queue.lease("bench", 1 + len(leased))[len(leased):]), repeat)
+        ids = iter([it["video_id"] for it in leased])
+        log_complete = _ms(lambda: queue.complete([next(ids)]), min(repeat, len(leased)))
+        log_open = _ms(lambda: ReviewQueue(state_dir).counts(), max(3, repeat // 4))
+        size = os.path.getsize(queue.path)
+        queue.complete([it["video_id"] for it in items])
+        t0 = time.perf_counter()
+        queue.compact()
+        compact_ms = (time.perf_counter() - t0) * 1000
+
+        print(f"{n} items (log {size / 1e6:.1f} MB, document {os.path.getsize(path) / 1e6:.1f} MB)")
+        print(f"  {'push    before':24}{before_push:>10.2f} ms   log {log_push:>8.3f} ms")
+        print(f"  {'lookup  before':24}{before_lookup:>10.2f} ms   log {log_lookup:>8.4f} ms")
+        print(f"  {'lease':24}{'':>13}   log {log_lease:>8.3f} ms")
+        print(f"  {'complete':24}{'':>13}   log {log_complete:>8.3f} ms")
+        print(f"  {'open (replay)':24}{'':>13}   log {log_open:>8.1f} ms")
+        print(f"  {'compact after review':24}{'':>13}   log {compact_ms:>8.1f} ms "
+              f"({os.path.getsize(queue.path) / 1e3:.0f} KB, {queue.stats()['evictions']} evicted)")
+
+        # parallel reviewers on a fresh queue
+        state_dir = os.path.join(root, "parallel")
+        os.makedirs(state_dir)
+        fresh = ReviewQueue(state_dir)
+        batch = items[:min(n, 2000)]
+        with fresh._locked():
+            fresh._write([{"op": "push", "id": it["video_id"], "item": it, "ts": 0} for it in batch])
+        out = multiprocessing.Queue()
+        procs = [multiprocessing.Process(target=reviewer, args=(state_dir, w, out)) for w in range(reviewers)]
+        t0 = time.perf_counter()
+        for p in procs:
+            p.start()
+        got = [out.get() for _ in procs]
+        for p in procs:
+            p.join()
+        elapsed = time.perf_counter() - t0
+        handed = [vid for g in got for vid in g]
+        print(f"  {reviewers} reviewers, {len(batch)} clips: handed out {len(handed)}, "
+              f"duplicates {len(handed) - len(set(handed))}, per reviewer {[len(g) for g in got]}, "
+              f"{len(handed) / elapsed:.0f} lease+complete/s")
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--items", type=int, nargs="+", default=[1000, 10000, 100000])
+    ap.add_argument("--reviewers", type=int, default=4)
+    ap.add_argument("--repeat", type=int, default=20)
+    args = ap.parse_args()
+    for n in args.items:
+        run(n, args.reviewers, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+"""Latency of /api/search filtering + paging: per-request loop vs the columnar SearchIndex.
+
+Builds synthetic knowledge history / manual ratings for N videos and times,
+for a set of typical search filters:
+
+  loop    – the old serve_search_api body: knowledge lookup, filters as nested
+            ifs and a full sort, for every name on every request
+  index   – SearchIndex.select (boolean masks) + page (argpartition top-k)
+
+plus prompt-text queries (`q` words: a scan of the prompt strings vs the
+inverted TextIndex), facet counts for a result set, the one-off full build and an incremental update after
+one new rating and one new history entry. The index runs on NumPy when it is installed and
+on plain lists otherwise (the backend is printed).
+
+Usage: python bench/bench_search_index.py [--videos 100000] [--repeat 5]
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from eva_state.knowledge_index import KnowledgeIndex  # noqa: E402
+from eva_state.search_index import FACETS, SearchIndexUpdater, search_row  # noqa: E402
+
+SAMPLERS = ["euler", "euler_a", "dpmpp_2m", "dpmpp_sde", "uni_pc", "ddim"]
+SCHEDULERS = ["normal", "karras", "exponential", "sgm_uniform"]
+WORDS = ("cinematic portrait woman golden hour soft light bokeh 35mm film grain detailed skin natural pose "
+         "wind hair city street night neon rain beach sunset studio backdrop dolly slow motion smile dress "
+         "linen silk denim jacket forest mist candle warm cold blue teal orange vintage lens flare").split()
+NEGATIVE = "blurry lowres watermark text deformed extra fingers cartoon jpeg artifacts oversaturated".split()
+HAIRS = ["honey blonde", "chestnut brown", "black straight", "auburn", "platinum blonde"]
+ETHNICITIES = ["European", "East Asian", "Latina", "Mediterranean", "Mixed race"]
+QUERIES = [
+    {},
+    {"rated": "false"},
+    {"rated": "true", "min_overall": 7},
+    {"sampler": "dpmpp_2m", "scheduler": "karras"},
+    {"min_score": 0.8, "fps": "24"},
+    {"banned": "false", "width": "768", "height": "1344"},
+    {"name_sub": "_17577"},
+]
+TEXT_QUERIES = ["neon", "woman golden hour", "persona:auburn silk", "neg:watermark beach", "cine* mist"]
+
+
+def build_state(n: int, seed: int = 7):
+    rnd = random.Random(seed)
+    history, manual, files = [], {}, []
+    for i in range(n):
+        name = f"gen_{1757000000 + i * 13}_{i:05d}_.mp4"
+        history.append({
+            "timestamp": 1757000000 + i * 13,
+            "video": f"/workspace/ComfyUI/output/{name}",
+            "params": {
+                "fps": rnd.choice([16, 20, 24]),
+                "width": rnd.choice([512, 768, 1024]),
+                "height": rnd.choice([768, 1344]),
+                "sampler": rnd.choice(SAMPLERS),
+                "scheduler": rnd.choice(SCHEDULERS),
+            },
+            "metrics": {"overall": rnd.random()},
+            "prompt": " ".join(rnd.choice(WORDS) for _ in range(40)),
+            "negative_prompt": ", ".join(rnd.sample(NEGATIVE, 5)),
+            "photo_prompt": " ".join(rnd.choice(WORDS) for _ in range(30)),
+            "persona": {"hair": rnd.choice(HAIRS), "ethnicity": rnd.choice(ETHNICITIES)},
+        })
+        files.append(name)
+        if rnd.random() < 0.6:
+            manual[name] = {"rating": {
+                "overall_quality": rnd.randint(1, 10),
+                "banned": rnd.random() < 0.05,
+                "is_reference": rnd.random() < 0.02,
+            }}
+    return history, manual, files
+
+
+def loop_search(kindex, manual, files, q, offset=0, limit=50):
+    """What serve_search_api did per request before the index."""
+    results = []
+    for name in set(files) | set(manual):
+        row = search_row(name, kindex.lookup(name)[0] or {}, manual.get(name), True)
+        p = row.params
+        if q.get("name_sub") and q["name_sub"] not in name.lower():
+            continue
+        if q.get("rated") == "true" and not row.rated:
+            continue
+        if q.get("rated") == "false" and row.rated:
+            continue
+        if q.get("banned") and row.banned != (q["banned"] == "true"):
+            continue
+        if q.get("min_score", -1) >= 0 and (row.score is None or float(row.score) < q["min_score"]):
+            continue
+        if q.get("min_overall", -1) >= 0 and (row.manual_overall is None or float(row.manual_overall) < q["min_overall"]):
+            continue
+        if any(q.get(k) and str(p.get(k) or "").lower() != q[k] for k in ("fps", "width", "height", "sampler", "scheduler")):
+            continue
+        results.append(row)
+    results.sort(key=lambda x: (x.rated is False, -(x.score or -1)))
+    return len(results), results[offset:offset + limit]
+
+
+def scan_text(history, query):
+    """Per-request alternative without an index: every term as a substring of the entry's text."""
+    terms = [t.split(":")[-1].rstrip("*").lower() for t in query.split()]
+    hits = 0
+    for det in history:
+        text = " ".join(str(det.get(f) or "") for f in ("prompt", "negative_prompt", "photo_prompt", "persona")).lower()
+        if all(t in text for t in terms):
+            hits += 1
+    return hits
+
+
+def _ms(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - t0) * 1000)
+    return statistics.median(times)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--videos", type=int, default=100000)
+    ap.add_argument("--repeat", type=int, default=5)
+    args = ap.parse_args()
+
+    history, manual, files = build_state(args.videos)
+    kindex = KnowledgeIndex(history)
+    updater = SearchIndexUpdater()
+
+    t0 = time.perf_counter()
+    index = updater.index(0, history, manual, files, kindex.lookup)
+    build_ms = (time.perf_counter() - t0) * 1000
+    print(f"{args.videos} videos, backend={index.backend}, full build {build_ms:.0f} ms")
+
+    print(f"{'query':56}{'matches':>9}{'loop ms':>10}{'index ms':>10}")
+    for q in QUERIES:
+        filters = dict(q)
+        total, _ = loop_search(kindex, manual, files, q)
+        loop_ms = _ms(lambda: loop_search(kindex, manual, files, q), max(1, args.repeat // 2))
+        index_ms = _ms(lambda: index.page(index.select(**filters), 0, 50), args.repeat * 4)
+        assert len(index.select(**filters)) == total, q
+        print(f"{str(q):56}{total:>9}{loop_ms:>10.1f}{index_ms:>10.2f}")
+
+    print(f"{'q (prompt text)':56}{'matches':>9}{'scan ms':>10}{'index ms':>10}")
+    for text in TEXT_QUERIES:
+        total = len(index.search(0, 50, text_query=text)[0])
+        scan_ms = _ms(lambda: scan_text(history, text), max(1, args.repeat // 2))
+        index_ms = _ms(lambda: index.search(0, 50, text_query=text), args.repeat * 4)
+        print(f"{text:56}{total:>9}{scan_ms:>10.1f}{index_ms:>10.2f}")
+
+    print(f"{'facets (all six)':56}{'matches':>9}{'':>10}{'index ms':>10}")
+    for q in ({}, {"rated": "true"}, {"sampler": "dpmpp_2m", "min_score": 0.5}):
+        positions = index.select(**q)
+        facet_ms = _ms(lambda: index.facets(positions, FACETS), args.repeat * 4)
+        print(f"{str(q):56}{len(positions):>9}{'':>10}{facet_ms:>10.2f}")
+
+    # One new rating + one new generation: only the touched rows are recomputed
+    name = f"gen_{1757000000 + args.videos * 13}_{args.videos:05d}_.mp4"
+    history = history + [dict(history[-1], timestamp=1757000000 + args.videos * 13,
+                               video=f"/workspace/ComfyUI/output/{name}")]
+    manual = dict(manual, **{files[0]: {"rating": {"overall_quality": 3}}})
+    files = files + [name]
+    kindex = KnowledgeIndex(history)
+    t0 = time.perf_counter()
+    updater.index(1, history, manual, files, kindex.lookup)
+    print(f"incremental update: {(time.perf_counter() - t0) * 1000:.0f} ms, {updater.stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""Save / load time and size of knowledge.json per state serializer format.
+
+For knowledge histories of N entries (same generator as bench_search_index)
+times, per format:
+
+  before   – json.dump(indent=2) / json.load, what every writer and reader did
+  json     – compact stdlib JSON (STATE_FORMAT default)
+  pretty   – indent=2 written by the serializer, read by `load_file`
+  orjson   – orjson encoder (only when installed)
+  msgpack  – MessagePack (only when installed)
+
+``save`` is `atomic_write_json` (tmp + fsync + replace, as the state writers
+do), ``load`` is `load_file` with format auto-detection (orjson parses the
+JSON formats when it is installed).
+
+Usage: python bench/bench_serializer.py [--videos 1000 10000 100000] [--repeat 5]
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_search_index import build_state  # noqa: E402
+from eva_state.rating_journal import atomic_write_json  # noqa: E402
+from eva_state.serializer import available_formats, load_file  # noqa: E402
+
+
+def _ms(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - t0) * 1000)
+    return statistics.median(times)
+
+
+def run(n, repeat):
+    history, _manual, _files = build_state(n)
+    for i, entry in enumerate(history):
+        entry["score"] = entry["metrics"]["overall"]
+        entry["params"].update(cfg_scale=7.0, steps=25, seconds=5, prefix=f"gen_{entry['timestamp']}")
+        entry["combo"] = [entry["params"]["sampler"], entry["params"]["scheduler"]]
+    knowledge = {"best_score": 0.9, "best_params": dict(history[0]["params"]), "history": history}
+    root = tempfile.mkdtemp(prefix="bench_serializer_")
+    try:
+        path = os.path.join(root, "knowledge.json")
+
+        def before_save():
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(knowledge, f, ensure_ascii=False, indent=2)
+
+        def before_load():
+            with open(path, "r", encoding="utf-8") as f:
+                json.load(f)
+
+        rows = [("before", _ms(before_save, repeat), _ms(before_load, repeat), os.path.getsize(path))]
+        for fmt in available_formats():
+            if fmt == "auto":
+                continue
+            save_ms = _ms(lambda: atomic_write_json(path, knowledge, fmt=fmt), repeat)
+            assert load_file(path)["history"][-1] == history[-1], fmt
+            rows.append((fmt, save_ms, _ms(lambda: load_file(path), repeat), os.path.getsize(path)))
+
+        print(f"{n} entries")
+        print(f"  {'format':10}{'MB':>8}{'save ms':>10}{'load ms':>10}")
+        for fmt, save_ms, load_ms, size in rows:
+            print(f"  {fmt:10}{size / 1e6:>8.1f}{save_ms:>10.1f}{load_ms:>10.1f}")
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--videos", type=int, nargs="+", default=[1000, 10000, 100000])
+    ap.add_argument("--repeat", type=int, default=5)
+    args = ap.parse_args()
+    print(f"formats: {', '.join(available_formats())}")
+    for n in args.videos:
+        run(n, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
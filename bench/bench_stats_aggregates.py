@@ -0,0 +1,86 @@
+"""Cost of /api/stats: per-call recount vs the running StatsAggregates counters.
+
+For N videos (same generator as bench_search_index: ~60% rated) times
+
+  recount  – what _compute_stats did per call: len(manual ratings), the
+             average overall_quality over all of them and the output files
+             without a rating
+  totals   – StatsAggregates.totals() (plus one small-file signature check)
+  event    – one rating fed to the counters (journal listener)
+  check    – the periodic full recount that verifies the counters
+
+Usage: python bench/bench_stats_aggregates.py [--videos 10000 100000] [--repeat 5]
+"""
+import argparse
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_search_index import build_state  # noqa: E402
+from eva_state.stats_aggregates import StatsAggregates  # noqa: E402
+
+
+def _ms(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - t0) * 1000)
+    return statistics.median(times)
+
+
+def recount(manual, files):
+    """The old per-call body of _compute_stats (without the history length)."""
+    total_rated = len(manual)
+    pending_count = sum(1 for name in files if name not in manual)
+    scores = [v["rating"]["overall_quality"] for v in manual.values()
+              if isinstance(v, dict) and isinstance(v.get("rating"), dict) and "overall_quality" in v["rating"]]
+    return total_rated, pending_count, sum(scores) / len(scores) if scores else 0
+
+
+def run(n, repeat):
+    history, manual, files = build_state(n)
+    root = tempfile.mkdtemp(prefix="bench_stats_")
+    try:
+        aggregates = StatsAggregates(root, save_interval_s=3600)
+        t0 = time.perf_counter()
+        aggregates.check(lambda: (manual, files, len(history), 0.9))
+        check_ms = (time.perf_counter() - t0) * 1000
+        totals = aggregates.totals()
+        rated, pending, avg = recount(manual, files)
+        assert (totals["total_rated"], totals["pending_count"]) == (rated, pending)
+        assert abs(totals["avg_rating"] - avg) < 1e-9
+
+        counter = iter(range(10 ** 9))
+
+        def event():
+            name = files[next(counter) % len(files)]
+            aggregates.on_journal_append([{"op": "rate", "video": name, "entry": {"rating": {"overall_quality": 7}}}])
+
+        print(f"{n} videos, {len(manual)} rated")
+        print(f"  {'recount per call':24}{_ms(lambda: recount(manual, files), repeat):>10.2f} ms")
+        print(f"  {'totals()':24}{_ms(aggregates.totals, repeat * 20):>10.3f} ms")
+        print(f"  {'one rating event':24}{_ms(event, repeat * 20):>10.3f} ms")
+        print(f"  {'full check':24}{check_ms:>10.2f} ms")
+    finally:
+        aggregates.stop()
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--videos", type=int, nargs="+", default=[10000, 100000])
+    ap.add_argument("--repeat", type=int, default=5)
+    args = ap.parse_args()
+    for n in args.videos:
+        run(n, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
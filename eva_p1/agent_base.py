@@ -1,14 +1,26 @@
 # Copied from eva_p1_workflow_and_agent.py (depends on many symbols kept intact)
-import os, json, time, shutil, pathlib
+import os, json, time, shutil, pathlib, threading
 from typing import Dict, Any, Optional, List
 from eva_env_base import log, SYSTEM_BASE_DIR, GPT_AVAILABLE
 from eva_p1.comfy_client import ComfyClient
+from eva_p1.comfy_pool import create_comfy_client
 from eva_p1.video_analyzer import VideoAnalyzer
 from eva_p1.workflow import validate_workflow_nodes
 from eva_p1.multi_bandit import MultiDimensionalBandit
 from eva_p1.openrouter_analyzer import OpenRouterAnalyzer
 from eva_p1.knowledge_analyzer import KnowledgeAnalyzer
 from eva_p1.prompt_generator import MegaEroticJSONPromptGenerator
+from eva_p1.pipeline import (PIPELINE_DEFAULT, DEFAULT_ANALYSIS_WORKERS, DEFAULT_QUEUE_DEPTH, GenerationPipeline,
+                             PipelineStats, RenderedJob)
+from eva_state.output_catalog import get_output_catalog
+from eva_state.sqlite_catalog import get_sqlite_catalog
+from eva_state.knowledge_segments import get_knowledge_segments
+from eva_state.prompt_store import compact_refs, expand_refs
+from eva_state.rating_journal import atomic_write_json
+from eva_state.review_queue import get_review_queue
+from eva_state.serializer import load_file
+from eva_state.stats_aggregates import read_totals, record_generation
+from eva_state.versioned_state import bandit_arm_count, get_knowledge_state, merge_knowledge
 import cv2
 
 class EnhancedVideoAgentV4:
@@ -33,7 +45,16 @@ class EnhancedVideoAgentV4:
             os.makedirs(os.path.join(self.review_dir, subdir), exist_ok=True)
 
         # Initialize components
-        self.client = ComfyClient(api)
+        # One endpoint, or a ComfyClientPool for a comma-separated list / COMFY_ENDPOINTS
+        self.client = create_comfy_client(api, output_dir=self.comfyui_output)
+        # Bandit/knowledge/review-queue updates vs param selection (pipelined search_v4 runs them in parallel)
+        self.state_lock = threading.RLock()
+        # Renders done by GenerationPipeline, picked up by run_iteration_v4 (keyed by id(params))
+        self._renders: Dict[int, RenderedJob] = {}
+        # Params counted as pending pulls in the bandit, released exactly once (keyed by id(params))
+        self._pending_pulls: Dict[int, Dict[str, Any]] = {}
+        # Last gen_<ts> output prefix: jobs queued within one second still get distinct prefixes
+        self._last_prefix_ts = 0
 
         # Load workflow
         try:
@@ -57,6 +78,15 @@ class EnhancedVideoAgentV4:
         self.knowledge_path = os.path.join(self.state_dir, "knowledge.json")
         self.ratings_path = os.path.join(self.state_dir, "manual_ratings.json") 
         self.queue_path = os.path.join(self.state_dir, "review_queue.json")
+        # Optional SQLite catalog (STATE_BACKEND=sqlite or existing catalog.sqlite3): rows instead of JSON rewrites
+        self.state_db = get_sqlite_catalog(self.state_dir)
+        # Optional per-day history segments (STATE_BACKEND=segments or existing knowledge/manifest.json)
+        self.knowledge_segments = get_knowledge_segments(self.state_dir)
+        # Review queue log (default without SQLite): push is one appended line instead of a review_queue.json rewrite
+        self.review_queue_store = get_review_queue(self.state_dir)
+        # JSON backend: knowledge.json is committed against the review server's rating folds
+        self.knowledge_state = get_knowledge_state(self.knowledge_path)
+        self._knowledge_base = (0, {})
 
         self.knowledge = self._load_knowledge()
         self.manual_ratings = self._load_manual_ratings()
@@ -127,28 +157,37 @@ class EnhancedVideoAgentV4:
         pending_count, avg_rating, best_score, bandit_iterations, learning_arms.
         """
         try:
-            knowledge = self._load_knowledge() if isinstance(self.knowledge, dict) else {}
-            manual = self._load_manual_ratings() if isinstance(self.manual_ratings, dict) else {}
-            # Bandit state
-            bandit_path = os.path.join(self.state_dir, "bandit_state.json")
-            bandit_state = {}
+            # Bandit state as stored (learning_arms counts combo_stats plus not yet migrated legacy arms)
             try:
-                if os.path.exists(bandit_path):
-                    with open(bandit_path, 'r', encoding='utf-8') as f:
-                        bandit_state = json.load(f)
+                bandit_state = load_file(os.path.join(self.state_dir, "bandit_state.json")) or {}
             except Exception:
                 bandit_state = {}
+            totals = read_totals(self.state_dir)
+            if totals is not None:
+                # Running totals kept by the review server (and bumped by _record_generation): no rescans
+                return dict(totals, bandit_iterations=bandit_state.get("t", 0),
+                            learning_arms=bandit_arm_count(bandit_state))
+            if self.state_db is not None:
+                # Row counts instead of materializing the whole history
+                knowledge = self.state_db.knowledge_meta()
+                total_generated = self.state_db.counts()["generations"]
+            elif self.knowledge_segments is not None:
+                # Manifest only: no history segment is read
+                knowledge = self.knowledge_segments.meta()
+                total_generated = self.knowledge_segments.count()
+            else:
+                knowledge = self._load_knowledge() if isinstance(self.knowledge, dict) else {}
+                total_generated = len(knowledge.get("history", [])) if isinstance(knowledge, dict) else 0
+            manual = self._load_manual_ratings() if isinstance(self.manual_ratings, dict) else {}
 
-            total_generated = len(knowledge.get("history", [])) if isinstance(knowledge, dict) else 0
             total_rated = len(manual) if isinstance(manual, dict) else 0
 
-            # Pending = files present but not rated yet
+            # Pending = files present but not rated yet (shared output catalog, no per-call glob)
             pending_count = 0
             try:
-                import glob
-                video_files = glob.glob(f"{self.comfyui_output}/*.mp4")
+                catalog = get_output_catalog(self.comfyui_output).snapshot()
                 rated_names = set(manual.keys()) if isinstance(manual, dict) else set()
-                pending_count = len([p for p in video_files if os.path.basename(p) not in rated_names])
+                pending_count = sum(1 for e in catalog.entries if e.name not in rated_names)
             except Exception:
                 pending_count = 0
 
@@ -171,8 +210,8 @@ class EnhancedVideoAgentV4:
                 "pending_count": pending_count,
                 "avg_rating": avg_rating,
                 "best_score": (knowledge or {}).get("best_score", 0),
-                "bandit_iterations": (bandit_state or {}).get("t", 0),
-                "learning_arms": len((bandit_state or {}).get("arms", [])),
+                "bandit_iterations": bandit_state.get("t", 0),
+                "learning_arms": bandit_arm_count(bandit_state),
             }
         except Exception as e:
             log.warning(f"get_stats_v4 failed: {e}")
@@ -205,43 +244,74 @@ class EnhancedVideoAgentV4:
 
     def _load_knowledge(self) -> Dict[str, Any]:
         """Load knowledge database"""
+        if self.state_db is not None:
+            return self.state_db.knowledge_document()
+        if self.knowledge_segments is not None:
+            # Private copy: the agent appends to its history in memory
+            _version, document = self.knowledge_segments.document()
+            return dict(document, history=list(document["history"]))
         if os.path.isfile(self.knowledge_path):
             try:
-                with open(self.knowledge_path, "r", encoding="utf-8") as f:
-                    return json.load(f)
+                version, document = self.knowledge_state.read()
+                self._knowledge_base = (version, dict(document, history=list(document.get("history") or [])))
+                return expand_refs(document, self.state_dir)
             except Exception as e:
                 log.warning(f"Failed to load knowledge: {e}")
         return {"best_score": -1.0, "best_params": {}, "best_combo": None, "history": []}
 
     def _save_knowledge(self):
-        """Save knowledge database with full parameters"""
-        with open(self.knowledge_path, "w", encoding="utf-8") as f:
-            json.dump(self.knowledge, f, ensure_ascii=False, indent=2)
+        """Save knowledge database with full parameters
+
+        Compare-and-swap against the last version read: ratings the review server
+        folded in meanwhile are kept and adopted, our new history entries are appended.
+        """
+        base_version, base = self._knowledge_base
+        version, written = self.knowledge_state.commit(
+            base_version, base, compact_refs(self.knowledge, self.state_dir), merge_knowledge)
+        if version != base_version + 1:
+            # In place: KnowledgeAnalyzer holds this dict
+            merged = expand_refs(written, self.state_dir)
+            self.knowledge.clear()
+            self.knowledge.update(merged)
+        self._knowledge_base = (version, dict(written, history=list(written.get("history") or [])))
+
+    def _record_generation(self, entry: Dict[str, Any], best: Optional[Dict[str, Any]] = None):
+        """Persist one new history entry: a row insert with the SQLite catalog, a line in the tail segment, else a knowledge.json rewrite"""
+        if self.state_db is not None:
+            self.state_db.add_generation(entry, best=best)
+        elif self.knowledge_segments is not None:
+            self.knowledge_segments.append(entry, best=best)
+        else:
+            self._save_knowledge()
+        record_generation(self.state_dir, best_score=(best or {}).get("best_score"))
 
     def _load_manual_ratings(self) -> Dict[str, Any]:
         """Load manual ratings database"""
+        if self.state_db is not None:
+            return self.state_db.manual_ratings()
         if os.path.isfile(self.ratings_path):
             try:
-                with open(self.ratings_path, "r", encoding="utf-8") as f:
-                    return json.load(f)
+                return load_file(self.ratings_path)
             except Exception as e:
                 log.warning(f"Failed to load manual ratings: {e}")
         return {}
 
     def _load_review_queue(self) -> Dict[str, Any]:
         """Load review queue"""
+        if self.state_db is not None:
+            return self.state_db.review_queue_document()
+        if self.review_queue_store is not None:
+            return self.review_queue_store.view()
         if os.path.isfile(self.queue_path):
             try:
-                with open(self.queue_path, "r", encoding="utf-8") as f:
-                    return json.load(f)
+                return expand_refs(load_file(self.queue_path), self.state_dir)
             except Exception as e:
                 log.warning(f"Failed to load review queue: {e}")
         return {"pending": [], "in_review": [], "completed": []}
 
     def _save_review_queue(self):
         """Save review queue"""
-        with open(self.queue_path, "w", encoding="utf-8") as f:
-            json.dump(self.review_queue, f, ensure_ascii=False, indent=2)
+        atomic_write_json(self.queue_path, compact_refs(self.review_queue, self.state_dir))
 
     def _check_and_process_new_ratings(self):
         """Перевіряє, чи з'явилися нові manual_ratings і запускає OpenRouter аналіз для них.
@@ -253,14 +323,18 @@ class EnhancedVideoAgentV4:
             if not getattr(self, 'gpt_analyzer', None):
                 return
             ratings_file = os.path.join(self.state_dir, "manual_ratings.json")
-            if not os.path.exists(ratings_file):
-                return
             last_flag = os.path.join(self.state_dir, "last_rating_check.txt")
             current_mtime = 0.0
-            try:
-                current_mtime = os.path.getmtime(ratings_file)
-            except Exception:
-                return
+            if self.state_db is not None:
+                # Catalog revision plays the role of the file mtime
+                current_mtime = float(self.state_db.rev())
+            else:
+                if not os.path.exists(ratings_file):
+                    return
+                try:
+                    current_mtime = os.path.getmtime(ratings_file)
+                except Exception:
+                    return
 
             last_check_time = 0.0
             if os.path.exists(last_flag):
@@ -275,8 +349,10 @@ class EnhancedVideoAgentV4:
 
             log.info("🤖 Знайдено нові manual_ratings — запускаємо OpenRouter аналіз")
             try:
-                with open(ratings_file, 'r', encoding='utf-8') as f:
-                    ratings_data = json.load(f)
+                if self.state_db is not None:
+                    ratings_data = self.state_db.manual_ratings()
+                else:
+                    ratings_data = load_file(ratings_file)
             except Exception as e:
                 log.warning(f"Не вдалося прочитати manual_ratings.json: {e}")
                 return
@@ -285,8 +361,7 @@ class EnhancedVideoAgentV4:
             existing = {}
             try:
                 if os.path.exists(analysis_file):
-                    with open(analysis_file, 'r', encoding='utf-8') as f:
-                        existing = json.load(f) or {}
+                    existing = load_file(analysis_file) or {}
             except Exception:
                 existing = {}
 
@@ -302,8 +377,7 @@ class EnhancedVideoAgentV4:
                     log.warning(f"OpenRouter помилка для {video_name}: {e}")
 
             try:
-                with open(analysis_file, 'w', encoding='utf-8') as f:
-                    json.dump(existing, f, ensure_ascii=False, indent=2)
+                atomic_write_json(analysis_file, existing)
             except Exception as e:
                 log.warning(f"Не вдалося зберегти openrouter_results.json: {e}")
 
@@ -417,8 +491,14 @@ class EnhancedVideoAgentV4:
             "priority": priority
         }
 
-        self.review_queue["pending"].append(queue_item)
-        self._save_review_queue()
+        if self.review_queue_store is not None:
+            self.review_queue_store.push(queue_item)
+        elif self.state_db is not None:
+            self.review_queue["pending"].append(queue_item)
+            self.state_db.queue_add(queue_item)
+        else:
+            self.review_queue["pending"].append(queue_item)
+            self._save_review_queue()
 
         log.info(f"✚ Added to review queue: {video_id} (priority: {priority})")
 
@@ -443,12 +523,41 @@ class EnhancedVideoAgentV4:
         # fallback: bandit-driven
         return self.bandit.select_params()
 
-    # ==== High-level search/generation loop expected by QA CLI ====
-    def run_iteration_v4(self, params: Dict[str, Any]):
-        """Single iteration: apply params to workflow, queue in ComfyUI, wait, analyze, update knowledge/bandit.
-
-        Returns: (score, metrics, video_path, applied_workflow)
-        """
+    def attach_render(self, job: RenderedJob):
+        """Hand a finished render to the next run_iteration_v4(job.params) call (GenerationPipeline)."""
+        with self.state_lock:
+            self._renders[id(job.params)] = job
+
+    def _mark_pending(self, params: Dict[str, Any]):
+        """Count params as a pull in flight in the bandit until its reward or release_pending"""
+        with self.state_lock:
+            self.bandit.mark_pending(params)
+            self._pending_pulls[id(params)] = params
+
+    def _take_pending(self, params: Dict[str, Any]) -> bool:
+        """Drop our record of the pending pull of params; True if it was still held (caller holds state_lock)"""
+        held = self._pending_pulls.get(id(params))
+        if held is not params:
+            return False
+        del self._pending_pulls[id(params)]
+        return True
+
+    def release_pending(self, params: Dict[str, Any]):
+        """The pull of params gets no reward (failed, abandoned): it stops counting as pending. Idempotent."""
+        with self.state_lock:
+            if self._take_pending(params):
+                self.bandit.clear_pending(params)
+
+    def _new_prefix(self) -> str:
+        ts = max(int(time.time()), self._last_prefix_ts + 1)
+        self._last_prefix_ts = ts
+        return f"gen_{ts}"
+
+    def _render_timeout_s(self, params: Dict[str, Any]) -> int:
+        return int(max(600, params.get('seconds', self.seconds) * 120))
+
+    def _prepare_v4(self, params: Dict[str, Any]) -> RenderedJob:
+        """Prompt + artifacts for an iteration and the workflow with its params applied."""
         # Перевіряємо наявність нових ручних оцінок і запускаємо OpenRouter для них
         try:
             self._check_and_process_new_ratings()
@@ -494,7 +603,7 @@ class EnhancedVideoAgentV4:
                 "blurry, low quality, jpeg artifacts, bad anatomy, extra limbs, deformed, watermark, text, logo"
             )
         # Set unique prefix to bind outputs; save prompt artifacts
-        prefix = f"gen_{int(time.time())}"
+        prefix = self._new_prefix()
         try:
             params['prefix'] = prefix
             # Save prompt artifacts for traceability
@@ -504,12 +613,13 @@ class EnhancedVideoAgentV4:
                 f.write(params.get('prompt', ''))
             prompt_json_path = os.path.join(self.prompts_dir, f"{prefix}.prompt.json")
             with open(prompt_json_path, 'w', encoding='utf-8') as f:
-                json.dump({
+                # Texts go to the prompt store when it is enabled (the .txt keeps the readable prompt)
+                json.dump(compact_refs({
                     'timestamp': int(time.time()),
                     'prompt': params.get('prompt'),
                     'negative_prompt': params.get('negative_prompt'),
                     'params': {k: v for k, v in params.items() if k not in ('prompt','negative_prompt')},
-                }, f, ensure_ascii=False, indent=2)
+                }, self.state_dir), f, ensure_ascii=False, indent=2)
             log.info(f"📝 Saved prompt: {prompt_txt_path}")
         except Exception as e:
             log.warning(f"Failed to save prompt artifacts: {e}")
@@ -524,17 +634,84 @@ class EnhancedVideoAgentV4:
 
         # Prepare workflow with params
         wf = apply_enhanced_params_to_workflow(self.base_wf, params)
+        return RenderedJob(params=params, prefix=prefix, workflow=wf)
+
+    def submit_v4(self, params: Dict[str, Any]) -> RenderedJob:
+        """Prepare an iteration and queue it in ComfyUI without waiting (job.error if queueing failed)."""
+        job = self._prepare_v4(params)
+        job.submitted_at = time.time()
         try:
-            # Queue job
             log.info(f"🚀 Генерація: {self._format_params_info(params)} | seconds={params.get('seconds', self.seconds)}")
-            prompt_id = self.client.queue(wf)
-            hist = self.client.wait(prompt_id, timeout_s=int(max(600, params.get('seconds', self.seconds) * 120)))
+            job.prompt_id = self.client.queue(job.workflow)
+        except Exception as e:
+            log.warning(f"ComfyUI generation failed: {e}")
+            job.error = str(e)
+        return job
+
+    def poll_v4(self, job: RenderedJob, exclusive: bool = True) -> bool:
+        """Check a queued job once; True when it is finished (video located, or job.error).
+
+        exclusive: no other job of ours is in flight, so the newest output may be taken as a fallback.
+        """
+        entry = self.client.poll(job.prompt_id)
+        if entry is None:
+            if time.time() - job.submitted_at <= self._render_timeout_s(job.params):
+                return False
+            log.warning(f"⏰ timeout waiting for prompt_id={job.prompt_id}")
+            job.error = f"Job {job.prompt_id} timed out"
+        else:
+            log.info(f"✅ prompt_id={job.prompt_id} completed")
+            job.video_path = self._locate_video(job, entry, exclusive)
+        job.render_s = time.time() - job.submitted_at
+        return True
+
+    def _locate_video(self, job: RenderedJob, entry: Optional[Dict[str, Any]], exclusive: bool) -> Optional[str]:
+        """The job's video: from its history outputs, else by prefix, else (only when exclusive) the newest one."""
+        for item in ComfyClient.output_files(entry or {}):
+            if not item["filename"].lower().endswith('.mp4'):
+                continue
+            path = os.path.join(self.comfyui_output, item.get("subfolder") or "", item["filename"])
+            if os.path.exists(path):
+                log.info(f"✅ Found from history: {path}")
+                return path
+        return self.find_generated_video(job.prefix) or (self.find_generated_video("") if exclusive else None)
+
+    def render_v4(self, params: Dict[str, Any]) -> RenderedJob:
+        """Render stage of an iteration: prompt + artifacts, apply params to workflow, queue in ComfyUI, wait, locate the video."""
+        job = self.submit_v4(params)
+        if job.error is not None:
+            return job
+        t0 = time.perf_counter()
+        try:
+            entry = self.client.wait(job.prompt_id, timeout_s=self._render_timeout_s(params))
         except Exception as e:
             log.warning(f"ComfyUI generation failed: {e}")
-            return 0.0, {"error": str(e)}, None, wf
+            job.error = str(e)
+        job.render_s = time.perf_counter() - t0
+        if job.error is None:
+            # Find produced video (history outputs, prefix or recent timestamp)
+            job.video_path = self._locate_video(job, entry, exclusive=True)
+        return job
+
+    # ==== High-level search/generation loop expected by QA CLI ====
+    def run_iteration_v4(self, params: Dict[str, Any]):
+        """Single iteration: apply params to workflow, queue in ComfyUI, wait, analyze, update knowledge/bandit.
+
+        With a render attached by GenerationPipeline only the analysis part runs here.
+        Returns: (score, metrics, video_path, applied_workflow)
+        """
+        with self.state_lock:
+            job = self._renders.pop(id(params), None)
+        if job is None or job.params is not params:
+            job = self.render_v4(params)
+        wf = job.workflow
+        video_path = job.video_path
+        if job.error is not None or not (video_path and os.path.exists(video_path)):
+            # No reward for this pull: its combo stops counting as pending in the bandit
+            self.release_pending(params)
+        if job.error is not None:
+            return 0.0, {"error": job.error}, None, wf
 
-        # Find produced video (by recent timestamp or prefix)
-        video_path = self.find_generated_video(prefix) or self.find_generated_video("")
         metrics = {}
         score = 0.0
         if video_path and os.path.exists(video_path):
@@ -548,64 +725,78 @@ class EnhancedVideoAgentV4:
                 log.warning(f"Basic analysis failed: {e}")
                 metrics = {"overall": 0.0}
 
-            # Update knowledge
-            try:
-                entry = {
-                    "video": video_path,
-                    "timestamp": int(time.time()),
-                    "params": params,
-                    "metrics": metrics,
-                    "score": score,
-                    "prompt": params.get('prompt'),
-                    "negative_prompt": params.get('negative_prompt'),
-                    "combo": [params.get('sampler'), params.get('scheduler')],
-                }
-                self.knowledge.setdefault("history", []).append(entry)
-                if score > self.knowledge.get("best_score", 0):
-                    self.knowledge["best_score"] = score
-                    self.knowledge["best_params"] = {"params": params, "metrics": metrics}
-                self._save_knowledge()
-            except Exception as e:
-                log.warning(f"Knowledge update failed: {e}")
+            # Knowledge, review queue and bandit change under the state lock (param selection reads them)
+            with self.state_lock:
+                # Update knowledge
+                try:
+                    entry = {
+                        "video": video_path,
+                        "timestamp": int(time.time()),
+                        "params": params,
+                        "metrics": metrics,
+                        "score": score,
+                        "prompt": params.get('prompt'),
+                        "negative_prompt": params.get('negative_prompt'),
+                        "combo": [params.get('sampler'), params.get('scheduler')],
+                    }
+                    self.knowledge.setdefault("history", []).append(entry)
+                    best = None
+                    if score > self.knowledge.get("best_score", 0):
+                        self.knowledge["best_score"] = score
+                        self.knowledge["best_params"] = {"params": params, "metrics": metrics}
+                        best = {"best_score": score, "best_params": self.knowledge["best_params"]}
+                    self._record_generation(entry, best)
+                except Exception as e:
+                    log.warning(f"Knowledge update failed: {e}")
 
-            # Add to manual review queue (helps UI)
-            try:
-                combo = [params.get('sampler'), params.get('scheduler')]
-                self.add_to_review_queue(video_path, params, metrics, combo)
-            except Exception:
-                pass
+                # Add to manual review queue (helps UI)
+                try:
+                    combo = [params.get('sampler'), params.get('scheduler')]
+                    self.add_to_review_queue(video_path, params, metrics, combo)
+                except Exception:
+                    pass
 
-            # Update bandit
-            try:
-                self.bandit.update(params, max(0.0, min(1.0, score)))
-            except Exception as e:
-                log.warning(f"Bandit update failed: {e}")
+                # Update bandit (the pending pull, if any, becomes a real one)
+                try:
+                    self.bandit.update(params, max(0.0, min(1.0, score)), pending=self._take_pending(params))
+                except Exception as e:
+                    log.warning(f"Bandit update failed: {e}")
 
         return score, metrics, video_path, wf
 
-    def search_v4(self, iterations: int = 10):
+    def search_v4(self, iterations: int = 10, pipelined: Optional[bool] = None,
+                  analysis_workers: int = DEFAULT_ANALYSIS_WORKERS,
+                  queue_depth: int = DEFAULT_QUEUE_DEPTH) -> PipelineStats:
         """Main search loop.
 
         Behavior:
         - If reference-only mode is enabled, iterate only over reference params.
         - Else if whitelist file auto_state/reference_params.json contains combos, iterate over them (cycling).
         - Otherwise, fall back to MultiDimensionalBandit selection.
+
+        pipelined (default AGENT_PIPELINE=1): queue the next job while a worker pool
+        analyzes the previous video (see eva_p1.pipeline). queue_depth (default
+        AGENT_QUEUE_DEPTH=1, at least one per backend of a ComfyClientPool): prompts kept
+        outstanding in ComfyUI. Returns timing stats.
         """
         iters = int(max(1, iterations))
+        if pipelined is None:
+            pipelined = PIPELINE_DEFAULT
+        # A backend pool gets at least one job per backend (the bandit's pending counts keep them distinct)
+        queue_depth = max(int(queue_depth), getattr(self.client, "capacity", 1))
+        pipeline = GenerationPipeline(self, pipelined=pipelined, analysis_workers=analysis_workers,
+                                      queue_depth=queue_depth)
+        return pipeline.run(self._iteration_params(iters), iters)
+
+    def _iteration_params(self, iters: int):
+        """(mode label, params) for each iteration of search_v4; params are fresh dicts (renders mutate them)."""
         # Strict reference-only mode
         if self.reference_only_mode and self.reference_params:
             log.info(f"✅ Reference-only mode активний: {len(self.reference_params)} комбінацій")
             for i in range(iters):
                 # В reference‑only режимі інкрементуємо bandit.t у select_reference_only,
                 # тому додатково тут t не чіпаємо
-                params = self.generate_next_params()
-                # При логуванні не показуємо сирі prompt/negative з reference-файлу
-                safe = dict(params)
-                safe.pop('prompt', None)
-                safe.pop('negative_prompt', None)
-                log.info(f"▶️ Iteration {i+1}/{iters} (reference-only): params={safe}")
-                score, metrics, video_path, _ = self.run_iteration_v4(params)
-                log.info(f"✅ Done iter {i+1}: score={score:.3f}, video={video_path}")
+                yield "reference-only", dict(self.generate_next_params())
             return
 
         wl = self._load_whitelist_params()
@@ -616,14 +807,10 @@ class EnhancedVideoAgentV4:
                 params = raw.get('params') if isinstance(raw, dict) else None
                 if not isinstance(params, dict):
                     params = raw if isinstance(raw, dict) else {}
+                params = dict(params)
                 # Ensure seconds present
                 params.setdefault('seconds', self.seconds)
-                safe = dict(params)
-                safe.pop('prompt', None)
-                safe.pop('negative_prompt', None)
-                log.info(f"▶️ Iteration {i+1}/{iters} (whitelist): params={safe}")
-                score, metrics, video_path, _ = self.run_iteration_v4(params)
-                log.info(f"✅ Done iter {i+1}: score={score:.3f}, video={video_path}")
+                yield "whitelist", params
             return
 
         # Fallback: bandit-driven search
@@ -633,9 +820,10 @@ class EnhancedVideoAgentV4:
             except Exception as e:
                 log.warning(f"Bandit param select failed: {e}. Using defaults.")
                 params = {"fps": 20, "seconds": self.seconds, "sampler": "euler", "scheduler": "normal", "steps": 25, "cfg_scale": 7.0, "width": 768, "height": 432}
-            log.info(f"▶️ Iteration {i+1}/{iters}: params={params}")
-            score, metrics, video_path, _ = self.run_iteration_v4(params)
-            log.info(f"✅ Done iter {i+1}: score={score:.3f}, video={video_path}")
+            # In flight until its reward (bandit.update) or release_pending: later selections see it as a pull
+            params = dict(params)
+            self._mark_pending(params)
+            yield "", params
 
     def _load_whitelist_params(self):
         """Load whitelist parameter combinations from reference_params.json in state_dir.
@@ -652,8 +840,7 @@ class EnhancedVideoAgentV4:
         try:
             if not os.path.exists(ref_path):
                 return []
-            with open(ref_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
+            data = expand_refs(load_file(ref_path), self.state_dir)
             if isinstance(data, list):
                 return data
             if isinstance(data, dict):
@@ -1,19 +1,32 @@
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional
+import os
 import time
+from urllib.parse import urlparse
 import requests
 from eva_env_base import log
 
+LOOPBACK_HOSTS = ("127.0.0.1", "localhost", "::1")
+
 class ComfyClient:
     """Enhanced ComfyUI API client with better error handling"""
 
-    def __init__(self, api_base: str = "http://127.0.0.1:8188"):
+    def __init__(self, api_base: str = "http://127.0.0.1:8188", local: Optional[bool] = None):
         self.api_base = api_base.rstrip("/")
+        # local: ComfyUI shares this machine's input/output dirs (no upload/download needed)
+        self.local = urlparse(self.api_base).hostname in LOOPBACK_HOSTS if local is None else bool(local)
+
+    def queue(self, workflow: Dict[str, Any], inputs: Optional[List[str]] = None) -> str:
+        """Queue a workflow for generation
 
-    def queue(self, workflow: Dict[str, Any]) -> str:
-        """Queue a workflow for generation"""
+        inputs: local files the workflow loads from ComfyUI's input dir (by basename);
+        uploaded first when the backend is not local.
+        """
         url = f"{self.api_base}/prompt"
         payload = {"prompt": workflow}
         try:
+            if inputs and not self.local:
+                for path in inputs:
+                    self.upload_input(path)
             log.info("🎯 POST /prompt (queue job)")
             try:
                 # Compact summary of params for diagnostics
@@ -37,28 +50,96 @@ class ComfyClient:
             log.error(f"Failed to queue workflow: {e}")
             raise
 
+    def history(self, prompt_id: str) -> Optional[Dict[str, Any]]:
+        """/history entry once the job finished (or failed), None while it is queued or running; raises on HTTP errors"""
+        r = requests.get(f"{self.api_base}/history/{prompt_id}", timeout=60)
+        r.raise_for_status()
+        hist = r.json()
+        entry = hist[prompt_id] if isinstance(hist, dict) and prompt_id in hist else hist
+        if isinstance(entry, dict):
+            status = entry.get("status") or {}
+            if status.get("completed") or entry.get("outputs") or status.get("status_str") == "error":
+                return entry
+        return None
+
+    def poll(self, prompt_id: str) -> Optional[Dict[str, Any]]:
+        """One /history check: the history entry once the job finished (or failed), else None"""
+        try:
+            return self.history(prompt_id)
+        except Exception as e:
+            log.warning(f"Polling error (prompt_id={prompt_id}): {e}")
+        return None
+
+    @staticmethod
+    def output_files(entry: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Files a finished job reported in its history outputs ({"filename", "subfolder", "type"})"""
+        files = []
+        for node_out in (entry.get("outputs") or {}).values():
+            if not isinstance(node_out, dict):
+                continue
+            for items in node_out.values():
+                if isinstance(items, list):
+                    files.extend(it for it in items if isinstance(it, dict) and it.get("filename"))
+        return files
+
     def wait(self, prompt_id: str, timeout_s: int = 3600, poll_s: int = 2) -> Dict[str, Any]:
         """Wait for workflow completion"""
-        url = f"{self.api_base}/history/{prompt_id}"
         t0 = time.time()
 
         while True:
-            try:
-                r = requests.get(url, timeout=60)
-                if r.status_code == 200:
-                    hist = r.json()
-                    entry = hist[prompt_id] if isinstance(hist, dict) and prompt_id in hist else hist
-                    if (isinstance(entry, dict) and entry.get("status", {}).get("completed")) or (isinstance(entry, dict) and entry.get("outputs")):
-                        log.info(f"✅ prompt_id={prompt_id} completed")
-                        return entry
-            except Exception as e:
-                log.warning(f"Polling error (prompt_id={prompt_id}): {e}")
+            entry = self.poll(prompt_id)
+            if entry is not None:
+                log.info(f"✅ prompt_id={prompt_id} completed")
+                return entry
 
             if time.time() - t0 > timeout_s:
                 log.warning(f"⏰ timeout waiting for prompt_id={prompt_id} after {timeout_s}s")
                 raise TimeoutError(f"Job {prompt_id} timed out after {timeout_s}s")
             time.sleep(poll_s)
 
+    def queue_status(self, timeout: float = 10) -> Dict[str, Any]:
+        """/queue: {"queue_running": [...], "queue_pending": [...]}, items are [number, prompt_id, ...]"""
+        r = requests.get(f"{self.api_base}/queue", timeout=timeout)
+        r.raise_for_status()
+        return r.json()
+
+    def system_stats(self, timeout: float = 10) -> Dict[str, Any]:
+        """/system_stats: system info and devices (vram_total / vram_free)"""
+        r = requests.get(f"{self.api_base}/system_stats", timeout=timeout)
+        r.raise_for_status()
+        return r.json()
+
+    def upload_input(self, path: str, name: Optional[str] = None) -> str:
+        """Upload a local file into ComfyUI's input dir (POST /upload/image); returns the stored name"""
+        name = name or os.path.basename(path)
+        with open(path, "rb") as f:
+            r = requests.post(f"{self.api_base}/upload/image", files={"image": (name, f)},
+                              data={"type": "input", "overwrite": "true"}, timeout=300)
+        r.raise_for_status()
+        log.info(f"📤 Uploaded {name} to {self.api_base}")
+        return r.json().get("name", name)
+
+    def fetch_outputs(self, entry: Dict[str, Any], output_dir: str) -> List[str]:
+        """Download the job's output files that are missing under output_dir (GET /view); returns the local paths"""
+        paths = []
+        for item in self.output_files(entry):
+            if item.get("type", "output") != "output":
+                continue
+            path = os.path.join(output_dir, item.get("subfolder") or "", item["filename"])
+            if not os.path.exists(path):
+                params = {"filename": item["filename"], "subfolder": item.get("subfolder") or "", "type": "output"}
+                with requests.get(f"{self.api_base}/view", params=params, stream=True, timeout=300) as r:
+                    r.raise_for_status()
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    tmp = f"{path}.part"
+                    with open(tmp, "wb") as f:
+                        for chunk in r.iter_content(1 << 20):
+                            f.write(chunk)
+                    os.replace(tmp, path)
+                log.info(f"📥 Downloaded {item['filename']} from {self.api_base}")
+            paths.append(path)
+        return paths
+
     def object_info(self) -> Dict[str, Any]:
         """Get ComfyUI object info"""
         url = f"{self.api_base}/object_info"
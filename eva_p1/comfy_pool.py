@@ -0,0 +1,438 @@
+"""Pool of ComfyUI backends behind the ComfyClient interface.
+
+`ComfyClientPool` takes several ComfyUI endpoints (e.g. one per GPU pod) and
+is used wherever a `ComfyClient` is: `queue` / `poll` / `wait` /
+`object_info`. Each job goes to the least-loaded healthy backend:
+
+  health  – GET /system_stats (and /queue) at most every COMFY_POOL_HEALTH_S
+            seconds per backend; a backend that fails is skipped for
+            COMFY_POOL_COOLDOWN_S seconds
+  load    – running + pending prompts from /queue (all clients of that node)
+            plus the jobs we queued there since; ties go to more free VRAM
+
+The prompt_id returned by `queue` is the pool's handle for the job. When a
+job fails on its backend – execution error, the prompt vanished from the
+node's queue (restart), or the node stayed unreachable for COMFY_POOL_LOST_S
+seconds – the same workflow is queued on another backend, up to
+COMFY_POOL_RETRIES times; the handle stays valid. Per-job input files are
+uploaded to non-local backends before queueing, files given to `upload_input`
+go to every backend (one that was down gets them before its next job), and
+outputs of finished jobs are downloaded into ``output_dir`` unless already
+there, so callers keep finding videos in the local ComfyUI output directory.
+
+Endpoints come from a comma-separated ``--api`` value or COMFY_ENDPOINTS;
+`create_comfy_client` returns a plain `ComfyClient` for a single endpoint.
+A GPU-less stand-in for local testing: ``python -m qa.stub_comfyui``.
+"""
+import os
+import time
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Set
+
+import requests
+from eva_env_base import log
+from eva_p1.comfy_client import ComfyClient
+
+COMFY_ENDPOINTS = os.environ.get("COMFY_ENDPOINTS", "")
+HEALTH_TTL_S = float(os.environ.get("COMFY_POOL_HEALTH_S", "5"))
+COOLDOWN_S = float(os.environ.get("COMFY_POOL_COOLDOWN_S", "30"))
+LOST_AFTER_S = float(os.environ.get("COMFY_POOL_LOST_S", "60"))
+MAX_RETRIES = int(os.environ.get("COMFY_POOL_RETRIES", "2"))
+DEFAULT_OUTPUT_DIR = "/workspace/ComfyUI/output"
+MAX_FINISHED = 1000  # finished prompt_ids remembered for fetch_outputs
+
+
+@dataclass
+class Backend:
+    client: ComfyClient
+    healthy: bool = True
+    checked_at: float = 0.0
+    down_until: float = 0.0
+    queue_len: int = 0          # running + pending on the node at the last check
+    queued_since_check: int = 0  # our submissions after that check
+    inflight: int = 0           # our jobs there that did not finish yet
+    vram_free: int = 0
+    jobs: int = 0
+    failures: int = 0
+    error: Optional[str] = None
+
+    @property
+    def name(self) -> str:
+        return self.client.api_base
+
+    @property
+    def load(self) -> int:
+        return self.queue_len + self.queued_since_check
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "endpoint": self.name,
+            "healthy": self.healthy,
+            "load": self.load,
+            "inflight": self.inflight,
+            "vram_free_gb": round(self.vram_free / 2 ** 30, 1),
+            "jobs": self.jobs,
+            "failures": self.failures,
+            "error": self.error,
+        }
+
+
+@dataclass
+class PoolJob:
+    key: str
+    workflow: Dict[str, Any]
+    inputs: List[str]
+    backend: Backend
+    prompt_id: str
+    submitted_at: float
+    attempts: int = 1
+    tried: Set[str] = field(default_factory=set)
+    unreachable_since: Optional[float] = None
+    queue_checked_at: float = 0.0
+    busy: bool = False          # a history() call is checking it (the other callers see "still running")
+
+
+def _prompt_ids(items) -> Set[str]:
+    return {it[1] for it in items or [] if isinstance(it, (list, tuple)) and len(it) > 1}
+
+
+class ComfyClientPool(ComfyClient):
+    """Least-loaded routing of ComfyUI jobs over several backends, with retries elsewhere on failure
+
+    ``_lock`` guards the job table and the backend counters only; HTTP requests run with it released,
+    so a slow or dead backend never holds up routing to the others.
+    """
+
+    def __init__(self, endpoints: List[str], output_dir: str = DEFAULT_OUTPUT_DIR, max_retries: int = MAX_RETRIES,
+                 health_ttl_s: float = HEALTH_TTL_S, cooldown_s: float = COOLDOWN_S, lost_after_s: float = LOST_AFTER_S,
+                 local: Optional[bool] = None):
+        if not endpoints:
+            raise ValueError("ComfyClientPool: no endpoints")
+        self.backends = [Backend(ComfyClient(e, local=local)) for e in dict.fromkeys(e.rstrip("/") for e in endpoints)]
+        self.api_base = ",".join(b.name for b in self.backends)
+        self.local = all(b.client.local for b in self.backends)
+        self.output_dir = output_dir
+        self.max_retries = max(0, int(max_retries))
+        self.health_ttl_s, self.cooldown_s, self.lost_after_s = health_ttl_s, cooldown_s, lost_after_s
+        self.retries = 0
+        self._jobs: Dict[str, PoolJob] = {}
+        self._uploads: Dict[str, str] = {}       # upload_input(): stored name → local path, for every backend
+        self._uploaded: Dict[str, Set[str]] = {b.name: set() for b in self.backends}
+        self._finished: "OrderedDict[str, Backend]" = OrderedDict()  # backend prompt_id → backend, for fetch_outputs
+        self._lock = threading.RLock()
+
+    @property
+    def capacity(self) -> int:
+        """Backends in the pool: search_v4 keeps at least this many jobs in flight"""
+        return len(self.backends)
+
+    # --- Health / routing (callers of _mark_down / _release hold _lock) -----------
+    def _mark_down(self, backend: Backend, error: Exception):
+        if backend.healthy:
+            log.warning(f"⚠️ ComfyUI backend {backend.name} unavailable for {self.cooldown_s:.0f}s: {error}")
+        backend.healthy = False
+        backend.failures += 1
+        backend.error = str(error)
+        backend.checked_at = time.time()
+        backend.down_until = backend.checked_at + self.cooldown_s
+
+    @staticmethod
+    def _release(backend: Backend, queued: bool = False):
+        """Undo a reservation made by _pick (queued=True: the job never reached the node's queue)"""
+        backend.inflight = max(0, backend.inflight - 1)
+        if queued:
+            backend.queued_since_check = max(0, backend.queued_since_check - 1)
+
+    def _refresh(self, backend: Backend):
+        with self._lock:
+            now = time.time()
+            if now < backend.down_until or now - backend.checked_at < self.health_ttl_s:
+                return
+            # Claim this round: concurrent callers keep using the previous numbers instead of asking again
+            backend.checked_at = now
+        try:
+            stats = backend.client.system_stats()
+            queue = backend.client.queue_status()
+        except Exception as e:
+            with self._lock:
+                self._mark_down(backend, e)
+            return
+        with self._lock:
+            if not backend.healthy:
+                log.info(f"✅ ComfyUI backend {backend.name} is back")
+            backend.healthy, backend.error = True, None
+            backend.queue_len = len(queue.get("queue_running") or []) + len(queue.get("queue_pending") or [])
+            backend.queued_since_check = 0
+            backend.vram_free = sum(int(d.get("vram_free") or 0) for d in stats.get("devices") or []
+                                    if isinstance(d, dict))
+
+    def _pick(self, exclude: Set[str], reserve: bool = True) -> Optional[Backend]:
+        """Best healthy backend; reserve=True counts a job on it right away so concurrent picks spread out"""
+        for backend in self.backends:
+            self._refresh(backend)
+        with self._lock:
+            healthy = [b for b in self.backends if b.healthy]
+            # Prefer backends the job has not failed on; a single healthy one is still better than none
+            candidates = [b for b in healthy if b.name not in exclude] or healthy
+            if not candidates:
+                return None
+            backend = min(candidates, key=lambda b: (b.load, -b.vram_free, b.jobs))
+            if reserve:
+                backend.queued_since_check += 1
+                backend.inflight += 1
+            return backend
+
+    def _sync_uploads(self, backend: Backend):
+        """Upload the upload_input() files this backend does not have yet (it was down, or joined later)"""
+        with self._lock:
+            missing = [(n, p) for n, p in self._uploads.items() if n not in self._uploaded[backend.name]]
+        for name, path in missing:
+            backend.client.upload_input(path, name)
+            with self._lock:
+                self._uploaded[backend.name].add(name)
+
+    def _submit(self, workflow: Dict[str, Any], inputs: List[str], exclude: Set[str]):
+        """Queue on the best backend, moving on to the next one if queueing fails"""
+        tried = set(exclude)
+        while True:
+            # Backends that refused the job are marked down, so this ends when none is left
+            backend = self._pick(tried)
+            if backend is None:
+                raise RuntimeError(f"No healthy ComfyUI backend ({', '.join(b.name for b in self.backends)})")
+            try:
+                self._sync_uploads(backend)
+                prompt_id = backend.client.queue(workflow, inputs=inputs)
+            except requests.HTTPError as e:
+                with self._lock:
+                    self._release(backend, queued=True)
+                    # 4xx: the workflow itself was rejected (node_errors) and would be everywhere
+                    if e.response is not None and e.response.status_code < 500:
+                        raise
+                    self._mark_down(backend, e)
+                tried.add(backend.name)
+                continue
+            except Exception as e:
+                with self._lock:
+                    self._release(backend, queued=True)
+                    self._mark_down(backend, e)
+                tried.add(backend.name)
+                continue
+            with self._lock:
+                backend.jobs += 1
+                log.info(f"🖥️ prompt_id={prompt_id} → {backend.name} (load {backend.load}, inflight {backend.inflight})")
+            return backend, prompt_id
+
+    # --- ComfyClient interface -----------------------------------------------------
+    def queue(self, workflow: Dict[str, Any], inputs: Optional[List[str]] = None) -> str:
+        """Queue a workflow on the least-loaded healthy backend; returns the pool's handle of the job"""
+        backend, prompt_id = self._submit(workflow, list(inputs or []), set())
+        job = PoolJob(key=prompt_id, workflow=workflow, inputs=list(inputs or []), backend=backend,
+                      prompt_id=prompt_id, submitted_at=time.time(), tried={backend.name})
+        with self._lock:
+            self._jobs[prompt_id] = job
+        return prompt_id
+
+    def history(self, prompt_id: str) -> Optional[Dict[str, Any]]:
+        """History entry of the job once it finished (outputs downloaded), None while it runs or is being retried"""
+        with self._lock:
+            job = self._jobs.get(prompt_id)
+            if job is not None:
+                if job.busy:
+                    return None
+                job.busy = True
+        if job is None:
+            return self._history_anywhere(prompt_id)
+        try:
+            return self._check(job)
+        finally:
+            with self._lock:
+                job.busy = False
+
+    def _check(self, job: PoolJob) -> Optional[Dict[str, Any]]:
+        """One history() round of a claimed job (job.busy): only this thread touches it until it returns"""
+        now = time.time()
+        try:
+            entry = job.backend.client.history(job.prompt_id)
+        except Exception as e:
+            job.unreachable_since = job.unreachable_since or now
+            with self._lock:
+                # Give a healthy backend lost_after_s to come back; jobs of one already marked down move at once
+                if job.backend.healthy and now - job.unreachable_since < self.lost_after_s:
+                    raise
+                self._mark_down(job.backend, e)
+            return self._retry(job, f"backend unreachable for {now - job.unreachable_since:.0f}s")
+        job.unreachable_since = None
+        if entry is None:
+            return self._retry(job, "prompt lost from the backend queue") if self._lost(job, now) else None
+        if (entry.get("status") or {}).get("status_str") == "error":
+            return self._retry(job, "execution error", entry)
+        try:
+            job.backend.client.fetch_outputs(entry, self.output_dir)
+        except Exception as e:
+            log.warning(f"Failed to fetch outputs of prompt_id={job.prompt_id} from {job.backend.name}: {e}")
+        with self._lock:
+            self._finish(job)
+        return entry
+
+    def _history_anywhere(self, prompt_id: str) -> Optional[Dict[str, Any]]:
+        """A job this pool did not queue (e.g. before a restart): ask every backend"""
+        for backend in self.backends:
+            try:
+                entry = backend.client.history(prompt_id)
+            except Exception:
+                continue
+            if entry is not None:
+                with self._lock:
+                    self._remember(prompt_id, backend)
+                return entry
+        return None
+
+    def _lost(self, job: PoolJob, now: float) -> bool:
+        """Not finished and not in the node's queue either (node restarted / queue cleared)"""
+        if now - job.queue_checked_at < self.health_ttl_s:
+            return False
+        job.queue_checked_at = now
+        try:
+            queue = job.backend.client.queue_status()
+            if job.prompt_id in _prompt_ids(queue.get("queue_running")) | _prompt_ids(queue.get("queue_pending")):
+                return False
+            # It may have finished between the two requests
+            return job.backend.client.history(job.prompt_id) is None
+        except Exception:
+            return False
+
+    def _remember(self, prompt_id: str, backend: Backend):
+        self._finished[prompt_id] = backend
+        while len(self._finished) > MAX_FINISHED:
+            self._finished.popitem(last=False)
+
+    def _finish(self, job: PoolJob):
+        self._release(job.backend)
+        self._remember(job.prompt_id, job.backend)
+        self._jobs.pop(job.key, None)
+
+    def _retry(self, job: PoolJob, reason: str, entry: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+        """Queue the job again on another backend (None: still running), or give up with an error entry"""
+        with self._lock:
+            self._release(job.backend)
+        failed = job.backend.name
+        if job.attempts <= self.max_retries:
+            try:
+                backend, prompt_id = self._submit(job.workflow, job.inputs, job.tried)
+            except Exception as e:
+                reason = f"{reason}; retry failed: {e}"
+            else:
+                with self._lock:
+                    job.backend, job.prompt_id = backend, prompt_id
+                    job.attempts += 1
+                    job.tried.add(backend.name)
+                    job.unreachable_since, job.queue_checked_at = None, 0.0
+                    self.retries += 1
+                log.warning(f"🔁 Job {job.key}: {reason} on {failed}, retry {job.attempts - 1}/{self.max_retries} "
+                            f"on {backend.name}")
+                return None
+        with self._lock:
+            self._jobs.pop(job.key, None)
+        log.error(f"❌ Job {job.key} failed after {job.attempts} attempt(s): {reason} on {failed}")
+        if entry is None:
+            entry = {"outputs": {}, "status": {"status_str": "error", "completed": False, "messages": [reason]}}
+        return entry
+
+    def object_info(self) -> Dict[str, Any]:
+        """Object info of the first healthy backend (all backends are expected to run the same nodes)"""
+        backend = self._pick(set(), reserve=False)
+        if backend is None:
+            raise RuntimeError("No healthy ComfyUI backend")
+        return backend.client.object_info()
+
+    def queue_status(self, timeout: float = 10) -> Dict[str, Any]:
+        """/queue of all healthy backends, merged"""
+        running, pending = [], []
+        for backend in self.backends:
+            if not backend.healthy:
+                continue
+            try:
+                queue = backend.client.queue_status(timeout)
+            except Exception:
+                continue
+            running.extend(queue.get("queue_running") or [])
+            pending.extend(queue.get("queue_pending") or [])
+        return {"queue_running": running, "queue_pending": pending}
+
+    def system_stats(self, timeout: float = 10) -> Dict[str, Any]:
+        """Devices of all backends (each tagged with its endpoint)"""
+        devices = []
+        for backend in self.backends:
+            try:
+                stats = backend.client.system_stats(timeout)
+            except Exception:
+                continue
+            devices.extend(dict(d, endpoint=backend.name) for d in stats.get("devices") or [] if isinstance(d, dict))
+        return {"devices": devices}
+
+    def upload_input(self, path: str, name: Optional[str] = None) -> str:
+        """Upload a local file into the input dir of every backend; returns the stored name
+
+        Backends that are down now get the file before their next job, so a workflow queued after
+        this call finds it wherever it is routed. Raises only if no backend took it.
+        """
+        name = name or os.path.basename(path)
+        with self._lock:
+            self._uploads[name] = path
+            for names in self._uploaded.values():
+                names.discard(name)   # overwritten: re-send everywhere
+        stored, error = None, None
+        for backend in self.backends:
+            if not backend.healthy:
+                continue
+            try:
+                stored = backend.client.upload_input(path, name)
+            except Exception as e:
+                error = e
+                with self._lock:
+                    self._mark_down(backend, e)
+                continue
+            with self._lock:
+                self._uploaded[backend.name].add(name)
+        if stored is None:
+            raise error or RuntimeError(f"No healthy ComfyUI backend to upload {name} to")
+        return stored
+
+    def fetch_outputs(self, entry: Dict[str, Any], output_dir: str) -> List[str]:
+        """Download the outputs of a history entry from the backend that produced it"""
+        prompt = entry.get("prompt")
+        prompt_id = prompt[1] if isinstance(prompt, (list, tuple)) and len(prompt) > 1 else None
+        with self._lock:
+            backend = self._finished.get(prompt_id)
+        error = None
+        for b in [backend] if backend is not None else self.backends:
+            try:
+                return b.client.fetch_outputs(entry, output_dir)
+            except Exception as e:
+                error = e
+        raise error
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "backends": [b.as_dict() for b in self.backends],
+                "inflight": len(self._jobs),
+                "retries": self.retries,
+            }
+
+
+def parse_endpoints(api: Optional[str]) -> List[str]:
+    """Endpoints from a comma-separated --api value, else COMFY_ENDPOINTS"""
+    spec = api if api and "," in api else (COMFY_ENDPOINTS or api or "")
+    return [e.strip() for e in spec.split(",") if e.strip()]
+
+
+def create_comfy_client(api: Optional[str], output_dir: str = DEFAULT_OUTPUT_DIR) -> ComfyClient:
+    """ComfyClient for a single endpoint, ComfyClientPool for several"""
+    endpoints = parse_endpoints(api)
+    if len(endpoints) <= 1:
+        return ComfyClient(endpoints[0] if endpoints else "http://127.0.0.1:8188")
+    log.info(f"🖥️ ComfyUI pool: {len(endpoints)} backends ({', '.join(endpoints)})")
+    return ComfyClientPool(endpoints, output_dir=output_dir)
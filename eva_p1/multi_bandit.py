@@ -1,114 +1,84 @@
 # Copied from eva_p1_comfy_video_bandit.py
-import os, json, math, random
+import os, copy, math, random
 from typing import Dict, Any, List
 from eva_env_base import log
 from eva_p1.analysis_config import FPS_OPTIONS, SECONDS_OPTIONS, CFG_SCALES, STEPS_OPTIONS, RESOLUTION_OPTIONS
+from eva_state.prompt_store import expand_refs
+from eva_state.serializer import load_file
+from eva_state.versioned_state import combo_key, get_bandit_state, merge_bandit_state
 
 class MultiDimensionalBandit:
     """Multi-dimensional UCB bandit with intelligent combo filtering and data migration"""
 
     def __init__(self, state_path: str):
         self.state_path = state_path
+        # bandit_state.json is shared with the review server: versioned writes, merged on conflict
+        self._state = get_bandit_state(state_path)
+        self._version = 0
+        self._base = {}
         self.combo_stats = {}  # {combo_key: {"N": int, "S": float, "scores": []}}
         self.t = 0
         self.min_attempts = 3
         self.poor_threshold = 0.45
         self.banned_combos = set()
+        # Jobs queued in ComfyUI but not rewarded yet: {combo_key: count} (in memory only)
+        self.pending = {}
         self.load()
 
-    def _migrate_old_format(self, data: Dict[str, Any]) -> Dict[str, Any]:
-        """Migrate old bandit format to new format"""
-        migrated = False
-        combo_stats = data.get("combo_stats", {})
-        
-        for combo_key, stats_dict in combo_stats.items():
-            # Check if this is old format
-            if "total_reward" in stats_dict and "count" in stats_dict:
-                # Convert old format to new
-                total_reward = stats_dict["total_reward"]
-                count = stats_dict["count"]
-                
-                # Create new format
-                new_stats = {
-                    "N": count,
-                    "S": total_reward,
-                    "scores": [total_reward / count] * count  # Approximate scores list
-                }
-                
-                combo_stats[combo_key] = new_stats
-                migrated = True
-                log.info(f"🔄 Migrated old bandit entry: {combo_key}")
-            
-            # Ensure all required fields exist
-            elif "N" not in stats_dict or "S" not in stats_dict:
-                # Fix incomplete entries
-                combo_stats[combo_key] = {
-                    "N": stats_dict.get("N", stats_dict.get("count", 0)),
-                    "S": stats_dict.get("S", stats_dict.get("total_reward", 0.0)),
-                    "scores": stats_dict.get("scores", [])
-                }
-                migrated = True
-                log.info(f"🔧 Fixed incomplete bandit entry: {combo_key}")
-        
-        if migrated:
-            data["combo_stats"] = combo_stats
-            log.info("💾 Saving migrated bandit state...")
-            self._save_data(data)
-        
-        return data
-
-    def _save_data(self, data: Dict[str, Any]):
-        """Save data to file atomically to avoid corruption on crash."""
-        try:
-            tmp_path = f"{self.state_path}.tmp"
-            with open(tmp_path, "w", encoding="utf-8") as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
-            os.replace(tmp_path, self.state_path)
-        except Exception as e:
-            log.error(f"Failed to save bandit state: {e}")
-
     def _combo_key(self, params: Dict[str, Any]) -> str:
         """Generate unique key for parameter combination"""
-        key_parts = [
-            params.get("sampler", "unknown"),
-            params.get("scheduler", "unknown"),
-            str(params.get("fps", 20)),
-            str(params.get("cfg_scale", 7.0)),
-            str(params.get("steps", 25)),
-            f"{params.get('width', 768)}x{params.get('height', 432)}"
-        ]
-        return "|".join(key_parts)
+        return combo_key(params)
 
-    def load(self):
-        """Load bandit state from file with migration support"""
-        if os.path.isfile(self.state_path):
-            try:
-                with open(self.state_path, "r", encoding="utf-8") as f:
-                    data = json.load(f)
-                
-                # Migrate old format if needed
-                data = self._migrate_old_format(data)
-                
-                self.combo_stats = data.get("combo_stats", {})
-                self.t = data.get("t", 0)
-                self.banned_combos = set(data.get("banned_combos", []))
-                
-                log.info(f"✅ Loaded multi-dim bandit: t={self.t}, combos={len(self.combo_stats)}, banned={len(self.banned_combos)}")
-            except Exception as e:
-                log.warning(f"Failed to load bandit state: {e}")
-                # Initialize with empty state
-                self.combo_stats = {}
-                self.t = 0
-                self.banned_combos = set()
-
-    def save(self):
-        """Save bandit state to file"""
-        data = {
+    def _document(self) -> Dict[str, Any]:
+        return {
             "combo_stats": self.combo_stats,
             "t": self.t,
             "banned_combos": list(self.banned_combos)
         }
-        self._save_data(data)
+
+    def _adopt(self, version: int, data: Dict[str, Any]):
+        """Take the on-disk state as the in-memory state and as the base of the next save."""
+        self._version = version
+        self._base = copy.deepcopy(data)
+        self.combo_stats = copy.deepcopy(data.get("combo_stats", {}))
+        self.t = data.get("t", 0)
+        self.banned_combos = set(data.get("banned_combos", []))
+
+    def load(self):
+        """Load bandit state from file (legacy shapes are migrated by normalize_bandit_state)"""
+        try:
+            self._adopt(*self._state.read())
+            log.info(f"✅ Loaded multi-dim bandit: t={self.t}, combos={len(self.combo_stats)}, banned={len(self.banned_combos)}")
+        except Exception as e:
+            log.warning(f"Failed to load bandit state: {e}")
+            # Initialize with empty state
+            self._adopt(0, {})
+
+    def save(self):
+        """Save bandit state: compare-and-swap against the version we loaded, merging
+        whatever the review server (bans, t) wrote in between"""
+        try:
+            merges = self._state.merges
+            version, data = self._state.commit(self._version, self._base, self._document(), merge_bandit_state)
+            if self._state.merges != merges:
+                log.info(f"🔀 Merged bandit state v{version}: t={data.get('t', 0)}, banned={len(data.get('banned_combos', []))}")
+            self._adopt(version, data)
+        except Exception as e:
+            log.error(f"Failed to save bandit state: {e}")
+
+    def mark_pending(self, params: Dict[str, Any]):
+        """Count a queued job as a virtual pull of its combo until update/clear_pending"""
+        key = self._combo_key(params)
+        self.pending[key] = self.pending.get(key, 0) + 1
+
+    def clear_pending(self, params: Dict[str, Any]):
+        """Drop one pending pull of the combo (job rewarded or failed)"""
+        key = self._combo_key(params)
+        left = self.pending.get(key, 0) - 1
+        if left > 0:
+            self.pending[key] = left
+        else:
+            self.pending.pop(key, None)
 
     def _generate_random_params(self) -> Dict[str, Any]:
         """Generate random parameter combination with FIXED PAIRS"""
@@ -175,12 +145,16 @@ class MultiDimensionalBandit:
 
         # Вибір параметрів
         if self.t <= 20 or random.random() < 0.3:  # exploration
+            fallback = None
             for _ in range(50):
                 params = self._generate_random_params()
                 combo_key = self._combo_key(params)
                 if combo_key not in self.banned_combos:
-                    return params
-            return self._generate_random_params()
+                    # Jobs already in flight explore their combos, look for another one first
+                    if combo_key not in self.pending:
+                        return params
+                    fallback = fallback or params
+            return fallback or self._generate_random_params()
         else:  # exploitation - вибираємо найкращу за UCB
             best_ucb = -1
             best_params = None
@@ -194,7 +168,8 @@ class MultiDimensionalBandit:
 
                 if N > 0:
                     mean = S / N
-                    bonus = math.sqrt(2.0 * math.log(self.t) / N)
+                    # Pending jobs count as pulls with the current mean: same estimate, smaller bonus
+                    bonus = math.sqrt(2.0 * math.log(self.t) / (N + self.pending.get(combo_key, 0)))
                     ucb = mean + bonus
 
                     if ucb > best_ucb:
@@ -223,9 +198,16 @@ class MultiDimensionalBandit:
             else:
                 return self._generate_random_params()
 
-    def update(self, params: Dict[str, Any], reward: float):
-        """Update statistics for given parameters"""
+    def update(self, params: Dict[str, Any], reward: float, pending: bool = False):
+        """Update statistics for given parameters
+
+        pending: pass True only when this very pull was counted with
+        mark_pending, so it becomes a real one; by default no pending pull
+        is touched (another in-flight render of the same combo keeps its own).
+        """
         combo_key = self._combo_key(params)
+        if pending and combo_key in self.pending:
+            self.clear_pending(params)
 
         if combo_key not in self.combo_stats:
             self.combo_stats[combo_key] = {"N": 0, "S": 0.0, "scores": []}
@@ -256,8 +238,7 @@ class MultiDimensionalBandit:
 
         try:
             if os.path.exists(reference_file):
-                with open(reference_file, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
+                data = expand_refs(load_file(reference_file), os.path.dirname(os.path.abspath(reference_file)))
 
                 ref_items: List[Dict[str, Any]] = []
 
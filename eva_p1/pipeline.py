@@ -0,0 +1,300 @@
+"""Pipelined generate/analyze loop behind EnhancedVideoAgentV4.search_v4.
+
+Sequentially every iteration builds the prompt, queues the job, blocks in
+`ComfyClient.wait` and only then decodes and analyzes the video on the CPU:
+the GPU idles during every analysis and the CPU during every render.
+
+`GenerationPipeline` splits an iteration into two stages:
+
+  render   – `agent.render_v4(params)`: prompt + artifacts, queue, wait,
+             locate the produced video (main thread, one job at a time)
+  analyze  – `agent.run_iteration_v4(params)` with that render attached:
+             analysis, knowledge / review queue / bandit updates (and
+             whatever subclasses and QA patches add on top)
+
+In pipelined mode the next job is queued as soon as the previous render
+finished, while a small worker pool analyzes the previous video and applies
+its bandit update. Params of job i+1 are therefore chosen before the reward
+of job i is known (one job of bandit lag); selection and the state updates
+share ``agent.state_lock``. At most ``max_backlog`` rendered videos wait for
+analysis, so a slow analyzer throttles rendering instead of piling up jobs.
+
+With ``queue_depth`` K > 1 the render stage is split further: the main loop
+keeps K prompt_ids outstanding in ComfyUI (`agent.submit_v4`), tracks them in
+an `InFlightTable` and polls them (`agent.poll_v4`) instead of blocking on one
+job, so ComfyUI starts the next prompt without the poll / prompt generation /
+queue round trip and with the models still loaded. A finished job is handed to
+analysis and its slot refilled; params are selected at refill time, and the
+bandit counts the combos still in flight as virtual pulls so the K jobs
+explore different combos. Every iteration ends its pull exactly once: with its
+reward, or with `agent.release_pending(params)` when it fails or is
+abandoned (analysis error, submit / render error, jobs left in flight).
+
+All modes return `PipelineStats`: wall time, GPU-busy fraction (render time,
+or time with at least one job in flight, over wall time) and iterations per
+hour. ``AGENT_PIPELINE=1`` makes search_v4 pipelined by default,
+``AGENT_ANALYSIS_WORKERS`` sizes the pool, ``AGENT_QUEUE_DEPTH`` sets K and
+``AGENT_POLL_S`` the poll interval of the in-flight jobs.
+"""
+import os
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+# The agent's logger (eva_env_base) without importing its heavy dependencies
+log = logging.getLogger("enhanced-video-agent-v4")
+
+PIPELINE_DEFAULT = os.environ.get("AGENT_PIPELINE", "") == "1"
+DEFAULT_ANALYSIS_WORKERS = int(os.environ.get("AGENT_ANALYSIS_WORKERS", "1"))
+DEFAULT_QUEUE_DEPTH = int(os.environ.get("AGENT_QUEUE_DEPTH", "1"))
+POLL_S = float(os.environ.get("AGENT_POLL_S", "2"))
+
+
+@dataclass
+class RenderedJob:
+    """Result of the render stage of one iteration."""
+    params: Dict[str, Any]
+    prefix: str = ""
+    workflow: Optional[Dict[str, Any]] = None
+    prompt_id: Optional[str] = None
+    video_path: Optional[str] = None
+    error: Optional[str] = None
+    render_s: float = 0.0
+    submitted_at: float = 0.0
+
+
+@dataclass
+class PipelineStats:
+    mode: str
+    iterations: int = 0
+    failures: int = 0
+    wall_s: float = 0.0
+    render_s: float = 0.0
+    analyze_s: float = 0.0
+    scores: list = field(default_factory=list)
+
+    @property
+    def gpu_busy(self) -> float:
+        return self.render_s / self.wall_s if self.wall_s > 0 else 0.0
+
+    @property
+    def iterations_per_hour(self) -> float:
+        return self.iterations * 3600.0 / self.wall_s if self.wall_s > 0 else 0.0
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "mode": self.mode,
+            "iterations": self.iterations,
+            "failures": self.failures,
+            "wall_s": round(self.wall_s, 2),
+            "render_s": round(self.render_s, 2),
+            "analyze_s": round(self.analyze_s, 2),
+            "gpu_busy": round(self.gpu_busy, 3),
+            "iterations_per_hour": round(self.iterations_per_hour, 1),
+        }
+
+
+def _safe_params(params: Dict[str, Any]) -> Dict[str, Any]:
+    """Params for the log, without the (long) prompt texts."""
+    return {k: v for k, v in params.items() if k not in ("prompt", "negative_prompt")}
+
+
+class InFlightTable:
+    """Jobs queued in ComfyUI and not finished yet, by prompt_id (submission order).
+
+    Also accounts GPU-busy time: the wall time during which at least one job
+    was outstanding.
+    """
+
+    def __init__(self):
+        self._jobs: Dict[str, Tuple[int, RenderedJob]] = {}
+        self._busy_since: Optional[float] = None
+        self.busy_s = 0.0
+
+    def __len__(self) -> int:
+        return len(self._jobs)
+
+    def add(self, i: int, job: RenderedJob):
+        if not self._jobs:
+            self._busy_since = time.perf_counter()
+        self._jobs[job.prompt_id] = (i, job)
+
+    def pop(self, prompt_id: str) -> Tuple[int, RenderedJob]:
+        entry = self._jobs.pop(prompt_id)
+        if not self._jobs and self._busy_since is not None:
+            self.busy_s += time.perf_counter() - self._busy_since
+            self._busy_since = None
+        return entry
+
+    def poll(self, agent) -> List[Tuple[int, RenderedJob]]:
+        """Poll every outstanding job once; remove and return the finished ones (a poll error fails the job)."""
+        done = []
+        for prompt_id, (_i, job) in list(self._jobs.items()):
+            try:
+                finished = agent.poll_v4(job, exclusive=len(self._jobs) == 1)
+            except Exception as e:
+                log.warning(f"Polling prompt_id={prompt_id} failed: {e}")
+                job.error = str(e)
+                finished = True
+            if finished:
+                done.append(self.pop(prompt_id))
+        return done
+
+    def jobs(self) -> List[RenderedJob]:
+        return [job for _i, job in self._jobs.values()]
+
+    def prompt_ids(self) -> List[str]:
+        return list(self._jobs)
+
+
+class GenerationPipeline:
+    """Runs (label, params) iterations through the agent's render and analyze stages."""
+
+    def __init__(self, agent, pipelined: bool = True, analysis_workers: int = DEFAULT_ANALYSIS_WORKERS,
+                 max_backlog: Optional[int] = None, queue_depth: int = DEFAULT_QUEUE_DEPTH, poll_s: float = POLL_S):
+        self.agent = agent
+        self.pipelined = bool(pipelined)
+        self.analysis_workers = max(1, int(analysis_workers))
+        self.max_backlog = max(1, int(max_backlog if max_backlog is not None else 2 * self.analysis_workers))
+        self.queue_depth = max(1, int(queue_depth))
+        self.poll_s = max(0.0, float(poll_s))
+        self._stats_lock = threading.Lock()
+
+    def _next(self, jobs: Iterator[Tuple[str, Dict[str, Any]]]) -> Optional[Tuple[str, Dict[str, Any]]]:
+        # Selection reads the bandit / knowledge that analysis workers update
+        with self.agent.state_lock:
+            return next(jobs, None)
+
+    def _release(self, params: Dict[str, Any]):
+        # The pending bandit pull of an iteration that gets no reward (no-op once released or rewarded)
+        release = getattr(self.agent, "release_pending", None)
+        if release is not None:
+            release(params)
+
+    def _analyze(self, i: int, total: int, job: RenderedJob, stats: PipelineStats):
+        t0 = time.perf_counter()
+        try:
+            self.agent.attach_render(job)
+            score, _metrics, video_path, _ = self.agent.run_iteration_v4(job.params)
+            failed = video_path is None
+        except Exception as e:
+            log.warning(f"Iteration {i}/{total} analysis failed: {e}")
+            score, video_path, failed = 0.0, None, True
+        finally:
+            self._release(job.params)
+        elapsed = time.perf_counter() - t0
+        with self._stats_lock:
+            stats.iterations += 1
+            stats.failures += int(failed)
+            stats.analyze_s += elapsed
+            stats.scores.append(score)
+        log.info(f"✅ Done iter {i}: score={score:.3f}, video={video_path}")
+
+    def _start(self, i: int, total: int, label: str, params: Dict[str, Any]):
+        log.info(f"▶️ Iteration {i}/{total}{f' ({label})' if label else ''}: params={_safe_params(params)}")
+
+    def run(self, jobs: Iterable[Tuple[str, Dict[str, Any]]], total: int) -> PipelineStats:
+        mode = "pipelined" if self.pipelined else "sequential"
+        stats = PipelineStats(mode if self.queue_depth == 1 else f"{mode} K={self.queue_depth}")
+        executor = ThreadPoolExecutor(self.analysis_workers, thread_name_prefix="analyze") if self.pipelined else None
+        futures = []
+        jobs = iter(jobs)
+        t0 = time.perf_counter()
+        try:
+            if self.queue_depth == 1:
+                self._run_blocking(jobs, total, stats, executor, futures)
+            else:
+                self._run_in_flight(jobs, total, stats, executor, futures)
+        finally:
+            for future in futures:
+                future.result()
+            if executor is not None:
+                executor.shutdown(wait=True)
+            stats.wall_s = time.perf_counter() - t0
+        s = stats.as_dict()
+        log.info(f"⏱️ {s['mode']}: {s['iterations']} iterations in {s['wall_s']}s, GPU busy {s['gpu_busy'] * 100:.0f}%, "
+                 f"{s['iterations_per_hour']} it/h (render {s['render_s']}s, analysis {s['analyze_s']}s)")
+        return stats
+
+    def _run_blocking(self, jobs, total, stats, executor, futures):
+        """One job in ComfyUI at a time: render_v4 queues it and waits."""
+        backlog = threading.BoundedSemaphore(self.max_backlog)
+        i = 0
+        while True:
+            nxt = self._next(jobs)
+            if nxt is None:
+                break
+            label, params = nxt
+            i += 1
+            self._start(i, total, label, params)
+            if executor is not None:
+                # Free analysis slot first: the render must not outrun the analyzers unboundedly
+                backlog.acquire()
+            try:
+                job = self.agent.render_v4(params)
+            except BaseException:
+                self._release(params)
+                raise
+            stats.render_s += job.render_s
+            if executor is None:
+                self._analyze(i, total, job, stats)
+                continue
+            future = executor.submit(self._analyze, i, total, job, stats)
+            future.add_done_callback(lambda _f: backlog.release())
+            futures.append(future)
+
+    def _run_in_flight(self, jobs, total, stats, executor, futures):
+        """Keep queue_depth jobs outstanding in ComfyUI, hand finished ones to analysis."""
+        inflight = InFlightTable()
+        # Jobs in ComfyUI plus rendered videos waiting for analysis
+        slots = threading.BoundedSemaphore(self.queue_depth + self.max_backlog) if executor is not None else None
+
+        def dispatch(i, job):
+            if executor is None:
+                self._analyze(i, total, job, stats)
+                return
+            future = executor.submit(self._analyze, i, total, job, stats)
+            future.add_done_callback(lambda _f: slots.release())
+            futures.append(future)
+
+        i = 0
+        exhausted = False
+        try:
+            while True:
+                while not exhausted and len(inflight) < self.queue_depth:
+                    if slots is not None and not slots.acquire(blocking=not inflight):
+                        break
+                    nxt = self._next(jobs)
+                    if nxt is None:
+                        exhausted = True
+                        if slots is not None:
+                            slots.release()
+                        break
+                    label, params = nxt
+                    i += 1
+                    self._start(i, total, label, params)
+                    try:
+                        job = self.agent.submit_v4(params)
+                    except BaseException:
+                        self._release(params)
+                        raise
+                    if job.prompt_id is None or job.error is not None:
+                        dispatch(i, job)
+                        continue
+                    inflight.add(i, job)
+                if not inflight:
+                    break
+                done = inflight.poll(self.agent)
+                if not done:
+                    time.sleep(self.poll_s)
+                for i_done, job in done:
+                    dispatch(i_done, job)
+        finally:
+            if len(inflight):
+                log.warning(f"⚠️ Leaving {len(inflight)} job(s) in ComfyUI: {inflight.prompt_ids()}")
+                for job in inflight.jobs():
+                    self._release(job.params)
+            stats.render_s += inflight.busy_s
@@ -0,0 +1,103 @@
+"""In-process event bus for push notifications (Server-Sent Events).
+
+Producers (output catalog rescans, rating journal appends) `publish` small
+events; every event gets a monotonically increasing id and is kept in a
+bounded ring buffer. Consumers block in `wait(after_id)` on a condition
+variable, so an idle subscriber costs a sleeping thread and no CPU, and a
+reconnecting client resumes from its Last-Event-ID without missing events
+(or learns that it fell too far behind and has to resync).
+"""
+import time
+import logging
+import threading
+from collections import deque
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+
+log = logging.getLogger("eva_state")
+
+DEFAULT_BUFFER_SIZE = 1024
+
+
+class Event(NamedTuple):
+    id: int
+    type: str
+    data: Dict[str, Any]
+    ts: float
+
+
+class EventBus:
+    """Thread-safe publish / long-wait buffer of recent events."""
+
+    def __init__(self, buffer_size: int = DEFAULT_BUFFER_SIZE):
+        self._events: deque = deque(maxlen=buffer_size)
+        self._cond = threading.Condition()
+        self._last_id = 0
+        self._listeners: List[Callable[[Event], None]] = []
+        self.subscribers = 0
+        self.published = 0
+
+    @property
+    def last_id(self) -> int:
+        return self._last_id
+
+    def publish(self, event_type: str, data: Dict[str, Any]) -> int:
+        with self._cond:
+            self._last_id += 1
+            event = Event(self._last_id, event_type, data, time.time())
+            self._events.append(event)
+            self.published += 1
+            self._cond.notify_all()
+            listeners = list(self._listeners)
+        for cb in listeners:
+            try:
+                cb(event)
+            except Exception as e:
+                log.warning(f"EventBus listener failed: {e}")
+        return event.id
+
+    def add_listener(self, callback: Callable[[Event], None]):
+        """Call `callback(event)` after every publish (e.g. to wake an asyncio loop)."""
+        with self._cond:
+            self._listeners.append(callback)
+
+    def since(self, after_id: int) -> Optional[List[Event]]:
+        """Events with id > after_id; None if some of them were already dropped."""
+        with self._cond:
+            return self._since_locked(after_id)
+
+    def wait(self, after_id: int, timeout: float) -> Optional[List[Event]]:
+        """Block until there are events newer than `after_id` (or `timeout`); [] on timeout."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self._last_id <= after_id:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return []
+                self._cond.wait(remaining)
+            return self._since_locked(after_id)
+
+    def _since_locked(self, after_id: int) -> Optional[List[Event]]:
+        if after_id >= self._last_id:
+            return []
+        if not self._events or self._events[0].id > after_id + 1:
+            return None
+        # Ids are contiguous: index straight into the buffer instead of scanning it
+        start = after_id + 1 - self._events[0].id
+        return [self._events[i] for i in range(start, len(self._events))]
+
+    def subscribe(self):
+        with self._cond:
+            self.subscribers += 1
+
+    def unsubscribe(self):
+        with self._cond:
+            self.subscribers -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                "last_id": self._last_id,
+                "buffered": len(self._events),
+                "published": self.published,
+                "subscribers": self.subscribers,
+            }
@@ -0,0 +1,151 @@
+"""Constant-time video -> knowledge history lookup.
+
+Mirrors the two-step matching the review server used to do with linear scans
+over knowledge["history"]:
+
+1. exact filename: first history entry (in history order) whose
+   ``video``/``video_path`` ends with the requested name;
+2. timestamp fallback: for names like ``gen_<ts>_00001_.mp4`` the entry with
+   the closest ``timestamp`` (ties -> earliest in history), accepted when the
+   difference is under 60 seconds.
+
+The index is built once per knowledge.json version and answers both steps
+with dict / bisect lookups, returning the same (entry, match_info) pairs.
+"""
+import os
+import bisect
+from typing import Any, Dict, List, Optional, Tuple
+
+TIMESTAMP_MATCH_WINDOW_S = 60
+
+
+def entry_video_path(entry: Dict[str, Any]) -> str:
+    return entry.get("video") or entry.get("video_path") or ""
+
+
+class KnowledgeIndex:
+    """Read-only lookup structure over one knowledge history list."""
+
+    def __init__(self, history: List[Dict[str, Any]]):
+        self.history = history if isinstance(history, list) else []
+        # Exact match: basename -> first history position
+        self._by_basename: Dict[str, int] = {}
+        # Suffix match (name is a tail of a longer basename): reversed basenames, sorted
+        rev = {}
+        # Timestamp fallback: distinct timestamps, sorted, with the first history position for each
+        first_by_ts: Dict[Any, int] = {}
+
+        for idx, entry in enumerate(self.history):
+            if not isinstance(entry, dict):
+                continue
+            path = entry_video_path(entry)
+            if isinstance(path, str) and path:
+                base = os.path.basename(path)
+                if base not in self._by_basename:
+                    self._by_basename[base] = idx
+                    rev[base[::-1]] = idx
+            ts = entry.get("timestamp", 0)
+            if isinstance(ts, (int, float)) and not isinstance(ts, bool) and ts > 0:
+                if ts not in first_by_ts:
+                    first_by_ts[ts] = idx
+
+        self._rev_keys = sorted(rev)
+        self._rev_pos = [rev[k] for k in self._rev_keys]
+        self._ts_keys = sorted(first_by_ts)
+        self._ts_pos = [first_by_ts[k] for k in self._ts_keys]
+
+    def __len__(self) -> int:
+        return len(self.history)
+
+    def exact_position(self, video_name: str) -> Optional[int]:
+        """History position of the first entry whose path ends with `video_name`."""
+        if not video_name:
+            # "".endswith("") is True but an empty path never matches in the scan
+            return self._first_with_path()
+        if "/" in video_name:
+            return self._scan_exact(video_name)
+        best = self._by_basename.get(video_name)
+        # A longer basename ending with the same tail may come earlier in history
+        key = video_name[::-1]
+        lo = bisect.bisect_left(self._rev_keys, key)
+        hi = bisect.bisect_left(self._rev_keys, key + "\U0010ffff", lo)
+        for i in range(lo, hi):
+            pos = self._rev_pos[i]
+            if best is None or pos < best:
+                best = pos
+        return best
+
+    def exact(self, video_name: str) -> Optional[Dict[str, Any]]:
+        pos = self.exact_position(video_name)
+        return self.history[pos] if pos is not None else None
+
+    def nearest_timestamp(self, ts: float) -> Tuple[Optional[Dict[str, Any]], float]:
+        """(entry, |diff|) of the closest timestamp; earliest entry wins ties."""
+        keys = self._ts_keys
+        if not keys:
+            return None, float("inf")
+        i = bisect.bisect_left(keys, ts)
+        best_pos, best_diff = None, float("inf")
+        for j in (i - 1, i):
+            if 0 <= j < len(keys):
+                diff = abs(keys[j] - ts)
+                pos = self._ts_pos[j]
+                if diff < best_diff or (diff == best_diff and pos < best_pos):
+                    best_pos, best_diff = pos, diff
+        return self.history[best_pos], best_diff
+
+    def lookup(self, video_name: str) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        """Same contract as the handler's _enhanced_video_search: (entry or {}, match_info)."""
+        match_info = {'found': False, 'method': 'none', 'details': {}}
+        if not self.history:
+            match_info['details'] = {'error': 'Порожня історія в knowledge.json'}
+            return {}, match_info
+
+        pos = self.exact_position(video_name)
+        if pos is not None:
+            entry = self.history[pos]
+            match_info.update({
+                'found': True,
+                'method': 'exact_filename',
+                'details': {'matched_path': entry_video_path(entry)}
+            })
+            return entry, match_info
+
+        parts = video_name.split('_')
+        if len(parts) >= 2:
+            try:
+                video_timestamp = int(parts[1])
+            except ValueError:
+                video_timestamp = None
+            if video_timestamp is not None:
+                best_match, min_diff = self.nearest_timestamp(video_timestamp)
+                if best_match and min_diff < TIMESTAMP_MATCH_WINDOW_S:
+                    match_info.update({
+                        'found': True,
+                        'method': 'timestamp_match',
+                        'details': {
+                            'video_timestamp': video_timestamp,
+                            'matched_timestamp': best_match.get("timestamp"),
+                            'time_diff': min_diff
+                        }
+                    })
+                    return best_match, match_info
+
+        match_info['details'] = {
+            'error': 'Не знайдено співпадінь',
+            'video_name': video_name,
+            'history_count': len(self.history)
+        }
+        return {}, match_info
+
+    def _first_with_path(self) -> Optional[int]:
+        positions = list(self._by_basename.values())
+        return min(positions) if positions else None
+
+    def _scan_exact(self, video_name: str) -> Optional[int]:
+        for idx, entry in enumerate(self.history):
+            if isinstance(entry, dict):
+                path = entry_video_path(entry)
+                if isinstance(path, str) and path and path.endswith(video_name):
+                    return idx
+        return None
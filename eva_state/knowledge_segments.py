@@ -0,0 +1,448 @@
+"""Knowledge history split into per-day segments with a small manifest.
+
+knowledge.json is one document: the agent rewrites all of it (``indent=2``)
+after every generation and every reader parses the whole history, both
+growing without bound. With segments the history lives in
+``<state_dir>/knowledge/`` as JSON-lines files, one per day of generation
+(``history-YYYY-MM-DD.jsonl``), next to ``manifest.json`` that holds
+``best_score`` / ``best_params`` (and any other top-level knowledge fields),
+the segment list with entry counts and a write revision.
+
+Writers:
+  - `append` adds one line to the tail segment (a new segment when the day
+    changes) and rewrites only the manifest;
+  - `fold` (rating journal compaction) rewrites only the segments whose
+    entries actually changed.
+Both hold an exclusive ``fcntl`` lock on ``knowledge/.lock``, so the agent and
+the review server never interleave their writes.
+
+Readers check one file (the manifest, whose ``rev`` every write bumps) and
+re-read only the segments whose signature changed; a grown tail segment is
+parsed from the last consumed offset. Counts and best_* come from the
+manifest without touching the history at all.
+
+Enabling: ``STATE_BACKEND=segments`` (knowledge.json is migrated once on
+first open) or an existing ``knowledge/manifest.json``; the SQLite catalog
+takes precedence when it is enabled, ``STATE_BACKEND=json`` forces the
+monolithic file. Compatibility CLI::
+
+    python -m eva_state.knowledge_segments migrate <state_dir> [--force]
+    python -m eva_state.knowledge_segments export <state_dir>
+"""
+import os
+import sys
+import json
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # not on POSIX: in-process lock only
+    fcntl = None
+
+from eva_state.prompt_store import get_prompt_store
+from eva_state.rating_journal import atomic_write_json, _load_json
+from eva_state.serializer import loads
+from eva_state.sqlite_catalog import sqlite_backend_enabled
+from eva_state.store import file_signature
+
+log = logging.getLogger("eva_state")
+
+SEGMENTS_DIRNAME = "knowledge"
+MANIFEST_FILENAME = "manifest.json"
+LOCK_FILENAME = ".lock"
+MANIFEST_FORMAT = 1
+
+_META_DEFAULT = {"best_score": 0, "best_params": {}}
+
+
+def _dumps(value: Any) -> str:
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+
+def _timestamp(entry: Dict[str, Any]) -> Optional[float]:
+    ts = entry.get("timestamp")
+    if isinstance(ts, bool) or not isinstance(ts, (int, float)):
+        return None
+    return float(ts)
+
+
+def segment_day(entry: Dict[str, Any]) -> Optional[str]:
+    """UTC day (YYYY-MM-DD) of a history entry, None without a numeric timestamp."""
+    ts = _timestamp(entry)
+    if ts is None:
+        return None
+    try:
+        return time.strftime("%Y-%m-%d", time.gmtime(ts))
+    except (OverflowError, OSError, ValueError):
+        return None
+
+
+def _empty_manifest() -> Dict[str, Any]:
+    return {"format": MANIFEST_FORMAT, "rev": 0, "entries": 0, "meta": dict(_META_DEFAULT), "segments": []}
+
+
+def _parse_lines(data: bytes, path: str) -> Tuple[List[Dict[str, Any]], int]:
+    """Entries of complete lines in `data` and the number of bytes consumed.
+
+    A trailing line without a newline is an append in progress: it is left for
+    the next read.
+    """
+    end = data.rfind(b"\n") + 1
+    lines = [line for line in data[:end].split(b"\n") if line.strip()]
+    try:
+        # One parser call for the whole segment; line by line only to skip a damaged line
+        return loads(b"[" + b",".join(lines) + b"]"), end
+    except ValueError:
+        pass
+    entries = []
+    for line in lines:
+        try:
+            entries.append(json.loads(line))
+        except ValueError as e:
+            log.warning(f"KnowledgeSegments: skipping bad line in {path}: {e}")
+    return entries, end
+
+
+class _Segment:
+    __slots__ = ("signature", "offset", "entries")
+
+    def __init__(self, signature, offset: int, entries: List[Dict[str, Any]]):
+        self.signature = signature
+        self.offset = offset
+        self.entries = entries
+
+
+class KnowledgeSegments:
+    """Segmented knowledge history of one state directory (shared by threads of a process)."""
+
+    def __init__(self, state_dir: str, prompts=None):
+        self.state_dir = state_dir
+        # PromptStore override (CLI tools); otherwise the process-wide store, once it exists
+        self._prompts = prompts
+        self.directory = os.path.join(state_dir, SEGMENTS_DIRNAME)
+        self.manifest_path = os.path.join(self.directory, MANIFEST_FILENAME)
+        self._lock = threading.RLock()
+        self._write_lock = threading.Lock()
+        self._segments: Dict[str, _Segment] = {}
+        self._manifest_sig = None
+        self._manifest: Optional[Dict[str, Any]] = None
+        self._doc: Optional[Dict[str, Any]] = None
+        self._doc_key = None
+        self._version = 0
+        self.appends = 0
+        self.folds = 0
+        self.segments_rewritten = 0
+        self.segments_parsed = 0
+        self.tail_reads = 0
+
+    def exists(self) -> bool:
+        return os.path.exists(self.manifest_path)
+
+    # ---- locking ----
+    @contextmanager
+    def _locked(self):
+        """Exclusive writer lock: threads of this process, then other processes via fcntl."""
+        with self._write_lock:
+            os.makedirs(self.directory, exist_ok=True)
+            if fcntl is None:
+                yield
+                return
+            with open(os.path.join(self.directory, LOCK_FILENAME), "a") as f:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    def _prompt_store(self):
+        return self._prompts if self._prompts is not None else get_prompt_store(self.state_dir)
+
+    # ---- manifest ----
+    def _read_manifest(self) -> Dict[str, Any]:
+        manifest = _load_json(self.manifest_path, None)
+        if not isinstance(manifest, dict):
+            return _empty_manifest()
+        manifest.setdefault("meta", dict(_META_DEFAULT))
+        manifest.setdefault("segments", [])
+        manifest.setdefault("entries", sum(s.get("entries", 0) for s in manifest["segments"]))
+        manifest.setdefault("rev", 0)
+        return manifest
+
+    def _write_manifest(self, manifest: Dict[str, Any]):
+        manifest["rev"] = manifest.get("rev", 0) + 1
+        manifest["updated_at"] = time.time()
+        atomic_write_json(self.manifest_path, manifest)
+
+    def manifest(self) -> Dict[str, Any]:
+        """Current manifest (cached until the file changes; read-only)."""
+        sig = file_signature(self.manifest_path)
+        with self._lock:
+            if self._manifest is None or sig != self._manifest_sig:
+                self._manifest = self._read_manifest()
+                self._manifest_sig = sig
+            return self._manifest
+
+    def meta(self) -> Dict[str, Any]:
+        """best_score, best_params and the other top-level knowledge fields, without the history."""
+        return self.manifest()["meta"]
+
+    def count(self) -> int:
+        return self.manifest()["entries"]
+
+    # ---- segments ----
+    def _segment_path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def load_segment(self, name: str) -> List[Dict[str, Any]]:
+        """Entries of one segment (shared, read-only); re-parsed only when the file changed.
+
+        Appends keep the inode and grow the file, so only the new tail bytes are parsed.
+        """
+        path = self._segment_path(name)
+        sig = file_signature(path)
+        with self._lock:
+            cached = self._segments.get(name)
+            if cached is not None and cached.signature == sig:
+                return cached.entries
+            if sig is None:
+                self._segments.pop(name, None)
+                return []
+            try:
+                with open(path, "rb") as f:
+                    if cached is not None and cached.signature[2] == sig[2] and sig[1] >= cached.offset:
+                        f.seek(cached.offset)
+                        entries, used = _parse_lines(f.read(), path)
+                        entries = self._expand(entries)
+                        # New list: snapshots handed out earlier keep their length
+                        entries = cached.entries + entries
+                        offset = cached.offset + used
+                        self.tail_reads += 1
+                    else:
+                        entries, offset = _parse_lines(f.read(), path)
+                        entries = self._expand(entries)
+                        self.segments_parsed += 1
+            except OSError as e:
+                log.warning(f"KnowledgeSegments: failed to read {path}: {e}")
+                return cached.entries if cached is not None else []
+            self._segments[name] = _Segment(sig, offset, entries)
+            return entries
+
+    def iter_entries(self) -> Iterator[Dict[str, Any]]:
+        """History entries oldest first, loading one segment at a time."""
+        for seg in list(self.manifest()["segments"]):
+            yield from self.load_segment(seg["file"])
+
+    def history(self) -> List[Dict[str, Any]]:
+        return self.document()[1]["history"]
+
+    def document(self) -> Tuple[int, Dict[str, Any]]:
+        """(version, knowledge.json-shaped document); rebuilt only after a write. Treat as read-only."""
+        with self._lock:
+            manifest = self.manifest()
+            if self._doc is not None and self._doc_key == self._manifest_sig:
+                return self._version, self._doc
+            history: List[Dict[str, Any]] = []
+            for seg in manifest["segments"]:
+                history.extend(self.load_segment(seg["file"]))
+            live = {seg["file"] for seg in manifest["segments"]}
+            for name in [n for n in self._segments if n not in live]:
+                del self._segments[name]
+            document = dict(manifest["meta"])
+            document["history"] = history
+            self._version += 1
+            self._doc, self._doc_key = document, self._manifest_sig
+            return self._version, document
+
+    # ---- writes ----
+    def _expand(self, entries: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Resolve prompt-store references (cached segments always hold full texts)."""
+        prompts = self._prompt_store()
+        return [prompts.expand(e) for e in entries] if prompts is not None else entries
+
+    def _write_segment(self, name: str, entries: List[Dict[str, Any]], compact: bool = True):
+        """Replace a whole segment atomically; the written entries become its cached copy.
+
+        Prompts go to the prompt store when it is enabled, unless `compact` is False.
+        """
+        path = self._segment_path(name)
+        tmp = f"{path}.tmp.{os.getpid()}.{threading.get_ident()}"
+        prompts = self._prompt_store() if compact else None
+        with open(tmp, "w", encoding="utf-8") as f:
+            for entry in entries:
+                f.write(_dumps(prompts.compact(entry) if prompts is not None else entry))
+                f.write("\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+        with self._lock:
+            self._segments[name] = _Segment(file_signature(path), os.path.getsize(path), self._expand(entries))
+
+    def append(self, entry: Dict[str, Any], best: Optional[Dict[str, Any]] = None):
+        """Append one history entry to the tail segment (and optionally update best_score/best_params)."""
+        with self._locked():
+            manifest = self._read_manifest()
+            segments = manifest["segments"]
+            day = segment_day(entry) or (segments[-1]["day"] if segments else time.strftime("%Y-%m-%d", time.gmtime()))
+            # A later day opens a new segment; an older timestamp stays in the tail to keep history order
+            if not segments or day > segments[-1]["day"]:
+                segments.append({"file": f"history-{day}.jsonl", "day": day, "entries": 0,
+                                 "first_ts": _timestamp(entry), "last_ts": None})
+            seg = segments[-1]
+            prompts = self._prompt_store()
+            line = _dumps(prompts.compact(entry) if prompts is not None else entry)
+            with open(self._segment_path(seg["file"]), "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            seg["entries"] += 1
+            seg["last_ts"] = _timestamp(entry) or seg.get("last_ts")
+            manifest["entries"] += 1
+            if best:
+                manifest["meta"].update({k: v for k, v in best.items() if k != "history"})
+            self._write_manifest(manifest)
+            self.appends += 1
+
+    def fold(self, fn: Callable[[Dict[str, Any]], Any]):
+        """Apply `fn` to a knowledge document and persist only what it changed.
+
+        `fn` may set top-level fields and replace history entries
+        (``history[i] = dict(history[i], ...)``); the entries themselves are
+        shared with readers and must not be modified in place. Only segments
+        with a replaced entry are rewritten.
+        """
+        with self._locked():
+            manifest = self._read_manifest()
+            originals = [(seg["file"], self.load_segment(seg["file"])) for seg in manifest["segments"]]
+            document = dict(manifest["meta"])
+            document["history"] = history = [e for _name, entries in originals for e in entries]
+            fn(document)
+            rewritten = start = 0
+            for name, entries in originals:
+                new = history[start:start + len(entries)]
+                start += len(entries)
+                if any(a is not b for a, b in zip(entries, new)):
+                    self._write_segment(name, new)
+                    rewritten += 1
+            manifest["meta"] = {k: v for k, v in document.items() if k != "history"}
+            self._write_manifest(manifest)
+            self.folds += 1
+            self.segments_rewritten += rewritten
+
+    # ---- migration / export ----
+    def migrate_from_json(self, force: bool = False) -> bool:
+        """Split knowledge.json into segments; returns False if segments already exist."""
+        with self._locked():
+            if self.exists() and not force:
+                return False
+            knowledge = _load_json(os.path.join(self.state_dir, "knowledge.json"), {}) or {}
+            if not isinstance(knowledge, dict):
+                knowledge = {}
+            history = [e for e in knowledge.get("history", []) if isinstance(e, dict)]
+            previous = self._read_manifest()
+            old = previous["segments"] if force else []
+            manifest = _empty_manifest()
+            manifest["rev"] = previous.get("rev", 0)
+            manifest["meta"] = {k: v for k, v in knowledge.items() if k != "history"} or dict(_META_DEFAULT)
+            groups: List[Tuple[str, List[Dict[str, Any]]]] = []
+            for entry in history:
+                day = segment_day(entry)
+                if not groups or (day is not None and day > groups[-1][0]):
+                    groups.append((day or time.strftime("%Y-%m-%d", time.gmtime()), []))
+                groups[-1][1].append(entry)
+            for day, entries in groups:
+                name = f"history-{day}.jsonl"
+                self._write_segment(name, entries)
+                stamps = [t for t in map(_timestamp, entries) if t is not None]
+                manifest["segments"].append({"file": name, "day": day, "entries": len(entries),
+                                             "first_ts": stamps[0] if stamps else None,
+                                             "last_ts": stamps[-1] if stamps else None})
+            manifest["entries"] = len(history)
+            manifest["migrated_at"] = time.time()
+            self._write_manifest(manifest)
+            live = {seg["file"] for seg in manifest["segments"]}
+            for seg in old:
+                if seg["file"] not in live:
+                    try:
+                        os.remove(self._segment_path(seg["file"]))
+                    except OSError:
+                        pass
+        log.info(f"KnowledgeSegments: migrated {len(history)} entries into {len(groups)} segments in {self.directory}")
+        return True
+
+    def export_json(self, path: Optional[str] = None):
+        """Write the monolithic knowledge.json (for tools that still read the file)."""
+        _version, document = self.document()
+        atomic_write_json(path or os.path.join(self.state_dir, "knowledge.json"), document)
+
+    def stats(self) -> Dict[str, Any]:
+        manifest = self.manifest()
+        return {
+            "segments": len(manifest["segments"]),
+            "entries": manifest["entries"],
+            "rev": manifest.get("rev", 0),
+            "cached_segments": len(self._segments),
+            "segments_parsed": self.segments_parsed,
+            "tail_reads": self.tail_reads,
+            "appends": self.appends,
+            "folds": self.folds,
+            "segments_rewritten": self.segments_rewritten,
+        }
+
+
+def segments_enabled(state_dir: str) -> bool:
+    backend = os.environ.get("STATE_BACKEND", "").strip().lower()
+    if backend == "json" or sqlite_backend_enabled(state_dir):
+        return False
+    return backend == "segments" or os.path.exists(os.path.join(state_dir, SEGMENTS_DIRNAME, MANIFEST_FILENAME))
+
+
+_stores: Dict[str, Optional[KnowledgeSegments]] = {}
+_stores_lock = threading.Lock()
+
+
+def get_knowledge_segments(state_dir: str) -> Optional[KnowledgeSegments]:
+    """Process-wide segmented history for a state directory, or None when knowledge.json is in use.
+
+    Decided once per process, like the SQLite catalog.
+    """
+    key = os.path.abspath(state_dir)
+    try:
+        return _stores[key]
+    except KeyError:
+        pass
+    with _stores_lock:
+        if key not in _stores:
+            segments = None
+            if segments_enabled(key):
+                segments = KnowledgeSegments(key)
+                segments.migrate_from_json()
+            _stores[key] = segments
+        return _stores[key]
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    import argparse
+    ap = argparse.ArgumentParser(prog="python -m eva_state.knowledge_segments")
+    ap.add_argument("command", choices=("migrate", "export", "stats"))
+    ap.add_argument("state_dir")
+    ap.add_argument("--force", action="store_true", help="migrate: re-split knowledge.json even if segments exist")
+    ap.add_argument("--output", help="export: target file (default <state_dir>/knowledge.json)")
+    args = ap.parse_args(argv)
+    segments = KnowledgeSegments(args.state_dir)
+    if args.command == "migrate":
+        done = segments.migrate_from_json(force=args.force)
+        print(json.dumps(dict(segments.stats(), migrated=done)))
+    elif args.command == "export":
+        segments.export_json(args.output)
+        print(json.dumps(segments.stats()))
+    else:
+        print(json.dumps(segments.stats()))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
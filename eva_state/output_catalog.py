@@ -0,0 +1,252 @@
+"""Incremental catalog of the ComfyUI output directory.
+
+Replaces per-request ``glob("*.mp4")`` + ``os.path.getmtime`` sorting. The
+directory is rescanned with ``os.scandir`` at most once per interval (or on
+demand); the result is kept pre-sorted by mtime (newest first) together with
+file sizes, and every rescan reports which files were added/removed/changed.
+"""
+import os
+import time
+import bisect
+import hashlib
+import logging
+import threading
+from collections import deque
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+log = logging.getLogger("eva_state")
+
+DEFAULT_RESCAN_INTERVAL_S = float(os.environ.get("CATALOG_RESCAN_S", "2.0"))
+# Files modified this recently may still be growing: re-stat them even when the directory itself did not change
+HOT_FILE_WINDOW_S = 120.0
+
+
+class CatalogEntry(NamedTuple):
+    name: str
+    path: str
+    mtime: float
+    size: int
+
+
+class CatalogDelta(NamedTuple):
+    version: int
+    added: Tuple[str, ...]
+    removed: Tuple[str, ...]
+    changed: Tuple[str, ...]
+
+    def __bool__(self) -> bool:
+        return bool(self.added or self.removed or self.changed)
+
+
+class CatalogSnapshot:
+    """Immutable listing: entries newest-first plus a name -> entry map."""
+
+    __slots__ = ("entries", "by_name", "version", "scanned_at", "_digest", "_keys")
+
+    def __init__(self, entries: Tuple[CatalogEntry, ...], version: int, scanned_at: float,
+                 digest: Optional[str] = None, keys: Optional[List[Tuple[float, str]]] = None):
+        self.entries = entries
+        self.by_name: Dict[str, CatalogEntry] = {e.name: e for e in entries}
+        self.version = version
+        self.scanned_at = scanned_at
+        self._digest = digest
+        self._keys = keys
+
+    @property
+    def digest(self) -> str:
+        """Content hash of the listing (name, mtime, size); stable across processes, unlike `version`."""
+        if self._digest is None:
+            h = hashlib.sha1()
+            for e in self.entries:
+                h.update(f"{e.name}\0{e.mtime!r}\0{e.size}\n".encode("utf-8", "surrogateescape"))
+            self._digest = h.hexdigest()
+        return self._digest
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.by_name
+
+    def names(self) -> List[str]:
+        return [e.name for e in self.entries]
+
+    def get(self, name: str) -> Optional[CatalogEntry]:
+        return self.by_name.get(name)
+
+    def index_after(self, mtime: float, name: str) -> int:
+        """Position of the first entry listed after (mtime, name), in O(log n).
+
+        The position does not have to exist any more: a cursor taken from a
+        file that was since deleted still resumes at the right place.
+        """
+        if self._keys is None:
+            self._keys = [(-e.mtime, e.name) for e in self.entries]
+        return bisect.bisect_right(self._keys, (-mtime, name))
+
+
+class OutputCatalog:
+    """Thread-safe, interval-refreshed listing of `*.mp4` files in one directory."""
+
+    def __init__(self, directory: str, suffix: str = ".mp4", min_interval_s: float = DEFAULT_RESCAN_INTERVAL_S):
+        self.directory = directory
+        self.suffix = suffix
+        self.min_interval_s = float(min_interval_s)
+        self._lock = threading.Lock()
+        self._snapshot = CatalogSnapshot((), 0, 0.0)
+        self._dir_mtime_ns: Optional[int] = None
+        self._deltas: deque = deque(maxlen=256)
+        self._listeners: List[Callable[[CatalogDelta, CatalogSnapshot], None]] = []
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self.scans = 0
+
+    # ---- public API ----
+    def snapshot(self, force: bool = False) -> CatalogSnapshot:
+        """Current listing; rescans first if the interval elapsed (or `force`)."""
+        snap = self._snapshot
+        if force or (time.time() - snap.scanned_at) >= self.min_interval_s:
+            self._rescan(force)
+            snap = self._snapshot
+        return snap
+
+    def refresh(self) -> CatalogDelta:
+        """On-demand rescan (e.g. right after the agent produced a video)."""
+        return self._rescan(True)
+
+    def rescan(self) -> CatalogDelta:
+        return self._rescan(True)
+
+    def _rescan(self, force: bool) -> CatalogDelta:
+        with self._lock:
+            old = self._snapshot
+            # Concurrent readers queue on the lock: only the first one pays for the scan
+            if not force and (time.time() - old.scanned_at) < self.min_interval_s:
+                return CatalogDelta(old.version, (), (), ())
+            entries = self._scan(old)
+            now = time.time()
+            delta = self._diff(old, entries, old.version + 1)
+            if delta or not old.scanned_at:
+                entries.sort(key=lambda e: (-e.mtime, e.name))
+                self._snapshot = CatalogSnapshot(tuple(entries), old.version + 1, now)
+            else:
+                # Nothing changed: keep the sorted tuple, only bump the scan time
+                self._snapshot = CatalogSnapshot(old.entries, old.version, now, old._digest, old._keys)
+                delta = CatalogDelta(old.version, (), (), ())
+            self.scans += 1
+            if delta:
+                self._deltas.append(delta)
+            listeners = list(self._listeners) if delta else []
+            snap = self._snapshot
+        for cb in listeners:
+            try:
+                cb(delta, snap)
+            except Exception as e:
+                log.warning(f"OutputCatalog listener failed: {e}")
+        return delta
+
+    def changes_since(self, version: int) -> Optional[List[CatalogDelta]]:
+        """Deltas newer than `version`; None if they already fell out of the buffer."""
+        with self._lock:
+            deltas = [d for d in self._deltas if d.version > version]
+            if deltas and deltas[0].version != version + 1:
+                return None
+            if not deltas and version < self._snapshot.version:
+                return None
+            return deltas
+
+    def add_listener(self, callback: Callable[[CatalogDelta, CatalogSnapshot], None]):
+        """Call `callback(delta, snapshot)` after every rescan that changed something."""
+        with self._lock:
+            self._listeners.append(callback)
+
+    def start(self, interval_s: Optional[float] = None):
+        """Rescan in a daemon thread so readers never pay for the scan."""
+        if self._thread and self._thread.is_alive():
+            return
+        interval = float(interval_s or self.min_interval_s)
+
+        def _loop():
+            while not self._stop.wait(interval):
+                try:
+                    self.rescan()
+                except Exception as e:
+                    log.warning(f"OutputCatalog rescan failed: {e}")
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=_loop, name="output-catalog", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    # ---- internals ----
+    def _scan(self, old: CatalogSnapshot) -> List[CatalogEntry]:
+        try:
+            dir_mtime_ns = os.stat(self.directory).st_mtime_ns
+        except OSError:
+            self._dir_mtime_ns = None
+            return []
+        if old.scanned_at and dir_mtime_ns == self._dir_mtime_ns:
+            # No file added/removed/renamed: only refresh files that may still be written
+            return self._restat_hot(old)
+        self._dir_mtime_ns = dir_mtime_ns
+        entries: List[CatalogEntry] = []
+        try:
+            with os.scandir(self.directory) as it:
+                for de in it:
+                    name = de.name
+                    if name.startswith(".") or not name.endswith(self.suffix):
+                        continue
+                    try:
+                        if not de.is_file():
+                            continue
+                        st = de.stat()
+                    except OSError:
+                        continue
+                    entries.append(CatalogEntry(name, os.path.join(self.directory, name), st.st_mtime, st.st_size))
+        except OSError as e:
+            log.warning(f"OutputCatalog: cannot scan {self.directory}: {e}")
+        return entries
+
+    def _restat_hot(self, old: CatalogSnapshot) -> List[CatalogEntry]:
+        cutoff = time.time() - HOT_FILE_WINDOW_S
+        entries: List[CatalogEntry] = []
+        for e in old.entries:
+            if e.mtime >= cutoff:
+                try:
+                    st = os.stat(e.path)
+                except OSError:
+                    continue
+                if st.st_mtime != e.mtime or st.st_size != e.size:
+                    e = CatalogEntry(e.name, e.path, st.st_mtime, st.st_size)
+            entries.append(e)
+        return entries
+
+    @staticmethod
+    def _diff(old: CatalogSnapshot, entries: List[CatalogEntry], version: int) -> CatalogDelta:
+        new_by_name = {e.name: e for e in entries}
+        added = tuple(n for n in new_by_name if n not in old.by_name)
+        removed = tuple(n for n in old.by_name if n not in new_by_name)
+        changed = tuple(
+            n for n, e in new_by_name.items()
+            if n in old.by_name and (old.by_name[n].mtime != e.mtime or old.by_name[n].size != e.size)
+        )
+        return CatalogDelta(version, added, removed, changed)
+
+
+_catalogs: Dict[str, OutputCatalog] = {}
+_catalogs_lock = threading.Lock()
+
+
+def get_output_catalog(directory: str) -> OutputCatalog:
+    """Process-wide catalog for a directory (shared by all request threads)."""
+    key = os.path.abspath(directory)
+    cat = _catalogs.get(key)
+    if cat is None:
+        with _catalogs_lock:
+            cat = _catalogs.get(key)
+            if cat is None:
+                cat = OutputCatalog(key)
+                _catalogs[key] = cat
+    return cat
@@ -0,0 +1,380 @@
+"""Content-addressed store for prompt texts referenced from the state files.
+
+Every generation used to embed its multi-KB prompt and the long negative
+prompt (generator negative + the fixed blacklist from ``run_iteration_v4``)
+several times over: twice in its knowledge history entry (top level and
+``params``), twice in its review queue item, in the ``.prompt.json``
+artifact and again in ``reference_params.json``. With the store each text is
+written once to ``auto_state/prompt_store.jsonl`` (one
+``{"h": <hash>, "t": <text>}`` line per distinct text) and the records hold
+``cas:<hash>`` references instead.
+
+Writers call `compact` before persisting a record or document; readers call
+`expand` after loading one, which resolves references through an LRU cache
+of texts (misses read one line by offset). Only the prompt fields
+(`PROMPT_FIELDS`) of records reached through the known container keys are
+touched, and an unchanged record is returned as the same object, so
+expanding a document without references costs one dict walk.
+
+Enabling: ``PROMPT_STORE=1`` makes writers compact; an existing
+``prompt_store.jsonl`` enables the store for every process (readers expand
+whenever it exists). Compatibility CLI (rewrites knowledge.json,
+review_queue.json, reference_params.json and the knowledge segments)::
+
+    python -m eva_state.prompt_store compact <state_dir>
+    python -m eva_state.prompt_store expand <state_dir>
+"""
+import os
+import sys
+import json
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # not on POSIX: in-process lock only
+    fcntl = None
+
+log = logging.getLogger("eva_state")
+
+STORE_FILENAME = "prompt_store.jsonl"
+REF_PREFIX = "cas:"
+HASH_CHARS = 32
+# Shorter texts stay inline: a reference would not save anything
+MIN_STORED_LEN = 64
+DEFAULT_CACHE_SIZE = int(os.environ.get("PROMPT_CACHE_SIZE", "65536"))
+
+PROMPT_FIELDS = frozenset(("prompt", "negative_prompt", "photo_prompt", "photo_negative"))
+# Keys whose dict/list values are walked for nested records
+CONTAINER_KEYS = frozenset((
+    "history", "params", "best_params", "pending", "in_review", "completed",
+    "reference_combinations", "params_list", "combos", "list", "reference_videos",
+))
+
+_WALKED_KEYS = PROMPT_FIELDS | CONTAINER_KEYS
+_LINE_HEAD = b'{"h":"'
+
+
+def prompt_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:HASH_CHARS]
+
+
+def is_ref(value: Any) -> bool:
+    return isinstance(value, str) and len(value) == len(REF_PREFIX) + HASH_CHARS and value.startswith(REF_PREFIX)
+
+
+class PromptStore:
+    """Append-only hash -> text file with an in-memory offset index and an LRU of texts."""
+
+    def __init__(self, path: str, cache_size: int = DEFAULT_CACHE_SIZE):
+        self.path = path
+        self.cache_size = max(1, int(cache_size))
+        self._lock = threading.RLock()
+        self._offsets: Dict[str, Tuple[int, int]] = {}
+        self._indexed = 0  # bytes of the file already in _offsets
+        self._texts: "OrderedDict[str, str]" = OrderedDict()   # hash -> text (LRU)
+        self._hashes: "OrderedDict[str, str]" = OrderedDict()  # text -> hash (LRU, spares re-hashing on compact)
+        self._pending: Dict[str, str] = {}  # new texts of the current compact, written by _flush
+        self.hits = 0
+        self.misses = 0
+        self.puts = 0
+        self.missing = 0
+
+    # ---- index ----
+    def _refresh(self):
+        """Index lines appended since the last call (by this or another process).
+
+        While the text cache has room the texts of the new lines are cached too
+        (one parser call for the whole chunk), so a cold reader does not go back
+        to the file for every reference.
+        """
+        try:
+            with open(self.path, "rb") as f:
+                f.seek(self._indexed)
+                data = f.read()
+        except FileNotFoundError:
+            return
+        pos = self._indexed
+        end = data.rfind(b"\n") + 1
+        lines = data[:end].split(b"\n")[:-1]
+        head, tail = len(_LINE_HEAD), len(_LINE_HEAD) + HASH_CHARS
+        for line in lines:
+            length = len(line) + 1
+            h = None
+            if line.startswith(_LINE_HEAD) and line[tail:tail + 1] == b'"':
+                h = line[head:tail].decode("ascii", "replace")
+            elif line.strip():
+                try:
+                    h = json.loads(line).get("h")
+                except (ValueError, AttributeError):
+                    log.warning(f"PromptStore: skipping bad line at offset {pos} in {self.path}")
+            if h:
+                self._offsets.setdefault(h, (pos, length))
+            pos += length
+        self._indexed = pos
+        room = self.cache_size - len(self._texts)
+        if room > 0 and lines:
+            try:
+                items = json.loads(b"[" + b",".join(line for line in lines[-room:] if line.strip()) + b"]")
+            except ValueError:
+                return
+            for item in items:
+                if isinstance(item, dict) and item.get("h") and isinstance(item.get("t"), str):
+                    self._texts.setdefault(item["h"], item["t"])
+
+    def _remember(self, h: str, text: str):
+        self._texts[h] = text
+        self._texts.move_to_end(h)
+        if len(self._texts) > self.cache_size:
+            self._texts.popitem(last=False)
+        self._hashes[text] = h
+        self._hashes.move_to_end(text)
+        if len(self._hashes) > self.cache_size:
+            self._hashes.popitem(last=False)
+
+    # ---- put / get ----
+    def put(self, text: str) -> str:
+        """Reference for `text`, writing it to the store if it is new (fsynced before returning)."""
+        with self._lock:
+            ref = self._put(text)
+            self._flush()
+            return ref
+
+    def _put(self, text: str) -> str:
+        h = self._hashes.get(text)
+        if h is None:
+            h = prompt_hash(text)
+        if h not in self._offsets and h not in self._pending:
+            self._refresh()
+            if h not in self._offsets:
+                self._pending[h] = text
+        self._remember(h, text)
+        return REF_PREFIX + h
+
+    def _flush(self):
+        """Append the pending new texts with one write and one fsync."""
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path, "ab") as f:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                # Another process may have stored some of the texts while we waited for the lock
+                self._refresh()
+                lines = [(json.dumps({"h": h, "t": text}, ensure_ascii=False, separators=(",", ":")) + "\n")
+                         .encode("utf-8") for h, text in pending.items() if h not in self._offsets]
+                if not lines:
+                    return
+                f.seek(0, os.SEEK_END)
+                f.write(b"".join(lines))
+                f.flush()
+                os.fsync(f.fileno())
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+        self._refresh()
+        self.puts += len(lines)
+
+    def get(self, ref: str) -> Optional[str]:
+        """Text of a `cas:` reference (or a bare hash); None if the store does not have it."""
+        h = ref[len(REF_PREFIX):] if ref.startswith(REF_PREFIX) else ref
+        with self._lock:
+            text = self._texts.get(h)
+            if text is not None:
+                self._texts.move_to_end(h)
+                self.hits += 1
+                return text
+            self.misses += 1
+            loc = self._offsets.get(h)
+            if loc is None:
+                self._refresh()
+                loc = self._offsets.get(h)
+            if loc is None:
+                self.missing += 1
+                return None
+            try:
+                with open(self.path, "rb") as f:
+                    f.seek(loc[0])
+                    text = json.loads(f.read(loc[1]))["t"]
+            except (OSError, ValueError, KeyError) as e:
+                log.warning(f"PromptStore: failed to read {h} from {self.path}: {e}")
+                self.missing += 1
+                return None
+            self._remember(h, text)
+            return text
+
+    # ---- records ----
+    def compact(self, value: Any) -> Any:
+        """Copy of `value` with long prompt fields replaced by references (same object if nothing changed).
+
+        New texts are durable in the store when this returns, before the caller writes the record.
+        """
+        with self._lock:
+            out = self._walk(value, self._compact_text)
+            self._flush()
+            return out
+
+    def expand(self, value: Any) -> Any:
+        """Copy of `value` with references resolved (same object if it holds none); unknown ones stay as is."""
+        with self._lock:
+            return self._walk(value, self._expand_text)
+
+    def _compact_text(self, text: str) -> str:
+        if len(text) < MIN_STORED_LEN or is_ref(text):
+            return text
+        return self._put(text)
+
+    def _expand_text(self, text: str) -> str:
+        if not is_ref(text):
+            return text
+        h = text[len(REF_PREFIX):]
+        resolved = self._texts.get(h)
+        if resolved is not None:
+            self._texts.move_to_end(h)
+            self.hits += 1
+            return resolved
+        resolved = self.get(text)
+        return text if resolved is None else resolved
+
+    def _walk(self, value: Any, fn) -> Any:
+        if isinstance(value, list):
+            out = None
+            for i, item in enumerate(value):
+                if isinstance(item, (dict, list)):
+                    new = self._walk(item, fn)
+                    if new is not item:
+                        if out is None:
+                            out = list(value)
+                        out[i] = new
+            return value if out is None else out
+        if not isinstance(value, dict):
+            return value
+        out = None
+        # Only the prompt and container keys present in this dict
+        for key in value.keys() & _WALKED_KEYS:
+            item = value[key]
+            if key in PROMPT_FIELDS:
+                if not isinstance(item, str):
+                    continue
+                new = fn(item)
+            elif isinstance(item, (dict, list)):
+                new = self._walk(item, fn)
+            else:
+                continue
+            if new is not item:
+                if out is None:
+                    out = dict(value)
+                out[key] = new
+        return value if out is None else out
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "texts": len(self._offsets),
+                "bytes": self._indexed,
+                "cached": len(self._texts),
+                "hits": self.hits,
+                "misses": self.misses,
+                "puts": self.puts,
+                "missing": self.missing,
+            }
+
+
+def prompt_store_enabled(state_dir: str) -> bool:
+    return os.environ.get("PROMPT_STORE", "") == "1" or os.path.exists(os.path.join(state_dir, STORE_FILENAME))
+
+
+_stores: Dict[str, PromptStore] = {}
+_stores_lock = threading.Lock()
+
+
+def get_prompt_store(state_dir: str) -> Optional[PromptStore]:
+    """Process-wide prompt store for a state directory, or None while it is not enabled.
+
+    Unlike the storage backends this is re-checked until the store appears: a
+    reader started before the first compacting writer must still expand.
+    """
+    key = os.path.abspath(state_dir)
+    store = _stores.get(key)
+    if store is not None:
+        return store
+    if not prompt_store_enabled(key):
+        return None
+    with _stores_lock:
+        store = _stores.get(key)
+        if store is None:
+            store = PromptStore(os.path.join(key, STORE_FILENAME))
+            _stores[key] = store
+        return store
+
+
+def expand_refs(value: Any, state_dir: str) -> Any:
+    """`value` with prompt references resolved, or unchanged when the state dir has no store."""
+    store = get_prompt_store(state_dir)
+    return store.expand(value) if store is not None else value
+
+
+def compact_refs(value: Any, state_dir: str) -> Any:
+    """`value` with long prompts moved to the store, or unchanged when the store is not enabled."""
+    store = get_prompt_store(state_dir)
+    return store.compact(value) if store is not None else value
+
+
+def _rewrite_state(state_dir: str, store: PromptStore, compact: bool) -> Dict[str, int]:
+    """Compact (or expand) every JSON state document that can hold prompts; returns file sizes."""
+    from eva_state.rating_journal import atomic_write_json, _load_json
+    from eva_state.knowledge_segments import KnowledgeSegments
+    from eva_state.review_queue import ReviewQueue
+    fn = store.compact if compact else store.expand
+    sizes = {}
+    for name in ("knowledge.json", "review_queue.json", "reference_params.json"):
+        path = os.path.join(state_dir, name)
+        data = _load_json(path, None)
+        if data is None:
+            continue
+        new = fn(data)
+        if new is not data:
+            atomic_write_json(path, new)
+        sizes[name] = os.path.getsize(path)
+    segments = KnowledgeSegments(state_dir, prompts=store)
+    if segments.exists():
+        with segments._locked():
+            manifest = segments._read_manifest()
+            for seg in manifest["segments"]:
+                segments._write_segment(seg["file"], segments.load_segment(seg["file"]), compact=compact)
+            segments._write_manifest(manifest)
+        sizes["knowledge/"] = sum(os.path.getsize(os.path.join(segments.directory, s["file"]))
+                                  for s in manifest["segments"])
+    queue = ReviewQueue(state_dir, prompts=store)
+    if os.path.exists(queue.path):
+        queue.compact(compact_prompts=compact)
+        sizes["review_queue.jsonl"] = os.path.getsize(queue.path)
+    return sizes
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    import argparse
+    ap = argparse.ArgumentParser(prog="python -m eva_state.prompt_store")
+    ap.add_argument("command", choices=("compact", "expand", "stats"))
+    ap.add_argument("state_dir")
+    args = ap.parse_args(argv)
+    store = PromptStore(os.path.join(args.state_dir, STORE_FILENAME))
+    store._refresh()
+    if args.command == "stats":
+        print(json.dumps(store.stats()))
+        return 0
+    sizes = _rewrite_state(args.state_dir, store, compact=args.command == "compact")
+    if args.command == "expand" and os.path.exists(store.path):
+        # Writers compact while the store file exists: keep it aside, nothing references it any more
+        os.replace(store.path, store.path + ".expanded")
+    print(json.dumps(dict(store.stats(), files=sizes)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
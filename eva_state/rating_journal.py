@@ -0,0 +1,437 @@
+"""Append-only journal for review actions (ratings, bans, reference marks).
+
+The review server used to answer every POST by re-reading and re-writing
+manual_ratings.json, knowledge.json and bandit_state.json; concurrent
+reviewers raced on those read-modify-write cycles and lost updates.
+
+Now a POST appends one JSON line per action to ``rating_journal.jsonl``.
+Concurrent appends share one ``fsync`` (group commit), so the cost of an
+action does not depend on the size of the state files. A background
+compactor periodically folds the journal into the snapshot files (the same
+files the agent reads) and truncates it. Readers combine the snapshot with
+the not-yet-compacted tail (see ``JournalView``), so an acknowledged action
+is visible immediately and never lost.
+
+Crash safety: records are fsynced before the POST is acknowledged. The
+checkpoint (last folded seq) is written after the snapshot files; a crash in
+between re-applies that batch on restart, which is harmless for ratings and
+bans (keyed writes) and may double-count the bandit ``t`` / history appends
+of that one batch.
+"""
+import os
+import json
+import time
+import atexit
+import logging
+import threading
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from eva_state.knowledge_index import KnowledgeIndex
+from eva_state.prompt_store import compact_refs
+from eva_state.serializer import dumps, load_file
+
+log = logging.getLogger("eva_state")
+
+JOURNAL_FILENAME = "rating_journal.jsonl"
+CHECKPOINT_FILENAME = "rating_journal.checkpoint"
+DEFAULT_COMPACT_INTERVAL_S = float(os.environ.get("JOURNAL_COMPACT_S", "2.0"))
+# Fold early when this many records are waiting
+COMPACT_MAX_TAIL = 500
+# With the SQLite catalog or knowledge segments: also regenerate the JSON documents after every fold (for tools that read them)
+EXPORT_JSON = os.environ.get("STATE_EXPORT_JSON", "") == "1"
+
+
+def atomic_write_json(path: str, data: Any, fmt: Optional[str] = None):
+    """Write a state document (STATE_FORMAT, see serializer) via tmp file + fsync + os.replace.
+
+    Readers never see a half-written file.
+    """
+    tmp = f"{path}.tmp.{os.getpid()}.{threading.get_ident()}"
+    with open(tmp, "wb") as f:
+        f.write(dumps(data, fmt))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def _load_json(path: str, default: Any) -> Any:
+    try:
+        return load_file(path)
+    except FileNotFoundError:
+        return default
+
+
+class JournalView:
+    """What the journal adds on top of the snapshot files at one moment."""
+
+    __slots__ = ("seq", "ratings", "banned", "rated_count", "records")
+
+    def __init__(self, seq: int, records: List[Dict[str, Any]]):
+        self.seq = seq
+        self.records = records
+        self.ratings: Dict[str, Dict[str, Any]] = {}
+        self.banned: List[str] = []
+        self.rated_count = 0
+        for rec in records:
+            op = rec.get("op")
+            if op == "rate":
+                self.ratings[rec["video"]] = rec["entry"]
+                self.rated_count += 1
+            elif op == "ban":
+                if rec.get("combo_key") and rec["combo_key"] not in self.banned:
+                    self.banned.append(rec["combo_key"])
+                if rec.get("entry") and rec.get("video") and rec["video"] not in self.ratings:
+                    self.ratings[rec["video"]] = rec["entry"]
+
+    def __bool__(self) -> bool:
+        return bool(self.records)
+
+
+class Journal:
+    """Append-only JSONL log with group-commit fsync and background compaction.
+
+    Subclasses implement `_fold(records)` to apply a batch to the snapshot files.
+    """
+
+    def __init__(self, directory: str, filename: str = JOURNAL_FILENAME,
+                 checkpoint_filename: str = CHECKPOINT_FILENAME,
+                 compact_interval_s: float = DEFAULT_COMPACT_INTERVAL_S):
+        self.directory = directory
+        self.path = os.path.join(directory, filename)
+        self.checkpoint_path = os.path.join(directory, checkpoint_filename)
+        self.compact_interval_s = float(compact_interval_s)
+        self._lock = threading.Lock()          # file handle, seq, tail
+        self._sync_lock = threading.Lock()     # one fsync at a time; waiters piggyback on it
+        self._compact_lock = threading.Lock()  # one fold at a time
+        self._tail: List[Dict[str, Any]] = []
+        self._view: Optional[JournalView] = None
+        self._listeners: List[Callable[[List[Dict[str, Any]]], None]] = []
+        self._seq = 0
+        self._written_seq = 0
+        self._synced_seq = 0
+        self._folded_seq = 0
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.appends = 0
+        self.fsyncs = 0
+        self.compactions = 0
+        self.last_compact_ms = 0.0
+        os.makedirs(directory, exist_ok=True)
+        self._recover()
+        self._fh = open(self.path, "a", encoding="utf-8")
+
+    # ---- write path ----
+    def append(self, records: Iterable[Dict[str, Any]]) -> int:
+        """Durably append records (one fsync for the whole batch); returns the last seq."""
+        batch = []
+        with self._lock:
+            for rec in records:
+                self._seq += 1
+                rec = dict(rec, seq=self._seq)
+                rec.setdefault("ts", time.time())
+                self._fh.write(json.dumps(rec, ensure_ascii=False, separators=(",", ":")) + "\n")
+                batch.append(rec)
+            if not batch:
+                return self._seq
+            self._tail.extend(batch)
+            self._view = None
+            self._written_seq = self._seq
+            last = self._seq
+            self.appends += len(batch)
+            tail_len = len(self._tail)
+        self._sync_to(last)
+        if tail_len >= COMPACT_MAX_TAIL:
+            self._wake.set()
+        for cb in list(self._listeners):
+            try:
+                cb(batch)
+            except Exception as e:
+                log.warning(f"Journal listener failed: {e}")
+        return last
+
+    def _sync_to(self, seq: int):
+        # Group commit: whoever holds the sync lock fsyncs everything written so far
+        with self._sync_lock:
+            if self._synced_seq >= seq:
+                return
+            with self._lock:
+                self._fh.flush()
+                target = self._written_seq
+                fd = self._fh.fileno()
+            os.fsync(fd)
+            self._synced_seq = target
+            self.fsyncs += 1
+
+    def add_listener(self, callback: Callable[[List[Dict[str, Any]]], None]):
+        """Call `callback(records)` after every durable append."""
+        self._listeners.append(callback)
+
+    # ---- read path ----
+    def view(self) -> JournalView:
+        """Records not yet folded into the snapshot files.
+
+        Take the view BEFORE reading the snapshot files: a fold that finishes in
+        between then shows up in both (harmless) instead of in neither.
+        """
+        view = self._view
+        if view is None:
+            with self._lock:
+                view = self._view
+                if view is None:
+                    view = JournalView(self._seq, list(self._tail))
+                    self._view = view
+        return view
+
+    # ---- compaction ----
+    def compact(self) -> int:
+        """Fold the current tail into the snapshot files; returns the number of records folded."""
+        with self._compact_lock:
+            with self._lock:
+                records = list(self._tail)
+            if not records:
+                return 0
+            t0 = time.perf_counter()
+            self._fold(records)
+            upto = records[-1]["seq"]
+            atomic_write_json(self.checkpoint_path, {"seq": upto, "ts": time.time()})
+            with self._lock:
+                self._tail = [r for r in self._tail if r["seq"] > upto]
+                self._view = None
+                self._folded_seq = upto
+                self._rewrite_locked()
+            self.compactions += 1
+            self.last_compact_ms = (time.perf_counter() - t0) * 1000
+            return len(records)
+
+    def _fold(self, records: List[Dict[str, Any]]):
+        raise NotImplementedError
+
+    def _rewrite_locked(self):
+        # Keep only records appended while the fold was running
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            for rec in self._tail:
+                f.write(json.dumps(rec, ensure_ascii=False, separators=(",", ":")) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self._fh.close()
+        os.replace(tmp, self.path)
+        self._fh = open(self.path, "a", encoding="utf-8")
+
+    def _recover(self):
+        checkpoint = _load_json(self.checkpoint_path, {}) or {}
+        folded = int(checkpoint.get("seq", 0) or 0)
+        self._folded_seq = folded
+        self._seq = folded
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "rb") as f:
+            raw = f.read()
+        end = raw.rfind(b"\n") + 1
+        if end < len(raw):
+            # Torn last line from a crash mid-append: it was never acknowledged, cut it off
+            log.warning(f"Journal: dropping {len(raw) - end} bytes of a torn record in {self.path}")
+            with open(self.path, "r+b") as f:
+                f.truncate(end)
+        for line in raw[:end].decode("utf-8", "replace").splitlines():
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                log.warning(f"Journal: skipping unreadable line in {self.path}")
+                continue
+            seq = int(rec.get("seq", 0))
+            self._seq = max(self._seq, seq)
+            if seq > folded:
+                self._tail.append(rec)
+        self._written_seq = self._synced_seq = self._seq
+        if self._tail:
+            log.info(f"Journal: replaying {len(self._tail)} records from {self.path}")
+
+    def start(self):
+        """Run the compactor in a daemon thread (and once more at interpreter exit)."""
+        if self._thread and self._thread.is_alive():
+            return
+
+        def _loop():
+            while not self._stop.is_set():
+                self._wake.wait(self.compact_interval_s)
+                self._wake.clear()
+                try:
+                    self.compact()
+                except Exception as e:
+                    log.warning(f"Journal compaction failed: {e}")
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=_loop, name="journal-compactor", daemon=True)
+        self._thread.start()
+        atexit.register(self._final_compact)
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def _final_compact(self):
+        try:
+            self.compact()
+        except Exception as e:
+            log.warning(f"Journal final compaction failed: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "seq": self._seq,
+                "synced_seq": self._synced_seq,
+                "folded_seq": self._folded_seq,
+                "tail": len(self._tail),
+                "appends": self.appends,
+                "fsyncs": self.fsyncs,
+                "compactions": self.compactions,
+                "last_compact_ms": round(self.last_compact_ms, 2),
+            }
+
+
+class RatingJournal(Journal):
+    """Journal of review actions folded into the auto_state snapshot files.
+
+    Record shapes (``seq``/``ts`` are added by `append`):
+      {"op": "rate", "video": name, "entry": {"rating", "timestamp", "rated_at"}}
+      {"op": "ban", "combo_key": key, "video": name|None, "params": {...}|None, "entry": {...}|None}
+      {"op": "reference", "params": {...}}
+    """
+
+    def __init__(self, state_dir: str, catalog=None, segments=None, **kwargs):
+        # Optional SQLiteCatalog: ratings/bans/knowledge updates become rows instead of file rewrites
+        self.catalog = catalog
+        # Optional KnowledgeSegments: only the segments holding rated videos are rewritten
+        self.segments = segments
+        self.manual_ratings_file = os.path.join(state_dir, "manual_ratings.json")
+        self.knowledge_file = os.path.join(state_dir, "knowledge.json")
+        self.bandit_state_file = os.path.join(state_dir, "bandit_state.json")
+        from eva_state.versioned_state import get_bandit_state, get_knowledge_state  # imports atomic_write_json from here
+        self.bandit_state = get_bandit_state(self.bandit_state_file)
+        # knowledge.json is rewritten by the agent too: fold under the same lock it commits under
+        self.knowledge_state = get_knowledge_state(self.knowledge_file)
+        self.reference_params_file = os.path.join(state_dir, "reference_params.json")
+        self.ban_history_file = os.path.join(state_dir, "ban_history.json")
+        super().__init__(state_dir, **kwargs)
+
+    def _fold(self, records: List[Dict[str, Any]]):
+        rates = [r for r in records if r.get("op") == "rate"]
+        bans = [r for r in records if r.get("op") == "ban"]
+        references = [r for r in records if r.get("op") == "reference"]
+
+        if self.catalog is not None:
+            if rates or bans:
+                self.catalog.apply_review(records)
+                if EXPORT_JSON:
+                    self.catalog.export_json(self.directory)
+        elif rates or any(b.get("entry") for b in bans):
+            manual = _load_json(self.manual_ratings_file, {}) or {}
+            for rec in records:
+                if rec.get("op") == "rate":
+                    manual[rec["video"]] = rec["entry"]
+                elif rec.get("op") == "ban" and rec.get("entry") and rec.get("video"):
+                    # Ban marks a video as handled only if nobody rated it first
+                    manual.setdefault(rec["video"], rec["entry"])
+            atomic_write_json(self.manual_ratings_file, manual)
+
+        if rates or bans:
+            # Versioned read-modify-write under the bandit_state lock: the agent's
+            # concurrent save merges on top instead of overwriting t / bans
+            def fold_bandit(bandit):
+                bandit["t"] = bandit.get("t", 0) + len(rates)
+                banned = bandit["banned_combos"]
+                seen = set(banned)
+                for rec in bans:
+                    key = rec.get("combo_key")
+                    if key and key not in seen:
+                        banned.append(key)
+                        seen.add(key)
+
+            self.bandit_state.update(fold_bandit)
+
+        if rates and self.catalog is None:
+            self._fold_knowledge(rates)
+
+        if references:
+            data = _load_json(self.reference_params_file, [])
+            if isinstance(data, dict):
+                for key in ("combos", "params_list", "list"):
+                    if isinstance(data.get(key), list):
+                        data = data[key]
+                        break
+            if not isinstance(data, list):
+                data = []
+            data.extend({"params": compact_refs(r["params"], self.directory)} for r in references if r.get("params"))
+            atomic_write_json(self.reference_params_file, data)
+
+        if bans and self.catalog is None:
+            hist = _load_json(self.ban_history_file, [])
+            if not isinstance(hist, list):
+                hist = []
+            hist.extend({
+                "timestamp": r.get("ts"),
+                "video_name": r.get("video"),
+                "combo_key": r.get("combo_key"),
+                "params": r.get("params"),
+            } for r in bans)
+            atomic_write_json(self.ban_history_file, hist)
+
+    def _fold_knowledge(self, rates: List[Dict[str, Any]]):
+        """best_score/best_params and per-entry manual_rating, as the server did per POST."""
+        if self.segments is not None:
+            self.segments.fold(lambda knowledge: self._apply_rates(knowledge, rates))
+            if EXPORT_JSON:
+                self.segments.export_json()
+            return
+        self.knowledge_state.update(lambda knowledge: self._apply_rates(knowledge, rates))
+
+    @staticmethod
+    def _apply_rates(knowledge: Dict[str, Any], rates: List[Dict[str, Any]]):
+        """Rated entries are replaced in `history` by updated copies, never modified in place."""
+        history = knowledge.get("history", [])
+        # Built once per fold: basenames of both `video` and `video_path`, as the server matches them
+        index = KnowledgeIndex(history)
+
+        for rec in rates:
+            video_name = rec["video"]
+            rating = rec["entry"].get("rating") or {}
+            overall_score = rating.get("overall_quality", 0)
+            i = index.exact_position(video_name) if video_name else None
+            if overall_score > knowledge.get("best_score", 0):
+                knowledge["best_score"] = overall_score
+                video_details, _ = index.lookup(video_name)
+                if video_details:
+                    knowledge["best_params"] = {
+                        "prompt": video_details.get("prompt", ""),
+                        "params": video_details.get("params", {}),
+                        "combo": video_details.get("combo", {}),
+                        "manual_rating": rating,
+                    }
+            if i is not None:
+                history[i] = dict(history[i], manual_rating=rating,
+                                  manual_rated_at=rec["entry"].get("rated_at") or time.strftime("%Y-%m-%d %H:%M:%S"))
+
+
+_journals: Dict[str, RatingJournal] = {}
+_journals_lock = threading.Lock()
+
+
+def get_rating_journal(state_dir: str) -> RatingJournal:
+    """Process-wide rating journal for an auto_state directory (compactor started on first use)."""
+    key = os.path.abspath(state_dir)
+    journal = _journals.get(key)
+    if journal is None:
+        with _journals_lock:
+            journal = _journals.get(key)
+            if journal is None:
+                from eva_state.sqlite_catalog import get_sqlite_catalog
+                from eva_state.knowledge_segments import get_knowledge_segments
+                journal = RatingJournal(key, catalog=get_sqlite_catalog(key), segments=get_knowledge_segments(key))
+                journal.start()
+                _journals[key] = journal
+    return journal
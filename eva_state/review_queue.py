@@ -0,0 +1,662 @@
+"""Persistent priority queue of clips waiting for manual review.
+
+review_queue.json was one document: the agent appended every generated clip
+to ``pending`` and rewrote the whole file, nothing ever left it, and the
+review server rebuilt a name map from the full list on every request.
+``in_review`` / ``completed`` were never used.
+
+`ReviewQueue` keeps the queue in ``<state_dir>/review_queue.jsonl`` as a log
+of operations, one JSON line each:
+
+  push      – a clip entered the queue (the agent's queue item, ordered by
+              its ``priority``: 1 is the most urgent, then by arrival)
+  lease     – a reviewer reserved a clip until ``until`` (``in_review``);
+              nobody else is handed it before the lease is released or
+              expires, and the same reviewer gets it back on the next lease
+  release   – the reviewer gave the clip back (``pending`` again)
+  complete  – the clip was rated; only the last ``REVIEW_QUEUE_KEEP_COMPLETED``
+              completed items are kept, older ones are evicted
+
+Every process replays the log into an in-memory heap of
+(priority, arrival, video_id) with lazy deletion, a lease heap ordered by
+expiry and a name index, so push and lease are O(log n) and lookups by video
+name O(1). Writers append under an exclusive ``fcntl`` lock after catching up
+with the lines other processes wrote, which is what keeps two reviewers (or
+two server processes) from leasing the same clip. Readers only parse the
+bytes appended since their last read; when dead lines outnumber live items
+the log is rewritten with one line per live item (tmp + ``os.replace``,
+readers notice the new inode and reload). Prompt texts go through the prompt
+store when it is enabled.
+
+Enabling: opt-in with ``REVIEW_QUEUE=log`` (not with the SQLite catalog,
+whose ``review_queue`` table stays as it is); review_queue.json is imported
+once on first open and is no longer written afterwards, except by
+``STATE_EXPORT_JSON=1`` / ``export``, so external readers of review_queue.json
+keep the default. Maintenance CLI::
+
+    python -m eva_state.review_queue stats <state_dir>
+    python -m eva_state.review_queue compact <state_dir>
+    python -m eva_state.review_queue export <state_dir> [--output review_queue.json]
+"""
+import os
+import gc
+import sys
+import json
+import time
+import heapq
+import logging
+import threading
+from collections import OrderedDict
+from collections.abc import Mapping
+from contextlib import contextmanager
+from typing import Any, Container, Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # not on POSIX: in-process lock only
+    fcntl = None
+
+from eva_state.knowledge_segments import _parse_lines
+from eva_state.prompt_store import get_prompt_store
+from eva_state.rating_journal import EXPORT_JSON, atomic_write_json, _load_json
+from eva_state.sqlite_catalog import sqlite_backend_enabled
+
+log = logging.getLogger("eva_state")
+
+QUEUE_FILENAME = "review_queue.jsonl"
+LEGACY_FILENAME = "review_queue.json"
+STATUSES = ("pending", "in_review", "completed")
+DEFAULT_LEASE_S = float(os.environ.get("REVIEW_LEASE_S", "600"))
+KEEP_COMPLETED = int(os.environ.get("REVIEW_QUEUE_KEEP_COMPLETED", "200"))
+DEFAULT_PRIORITY = 3
+# Rewrite the log when it holds at least this many lines and 4x more lines than live items
+COMPACT_MIN_OPS = 1000
+# Replays of at least this many lines run with the cyclic GC paused
+REPLAY_GC_PAUSE_OPS = 10000
+
+
+def _dumps(value: Any) -> bytes:
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def _priority(item: Dict[str, Any]) -> int:
+    try:
+        return int(item.get("priority", DEFAULT_PRIORITY))
+    except (TypeError, ValueError):
+        return DEFAULT_PRIORITY
+
+
+def item_id(item: Dict[str, Any]) -> Optional[str]:
+    """Queue key of an item: ``video_id``, else the clip file name without ``.mp4``."""
+    vid = item.get("video_id")
+    if vid:
+        return str(vid)
+    name = os.path.basename(item.get("original_path") or item.get("video_path") or "")
+    return name[:-4] if name.endswith(".mp4") else (name or None)
+
+
+def _names(vid: str, item: Dict[str, Any]) -> List[str]:
+    """Names an item is found by: its id, the clip in the output dir and the pending copy."""
+    names = [vid, f"{vid}.mp4"]
+    for key in ("original_path", "video_path"):
+        name = os.path.basename(item.get(key) or "")
+        if name:
+            names.append(name)
+    return names
+
+
+class ReviewQueue:
+    """Review queue of one state directory (shared by the threads of a process)."""
+
+    def __init__(self, state_dir: str, lease_s: float = DEFAULT_LEASE_S,
+                 keep_completed: int = KEEP_COMPLETED, prompts=None):
+        self.state_dir = state_dir
+        self.path = os.path.join(state_dir, QUEUE_FILENAME)
+        self.lease_s = float(lease_s)
+        self.keep_completed = max(0, int(keep_completed))
+        # PromptStore override (CLI tools); otherwise the process-wide store, once it exists
+        self._prompts = prompts
+        self._lock = threading.RLock()
+        self._write_lock = threading.Lock()
+        self.version = 0
+        self.pushes = 0
+        self.leases = 0
+        self.releases = 0
+        self.completions = 0
+        self.evictions = 0
+        self.expired = 0
+        self.compactions = 0
+        self.reloads = 0
+        self._reset()
+
+    def _reset(self):
+        self._items: Dict[str, Dict[str, Any]] = {}
+        self._status: Dict[str, str] = {}
+        self._counts = {status: 0 for status in STATUSES}
+        self._order: Dict[str, int] = {}
+        self._heap: List[Tuple[int, int, str]] = []
+        self._lease: Dict[str, Tuple[Optional[str], float]] = {}
+        self._lease_heap: List[Tuple[float, str]] = []
+        self._completed: "OrderedDict[str, float]" = OrderedDict()
+        self._by_name: Dict[str, str] = {}
+        self._arrivals = 0
+        self._file_id = None
+        self._offset = 0
+        self._ops = 0
+        self._doc = None
+
+    def _prompt_store(self):
+        return self._prompts if self._prompts is not None else get_prompt_store(self.state_dir)
+
+    # ---- applying operations ----
+    def _set_status(self, vid: str, status: Optional[str]):
+        old = self._status.pop(vid, None)
+        if old is not None:
+            self._counts[old] -= 1
+        if status is not None:
+            self._status[vid] = status
+            self._counts[status] += 1
+
+    def _requeue(self, vid: str):
+        self._lease.pop(vid, None)
+        self._set_status(vid, "pending")
+        heapq.heappush(self._heap, (_priority(self._items[vid]), self._order[vid], vid))
+
+    def _drop(self, vid: str):
+        item = self._items.pop(vid, None)
+        if item is not None:
+            for name in _names(vid, item):
+                if self._by_name.get(name) == vid:
+                    del self._by_name[name]
+        self._set_status(vid, None)
+        self._order.pop(vid, None)
+        self._lease.pop(vid, None)
+        self._completed.pop(vid, None)
+
+    def _apply(self, op: Dict[str, Any]):
+        kind, vid = op.get("op"), op.get("id")
+        self._ops += 1
+        if not vid:
+            return
+        status = self._status.get(vid)
+        if kind == "push":
+            item = op.get("item") or {}
+            if status is not None:
+                self._drop(vid)
+            self._items[vid] = item
+            for name in _names(vid, item):
+                self._by_name[name] = vid
+            self._arrivals += 1
+            self._order[vid] = self._arrivals
+            self._set_status(vid, "pending")
+            heapq.heappush(self._heap, (_priority(item), self._arrivals, vid))
+        elif kind == "lease":
+            if status not in ("pending", "in_review"):
+                return
+            until = float(op.get("until") or 0)
+            self._set_status(vid, "in_review")
+            self._lease[vid] = (op.get("owner"), until)
+            heapq.heappush(self._lease_heap, (until, vid))
+        elif kind == "release":
+            owner = op.get("owner")
+            if status != "in_review" or (owner is not None and self._lease.get(vid, (None,))[0] != owner):
+                return
+            self._requeue(vid)
+        elif kind == "complete":
+            if status is None or status == "completed":
+                return
+            self._lease.pop(vid, None)
+            self._set_status(vid, "completed")
+            self._completed[vid] = op.get("ts") or time.time()
+            while len(self._completed) > self.keep_completed:
+                oldest = next(iter(self._completed))
+                self._drop(oldest)
+                self.evictions += 1
+        else:
+            return
+        self._doc = None
+        self.version += 1
+
+    def _expire(self, now: float):
+        """Leases past their ``until`` put the clip back into ``pending`` (same in every process)."""
+        while self._lease_heap and self._lease_heap[0][0] <= now:
+            until, vid = heapq.heappop(self._lease_heap)
+            lease = self._lease.get(vid)
+            if lease is not None and lease[1] == until and self._status.get(vid) == "in_review":
+                self._requeue(vid)
+                self.expired += 1
+                self._doc = None
+                self.version += 1
+
+    # ---- reading the log ----
+    def refresh(self):
+        """Apply lines other processes appended since the last call (reload after a rewrite)."""
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            st = None
+        with self._lock:
+            if st is None or (st.st_dev, st.st_ino) != self._file_id or st.st_size != self._offset:
+                self._refresh_locked()
+            self._expire(time.time())
+
+    def _refresh_locked(self):
+        try:
+            f = open(self.path, "rb")
+        except FileNotFoundError:
+            if self._file_id is not None:
+                self._reset()
+                self.version += 1
+            return
+        with f:
+            st = os.fstat(f.fileno())
+            file_id = (st.st_dev, st.st_ino)
+            if file_id != self._file_id or st.st_size < self._offset:
+                if self._file_id is not None:
+                    self.reloads += 1
+                self._reset()
+                self.version += 1
+                self._file_id = file_id
+            if st.st_size <= self._offset:
+                return
+            f.seek(self._offset)
+            data = f.read(st.st_size - self._offset)
+        ops, consumed = _parse_lines(data, self.path)
+        self._offset += consumed
+        prompts = self._prompt_store()
+        # Replaying a long log allocates an object graph per item: keep the cyclic GC out of it
+        pause_gc = len(ops) >= REPLAY_GC_PAUSE_OPS and gc.isenabled()
+        if pause_gc:
+            gc.disable()
+        try:
+            for op in ops:
+                if prompts is not None and op.get("op") == "push":
+                    op["item"] = prompts.expand(op.get("item"))
+                self._apply(op)
+        finally:
+            if pause_gc:
+                gc.enable()
+
+    # ---- writing ----
+    @contextmanager
+    def _locked(self):
+        """Exclusive writer lock (threads, then processes via fcntl), caught up with the log."""
+        with self._write_lock:
+            if fcntl is None:
+                with self._lock:
+                    self._refresh_locked()
+                    yield
+                return
+            with open(self.path + ".lock", "a") as f:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+                try:
+                    with self._lock:
+                        self._refresh_locked()
+                        yield
+                finally:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    def _encode(self, op: Dict[str, Any], compact: bool = True) -> bytes:
+        prompts = self._prompt_store() if compact else None
+        if prompts is not None and op.get("op") == "push":
+            op = dict(op, item=prompts.compact(op["item"]))
+        return _dumps(op) + b"\n"
+
+    def _write(self, ops: List[Dict[str, Any]]):
+        """Append and apply ops; call inside `_locked`."""
+        if not ops:
+            return
+        data = b"".join(self._encode(op) for op in ops)
+        os.makedirs(self.state_dir, exist_ok=True)
+        with open(self.path, "ab") as f:
+            st = os.fstat(f.fileno())
+            if (st.st_dev, st.st_ino) != self._file_id:
+                # Created just now (nothing applied from another file yet)
+                self._file_id, self._offset = (st.st_dev, st.st_ino), 0
+            # An unterminated line left by a crashed writer must not swallow ours
+            head = b"\n" if st.st_size > self._offset else b""
+            f.write(head + data)
+            f.flush()
+            os.fsync(f.fileno())
+        self._offset = st.st_size + len(head) + len(data)
+        for op in ops:
+            self._apply(op)
+        if self._ops >= COMPACT_MIN_OPS and self._ops > 4 * max(1, len(self._items)):
+            self._rewrite()
+
+    def _rewrite(self, compact: bool = True):
+        """Replace the log with one line per live item (call inside `_locked`)."""
+        t0 = time.perf_counter()
+        now = time.time()
+        ops = [{"op": "push", "id": vid, "item": self._items[vid], "ts": now}
+               for vid in sorted(self._items, key=self._order.__getitem__)]
+        ops += [{"op": "lease", "id": vid, "owner": owner, "until": until}
+                for vid, (owner, until) in self._lease.items()]
+        ops += [{"op": "complete", "id": vid, "ts": ts} for vid, ts in self._completed.items()]
+        tmp = f"{self.path}.tmp.{os.getpid()}.{threading.get_ident()}"
+        with open(tmp, "wb") as f:
+            for op in ops:
+                f.write(self._encode(op, compact))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+        # Re-read our own rewrite: arrival numbers and the heap start clean
+        self._file_id = None
+        self._refresh_locked()
+        self.compactions += 1
+        log.info(f"ReviewQueue: compacted {self.path} to {len(ops)} lines in {(time.perf_counter() - t0) * 1000:.0f} ms")
+        if EXPORT_JSON:
+            atomic_write_json(os.path.join(self.state_dir, LEGACY_FILENAME), self._compact_doc())
+
+    def _resolve(self, key: str) -> Optional[str]:
+        if key in self._items:
+            return key
+        return self._by_name.get(key) or self._by_name.get(os.path.basename(key or ""))
+
+    def push(self, item: Dict[str, Any]) -> str:
+        """Queue a clip (O(log n)); pushing the same video_id again replaces its item."""
+        vid = item_id(item)
+        if not vid:
+            raise ValueError("review queue item needs video_id or original_path")
+        with self._locked():
+            self._write([{"op": "push", "id": vid, "item": item, "ts": time.time()}])
+        self.pushes += 1
+        return vid
+
+    def lease(self, owner: str, count: int = 1, lease_s: Optional[float] = None) -> List[Dict[str, Any]]:
+        """Reserve up to `count` clips for `owner`, most urgent first.
+
+        Clips the owner already holds are renewed and returned first, so a
+        reviewer reloading the page keeps its clips. Returns copies of the
+        items with ``lease_owner`` / ``lease_until``.
+        """
+        lease_s = self.lease_s if lease_s is None else float(lease_s)
+        count = max(0, int(count))
+        with self._locked():
+            now = time.time()
+            self._expire(now)
+            until = now + lease_s
+            chosen = [vid for vid, (o, _) in self._lease.items() if o == owner][:count]
+            taken = set(chosen)
+            popped = []
+            while len(chosen) < count and self._heap:
+                entry = heapq.heappop(self._heap)
+                priority, order, vid = entry
+                if self._status.get(vid) != "pending" or self._order.get(vid) != order or vid in taken:
+                    continue
+                popped.append(entry)
+                chosen.append(vid)
+                taken.add(vid)
+            try:
+                self._write([{"op": "lease", "id": vid, "owner": owner, "until": until} for vid in chosen])
+            except Exception:
+                for entry in popped:
+                    heapq.heappush(self._heap, entry)
+                raise
+            items = [dict(self._items[vid], lease_owner=owner, lease_until=until) for vid in chosen]
+            self._compact_heap()
+        self.leases += len(items)
+        return items
+
+    def lease_clip(self, owner: str, key: str, lease_s: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """Reserve (or renew) one clip, by video id or name, for `owner` – the clip a reviewer has on screen.
+
+        None when the clip is not queued, already completed or leased by someone else.
+        """
+        lease_s = self.lease_s if lease_s is None else float(lease_s)
+        self.refresh()
+        with self._lock:
+            vid = self._resolve(key)
+            if vid is None or self._status.get(vid) not in ("pending", "in_review"):
+                return None
+        with self._locked():
+            now = time.time()
+            self._expire(now)
+            vid = self._resolve(key)
+            status = self._status.get(vid) if vid is not None else None
+            if status not in ("pending", "in_review"):
+                return None
+            if status == "in_review" and self._lease.get(vid, (None,))[0] != owner:
+                return None
+            until = now + lease_s
+            self._write([{"op": "lease", "id": vid, "owner": owner, "until": until}])
+            item = dict(self._items[vid], lease_owner=owner, lease_until=until)
+        self.leases += 1
+        return item
+
+    def _compact_heap(self):
+        # Stale entries (leased/completed in another process) are dropped once they dominate
+        if len(self._heap) > 2 * self._counts["pending"] + 64:
+            self._heap = [(p, o, v) for p, o, v in self._heap
+                          if self._status.get(v) == "pending" and self._order.get(v) == o]
+            heapq.heapify(self._heap)
+
+    def release(self, key: str, owner: Optional[str] = None) -> bool:
+        """Give a leased clip back to ``pending``; with `owner`, only that owner's lease."""
+        with self._locked():
+            vid = self._resolve(key)
+            if vid is None or self._status.get(vid) != "in_review":
+                return False
+            if owner is not None and self._lease.get(vid, (None,))[0] != owner:
+                return False
+            self._write([{"op": "release", "id": vid, "owner": owner}])
+        self.releases += 1
+        return True
+
+    def complete(self, keys: Iterable[str]) -> int:
+        """Mark clips (video ids or file names) as reviewed; returns how many were still open."""
+        keys = list(keys)
+        if not keys:
+            return 0
+        self.refresh()
+        with self._lock:
+            if not any(self._status.get(self._resolve(k) or "") in ("pending", "in_review") for k in keys):
+                return 0
+        with self._locked():
+            now, ops, seen = time.time(), [], set()
+            for key in keys:
+                vid = self._resolve(key)
+                if vid is not None and vid not in seen and self._status.get(vid) in ("pending", "in_review"):
+                    seen.add(vid)
+                    ops.append({"op": "complete", "id": vid, "ts": now})
+            self._write(ops)
+        self.completions += len(ops)
+        return len(ops)
+
+    def reconcile(self, rated: Container[str]) -> int:
+        """Complete open items whose clip already has a rating (e.g. after importing review_queue.json)."""
+        self.refresh()
+        with self._lock:
+            names = [name for name, vid in self._by_name.items()
+                     if self._status.get(vid) in ("pending", "in_review") and name in rated]
+        return self.complete(names)
+
+    def on_journal_append(self, records: List[Dict[str, Any]]):
+        """RatingJournal listener: a rating (or a ban that marks the video) completes its clip."""
+        names = [rec["video"] for rec in records
+                 if rec.get("video") and (rec.get("op") == "rate" or (rec.get("op") == "ban" and rec.get("entry")))]
+        if names:
+            try:
+                self.complete(names)
+            except Exception as e:
+                log.warning(f"ReviewQueue: failed to complete {len(names)} reviewed clips: {e}")
+
+    # ---- reads ----
+    def lookup(self, key: str) -> Optional[Dict[str, Any]]:
+        """Queue item by video id or clip name (shared, read-only), None when not queued."""
+        self.refresh()
+        with self._lock:
+            vid = self._resolve(key)
+            return self._items.get(vid) if vid is not None else None
+
+    def status(self, key: str) -> Optional[Dict[str, Any]]:
+        self.refresh()
+        with self._lock:
+            vid = self._resolve(key)
+            if vid is None:
+                return None
+            owner, until = self._lease.get(vid, (None, None))
+            return {"video_id": vid, "status": self._status[vid], "priority": _priority(self._items[vid]),
+                    "lease_owner": owner, "lease_until": until}
+
+    def leased_names(self, except_owner: Optional[str] = None) -> FrozenSet[str]:
+        """Names of the clips under a live lease (ids and file names), except the ones `except_owner` holds."""
+        self.refresh()
+        with self._lock:
+            return frozenset(name for vid, (owner, _) in self._lease.items() if owner != except_owner
+                             for name in _names(vid, self._items[vid]))
+
+    def counts(self) -> Dict[str, int]:
+        self.refresh()
+        return dict(self._counts)
+
+    def signature(self) -> str:
+        """Changes whenever the log does (ETag part, stable across restarts)."""
+        self.refresh()
+        ino = self._file_id[1] if self._file_id else 0
+        return f"{ino}:{self._offset}"
+
+    def document(self) -> Dict[str, List[Dict[str, Any]]]:
+        """The queue in the review_queue.json shape (pending by priority); cached per version, read-only."""
+        self.refresh()
+        with self._lock:
+            if self._doc is None:
+                doc = {status: [] for status in STATUSES}
+                for vid in sorted(self._items, key=lambda v: (_priority(self._items[v]), self._order[v])):
+                    doc[self._status[vid]].append(self._items[vid])
+                completed = {vid: i for i, vid in enumerate(self._completed)}
+                doc["completed"].sort(key=lambda item: completed.get(item_id(item), 0))
+                self._doc = doc
+            return self._doc
+
+    def _compact_doc(self) -> Dict[str, Any]:
+        prompts = self._prompt_store()
+        doc = self.document()
+        return prompts.compact(doc) if prompts is not None else doc
+
+    def view(self) -> "ReviewQueueView":
+        self.refresh()
+        return ReviewQueueView(self)
+
+    def export_json(self, path: Optional[str] = None):
+        atomic_write_json(path or os.path.join(self.state_dir, LEGACY_FILENAME), self._compact_doc())
+
+    def compact(self, compact_prompts: bool = True):
+        """Rewrite the log now (prompt references or full texts)."""
+        with self._locked():
+            self._rewrite(compact=compact_prompts)
+
+    def migrate_from_json(self) -> bool:
+        """Import review_queue.json once, when the log does not exist yet."""
+        legacy = os.path.join(self.state_dir, LEGACY_FILENAME)
+        if os.path.exists(self.path) or not os.path.exists(legacy):
+            return False
+        with self._locked():
+            if self._file_id is not None:
+                return False
+            doc = _load_json(legacy, None)
+            if not isinstance(doc, dict):
+                return False
+            prompts = self._prompt_store()
+            if prompts is not None:
+                doc = prompts.expand(doc)
+            now, ops = time.time(), []
+            # in_review had no owner or expiry: those clips go back to pending
+            for status in STATUSES:
+                for item in doc.get(status) or []:
+                    vid = item_id(item) if isinstance(item, dict) else None
+                    if vid:
+                        ops.append({"op": "push", "id": vid, "item": item, "ts": now})
+                        if status == "completed":
+                            ops.append({"op": "complete", "id": vid, "ts": now})
+            self._write(ops)
+        log.info(f"ReviewQueue: imported {len(ops)} operations from {legacy}")
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        counts = self.counts()
+        return dict(counts, version=self.version, log_lines=self._ops, log_bytes=self._offset,
+                    heap=len(self._heap), pushes=self.pushes, leases=self.leases, releases=self.releases,
+                    completions=self.completions, evictions=self.evictions, expired=self.expired,
+                    compactions=self.compactions, reloads=self.reloads)
+
+
+class ReviewQueueView(Mapping):
+    """review_queue.json-shaped read access for state snapshots, plus O(1) `lookup`.
+
+    Reads the live queue: the lists are the queue's document at the time of the
+    first access of each key.
+    """
+
+    __slots__ = ("queue", "_doc")
+
+    def __init__(self, queue: ReviewQueue):
+        self.queue = queue
+        self._doc = None
+
+    def _document(self):
+        if self._doc is None:
+            self._doc = self.queue.document()
+        return self._doc
+
+    def __getitem__(self, key):
+        return self._document()[key]
+
+    def __iter__(self):
+        return iter(STATUSES)
+
+    def __len__(self):
+        return len(STATUSES)
+
+    def lookup(self, key: str) -> Optional[Dict[str, Any]]:
+        return self.queue.lookup(key)
+
+
+def review_queue_enabled(state_dir: str) -> bool:
+    """REVIEW_QUEUE=log without the SQLite catalog; otherwise review_queue.json as before."""
+    return os.environ.get("REVIEW_QUEUE", "").strip().lower() == "log" and not sqlite_backend_enabled(state_dir)
+
+
+_queues: Dict[str, Optional[ReviewQueue]] = {}
+_queues_lock = threading.Lock()
+
+
+def get_review_queue(state_dir: str) -> Optional[ReviewQueue]:
+    """Process-wide review queue for a state directory, or None when review_queue.json / SQLite is in use.
+
+    Decided once per process, like the storage backends.
+    """
+    key = os.path.abspath(state_dir)
+    try:
+        return _queues[key]
+    except KeyError:
+        pass
+    with _queues_lock:
+        if key not in _queues:
+            queue = None
+            if review_queue_enabled(key):
+                queue = ReviewQueue(key)
+                queue.migrate_from_json()
+            _queues[key] = queue
+        return _queues[key]
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    import argparse
+    ap = argparse.ArgumentParser(prog="python -m eva_state.review_queue")
+    ap.add_argument("command", choices=("stats", "compact", "export"))
+    ap.add_argument("state_dir")
+    ap.add_argument("--output", help="export: target file (default <state_dir>/review_queue.json)")
+    args = ap.parse_args(argv)
+    queue = ReviewQueue(args.state_dir)
+    queue.migrate_from_json()
+    if args.command == "compact":
+        queue.compact()
+    elif args.command == "export":
+        queue.export_json(args.output)
+    print(json.dumps(queue.stats()))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
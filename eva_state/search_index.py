@@ -0,0 +1,740 @@
+"""Columnar search index for the review server's /api/search.
+
+One row per searchable video (output files + manually rated names) with the
+filterable attributes held as parallel columns: float scores, integer codes
+for fps / width / height / sampler / scheduler and boolean flags. A request
+turns its filters into boolean masks over those columns and takes its page by
+partial selection (argpartition) on a sort rank computed once per index,
+instead of matching every video against knowledge history and sorting the
+whole result list. Facet counts for a result set (sampler, scheduler, combo,
+fps, resolution, rating bucket) are bincounts over the same code columns.
+
+NumPy is used when it is installed; without it the same index runs on plain
+lists (filters as comprehensions, top-k via heapq), so the server keeps
+working on a bare interpreter.
+
+`SearchIndexUpdater` keeps one index in step with the state: new history
+entries, rating changes and files appearing or disappearing only recompute
+the rows they can affect.
+"""
+import os
+import math
+import time
+import heapq
+import bisect
+import logging
+import threading
+from collections import Counter
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Mapping, NamedTuple, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # optional: pure-Python columns
+    np = None
+
+from eva_state.knowledge_index import TIMESTAMP_MATCH_WINDOW_S, entry_video_path
+from eva_state.text_index import TextIndex, entry_text
+
+log = logging.getLogger("eva_state")
+
+# Columns and their kinds: f = float (NaN for missing), i = category code, b = flag
+COLUMNS = (
+    ("score", "f"),
+    ("sort_key", "f"),
+    ("manual_overall", "f"),
+    ("fps", "i"),
+    ("width", "i"),
+    ("height", "i"),
+    ("sampler", "i"),
+    ("scheduler", "i"),
+    ("rated", "b"),
+    ("banned", "b"),
+    ("reference", "b"),
+    ("exists", "b"),
+    ("live", "b"),
+)
+CODED_COLUMNS = ("fps", "width", "height", "sampler", "scheduler")
+# Code that no value ever gets: filtering by an unseen value matches nothing
+MISSING_CODE = -1
+# Rebuild from scratch once this share of rows belongs to videos that are gone
+DEAD_ROWS_REBUILD_RATIO = 0.5
+# ...or the text index holds this many docs per live row (superseded prompt versions)
+STALE_TEXT_REBUILD_RATIO = 2.0
+# Every this many updates history is compared entry by entry, not just its appended tail
+FULL_COMPARE_EVERY = 64
+# Relevance bonus for names containing `q`: file-name hits list before prompt hits
+NAME_MATCH_BOOST = 1000.0
+
+# Facets /api/search can return; rating buckets split manual overall_quality at these edges
+FACETS = ("sampler", "scheduler", "combo", "fps", "resolution", "rating")
+RATING_BUCKET_EDGES = (3, 5, 7, 9)
+RATING_BUCKETS = ("1-2", "3-4", "5-6", "7-8", "9-10")
+UNRATED_BUCKET = "unrated"
+
+_NAN = float("nan")
+_MISSING = object()
+
+
+def knowledge_score(det: Dict[str, Any]) -> Any:
+    """Automatic score of a knowledge entry: `overall`, else the first overall-like metric."""
+    if not isinstance(det, dict):
+        return None
+    if 'overall' in det:
+        return det.get('overall')
+    m = det.get('metrics', {}) or {}
+    for k in ('overall', 'overall_simple', 'blended_overall'):
+        if k in m:
+            return m.get(k)
+    return None
+
+
+def knowledge_params(det: Dict[str, Any]) -> Dict[str, Any]:
+    """Searchable generation params of a knowledge entry (sampler/scheduler fall back to `combo`)."""
+    det = det if isinstance(det, dict) else {}
+    p = det.get('params', {}) or {}
+    combo = det.get('combo') if isinstance(det.get('combo'), list) else [None, None]
+    return {
+        'fps': p.get('fps'), 'width': p.get('width'), 'height': p.get('height'),
+        'sampler': p.get('sampler') or combo[0],
+        'scheduler': p.get('scheduler') or combo[1],
+    }
+
+
+def coded_value(column: str, value: Any) -> str:
+    """Key a param value is matched under: filters compare str(value), sampler/scheduler case-insensitively."""
+    if column in ("sampler", "scheduler"):
+        return str(value or '').lower()
+    return str(value)
+
+
+def _float(value: Any) -> float:
+    if value is None:
+        return _NAN
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return _NAN
+
+
+def _sort_key(score: Any) -> float:
+    """-(score or -1): unscored (and zero) videos sort after every positive score."""
+    v = _float(score)
+    return 1.0 if math.isnan(v) or v == 0 else -v
+
+
+def _name_timestamp(name: str) -> Optional[int]:
+    """Timestamp the knowledge lookup would try for `gen_<ts>_...` names."""
+    parts = name.split('_')
+    if len(parts) >= 2:
+        try:
+            return int(parts[1])
+        except ValueError:
+            return None
+    return None
+
+
+class SearchRow(NamedTuple):
+    name: str
+    score: Any
+    manual_overall: Any
+    params: Dict[str, Any]
+    rated: bool
+    banned: bool
+    reference: bool
+    exists: bool
+    live: bool = True
+
+    def item(self) -> Dict[str, Any]:
+        """The /api/search item for this row (without knowledge text fields)."""
+        return {
+            'name': self.name,
+            'score': self.score,
+            'manual_overall': self.manual_overall,
+            'rated': self.rated,
+            'banned': self.banned,
+            'reference': self.reference,
+            'params': dict(self.params),
+            'exists': self.exists,
+        }
+
+
+def search_row(name: str, det: Dict[str, Any], manual_entry: Any, exists: bool) -> SearchRow:
+    rating = manual_entry.get('rating', {}) if isinstance(manual_entry, dict) else {}
+    rating = rating if isinstance(rating, dict) else {}
+    return SearchRow(
+        name=name,
+        score=knowledge_score(det),
+        manual_overall=rating.get('overall_quality'),
+        params=knowledge_params(det),
+        rated=bool(manual_entry),
+        banned=bool(rating.get('banned')),
+        reference=bool(rating.get('is_reference')),
+        exists=exists,
+    )
+
+
+def _facet_value(column: str, key: str) -> Optional[str]:
+    """Filter string of a coded value; None for a missing param."""
+    if column in ("sampler", "scheduler"):
+        return key or None
+    return None if key == "None" else key
+
+
+def _rating_bucket(value: float) -> str:
+    if math.isnan(value):
+        return UNRATED_BUCKET
+    return RATING_BUCKETS[bisect.bisect_right(RATING_BUCKET_EDGES, value)]
+
+
+def _dead_row(name: str) -> SearchRow:
+    return SearchRow(name, None, None, knowledge_params({}), False, False, False, False, live=False)
+
+
+def _make_column(kind: str, values: List[Any]):
+    if np is None:
+        return list(values)
+    dtype = {"f": np.float64, "i": np.int32, "b": np.bool_}[kind]
+    return np.array(values, dtype=dtype)
+
+
+def _grow_column(column, size: int):
+    """Copy of `column` extended to `size` rows (new cells are assigned right after)."""
+    if np is None:
+        return column + [None] * (size - len(column))
+    out = np.empty(size, dtype=column.dtype)
+    out[:len(column)] = column
+    return out
+
+
+class SearchIndex:
+    """Immutable column store over SearchRows; `with_rows` returns an updated copy."""
+
+    def __init__(self, rows: Iterable[SearchRow], text: Optional[TextIndex] = None):
+        self.rows: List[SearchRow] = list(rows)
+        self.positions: Dict[str, int] = {r.name: i for i, r in enumerate(self.rows)}
+        self.vocab: Dict[str, Dict[str, int]] = {c: {} for c in CODED_COLUMNS}
+        self._lower = [r.name.lower() for r in self.rows]
+        values = [self._row_values(r) for r in self.rows]
+        columns = list(zip(*values)) if values else [()] * len(COLUMNS)
+        self.columns = {name: _make_column(kind, col) for (name, kind), col in zip(COLUMNS, columns)}
+        # Prompt text: TextIndex doc id of each row's current text (-1 = none)
+        self.text = text
+        self.text_docs = _make_column("i", [-1] * len(self.rows))
+        self._finish()
+
+    @property
+    def backend(self) -> str:
+        return "python" if isinstance(self.columns["live"], list) else "numpy"
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def _code(self, column: str, value: Any) -> int:
+        vocab = self.vocab[column]
+        key = coded_value(column, value)
+        code = vocab.get(key)
+        if code is None:
+            code = vocab[key] = len(vocab)
+        return code
+
+    def _row_values(self, row: SearchRow) -> Tuple[Any, ...]:
+        p = row.params
+        return (
+            _float(row.score), _sort_key(row.score), _float(row.manual_overall),
+            self._code("fps", p.get("fps")), self._code("width", p.get("width")),
+            self._code("height", p.get("height")), self._code("sampler", p.get("sampler")),
+            self._code("scheduler", p.get("scheduler")),
+            row.rated, row.banned, row.reference, row.exists, row.live,
+        )
+
+    def _finish(self):
+        """Sort rank (rated first, then score descending, then row order) and live count."""
+        c = self.columns
+        n = len(self.rows)
+        if np is not None and not isinstance(c["live"], list):
+            # lexsort is stable: equal keys keep row order (rows start out sorted by name)
+            order = np.lexsort((c["sort_key"], ~c["rated"]))
+            self._rank = np.empty(n, dtype=np.int64)
+            self._rank[order] = np.arange(n, dtype=np.int64)
+            self.live_count = int(np.count_nonzero(c["live"]))
+        else:
+            rated, key = c["rated"], c["sort_key"]
+            order = sorted(range(n), key=lambda i: (not rated[i], key[i]))
+            self._rank = [0] * n
+            for r, i in enumerate(order):
+                self._rank[i] = r
+            self.live_count = sum(1 for v in c["live"] if v)
+        self._name_cache: Tuple[str, Any] = ("", None)
+        self._label_cache: Dict[str, List[Optional[str]]] = {}
+
+    def with_rows(self, changed: Iterable[SearchRow]) -> "SearchIndex":
+        """Copy with `changed` rows replaced (by name) or appended; unchanged columns are copied, not recomputed."""
+        new = SearchIndex.__new__(SearchIndex)
+        new.rows = list(self.rows)
+        new.positions = dict(self.positions)
+        new.vocab = {c: dict(v) for c, v in self.vocab.items()}
+        new._lower = list(self._lower)
+        where, updates = [], []
+        for row in changed:
+            pos = new.positions.get(row.name)
+            if pos is None:
+                pos = new.positions[row.name] = len(new.rows)
+                new.rows.append(row)
+                new._lower.append(row.name.lower())
+            else:
+                new.rows[pos] = row
+            where.append(pos)
+            updates.append(new._row_values(row))
+        size = len(new.rows)
+        new.columns = {}
+        for j, (name, kind) in enumerate(COLUMNS):
+            column = _grow_column(self.columns[name], size)
+            if isinstance(column, list):
+                for pos, values in zip(where, updates):
+                    column[pos] = values[j]
+            elif where:
+                column[np.array(where, dtype=np.int64)] = _make_column(kind, [u[j] for u in updates])
+            new.columns[name] = column
+        new.text = self.text
+        new.text_docs = _grow_column(self.text_docs, size)
+        new.text_docs[len(self.rows):] = [-1] * (size - len(self.rows))
+        new._finish()
+        return new
+
+    def _labels(self, column: str) -> List[Optional[str]]:
+        """Code -> facet value for a coded column."""
+        labels = self._label_cache.get(column)
+        if labels is None or len(labels) != len(self.vocab[column]):
+            labels = [None] * len(self.vocab[column])
+            for key, code in self.vocab[column].items():
+                labels[code] = _facet_value(column, key)
+            self._label_cache[column] = labels
+        return labels
+
+    def _code_counts(self, positions, columns: Tuple[str, ...]) -> List[Tuple[Tuple[int, ...], int]]:
+        """(codes, count) for each distinct combination of `columns` among `positions`."""
+        c = self.columns
+        if isinstance(c["live"], list):
+            cols = [c[col] for col in columns]
+            return list(Counter(tuple(col[i] for col in cols) for i in positions).items())
+        # One bincount over a mixed-radix key instead of a pass per value
+        sizes = [max(len(self.vocab[col]), 1) for col in columns]
+        key = np.zeros(len(positions), dtype=np.int64)
+        for col, size in zip(columns, sizes):
+            key = key * size + c[col][positions]
+        counts = np.bincount(key)
+        out = []
+        for k in np.flatnonzero(counts).tolist():
+            n, codes = int(counts[k]), []
+            for size in reversed(sizes):
+                k, code = divmod(k, size)
+                codes.append(code)
+            out.append((tuple(reversed(codes)), n))
+        return out
+
+    def facets(self, positions, names: Iterable[str] = FACETS) -> Dict[str, List[Dict[str, Any]]]:
+        """Value counts among `positions` for each requested facet, largest first."""
+        out: Dict[str, List[Dict[str, Any]]] = {}
+        for name in names:
+            if name in ("sampler", "scheduler", "fps"):
+                labels = self._labels(name)
+                values = [{"value": labels[codes[0]], "count": n} for codes, n in self._code_counts(positions, (name,))]
+            elif name == "combo":
+                samplers, schedulers = self._labels("sampler"), self._labels("scheduler")
+                values = []
+                for (a, b), n in self._code_counts(positions, ("sampler", "scheduler")):
+                    sampler, scheduler = samplers[a], schedulers[b]
+                    values.append({"value": f"{sampler or '-'}/{scheduler or '-'}", "sampler": sampler,
+                                   "scheduler": scheduler, "count": n})
+            elif name == "resolution":
+                widths, heights = self._labels("width"), self._labels("height")
+                values = []
+                for (w, h), n in self._code_counts(positions, ("width", "height")):
+                    width, height = widths[w], heights[h]
+                    values.append({"value": f"{width or '-'}x{height or '-'}", "width": width,
+                                   "height": height, "count": n})
+            elif name == "rating":
+                overall = self.columns["manual_overall"]
+                if isinstance(overall, list):
+                    counts = Counter(_rating_bucket(overall[i]) for i in positions)
+                else:
+                    vals = overall[positions]
+                    rated = ~np.isnan(vals)
+                    buckets = np.bincount(np.digitize(vals[rated], RATING_BUCKET_EDGES), minlength=len(RATING_BUCKETS))
+                    counts = {label: int(n) for label, n in zip(RATING_BUCKETS, buckets.tolist())}
+                    counts[UNRATED_BUCKET] = int(len(vals) - np.count_nonzero(rated))
+                values = [{"value": label, "count": counts.get(label, 0)}
+                          for label in RATING_BUCKETS + (UNRATED_BUCKET,) if counts.get(label, 0)]
+            else:
+                continue
+            values.sort(key=lambda v: (-v["count"], str(v["value"])))
+            out[name] = values
+        return out
+
+    def set_text_doc(self, pos: int, doc: int):
+        """Attach a TextIndex doc to a row; only while the index is being built, before it is shared."""
+        self.text_docs[pos] = doc
+
+    def match_text(self, query: str):
+        """(row positions, BM25 scores) of rows whose current prompt text matches every term of `query`."""
+        if self.text is None:
+            return ([], []) if isinstance(self.text_docs, list) else (np.empty(0, dtype=np.int64), np.empty(0))
+        docs, rows, scores = self.text.search(query)
+        n = len(self.rows)
+        if isinstance(self.text_docs, list):
+            hits = [(r, s) for d, r, s in zip(docs, rows, scores) if r < n and self.text_docs[r] == d]
+            return [r for r, _ in hits], [s for _, s in hits]
+        if np is None or not isinstance(rows, np.ndarray):
+            rows, docs, scores = np.asarray(rows, dtype=np.int64), np.asarray(docs), np.asarray(scores)
+        inside = rows < n
+        rows, docs, scores = rows[inside], docs[inside], scores[inside]
+        current = self.text_docs[rows] == docs
+        return rows[current].astype(np.int64), scores[current]
+
+    def _name_mask(self, name_sub: str):
+        """Rows whose lowercased name contains `name_sub` (the last one is cached: search + relevance ask twice)."""
+        cached_sub, mask = self._name_cache
+        if mask is None or cached_sub != name_sub:
+            if isinstance(self.text_docs, list):
+                mask = [name_sub in s for s in self._lower]
+            else:
+                mask = np.fromiter((name_sub in s for s in self._lower), dtype=bool, count=len(self._lower))
+            self._name_cache = (name_sub, mask)
+        return mask
+
+    def relevance(self, name_sub: str, text_rows, text_scores):
+        """Per-row relevance for a `q` search: prompt BM25 score + NAME_MATCH_BOOST for name hits."""
+        if isinstance(self.text_docs, list):
+            rel = dict(zip(text_rows, text_scores))
+            if name_sub:
+                for i, hit in enumerate(self._name_mask(name_sub)):
+                    if hit:
+                        rel[i] = rel.get(i, 0.0) + NAME_MATCH_BOOST
+            return rel
+        rel = np.zeros(len(self.rows))
+        rel[text_rows] = text_scores
+        if name_sub:
+            rel += NAME_MATCH_BOOST * self._name_mask(name_sub)
+        return rel
+
+    def search(self, offset: int = 0, limit: int = 100, text_query: str = "", **filters):
+        """(matching positions, page rows) for /api/search.
+
+        Without `text_query` the order is rated first, then score; with it `name_sub`
+        and the prompt text match are OR-ed and ordered by relevance.
+        """
+        relevance = None
+        if text_query:
+            text_rows, text_scores = self.match_text(text_query)
+            relevance = self.relevance(filters.get("name_sub", ""), text_rows, text_scores)
+            filters["text_rows"] = text_rows
+        positions = self.select(**filters)
+        return positions, self.page(positions, offset, limit, relevance)
+
+    def select(self, name_sub: str = "", rated: str = "all", banned: str = "", reference: str = "",
+               min_score: float = -1, min_overall: float = -1, text_rows=None, **coded: str):
+        """Row positions matching the /api/search filters (unordered).
+
+        `coded` takes fps / width / height / sampler / scheduler filter strings;
+        empty strings and negative minimums mean "no filter". With `text_rows`
+        (from match_text) a row passes the `name_sub` filter by either.
+        """
+        c = self.columns
+        flags = []
+        if rated == 'true':
+            flags.append(("rated", True))
+        elif rated == 'false':
+            flags.append(("rated", False))
+        if banned:
+            flags.append(("banned", banned.lower() == 'true'))
+        if reference:
+            flags.append(("reference", reference.lower() == 'true'))
+        floors = [(col, v) for col, v in (("score", min_score), ("manual_overall", min_overall)) if v >= 0]
+        codes = [(col, self.vocab[col].get(value, MISSING_CODE))
+                 for col, value in coded.items() if col in CODED_COLUMNS and value]
+
+        if isinstance(c["live"], list):
+            idx = [i for i, live in enumerate(c["live"]) if live]
+            if text_rows is not None:
+                names = self._name_mask(name_sub) if name_sub else None
+                text = set(text_rows)
+                idx = [i for i in idx if i in text or (names is not None and names[i])]
+            elif name_sub:
+                names = self._name_mask(name_sub)
+                idx = [i for i in idx if names[i]]
+            for col, want in flags:
+                values = c[col]
+                idx = [i for i in idx if values[i] == want]
+            for col, floor in floors:
+                values = c[col]
+                idx = [i for i in idx if values[i] >= floor]  # NaN compares False
+            for col, code in codes:
+                values = c[col]
+                idx = [i for i in idx if values[i] == code]
+            return idx
+
+        mask = c["live"].copy()
+        if text_rows is not None:
+            matched = self._name_mask(name_sub).copy() if name_sub else np.zeros(len(mask), dtype=bool)
+            matched[text_rows] = True
+            mask &= matched
+        elif name_sub:
+            mask &= self._name_mask(name_sub)
+        for col, want in flags:
+            mask &= c[col] if want else ~c[col]
+        with np.errstate(invalid="ignore"):
+            for col, floor in floors:
+                mask &= c[col] >= floor
+        for col, code in codes:
+            mask &= c[col] == code
+        return np.flatnonzero(mask)
+
+    def page(self, positions, offset: int, limit: int, relevance=None) -> List[SearchRow]:
+        """Rows `offset:offset+limit` of `positions` in search order (or by `relevance`), selecting only the top k."""
+        offset = max(0, int(offset))
+        k = offset + max(0, int(limit))
+        if k <= offset or offset >= len(positions):
+            return []
+        rank = self._rank
+        if isinstance(rank, list):
+            if relevance is not None:
+                top = heapq.nsmallest(k, positions, key=lambda i: (-relevance.get(i, 0.0), rank[i]))
+            else:
+                top = heapq.nsmallest(k, positions, key=rank.__getitem__)
+            return [self.rows[i] for i in top[offset:]]
+        if relevance is not None:
+            neg = -relevance[positions]
+            if k < len(positions):
+                # Keep everything up to the k-th relevance (ties included), then order exactly
+                keep = neg <= np.partition(neg, k - 1)[k - 1]
+                positions, neg = positions[keep], neg[keep]
+            positions = positions[np.lexsort((rank[positions], neg))]
+            return [self.rows[i] for i in positions[offset:k].tolist()]
+        if k < len(positions):
+            positions = positions[np.argpartition(rank[positions], k - 1)[:k]]
+        positions = positions[np.argsort(rank[positions])]
+        return [self.rows[i] for i in positions[offset:k].tolist()]
+
+
+class SearchIndexUpdater:
+    """Keeps one SearchIndex in step with knowledge history, ratings and the output listing.
+
+    `index(token, ...)` returns the cached index while `token` (versions of
+    the inputs) is unchanged; otherwise it recomputes only the rows that can
+    differ: rated/unrated names whose manual entry changed, files added or
+    removed, and names that new or edited history entries match (by file
+    name, or by timestamp for names without an exact match). History is
+    append-only apart from the rating fold, so only the appended tail and the
+    entries of re-rated names are checked; every FULL_COMPARE_EVERY-th update
+    compares all entries to catch other rewrites. History that shrank or was
+    mostly rewritten falls back to a full rebuild. Prompt text of a
+    recomputed row is indexed again only if it changed.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._current: Tuple[Any, Optional[SearchIndex]] = (None, None)
+        self._history: List[Dict[str, Any]] = []
+        # History as of the last full build or full compare (what the next full compare starts from)
+        self._checked_history: List[Dict[str, Any]] = []
+        self._manual: Dict[str, Any] = {}
+        self._files: frozenset = frozenset()
+        # Names matched by timestamp or not at all -> their `_<ts>_` (or None)
+        self._unmatched: Dict[str, Optional[int]] = {}
+        # name -> indexed (field, text) pairs; rows recomputed in this update -> their new text
+        self._texts: Dict[str, Tuple[Tuple[str, str], ...]] = {}
+        self._pending_text: Dict[str, Tuple[Tuple[str, str], ...]] = {}
+        self._since_full_compare = 0
+        self.full_builds = 0
+        self.full_compares = 0
+        self.updates = 0
+        self.rows_updated = 0
+        self.last_build_ms = 0.0
+
+    def index(self, token: Hashable, history: List[Dict[str, Any]], manual: Mapping[str, Any],
+              files: Iterable[str], lookup: Callable[[str], Tuple[Dict[str, Any], Dict[str, Any]]]) -> SearchIndex:
+        """Index for this state; `lookup(name)` -> (knowledge entry, match_info) as KnowledgeIndex.lookup."""
+        current_token, current = self._current
+        if current is not None and current_token == token:
+            return current
+        with self._lock:
+            current_token, current = self._current
+            if current is not None and current_token == token:
+                return current
+            t0 = time.perf_counter()
+            history = history if isinstance(history, list) else []
+            manual = dict(manual)
+            files = frozenset(files)
+            full_builds = self.full_builds
+            if current is None or len(history) < len(self._history):
+                index = self._rebuild(manual, files, lookup)
+            else:
+                index = self._update(current, history, manual, files, lookup)
+            if self.full_builds != full_builds:
+                self._checked_history = history
+            self._history = history
+            self._manual = manual
+            self._files = files
+            self._current = (token, index)
+            self.last_build_ms = (time.perf_counter() - t0) * 1000
+            return index
+
+    def _changed_entries(self, history: List[Dict[str, Any]], rated: Iterable[str],
+                         lookup) -> Optional[List[Dict[str, Any]]]:
+        """Entries appended or edited since the indexed history; None -> rebuild.
+
+        The agent and the QA runner only append and the rating fold only edits
+        the entries of `rated` videos, so those are all that is returned, except
+        on every FULL_COMPARE_EVERY-th update, which compares each entry of
+        the history last compared with its new version (both returned when
+        they differ).
+        """
+        if history is self._history:
+            return []
+        if len(history) < len(self._history):
+            return None
+        self._since_full_compare += 1
+        if self._since_full_compare < FULL_COMPARE_EVERY:
+            changed = history[len(self._history):]
+            for name in rated:
+                entry = lookup(name)[0]
+                if entry:
+                    changed.append(entry)
+            return changed
+        self._since_full_compare = 0
+        self.full_compares += 1
+        old = self._checked_history
+        if len(history) < len(old):
+            return None
+        changed = []
+        for i, entry in enumerate(old):
+            new = history[i]
+            # Same object: document not reloaded; otherwise compare contents (a reload re-parses every entry)
+            if new is not entry and new != entry:
+                changed.append(entry)
+                changed.append(new)
+        if len(changed) > len(old):
+            return None
+        changed.extend(history[len(old):])
+        self._checked_history = history
+        return changed
+
+    def _row(self, name: str, manual: Dict[str, Any], files: frozenset, lookup) -> SearchRow:
+        det, match_info = lookup(name)
+        if match_info.get('method') == 'exact_filename':
+            self._unmatched.pop(name, None)
+        else:
+            self._unmatched[name] = _name_timestamp(name)
+        self._pending_text[name] = entry_text(det or {})
+        return search_row(name, det or {}, manual.get(name), name in files)
+
+    def _attach_text(self, index: SearchIndex):
+        for name, text in self._pending_text.items():
+            if name in self._texts and self._texts[name] == text:
+                continue
+            pos = index.positions[name]
+            index.set_text_doc(pos, index.text.add(pos, text) if text else -1)
+            self._texts[name] = text
+        self._pending_text = {}
+
+    def _rebuild(self, manual: Dict[str, Any], files: frozenset, lookup) -> SearchIndex:
+        self._unmatched = {}
+        self._texts = {}
+        self._pending_text = {}
+        names = sorted(files.union(manual))
+        index = SearchIndex((self._row(name, manual, files, lookup) for name in names), TextIndex())
+        self._attach_text(index)
+        self.full_builds += 1
+        self.rows_updated += len(names)
+        return index
+
+    def _update(self, current: SearchIndex, history: List[Dict[str, Any]], manual: Dict[str, Any],
+                files: frozenset, lookup) -> SearchIndex:
+        rated = set()
+        previous = self._manual
+        if manual is not previous:
+            for name, entry in manual.items():
+                if previous.get(name, _MISSING) != entry:
+                    rated.add(name)
+            rated.update(name for name in previous if name not in manual)
+        changed = self._changed_entries(history, rated, lookup)
+        if changed is None:
+            return self._rebuild(manual, files, lookup)
+        dirty = rated | files.symmetric_difference(self._files)
+        if changed:
+            dirty |= self._affected(changed, files.union(manual))
+
+        rows, dead = [], []
+        for name in dirty:
+            if name in files or name in manual:
+                rows.append(self._row(name, manual, files, lookup))
+            elif name in current.positions:
+                self._unmatched.pop(name, None)
+                self._texts.pop(name, None)
+                rows.append(_dead_row(name))
+                dead.append(name)
+        if not rows:
+            return current
+        index = current.with_rows(rows)
+        for name in dead:
+            index.set_text_doc(index.positions[name], -1)
+        self._attach_text(index)
+        if (len(index) - index.live_count > DEAD_ROWS_REBUILD_RATIO * len(index)
+                or len(index.text) > STALE_TEXT_REBUILD_RATIO * max(index.live_count, 1000)):
+            return self._rebuild(manual, files, lookup)
+        self.updates += 1
+        self.rows_updated += len(rows)
+        return index
+
+    def _affected(self, entries: List[Dict[str, Any]], names: frozenset) -> set:
+        """Names whose knowledge match may involve one of `entries`: by file name, or by timestamp if unmatched."""
+        suffixes, stamps = set(), []
+        for entry in entries:
+            if not isinstance(entry, dict):
+                continue
+            path = entry_video_path(entry)
+            if isinstance(path, str) and path:
+                base = os.path.basename(path)
+                suffixes.update(base[i:] for i in range(len(base)))
+            ts = entry.get("timestamp", 0)
+            if isinstance(ts, (int, float)) and not isinstance(ts, bool) and ts > 0:
+                stamps.append(ts)
+        stamps.sort()
+        hits = suffixes.intersection(names)
+        for name, ts in self._unmatched.items():
+            if ts is not None and stamps:
+                i = bisect.bisect_right(stamps, ts - TIMESTAMP_MATCH_WINDOW_S)
+                if i < len(stamps) and stamps[i] < ts + TIMESTAMP_MATCH_WINDOW_S:
+                    hits.add(name)
+        return hits
+
+    def stats(self) -> Dict[str, Any]:
+        _token, index = self._current
+        return {
+            "backend": index.backend if index is not None else ("numpy" if np is not None else "python"),
+            "rows": len(index) if index is not None else 0,
+            "live_rows": index.live_count if index is not None else 0,
+            "full_builds": self.full_builds,
+            "full_compares": self.full_compares,
+            "updates": self.updates,
+            "rows_updated": self.rows_updated,
+            "text": index.text.stats() if index is not None and index.text is not None else None,
+            "last_build_ms": round(self.last_build_ms, 2),
+        }
+
+
+_updaters: Dict[Tuple[str, str], SearchIndexUpdater] = {}
+_updaters_lock = threading.Lock()
+
+
+def get_search_index_updater(state_dir: str, video_dir: str) -> SearchIndexUpdater:
+    """Process-wide updater for one (state dir, output dir) pair."""
+    key = (os.path.abspath(state_dir), os.path.abspath(video_dir))
+    updater = _updaters.get(key)
+    if updater is None:
+        with _updaters_lock:
+            updater = _updaters.get(key)
+            if updater is None:
+                updater = SearchIndexUpdater()
+                _updaters[key] = updater
+    return updater
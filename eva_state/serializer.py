@@ -0,0 +1,182 @@
+"""Pluggable encoding of the whole-document state files.
+
+knowledge.json, manual_ratings.json, review_queue.json, bandit_state.json,
+reference_params.json, ban_history.json and the small bookkeeping files
+(segment manifest, journal checkpoint) used to be written with stdlib
+``json.dump(..., indent=2)``: the indentation alone is a large share of
+knowledge.json and every writer and reader pays the pure-Python encoder.
+
+``STATE_FORMAT`` selects the writer:
+
+  json     – compact stdlib JSON (default)
+  pretty   – stdlib JSON with ``indent=2``, the old layout, for hand editing
+  orjson   – JSON produced by orjson (values orjson rejects fall back to
+             stdlib; NaN/Infinity become ``null``)
+  msgpack  – MessagePack; not readable by plain JSON tools
+  auto     – orjson when installed, else json
+
+orjson and msgpack are optional; when the selected one is not installed the
+writer falls back to compact JSON with a warning. Readers never look at
+``STATE_FORMAT``: `loads` detects the format from the first byte (a
+MessagePack map/array header vs JSON text), so files written before the
+switch or by another process with a different setting keep working, and JSON
+is parsed with orjson when it is available (integers beyond 64 bits then come
+back as floats). File names stay ``*.json``.
+
+Converting existing state (e.g. back to JSON for external tools; with the
+agent and the review server stopped)::
+
+    python -m eva_state.serializer convert <state_dir> [--format json]
+    python -m eva_state.serializer info <state_dir>
+"""
+import os
+import gc
+import sys
+import json
+import logging
+from typing import Any, Dict, List, Optional
+
+try:
+    import orjson
+except ImportError:  # optional: stdlib json only
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # optional: MessagePack files cannot be read or written
+    msgpack = None
+
+log = logging.getLogger("eva_state")
+
+FORMATS = ("json", "pretty", "orjson", "msgpack", "auto")
+STATE_FORMAT = os.environ.get("STATE_FORMAT", "json").strip().lower() or "json"
+
+# Whole-document files under auto_state (relative paths)
+STATE_FILES = (
+    "knowledge.json", "manual_ratings.json", "review_queue.json", "bandit_state.json",
+    "reference_params.json", "ban_history.json", os.path.join("knowledge", "manifest.json"),
+)
+
+# Documents at least this large are decoded with the cyclic GC paused
+GC_PAUSE_BYTES = 1 << 20
+# First byte of a MessagePack fixmap/fixarray/map16/map32/array16/array32
+_MSGPACK_HEADS = frozenset(range(0x80, 0xA0)) | {0xDC, 0xDD, 0xDE, 0xDF}
+_ORJSON_OPTIONS = (orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY) if orjson is not None else 0
+_warned = set()
+
+
+def available_formats() -> List[str]:
+    return [f for f in FORMATS if not (f == "orjson" and orjson is None) and not (f == "msgpack" and msgpack is None)]
+
+
+def resolve_format(fmt: Optional[str] = None) -> str:
+    """Effective writer format for ``fmt`` (default STATE_FORMAT), falling back to json."""
+    fmt = (fmt or STATE_FORMAT).lower()
+    if fmt == "auto":
+        return "orjson" if orjson is not None else "json"
+    if fmt not in FORMATS or (fmt == "orjson" and orjson is None) or (fmt == "msgpack" and msgpack is None):
+        if fmt not in _warned:
+            _warned.add(fmt)
+            log.warning(f"STATE_FORMAT={fmt} is not available (have: {', '.join(available_formats())}), writing json")
+        return "json"
+    return fmt
+
+
+def dumps(value: Any, fmt: Optional[str] = None) -> bytes:
+    """Encode a state document in ``fmt`` (default STATE_FORMAT)."""
+    fmt = resolve_format(fmt)
+    if fmt == "orjson":
+        try:
+            return orjson.dumps(value, option=_ORJSON_OPTIONS)
+        except TypeError:
+            # >64-bit ints and other values orjson does not take
+            pass
+    elif fmt == "msgpack":
+        return msgpack.packb(value, use_bin_type=True)
+    elif fmt == "pretty":
+        return json.dumps(value, ensure_ascii=False, indent=2).encode("utf-8")
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def detect_format(data: bytes) -> str:
+    """"msgpack" or "json" from the first byte of an encoded document."""
+    return "msgpack" if data and data[0] in _MSGPACK_HEADS else "json"
+
+
+def _decode(data: bytes) -> Any:
+    if detect_format(data) == "msgpack":
+        if msgpack is None:
+            raise ValueError("state file is MessagePack but the msgpack package is not installed")
+        return msgpack.unpackb(data, raw=False, strict_map_key=False)
+    if orjson is not None:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            # BOM, NaN/Infinity from stdlib writers, or really broken: stdlib decides
+            pass
+    return json.loads(data.decode("utf-8-sig"))
+
+
+def loads(data: bytes) -> Any:
+    """Decode a state document written in any format (auto-detected)."""
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    if len(data) < GC_PAUSE_BYTES or not gc.isenabled():
+        return _decode(data)
+    # Decoding a large history allocates millions of containers, and the cyclic
+    # collector would rescan them again and again (about 40% of the load time).
+    gc.disable()
+    try:
+        return _decode(data)
+    finally:
+        gc.enable()
+
+
+def load_file(path: str) -> Any:
+    """Read and decode a state file; raises FileNotFoundError / ValueError like json.load."""
+    with open(path, "rb") as f:
+        return loads(f.read())
+
+
+def file_format(path: str) -> Optional[str]:
+    try:
+        with open(path, "rb") as f:
+            return detect_format(f.read(1))
+    except FileNotFoundError:
+        return None
+
+
+def convert(state_dir: str, fmt: Optional[str] = None) -> Dict[str, Dict[str, Any]]:
+    """Re-encode every existing state file under state_dir in ``fmt``; returns per-file sizes."""
+    from eva_state.rating_journal import atomic_write_json
+
+    fmt = resolve_format(fmt)
+    done = {}
+    for name in STATE_FILES:
+        path = os.path.join(state_dir, name)
+        if not os.path.exists(path):
+            continue
+        before = os.path.getsize(path)
+        atomic_write_json(path, load_file(path), fmt=fmt)
+        done[name] = {"bytes_before": before, "bytes_after": os.path.getsize(path), "format": fmt}
+    return done
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    import argparse
+    ap = argparse.ArgumentParser(prog="python -m eva_state.serializer")
+    ap.add_argument("command", choices=("convert", "info"))
+    ap.add_argument("state_dir")
+    ap.add_argument("--format", choices=FORMATS, help="convert: target format (default STATE_FORMAT)")
+    args = ap.parse_args(argv)
+    if args.command == "convert":
+        print(json.dumps(convert(args.state_dir, args.format)))
+    else:
+        paths = {name: os.path.join(args.state_dir, name) for name in STATE_FILES}
+        print(json.dumps({name: {"format": file_format(path), "bytes": os.path.getsize(path)}
+                          for name, path in paths.items() if os.path.exists(path)}))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
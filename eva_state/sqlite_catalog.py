@@ -0,0 +1,597 @@
+"""Optional SQLite catalog for generations, ratings, bans and the review queue.
+
+The JSON state files are whole documents: the agent rewrites all of
+knowledge.json to append one generation, the journal compactor rewrites
+manual_ratings.json / knowledge.json / ban_history.json to fold a handful of
+ratings. With the catalog enabled both processes write rows instead (one
+short WAL transaction per generation / per folded batch) and readers look
+rows up through indexes (video basename, timestamp, sampler/scheduler,
+resolution, score).
+
+Enabling: ``STATE_BACKEND=sqlite`` (the JSON files are migrated once on first
+open), or simply an existing ``catalog.sqlite3`` in the state directory, so
+the agent and the server switch together. ``STATE_BACKEND=json`` forces the
+JSON files. ``bandit_state.json`` and ``reference_params.json`` stay JSON.
+
+Compatibility: ``export_json`` regenerates knowledge.json, manual_ratings.json,
+review_queue.json and ban_history.json from the rows (``STATE_EXPORT_JSON=1``
+does it after every journal compaction), and the module is also a CLI::
+
+    python -m eva_state.sqlite_catalog migrate <state_dir> [--force]
+    python -m eva_state.sqlite_catalog export <state_dir>
+"""
+import os
+import sys
+import json
+import time
+import logging
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, List, Optional
+
+from eva_state.prompt_store import get_prompt_store
+from eva_state.rating_journal import atomic_write_json, _load_json
+
+log = logging.getLogger("eva_state")
+
+CATALOG_FILENAME = "catalog.sqlite3"
+QUEUE_STATUSES = ("pending", "in_review", "completed")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key   TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS generations (
+    id         INTEGER PRIMARY KEY,
+    video_name TEXT,
+    timestamp  REAL,
+    sampler    TEXT,
+    scheduler  TEXT,
+    width      INTEGER,
+    height     INTEGER,
+    score      REAL,
+    doc        TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS generations_video_name ON generations(video_name);
+CREATE INDEX IF NOT EXISTS generations_timestamp ON generations(timestamp);
+CREATE INDEX IF NOT EXISTS generations_combo ON generations(sampler, scheduler);
+CREATE INDEX IF NOT EXISTS generations_resolution ON generations(width, height);
+CREATE INDEX IF NOT EXISTS generations_score ON generations(score);
+CREATE TABLE IF NOT EXISTS params (
+    generation_id INTEGER NOT NULL REFERENCES generations(id) ON DELETE CASCADE,
+    pos           INTEGER NOT NULL,
+    name          TEXT NOT NULL,
+    value         TEXT NOT NULL,
+    num           REAL,
+    PRIMARY KEY (generation_id, pos)
+);
+CREATE INDEX IF NOT EXISTS params_name_num ON params(name, num);
+CREATE TABLE IF NOT EXISTS metrics (
+    generation_id INTEGER NOT NULL REFERENCES generations(id) ON DELETE CASCADE,
+    pos           INTEGER NOT NULL,
+    name          TEXT NOT NULL,
+    value         TEXT NOT NULL,
+    num           REAL,
+    PRIMARY KEY (generation_id, pos)
+);
+CREATE INDEX IF NOT EXISTS metrics_name_num ON metrics(name, num);
+CREATE TABLE IF NOT EXISTS ratings (
+    video_name TEXT PRIMARY KEY,
+    overall    REAL,
+    rated_at   TEXT,
+    entry      TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ratings_overall ON ratings(overall);
+CREATE TABLE IF NOT EXISTS bans (
+    id         INTEGER PRIMARY KEY,
+    timestamp  REAL,
+    video_name TEXT,
+    combo_key  TEXT,
+    params     TEXT
+);
+CREATE INDEX IF NOT EXISTS bans_combo_key ON bans(combo_key);
+CREATE TABLE IF NOT EXISTS review_queue (
+    id           INTEGER PRIMARY KEY,
+    video_id     TEXT,
+    status       TEXT NOT NULL,
+    priority     INTEGER,
+    generated_at TEXT,
+    item         TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS review_queue_status ON review_queue(status, priority);
+"""
+
+_KNOWLEDGE_DEFAULT = {"best_score": 0, "best_params": {}, "history": []}
+
+
+def _dumps(value: Any) -> str:
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+
+def _num(value: Any) -> Optional[float]:
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return None
+    return float(value)
+
+
+def _int_or_none(value: Any) -> Optional[int]:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def entry_video_name(entry: Dict[str, Any]) -> Optional[str]:
+    """Basename of the video of a knowledge history entry (agent: 'video', old server: 'video_path')."""
+    path = entry.get("video") or entry.get("video_path")
+    return os.path.basename(path) if isinstance(path, str) and path else None
+
+
+def _rating_overall(entry: Any) -> Optional[float]:
+    rating = entry.get("rating") if isinstance(entry, dict) else None
+    return _num(rating.get("overall_quality")) if isinstance(rating, dict) else None
+
+
+class SQLiteCatalog:
+    """Row store shared by the agent and the review server (one connection per thread)."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._docs_lock = threading.Lock()
+        self._docs_build_lock = threading.Lock()
+        self._docs_rev: Optional[int] = None
+        self._docs: Optional[Dict[str, Any]] = None
+        # What the cached documents were built from: migrated_at and the last row id per table,
+        # and video basename -> (history position, generation id) of its first entry
+        self._docs_marks: Optional[Dict[str, Any]] = None
+        self._docs_first: Dict[str, tuple] = {}
+        db = self._conn()
+        db.executescript(SCHEMA)
+        db.execute("INSERT OR IGNORE INTO meta(key, value) VALUES ('rev', '0')")
+
+    # ---- connections / transactions ----
+    def _conn(self) -> sqlite3.Connection:
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30.0, isolation_level=None, check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.execute("PRAGMA foreign_keys=ON")
+            self._local.db = db
+        return db
+
+    @contextmanager
+    def _write(self):
+        """One IMMEDIATE transaction; bumps `rev` so readers know their cached documents are stale."""
+        db = self._conn()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            yield db
+            db.execute("UPDATE meta SET value = CAST(value AS INTEGER) + 1 WHERE key = 'rev'")
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+
+    def rev(self) -> int:
+        row = self._conn().execute("SELECT value FROM meta WHERE key = 'rev'").fetchone()
+        return int(row[0]) if row else 0
+
+    # ---- generations ----
+    def _insert_generation(self, db: sqlite3.Connection, entry: Dict[str, Any]) -> int:
+        # Dict params/metrics go to their own tables; anything else stays in the document as is
+        params = entry.get("params") if isinstance(entry.get("params"), dict) else None
+        metrics = entry.get("metrics") if isinstance(entry.get("metrics"), dict) else None
+        doc = {k: v for k, v in entry.items()
+               if not (k == "params" and params is not None) and not (k == "metrics" and metrics is not None)}
+        params = params or {}
+        metrics = metrics or {}
+        combo = entry.get("combo") if isinstance(entry.get("combo"), (list, tuple)) else []
+        score = _num(entry.get("score"))
+        if score is None:
+            score = _num(metrics.get("overall"))
+        cur = db.execute(
+            "INSERT INTO generations(video_name, timestamp, sampler, scheduler, width, height, score, doc) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (entry_video_name(entry), _num(entry.get("timestamp")),
+             params.get("sampler") or (combo[0] if len(combo) > 0 else None),
+             params.get("scheduler") or (combo[1] if len(combo) > 1 else None),
+             _int_or_none(params.get("width")), _int_or_none(params.get("height")), score, _dumps(doc)),
+        )
+        gid = cur.lastrowid
+        db.executemany("INSERT INTO params(generation_id, pos, name, value, num) VALUES (?, ?, ?, ?, ?)",
+                       [(gid, i, k, _dumps(v), _num(v)) for i, (k, v) in enumerate(params.items())])
+        db.executemany("INSERT INTO metrics(generation_id, pos, name, value, num) VALUES (?, ?, ?, ?, ?)",
+                       [(gid, i, k, _dumps(v), _num(v)) for i, (k, v) in enumerate(metrics.items())])
+        return gid
+
+    def add_generation(self, entry: Dict[str, Any], best: Optional[Dict[str, Any]] = None) -> int:
+        """Append one history entry (and optionally update best_score/best_params) in one transaction."""
+        with self._write() as db:
+            gid = self._insert_generation(db, entry)
+            if best:
+                self._set_knowledge_meta(db, best)
+        return gid
+
+    def _prompts(self):
+        return get_prompt_store(os.path.dirname(os.path.abspath(self.path)))
+
+    def _entries(self, rows: Iterable[tuple]) -> List[Dict[str, Any]]:
+        """History entries of (id, doc) rows, with params/metrics joined and prompt references expanded."""
+        rows = list(rows)
+        if not rows:
+            return []
+        ids = [r[0] for r in rows]
+        params: Dict[int, Dict[str, Any]] = {}
+        metrics: Dict[int, Dict[str, Any]] = {}
+        db = self._conn()
+        for table, target in (("params", params), ("metrics", metrics)):
+            for start in range(0, len(ids), 900):
+                chunk = ids[start:start + 900]
+                cur = db.execute(
+                    f"SELECT generation_id, name, value FROM {table} "
+                    f"WHERE generation_id IN ({','.join('?' * len(chunk))}) ORDER BY generation_id, pos", chunk)
+                for gid, name, value in cur:
+                    target.setdefault(gid, {})[name] = json.loads(value)
+        prompts = self._prompts()
+        out = []
+        for gid, doc in rows:
+            entry = json.loads(doc)
+            if "params" not in entry:
+                entry["params"] = params.get(gid, {})
+            if "metrics" not in entry:
+                entry["metrics"] = metrics.get(gid, {})
+            out.append(prompts.expand(entry) if prompts is not None else entry)
+        return out
+
+    def generation(self, video_name: str) -> Optional[Dict[str, Any]]:
+        """First history entry for a video basename (index lookup)."""
+        rows = self._conn().execute(
+            "SELECT id, doc FROM generations WHERE video_name = ? ORDER BY id LIMIT 1", (video_name,)).fetchall()
+        entries = self._entries(rows)
+        return entries[0] if entries else None
+
+    def history(self) -> List[Dict[str, Any]]:
+        return self._entries(self._conn().execute("SELECT id, doc FROM generations ORDER BY id"))
+
+    def _update_generation_doc(self, db: sqlite3.Connection, video_name: str, changes: Dict[str, Any]) -> bool:
+        row = db.execute("SELECT id, doc FROM generations WHERE video_name = ? ORDER BY id LIMIT 1",
+                         (video_name,)).fetchone()
+        if row is None:
+            return False
+        doc = json.loads(row[1])
+        doc.update(changes)
+        db.execute("UPDATE generations SET doc = ? WHERE id = ?", (_dumps(doc), row[0]))
+        return True
+
+    # ---- knowledge meta (best_score, best_params, ...) ----
+    def _set_knowledge_meta(self, db: sqlite3.Connection, fields: Dict[str, Any]):
+        db.executemany("INSERT OR REPLACE INTO meta(key, value) VALUES (?, ?)",
+                       [(f"knowledge.{k}", _dumps(v)) for k, v in fields.items() if k != "history"])
+
+    def knowledge_meta(self) -> Dict[str, Any]:
+        cur = self._conn().execute("SELECT key, value FROM meta WHERE key LIKE 'knowledge.%' ORDER BY rowid")
+        meta = {key[len("knowledge."):]: json.loads(value) for key, value in cur}
+        return meta or {k: v for k, v in _KNOWLEDGE_DEFAULT.items() if k != "history"}
+
+    def set_knowledge_meta(self, **fields):
+        with self._write() as db:
+            self._set_knowledge_meta(db, fields)
+
+    # ---- ratings / bans ----
+    def manual_ratings(self) -> Dict[str, Any]:
+        cur = self._conn().execute("SELECT video_name, entry FROM ratings ORDER BY rowid")
+        return {name: json.loads(entry) for name, entry in cur}
+
+    def rating(self, video_name: str) -> Optional[Dict[str, Any]]:
+        row = self._conn().execute("SELECT entry FROM ratings WHERE video_name = ?", (video_name,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _put_rating(self, db: sqlite3.Connection, video_name: str, entry: Dict[str, Any], replace: bool = True):
+        db.execute(
+            f"INSERT {'OR REPLACE' if replace else 'OR IGNORE'} INTO ratings(video_name, overall, rated_at, entry) "
+            "VALUES (?, ?, ?, ?)",
+            (video_name, _rating_overall(entry), (entry or {}).get("rated_at"), _dumps(entry)))
+
+    def ban_history(self) -> List[Dict[str, Any]]:
+        cur = self._conn().execute("SELECT timestamp, video_name, combo_key, params FROM bans ORDER BY id")
+        return [{"timestamp": ts, "video_name": name, "combo_key": key,
+                 "params": json.loads(params) if params is not None else None} for ts, name, key, params in cur]
+
+    def apply_review(self, records: List[Dict[str, Any]]):
+        """Fold rating-journal records into rows (same semantics as the JSON fold), one transaction."""
+        with self._write() as db:
+            meta = self.knowledge_meta()
+            best_score = meta.get("best_score", 0)
+            best_changed = False
+            for rec in records:
+                op = rec.get("op")
+                if op == "rate":
+                    video_name = rec["video"]
+                    self._put_rating(db, video_name, rec["entry"])
+                    rating = rec["entry"].get("rating") or {}
+                    overall_score = rating.get("overall_quality", 0)
+                    if overall_score > best_score:
+                        best_score = overall_score
+                        meta["best_score"] = overall_score
+                        best_changed = True
+                        details = self.generation(video_name)
+                        if details:
+                            meta["best_params"] = {
+                                "prompt": details.get("prompt", ""),
+                                "params": details.get("params", {}),
+                                "combo": details.get("combo", {}),
+                                "manual_rating": rating,
+                            }
+                    self._update_generation_doc(db, video_name, {
+                        "manual_rating": rating,
+                        "manual_rated_at": rec["entry"].get("rated_at") or time.strftime("%Y-%m-%d %H:%M:%S"),
+                    })
+                elif op == "ban":
+                    if rec.get("entry") and rec.get("video"):
+                        # Ban marks a video as handled only if nobody rated it first
+                        self._put_rating(db, rec["video"], rec["entry"], replace=False)
+                    db.execute("INSERT INTO bans(timestamp, video_name, combo_key, params) VALUES (?, ?, ?, ?)",
+                               (rec.get("ts"), rec.get("video"), rec.get("combo_key"),
+                                _dumps(rec.get("params")) if rec.get("params") is not None else None))
+            if best_changed:
+                self._set_knowledge_meta(db, {"best_score": meta["best_score"],
+                                              "best_params": meta.get("best_params", {})})
+
+    # ---- review queue ----
+    def queue_add(self, item: Dict[str, Any], status: str = "pending"):
+        with self._write() as db:
+            self._queue_insert(db, item, status)
+
+    def _queue_insert(self, db: sqlite3.Connection, item: Dict[str, Any], status: str):
+        db.execute("INSERT INTO review_queue(video_id, status, priority, generated_at, item) VALUES (?, ?, ?, ?, ?)",
+                   (item.get("video_id"), status, _int_or_none(item.get("priority")),
+                    item.get("generated_at"), _dumps(item)))
+
+    def _queue_items(self, rows: Iterable[tuple]):
+        prompts = self._prompts()
+        for status, item in rows:
+            item = json.loads(item)
+            yield status, (prompts.expand(item) if prompts is not None else item)
+
+    def review_queue_document(self) -> Dict[str, Any]:
+        doc: Dict[str, Any] = {status: [] for status in QUEUE_STATUSES}
+        for status, item in self._queue_items(self._conn().execute("SELECT status, item FROM review_queue ORDER BY id")):
+            doc.setdefault(status, []).append(item)
+        return doc
+
+    # ---- documents (compatibility with code that expects the JSON shapes) ----
+    def knowledge_document(self) -> Dict[str, Any]:
+        doc = dict(self.knowledge_meta())
+        doc["history"] = self.history()
+        return doc
+
+    def documents(self):
+        """(rev, {knowledge, manual_ratings, review_queue}) as JSON-shaped documents, refreshed once per `rev`.
+
+        Only the first call reads every row. Later revs read the rows added since
+        (ids above the last ones seen) plus the generation rows of newly rated
+        videos, the only rows updated in place, and wrap them with the unchanged
+        entries in new containers: documents already handed out never change.
+        Shared between callers: treat as read-only.
+        """
+        rev = self.rev()
+        with self._docs_lock:
+            if self._docs is not None and self._docs_rev == rev:
+                return rev, self._docs
+        with self._docs_build_lock:
+            db = self._conn()
+            # One read transaction: the three documents come from the same commit
+            db.execute("BEGIN")
+            try:
+                rev = self.rev()
+                if self._docs is not None and self._docs_rev == rev:
+                    return rev, self._docs
+                marks = self._marks(db)
+                seen = self._docs_marks
+                if (self._docs is None or seen["migrated_at"] != marks["migrated_at"]
+                        or any(marks[table] < seen[table] for table in ("generations", "ratings", "review_queue"))):
+                    docs = self._build_documents()
+                else:
+                    docs = self._refresh_documents(db, seen)
+            except BaseException:
+                # The position index may be half updated: rebuild from scratch next time
+                with self._docs_lock:
+                    self._docs = None
+                raise
+            finally:
+                db.execute("COMMIT")
+            with self._docs_lock:
+                self._docs, self._docs_rev, self._docs_marks = docs, rev, marks
+            return rev, docs
+
+    @staticmethod
+    def _marks(db: sqlite3.Connection) -> Dict[str, Any]:
+        row = db.execute("SELECT value FROM meta WHERE key = 'migrated_at'").fetchone()
+        return {
+            "migrated_at": row[0] if row else None,
+            "generations": db.execute("SELECT COALESCE(MAX(id), 0) FROM generations").fetchone()[0],
+            "ratings": db.execute("SELECT COALESCE(MAX(rowid), 0) FROM ratings").fetchone()[0],
+            "review_queue": db.execute("SELECT COALESCE(MAX(id), 0) FROM review_queue").fetchone()[0],
+        }
+
+    def _index_first(self, rows: List[tuple], entries: List[Dict[str, Any]], start: int):
+        for pos, ((gid, _doc), entry) in enumerate(zip(rows, entries), start):
+            name = entry_video_name(entry)
+            if name is not None and name not in self._docs_first:
+                self._docs_first[name] = (pos, gid)
+
+    def _build_documents(self) -> Dict[str, Any]:
+        rows = self._conn().execute("SELECT id, doc FROM generations ORDER BY id").fetchall()
+        history = self._entries(rows)
+        self._docs_first = {}
+        self._index_first(rows, history, 0)
+        return {
+            "knowledge": dict(self.knowledge_meta(), history=history),
+            "manual_ratings": self.manual_ratings(),
+            "review_queue": self.review_queue_document(),
+        }
+
+    def _refresh_documents(self, db: sqlite3.Connection, seen: Dict[str, Any]) -> Dict[str, Any]:
+        docs = self._docs
+        history = docs["knowledge"]["history"]
+        manual = docs["manual_ratings"]
+        queue = docs["review_queue"]
+
+        ratings = db.execute("SELECT video_name, entry FROM ratings WHERE rowid > ? ORDER BY rowid",
+                             (seen["ratings"],)).fetchall()
+        if ratings:
+            # A re-rating is a new row (INSERT OR REPLACE): it moves to the end, as in a full read
+            manual = dict(manual)
+            for name, entry in ratings:
+                manual.pop(name, None)
+                manual[name] = json.loads(entry)
+
+        # The rating fold rewrote the first generation row of each rated video
+        rated = [self._docs_first[name] for name, _entry in ratings if name in self._docs_first]
+        rows = db.execute("SELECT id, doc FROM generations WHERE id > ? ORDER BY id",
+                          (seen["generations"],)).fetchall()
+        if rated or rows:
+            history = list(history)
+            positions = {gid: pos for pos, gid in rated}
+            ids = list(positions)
+            for start in range(0, len(ids), 900):
+                chunk = ids[start:start + 900]
+                changed = db.execute(f"SELECT id, doc FROM generations WHERE id IN ({','.join('?' * len(chunk))})",
+                                     chunk).fetchall()
+                for (gid, _doc), entry in zip(changed, self._entries(changed)):
+                    history[positions[gid]] = entry
+            added = self._entries(rows)
+            self._index_first(rows, added, len(history))
+            history.extend(added)
+
+        items = db.execute("SELECT status, item FROM review_queue WHERE id > ? ORDER BY id",
+                           (seen["review_queue"],)).fetchall()
+        if items:
+            queue = dict(queue)
+            copied = set()
+            for status, item in self._queue_items(items):
+                if status not in copied:
+                    queue[status] = list(queue.get(status, []))
+                    copied.add(status)
+                queue[status].append(item)
+
+        return {
+            "knowledge": dict(self.knowledge_meta(), history=history),
+            "manual_ratings": manual,
+            "review_queue": queue,
+        }
+
+    def counts(self) -> Dict[str, int]:
+        db = self._conn()
+        return {
+            "generations": db.execute("SELECT COUNT(*) FROM generations").fetchone()[0],
+            "ratings": db.execute("SELECT COUNT(*) FROM ratings").fetchone()[0],
+            "bans": db.execute("SELECT COUNT(*) FROM bans").fetchone()[0],
+            "review_queue": db.execute("SELECT COUNT(*) FROM review_queue").fetchone()[0],
+        }
+
+    # ---- migration / export ----
+    def migrate_from_json(self, state_dir: str, force: bool = False) -> bool:
+        """One-shot import of the JSON state files; returns False if already migrated."""
+        row = self._conn().execute("SELECT value FROM meta WHERE key = 'migrated_at'").fetchone()
+        if row and not force:
+            return False
+        knowledge = _load_json(os.path.join(state_dir, "knowledge.json"), {}) or {}
+        manual = _load_json(os.path.join(state_dir, "manual_ratings.json"), {}) or {}
+        queue = _load_json(os.path.join(state_dir, "review_queue.json"), {}) or {}
+        bans = _load_json(os.path.join(state_dir, "ban_history.json"), []) or []
+        with self._write() as db:
+            if force:
+                for table in ("generations", "params", "metrics", "ratings", "bans", "review_queue"):
+                    db.execute(f"DELETE FROM {table}")
+                db.execute("DELETE FROM meta WHERE key LIKE 'knowledge.%'")
+            self._set_knowledge_meta(db, {k: v for k, v in knowledge.items() if k != "history"}
+                                     if isinstance(knowledge, dict) else {})
+            history = knowledge.get("history", []) if isinstance(knowledge, dict) else []
+            for entry in history:
+                if isinstance(entry, dict):
+                    self._insert_generation(db, entry)
+            if isinstance(manual, dict):
+                for video_name, entry in manual.items():
+                    self._put_rating(db, video_name, entry)
+            if isinstance(queue, dict):
+                for status, items in queue.items():
+                    for item in (items if isinstance(items, list) else []):
+                        if isinstance(item, dict):
+                            self._queue_insert(db, item, status)
+            for ban in (bans if isinstance(bans, list) else []):
+                if isinstance(ban, dict):
+                    db.execute("INSERT INTO bans(timestamp, video_name, combo_key, params) VALUES (?, ?, ?, ?)",
+                               (ban.get("timestamp"), ban.get("video_name"), ban.get("combo_key"),
+                                _dumps(ban.get("params")) if ban.get("params") is not None else None))
+            db.execute("INSERT OR REPLACE INTO meta(key, value) VALUES ('migrated_at', ?)", (str(time.time()),))
+        log.info(f"SQLiteCatalog: migrated {len(history)} generations, {len(manual)} ratings from {state_dir}")
+        return True
+
+    def export_json(self, state_dir: str):
+        """Regenerate the JSON documents from the rows (for tools that still read the files)."""
+        _rev, docs = self.documents()
+        atomic_write_json(os.path.join(state_dir, "knowledge.json"), docs["knowledge"])
+        atomic_write_json(os.path.join(state_dir, "manual_ratings.json"), docs["manual_ratings"])
+        atomic_write_json(os.path.join(state_dir, "review_queue.json"), docs["review_queue"])
+        atomic_write_json(os.path.join(state_dir, "ban_history.json"), self.ban_history())
+
+
+def sqlite_backend_enabled(state_dir: str) -> bool:
+    backend = os.environ.get("STATE_BACKEND", "").strip().lower()
+    if backend == "json":
+        return False
+    return backend == "sqlite" or os.path.exists(os.path.join(state_dir, CATALOG_FILENAME))
+
+
+_catalogs: Dict[str, Optional[SQLiteCatalog]] = {}
+_catalogs_lock = threading.Lock()
+
+
+def get_sqlite_catalog(state_dir: str) -> Optional[SQLiteCatalog]:
+    """Process-wide catalog for a state directory, or None when the JSON backend is in use.
+
+    The backend is decided once per process, so the journal compactor and the
+    request threads never disagree about where the state lives.
+    """
+    key = os.path.abspath(state_dir)
+    try:
+        return _catalogs[key]
+    except KeyError:
+        pass
+    with _catalogs_lock:
+        if key not in _catalogs:
+            catalog = None
+            if sqlite_backend_enabled(key):
+                os.makedirs(key, exist_ok=True)
+                catalog = SQLiteCatalog(os.path.join(key, CATALOG_FILENAME))
+                catalog.migrate_from_json(key)
+            _catalogs[key] = catalog
+        return _catalogs[key]
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    import argparse
+    ap = argparse.ArgumentParser(prog="python -m eva_state.sqlite_catalog")
+    ap.add_argument("command", choices=("migrate", "export", "stats"))
+    ap.add_argument("state_dir")
+    ap.add_argument("--force", action="store_true", help="migrate: re-import even if already migrated")
+    args = ap.parse_args(argv)
+    catalog = SQLiteCatalog(os.path.join(args.state_dir, CATALOG_FILENAME))
+    if args.command == "migrate":
+        done = catalog.migrate_from_json(args.state_dir, force=args.force)
+        print(json.dumps(dict(catalog.counts(), migrated=done)))
+    elif args.command == "export":
+        catalog.export_json(args.state_dir)
+        print(json.dumps(catalog.counts()))
+    else:
+        print(json.dumps(dict(catalog.counts(), rev=catalog.rev())))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,333 @@
+"""Running totals behind /api/stats and the agent's get_stats_v4.
+
+Both used to recount on every call: len(manual ratings), the average
+``overall_quality`` over all ratings, the output files without a rating and
+the history length (a full knowledge.json parse whenever the agent had
+written it). `StatsAggregates` keeps those numbers as counters that every
+event adjusts in O(1):
+
+  rating   – upsert of one video's ``overall_quality`` (a re-rating replaces
+             its old value in the running sum); a ban that marks a video
+             counts as a rating only if the video had none (as the fold does)
+  file     – a video appeared in / vanished from the output directory
+  generation – the agent recorded a history entry (`record_generation`)
+
+and persists them next to the state in ``stats_aggregates.json`` (a
+`VersionedState`, so the agent's increments and the server's totals do not
+overwrite each other). The review server owns the rating/file counters and
+writes them at most every ``STATS_SAVE_S`` seconds; the agent bumps
+``generated``/``pending`` after each generation and reads the file instead of
+rescanning. The file only exists once a server has counted everything, so an
+agent never starts the counters from zero on an existing history.
+
+Consistency: `check` recounts from the full state (at startup and every
+``STATS_RECOUNT_S`` seconds in a background thread), logs any drift and
+replaces the counters. Events that arrive while a recount runs are replayed
+on top of its result; all of them are idempotent.
+"""
+import os
+import time
+import logging
+import threading
+from typing import Any, Callable, Dict, Iterable, List, Mapping, Optional, Set, Tuple
+
+from eva_state.store import file_signature
+from eva_state.versioned_state import VersionedState
+
+log = logging.getLogger("eva_state")
+
+STATS_FILENAME = "stats_aggregates.json"
+DEFAULT_RECOUNT_S = float(os.environ.get("STATS_RECOUNT_S", "300"))
+DEFAULT_SAVE_S = float(os.environ.get("STATS_SAVE_S", "2.0"))
+
+STATS_DEFAULT = {"version": 0, "generated": 0, "best_score": 0, "rated": 0, "overall_sum": 0.0,
+                 "overall_count": 0, "files": 0, "pending": 0}
+
+# (manual ratings, output file names, history length, knowledge best_score)
+Recount = Tuple[Mapping[str, Any], Iterable[str], int, float]
+
+
+def overall_quality(entry: Any) -> Optional[float]:
+    """``rating.overall_quality`` of a manual_ratings entry, if it has one."""
+    rating = entry.get("rating") if isinstance(entry, dict) else None
+    if isinstance(rating, dict) and "overall_quality" in rating:
+        try:
+            return float(rating["overall_quality"])
+        except (TypeError, ValueError):
+            return None
+    return None
+
+
+def stats_path(state_dir: str) -> str:
+    return os.path.join(state_dir, STATS_FILENAME)
+
+
+def record_generation(state_dir: str, best_score: Optional[float] = None, count: int = 1) -> bool:
+    """Agent side: count new history entries (and their not yet rated videos) in the persisted totals.
+
+    No-op until a review server has created the file with a full count.
+    """
+    path = stats_path(state_dir)
+    if not os.path.exists(path):
+        return False
+
+    def bump(doc):
+        doc["generated"] = doc.get("generated", 0) + count
+        doc["pending"] = doc.get("pending", 0) + count
+        if best_score is not None and best_score > doc.get("best_score", 0):
+            doc["best_score"] = best_score
+
+    VersionedState(path, STATS_DEFAULT).update(bump)
+    return True
+
+
+def read_totals(state_dir: str) -> Optional[Dict[str, Any]]:
+    """Persisted totals in the shape of get_stats_v4 / /api/stats, or None without the file."""
+    path = stats_path(state_dir)
+    if not os.path.exists(path):
+        return None
+    _version, doc = VersionedState(path, STATS_DEFAULT).read()
+    return _totals(doc)
+
+
+def _totals(doc: Mapping[str, Any]) -> Dict[str, Any]:
+    count = doc.get("overall_count", 0)
+    return {
+        "total_generated": doc.get("generated", 0),
+        "total_rated": doc.get("rated", 0),
+        "pending_count": max(0, doc.get("pending", 0)),
+        "avg_rating": doc.get("overall_sum", 0.0) / count if count else 0,
+        "best_score": doc.get("best_score", 0),
+    }
+
+
+class StatsAggregates:
+    """In-memory counters of the review server, fed by journal and catalog events."""
+
+    def __init__(self, state_dir: str, save_interval_s: float = DEFAULT_SAVE_S):
+        self.state_dir = state_dir
+        self.state = VersionedState(stats_path(state_dir), STATS_DEFAULT)
+        self.save_interval_s = float(save_interval_s)
+        self._lock = threading.Lock()
+        self._overall: Dict[str, Optional[float]] = {}  # rated video -> overall_quality
+        self._files: Set[str] = set()
+        self._overall_sum = 0.0
+        self._overall_count = 0
+        self._rated_files = 0
+        self._best_score = 0
+        self._generated = 0
+        self._ready = False
+        # Events seen while a recount runs (replayed on top of its result)
+        self._replay: Optional[List[Tuple[str, Any]]] = None
+        self._persisted_sig = None
+        self._persisted: Dict[str, Any] = dict(STATS_DEFAULT)
+        self._save_timer: Optional[threading.Timer] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self.events = 0
+        self.recounts = 0
+        self.drifts = 0
+        self.last_drift: Dict[str, Any] = {}
+        self.last_check_ms = 0.0
+
+    @property
+    def ready(self) -> bool:
+        return self._ready
+
+    # ---- events (O(1) each) ----
+    def _rate(self, name: str, entry: Any, only_new: bool = False):
+        if name in self._overall:
+            if only_new:
+                return
+            old = self._overall[name]
+            if old is not None:
+                self._overall_sum -= old
+                self._overall_count -= 1
+        elif name in self._files:
+            self._rated_files += 1
+        value = overall_quality(entry)
+        self._overall[name] = value
+        if value is not None:
+            self._overall_sum += value
+            self._overall_count += 1
+            if value > self._best_score:
+                self._best_score = value
+
+    def _file(self, name: str, present: bool):
+        if present == (name in self._files):
+            return
+        if present:
+            self._files.add(name)
+        else:
+            self._files.discard(name)
+        if name in self._overall:
+            self._rated_files += 1 if present else -1
+
+    def _apply(self, kind: str, payload: Any):
+        if kind == "rate":
+            self._rate(*payload)
+        elif kind == "mark":
+            self._rate(*payload, only_new=True)
+        else:
+            self._file(*payload)
+
+    def _event(self, events: List[Tuple[str, Any]]):
+        if not events:
+            return
+        with self._lock:
+            for kind, payload in events:
+                self._apply(kind, payload)
+            if self._replay is not None:
+                self._replay.extend(events)
+            self.events += len(events)
+        self._schedule_save()
+
+    def on_journal_append(self, records: List[Dict[str, Any]]):
+        """RatingJournal listener: ratings and video-marking bans."""
+        events = []
+        for rec in records:
+            if rec.get("op") == "rate":
+                events.append(("rate", (rec["video"], rec.get("entry"))))
+            elif rec.get("op") == "ban" and rec.get("entry") and rec.get("video"):
+                events.append(("mark", (rec["video"], rec["entry"])))
+        self._event(events)
+
+    def on_catalog_change(self, delta, snap=None):
+        """OutputCatalog listener: files added to / removed from the output directory."""
+        self._event([("file", (name, True)) for name in delta.added] +
+                    [("file", (name, False)) for name in delta.removed])
+
+    # ---- reads ----
+    def _persisted_doc(self) -> Dict[str, Any]:
+        """The persisted document (the agent's generated/best_score), re-read only when the file changed."""
+        sig = file_signature(self.state.path)
+        if sig != self._persisted_sig:
+            self._persisted = self.state.read()[1]
+            self._persisted_sig = sig
+        return self._persisted
+
+    def totals(self) -> Dict[str, Any]:
+        """Current totals in the /api/stats shape; O(1)."""
+        persisted = self._persisted_doc()
+        with self._lock:
+            return _totals({
+                "generated": max(self._generated, persisted.get("generated", 0)),
+                "best_score": max(self._best_score, persisted.get("best_score", 0)),
+                "rated": len(self._overall),
+                "overall_sum": self._overall_sum,
+                "overall_count": self._overall_count,
+                "pending": len(self._files) - self._rated_files,
+            })
+
+    # ---- persistence ----
+    def _schedule_save(self):
+        with self._lock:
+            if self._save_timer is not None or not self._ready:
+                return
+            self._save_timer = threading.Timer(self.save_interval_s, self.save)
+            self._save_timer.daemon = True
+            self._save_timer.start()
+
+    def save(self, recount: bool = False):
+        """Write the server-owned counters (all of them after a recount) into the shared file."""
+        with self._lock:
+            self._save_timer = None
+            mine = {
+                "rated": len(self._overall),
+                "overall_sum": self._overall_sum,
+                "overall_count": self._overall_count,
+                "files": len(self._files),
+                "pending": len(self._files) - self._rated_files,
+            }
+            best, generated = self._best_score, self._generated
+
+        def merge(doc):
+            doc.update(mine)
+            doc["best_score"] = best if recount else max(best, doc.get("best_score", 0))
+            if recount:
+                doc["generated"] = generated
+                doc["checked_at"] = time.time()
+            doc["updated_at"] = time.time()
+
+        try:
+            self.state.update(merge)
+        except Exception as e:
+            log.warning(f"StatsAggregates: failed to save {self.state.path}: {e}")
+
+    # ---- consistency ----
+    def check(self, recount: Callable[[], Recount]) -> Dict[str, Any]:
+        """Full recount; replaces the counters and returns the drift it corrected (empty when consistent)."""
+        t0 = time.perf_counter()
+        persisted_generated = self._persisted_doc().get("generated", 0)
+        with self._lock:
+            self._replay = []
+            # Nothing to compare with on the first count of this process
+            before = dict(self._counts(), generated=max(self._generated, persisted_generated)) if self._ready else None
+        try:
+            ratings, files, generated, best_score = recount()
+            overall: Dict[str, Optional[float]] = {}
+            total, count = 0.0, 0
+            for name, entry in ratings.items():
+                value = overall_quality(entry)
+                overall[name] = value
+                if value is not None:
+                    total += value
+                    count += 1
+            file_set = set(files)
+            rated_files = sum(1 for name in overall if name in file_set)
+            with self._lock:
+                self._overall, self._files = overall, file_set
+                self._overall_sum, self._overall_count, self._rated_files = total, count, rated_files
+                self._best_score = best_score or 0
+                self._generated = generated
+                for kind, payload in self._replay:
+                    self._apply(kind, payload)
+                after = self._counts()
+                self._ready = True
+        finally:
+            with self._lock:
+                self._replay = None
+        drift = {k: (before[k], after[k]) for k in after if before is not None and before[k] != after[k]}
+        if drift:
+            self.drifts += 1
+            self.last_drift = drift
+            log.warning(f"StatsAggregates: counters drifted from the full recount, corrected: {drift}")
+        self.save(recount=True)
+        self.recounts += 1
+        self.last_check_ms = (time.perf_counter() - t0) * 1000
+        return drift
+
+    def _counts(self) -> Dict[str, Any]:
+        return {"rated": len(self._overall), "overall_count": self._overall_count,
+                "overall_sum": round(self._overall_sum, 6), "files": len(self._files),
+                "pending": len(self._files) - self._rated_files, "generated": self._generated}
+
+    def start(self, recount: Callable[[], Recount], interval_s: float = DEFAULT_RECOUNT_S):
+        """Count once now, then re-check in a daemon thread every interval_s seconds."""
+        if self._thread and self._thread.is_alive():
+            return
+        self.check(recount)
+
+        def _loop():
+            while not self._stop.wait(interval_s):
+                try:
+                    self.check(recount)
+                except Exception as e:
+                    log.warning(f"StatsAggregates: recount failed: {e}")
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=_loop, name="stats-recount", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "events": self.events,
+            "recounts": self.recounts,
+            "drifts": self.drifts,
+            "last_drift": self.last_drift,
+            "last_check_ms": round(self.last_check_ms, 2),
+            "version": self.state.read()[0],
+        }
@@ -0,0 +1,307 @@
+"""Process-wide cache of parsed auto_state JSON documents.
+
+The review server used to re-parse knowledge.json / manual_ratings.json /
+review_queue.json / bandit_state.json on every API call. StateStore keeps the
+parsed documents in memory and re-reads a file only when its signature
+(mtime_ns, size, inode) changes, so concurrent requests share one parsed copy.
+
+Cached documents are shared between threads, so they are frozen on load:
+dicts and lists become FrozenDict / FrozenList, which serialize and compare
+like the plain types but raise TypeError on in-place changes. Code that
+modifies a document works on a copy (``dict(doc, key=value)``,
+``copy.deepcopy(doc)`` gives plain dicts/lists), writes the file and lets the
+next signature check pick the new content up.
+"""
+import copy
+import os
+import logging
+import threading
+from types import MappingProxyType
+from typing import Any, Callable, Dict, Iterable, Mapping, Optional, Tuple
+
+from eva_state.serializer import load_file
+
+log = logging.getLogger("eva_state")
+
+
+def file_signature(path: str) -> Optional[Tuple[int, int, int]]:
+    """(mtime_ns, size, inode) of a file or None if it does not exist."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+
+def _read_only(self, *args, **kwargs):
+    raise TypeError(f"cached state document is read-only ({type(self).__name__}); change a copy")
+
+
+class FrozenDict(dict):
+    """dict that refuses in-place changes; copies (dict(d), copy, deepcopy, pickle) are plain dicts."""
+
+    __slots__ = ()
+    __setitem__ = __delitem__ = __ior__ = _read_only
+    clear = pop = popitem = setdefault = update = _read_only
+
+    def __reduce__(self):
+        return (dict, (dict(self),))
+
+    def __copy__(self):
+        return dict(self)
+
+    def __deepcopy__(self, memo):
+        return {copy.deepcopy(k, memo): copy.deepcopy(v, memo) for k, v in self.items()}
+
+
+class FrozenList(list):
+    """list that refuses in-place changes; copies (list(l), slices, copy, deepcopy, pickle) are plain lists."""
+
+    __slots__ = ()
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _read_only
+    append = extend = insert = pop = remove = clear = sort = reverse = _read_only
+
+    def __reduce__(self):
+        return (list, (list(self),))
+
+    def __copy__(self):
+        return list(self)
+
+    def __deepcopy__(self, memo):
+        return [copy.deepcopy(v, memo) for v in self]
+
+
+_CONTAINERS = frozenset((dict, list))
+
+
+def freeze(value: Any) -> Any:
+    """Recursively turn parsed dicts / lists into FrozenDict / FrozenList (other values as is)."""
+    if type(value) is dict:
+        return FrozenDict({k: (freeze(v) if type(v) in _CONTAINERS else v) for k, v in value.items()})
+    if type(value) is list:
+        return FrozenList([(freeze(v) if type(v) in _CONTAINERS else v) for v in value])
+    return value
+
+
+class _CachedDocument:
+    __slots__ = ("path", "state", "lock", "hits", "misses", "errors")
+
+    def __init__(self, path: str):
+        self.path = path
+        # (data, version, signature) of the last good read, replaced as a whole so
+        # the lock-free fast path never pairs data with another read's signature
+        self.state: Optional[Tuple[Any, int, Any]] = None
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+
+class StateSnapshot:
+    """Read-only view over a set of documents taken at one moment.
+
+    Holds references to the parsed documents and their versions; a request
+    reads everything it needs from one snapshot so it never mixes two
+    generations of the same file. The name -> document mappings are
+    MappingProxyType; documents read from files are frozen by StateStore
+    (FrozenDict / FrozenList all the way down), so a handler that tries to
+    change one in place gets TypeError instead of corrupting every other
+    reader. Copy before changing anything (``dict(entry, key=value)``), as
+    the journal fold does.
+    """
+
+    __slots__ = ("_documents", "_versions", "_signatures")
+
+    def __init__(self, documents: Dict[str, Any], versions: Dict[str, int], signatures: Dict[str, Any]):
+        self._documents = MappingProxyType(dict(documents))
+        self._versions = MappingProxyType(dict(versions))
+        self._signatures = MappingProxyType(dict(signatures))
+
+    def __getitem__(self, name: str) -> Any:
+        return self._documents[name]
+
+    def get(self, name: str, default: Any = None) -> Any:
+        return self._documents.get(name, default)
+
+    @property
+    def versions(self) -> Mapping[str, int]:
+        return self._versions
+
+    @property
+    def signatures(self) -> Mapping[str, Any]:
+        return self._signatures
+
+    def overlay(self, documents: Mapping[str, Any], versions: Mapping[str, int],
+                signatures: Optional[Mapping[str, Any]] = None) -> "StateSnapshot":
+        """Copy with some documents added/replaced (e.g. merged with pending journal records).
+
+        `versions` of the overlaid entries are also recorded as their signatures
+        (unless `signatures` is given, e.g. for a derived view of the same file),
+        so ETags and `derived` tokens change whenever the overlay does.
+        """
+        return StateSnapshot(
+            {**self._documents, **documents},
+            {**self._versions, **versions},
+            {**self._signatures, **(versions if signatures is None else signatures)},
+        )
+
+
+class StateStore:
+    """Thread-safe, signature-invalidated cache of JSON documents."""
+
+    def __init__(self, base_dir: str):
+        self.base_dir = base_dir
+        self._docs: Dict[str, _CachedDocument] = {}
+        self._docs_lock = threading.Lock()
+        self._derived: Dict[str, Tuple[Tuple[int, ...], Any]] = {}
+        self._derived_lock = threading.Lock()
+        self._generation = 0
+        self._generation_lock = threading.Lock()
+        # hits/misses/errors of all entries; not entry.lock, which a reload holds while parsing
+        self._counters_lock = threading.Lock()
+
+    def _next_version(self) -> int:
+        with self._generation_lock:
+            self._generation += 1
+            return self._generation
+
+    def _entry(self, path: str) -> _CachedDocument:
+        path = os.path.abspath(path)
+        entry = self._docs.get(path)
+        if entry is None:
+            with self._docs_lock:
+                entry = self._docs.get(path)
+                if entry is None:
+                    entry = _CachedDocument(path)
+                    self._docs[path] = entry
+        return entry
+
+    def _count(self, entry: _CachedDocument, field: str):
+        with self._counters_lock:
+            setattr(entry, field, getattr(entry, field) + 1)
+
+    def _read(self, entry: _CachedDocument, default: Any) -> Tuple[Any, int, Any]:
+        sig = file_signature(entry.path)
+        state = entry.state
+        if state is not None and sig == state[2]:
+            self._count(entry, "hits")
+            return state
+        with entry.lock:
+            # Another thread may have reloaded while we were waiting
+            sig = file_signature(entry.path)
+            state = entry.state
+            if state is not None and sig == state[2]:
+                self._count(entry, "hits")
+                return state
+            self._count(entry, "misses")
+            if sig is None:
+                data = default
+            else:
+                try:
+                    data = load_file(entry.path)
+                except Exception as e:
+                    # Half-written file or bad JSON: keep the last good copy and retry next time
+                    self._count(entry, "errors")
+                    log.warning(f"StateStore: failed to parse {entry.path}: {e}")
+                    if state is not None:
+                        return state
+                    return default, 0, None
+            state = (freeze(data), self._next_version(), sig)
+            entry.state = state
+            return state
+
+    def load(self, path: str, default: Any = None) -> Any:
+        """Parsed content of `path` (shared, frozen); `default` if missing."""
+        if default is None:
+            default = {}
+        data, _version, _sig = self._read(self._entry(path), default)
+        return data if data is not None else default
+
+    def version(self, path: str) -> int:
+        """Current version of `path` (changes every time the file is re-read)."""
+        _data, version, _sig = self._read(self._entry(path), None)
+        return version
+
+    def snapshot(self, files: Mapping[str, Tuple[str, Any]]) -> StateSnapshot:
+        """Take a snapshot of {name: (path, default)} documents."""
+        documents, versions, signatures = {}, {}, {}
+        for name, (path, default) in files.items():
+            data, version, sig = self._read(self._entry(path), default if default is not None else {})
+            documents[name] = data if data is not None else default
+            versions[name] = version
+            signatures[name] = sig
+        return StateSnapshot(documents, versions, signatures)
+
+    def derived(self, key: str, snapshot: StateSnapshot, names: Iterable[str], builder: Callable[[StateSnapshot], Any]) -> Any:
+        """Memoize `builder(snapshot)` until one of the `names` documents changes.
+
+        Used for indexes that are expensive to build but depend only on a few
+        state files (e.g. the video -> knowledge entry index).
+        """
+        token = tuple(snapshot.versions.get(n, 0) for n in names)
+        cached = self._derived.get(key)
+        if cached is not None and cached[0] == token:
+            return cached[1]
+        with self._derived_lock:
+            cached = self._derived.get(key)
+            if cached is not None and cached[0] == token:
+                return cached[1]
+            value = builder(snapshot)
+            self._derived[key] = (token, value)
+            return value
+
+    def invalidate(self, path: Optional[str] = None):
+        """Force a re-read of one file (or all of them) on next access."""
+        with self._docs_lock:
+            entries = [self._docs.get(os.path.abspath(path))] if path else list(self._docs.values())
+        for entry in entries:
+            if entry is not None:
+                with entry.lock:
+                    entry.state = None
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters, overall and per file."""
+        with self._docs_lock:
+            entries = list(self._docs.values())
+        with self._counters_lock:
+            counts = [(e, e.hits, e.misses, e.errors) for e in entries]
+        files = {}
+        hits = misses = errors = 0
+        for e, e_hits, e_misses, e_errors in counts:
+            _data, version, sig = e.state or (None, 0, None)
+            files[os.path.basename(e.path)] = {
+                "hits": e_hits,
+                "misses": e_misses,
+                "errors": e_errors,
+                "version": version,
+                "size": sig[1] if sig else None,
+            }
+            hits += e_hits
+            misses += e_misses
+            errors += e_errors
+        total = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "errors": errors,
+            "hit_ratio": (hits / total) if total else 0.0,
+            "derived": sorted(self._derived.keys()),
+            "files": files,
+        }
+
+
+_stores: Dict[str, StateStore] = {}
+_stores_lock = threading.Lock()
+
+
+def get_state_store(base_dir: str) -> StateStore:
+    """Process-wide StateStore for an auto_state directory."""
+    key = os.path.abspath(base_dir)
+    store = _stores.get(key)
+    if store is None:
+        with _stores_lock:
+            store = _stores.get(key)
+            if store is None:
+                store = StateStore(key)
+                _stores[key] = store
+    return store
@@ -0,0 +1,267 @@
+"""Inverted index over knowledge prompt text for /api/search `q`.
+
+Every indexed document is the text of one search row: `prompt`,
+`negative_prompt`, `photo_prompt`, `photo_negative` and the string values of
+`persona`. Tokens map to append-only postings (doc ids in increasing order,
+a field-weighted term frequency and a bitmask of the fields the token came
+from), so indexing a new generation only appends and a query never touches
+prompt strings.
+
+Queries are whitespace-separated terms, all of which must match (AND),
+ranked by BM25 over the weighted term frequencies, scaled by the weight of
+the strongest field a term occurs in. A term can be limited to
+one field (`neg:blurry`, `persona:blonde`) and a trailing `*` matches by
+prefix (`cine*`).
+
+A row whose text changes gets a new doc id; the caller keeps the current doc
+id per row and ignores stale ones, so older index versions keep answering
+consistently while new documents are appended.
+"""
+import re
+import math
+import bisect
+import threading
+from array import array
+from collections import Counter
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # optional: dict-based scoring
+    np = None
+
+# Field -> (bit, weight); negative prompts still match but rank below positive text
+TEXT_FIELDS = {
+    "prompt": (1, 1.0),
+    "photo_prompt": (2, 0.8),
+    "persona": (4, 1.5),
+    "negative_prompt": (8, 0.4),
+    "photo_negative": (16, 0.3),
+}
+# Query prefixes for field-limited terms
+FIELD_ALIASES = {
+    "prompt": "prompt",
+    "photo": "photo_prompt",
+    "photo_prompt": "photo_prompt",
+    "persona": "persona",
+    "neg": "negative_prompt",
+    "negative": "negative_prompt",
+    "negative_prompt": "negative_prompt",
+    "photo_neg": "photo_negative",
+    "photo_negative": "photo_negative",
+}
+MIN_TOKEN_LEN = 2
+# Prefix terms expand to at most this many vocabulary words
+MAX_PREFIX_EXPANSION = 64
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+_TOKEN_RE = re.compile(r"[^\W_]{%d,}" % MIN_TOKEN_LEN)
+# Field bitmask -> weight of its strongest field: a term only in the negative prompt ranks below a prompt hit
+_BITS_WEIGHT = [max([w for bit, w in TEXT_FIELDS.values() if bits & bit] or [0.0]) for bits in range(32)]
+
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN_RE.findall(text.lower())
+
+
+def _strings(value: Any) -> List[str]:
+    if isinstance(value, str):
+        return [value]
+    if isinstance(value, dict):
+        value = list(value.values())
+    if isinstance(value, (list, tuple)):
+        out = []
+        for v in value:
+            out.extend(_strings(v))
+        return out
+    return []
+
+
+def entry_text(det: Dict[str, Any]) -> Tuple[Tuple[str, str], ...]:
+    """(field, text) pairs of a knowledge entry that go into the index."""
+    if not isinstance(det, dict):
+        return ()
+    out = []
+    for field in TEXT_FIELDS:
+        text = " ".join(_strings(det.get(field)))
+        if text.strip():
+            out.append((field, text))
+    return tuple(out)
+
+
+class QueryTerm(NamedTuple):
+    token: str
+    fields: int  # bitmask; 0 = any field
+    prefix: bool
+
+
+def parse_query(query: str) -> List[QueryTerm]:
+    terms = []
+    for word in (query or "").split():
+        mask = 0
+        field, sep, rest = word.partition(":")
+        if sep and field.lower() in FIELD_ALIASES:
+            mask = TEXT_FIELDS[FIELD_ALIASES[field.lower()]][0]
+            word = rest
+        prefix = word.endswith("*")
+        tokens = tokenize(word)
+        for i, token in enumerate(tokens):
+            terms.append(QueryTerm(token, mask, prefix and i == len(tokens) - 1))
+    return terms
+
+
+class TextIndex:
+    """Append-only inverted index; `search` returns the docs matching every query term with BM25 scores."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # token -> (doc ids, weighted tf, field bits), doc ids increasing
+        self._postings: Dict[str, Tuple[array, array, array]] = {}
+        self._doc_row = array("i")
+        self._doc_len = array("f")
+        self._total_len = 0.0
+        self._vocab: Optional[List[str]] = None  # sorted, for prefix terms; reset when new tokens appear
+
+    def __len__(self) -> int:
+        return len(self._doc_row)
+
+    def doc_row(self, doc: int) -> int:
+        return self._doc_row[doc]
+
+    def add(self, row: int, text: Tuple[Tuple[str, str], ...]) -> int:
+        """Index the (field, text) pairs of search row `row`; returns the new doc id."""
+        counts: Dict[str, List] = {}
+        length = 0.0
+        for field, value in text:
+            bit, weight = TEXT_FIELDS[field]
+            tokens = tokenize(value)
+            length += weight * len(tokens)
+            for token, n in Counter(tokens).items():
+                c = counts.get(token)
+                if c is None:
+                    counts[token] = [weight * n, bit]
+                else:
+                    c[0] += weight * n
+                    c[1] |= bit
+        with self._lock:
+            doc = len(self._doc_row)
+            self._doc_row.append(row)
+            self._doc_len.append(length)
+            self._total_len += length
+            for token, (tf, bits) in counts.items():
+                p = self._postings.get(token)
+                if p is None:
+                    p = self._postings[token] = (array("i"), array("f"), array("B"))
+                    self._vocab = None
+                p[0].append(doc)
+                p[1].append(tf)
+                p[2].append(bits)
+        return doc
+
+    def _expand(self, term: QueryTerm) -> List[str]:
+        if not term.prefix:
+            return [term.token] if term.token in self._postings else []
+        if self._vocab is None:
+            self._vocab = sorted(self._postings)
+        vocab = self._vocab
+        i = bisect.bisect_left(vocab, term.token)
+        out = []
+        while i < len(vocab) and vocab[i].startswith(term.token) and len(out) < MAX_PREFIX_EXPANSION:
+            out.append(vocab[i])
+            i += 1
+        return out
+
+    def search(self, query: str):
+        """(doc ids, their rows, scores) of the docs matching every term of `query`.
+
+        NumPy arrays when NumPy is installed, lists otherwise; unordered.
+        """
+        terms = parse_query(query)
+        per_term = []
+        # Copies taken in one go: adds may be appending to the same arrays meanwhile
+        with self._lock:
+            n_docs = len(self._doc_row)
+            doc_len = self._doc_len[:]
+            doc_row = self._doc_row[:]
+            avg_len = (self._total_len / n_docs) if n_docs else 1.0
+            for term in terms:
+                postings = [tuple(a[:] for a in self._postings[t]) for t in self._expand(term)]
+                if not postings:
+                    per_term = []
+                    break
+                per_term.append((term, postings, sum(len(p[0]) for p in postings)))
+        # Rarest term first: the others are only probed for its candidates
+        per_term.sort(key=lambda t: t[2])
+        if np is not None:
+            if not per_term:
+                return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.int32), np.empty(0)
+            docs, scores = self._search_numpy(per_term, n_docs, doc_len, avg_len or 1.0)
+            return docs, np.frombuffer(doc_row, dtype=np.int32)[docs], scores
+        if not per_term:
+            return [], [], []
+        result = self._search_python(per_term, n_docs, doc_len, avg_len or 1.0)
+        docs = list(result)
+        return docs, [doc_row[d] for d in docs], [result[d] for d in docs]
+
+    @staticmethod
+    def _search_python(per_term, n_docs, doc_len, avg_len) -> Dict[int, float]:
+        result: Optional[Dict[int, float]] = None
+        for term, postings, df in per_term:
+            idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+            scores: Dict[int, float] = {}
+            for docs, tfs, bits in postings:
+                if result is None:
+                    hits = range(len(docs))
+                else:
+                    hits = []
+                    for doc in result:
+                        i = bisect.bisect_left(docs, doc)
+                        if i < len(docs) and docs[i] == doc:
+                            hits.append(i)
+                for i in hits:
+                    if term.fields and not bits[i] & term.fields:
+                        continue
+                    doc, tf = docs[i], tfs[i]
+                    norm = BM25_K1 * (1 - BM25_B + BM25_B * doc_len[doc] / avg_len)
+                    s = idf * _BITS_WEIGHT[bits[i]] * tf * (BM25_K1 + 1) / (tf + norm)
+                    if s > scores.get(doc, 0.0):
+                        scores[doc] = s
+            if result is None:
+                result = scores
+            else:
+                result = {doc: s + scores[doc] for doc, s in result.items() if doc in scores}
+            if not result:
+                return {}
+        return result or {}
+
+    @staticmethod
+    def _search_numpy(per_term, n_docs, doc_len, avg_len):
+        doc_len = np.frombuffer(doc_len, dtype=np.float32)
+        # Dense accumulators over all doc ids: AND = docs hit by every term
+        total = np.zeros(n_docs)
+        hits = np.zeros(n_docs, dtype=np.int16)
+        for term, postings, df in per_term:
+            idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+            docs = np.concatenate([np.frombuffer(p[0], dtype=np.int32) for p in postings])
+            tfs = np.concatenate([np.frombuffer(p[1], dtype=np.float32) for p in postings]).astype(np.float64)
+            bits = np.concatenate([np.frombuffer(p[2], dtype=np.uint8) for p in postings])
+            if term.fields:
+                keep = (bits & term.fields) != 0
+                docs, tfs, bits = docs[keep], tfs[keep], bits[keep]
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * doc_len[docs] / avg_len)
+            s = idf * np.asarray(_BITS_WEIGHT)[bits] * tfs * (BM25_K1 + 1) / (tfs + norm)
+            if len(postings) > 1:
+                # Prefix expansions: a doc counts once, with its best-scoring word
+                best = np.zeros(n_docs)
+                np.maximum.at(best, docs, s)
+                docs = np.flatnonzero(best)
+                s = best[docs]
+            total[docs] += s
+            hits[docs] += 1
+        docs = np.flatnonzero(hits == len(per_term)).astype(np.int32)
+        return docs, total[docs]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"docs": len(self._doc_row), "terms": len(self._postings)}
@@ -0,0 +1,271 @@
+"""Versioned JSON state files with cross-process compare-and-swap writes.
+
+bandit_state.json has two writers in different processes: the agent
+(`MultiDimensionalBandit.save`, after every reward update) and the review
+server's journal compactor (bandit ``t`` and banned combos). Both used to
+load the file, change it and overwrite it, so whichever wrote last silently
+dropped the other's bans and counters; older code also wrote a different
+shape (``arms/N/S``) than the bandit reads (``combo_stats/banned_combos``).
+
+`VersionedState` keeps a ``version`` field in the document that every write
+increments, and serializes writers with an exclusive ``fcntl`` lock on a
+sidecar ``<file>.lock``:
+
+  - `update(fn)` is a read-modify-write under the lock (the journal fold);
+  - `commit(base_version, base, ours, merge)` is a compare-and-swap for a
+    writer that keeps the state in memory (the bandit): if the file is still
+    at ``base_version`` ``ours`` is written as is, otherwise
+    ``merge(base, ours, theirs)`` replays our changes since ``base`` on top of
+    the current file.
+
+Writes go through tmp file + ``os.replace``, so readers never take the lock
+and never see a half-written file.
+
+For the bandit document `merge_bandit_state` adds counter deltas (``t``,
+``N``, ``S``), appends the new ``scores`` and merges ``banned_combos`` as a
+set, so no ban and no reward update is lost. `normalize_bandit_state` maps
+every shape written so far onto ``{"version", "combo_stats", "t",
+"banned_combos"}``.
+
+knowledge.json (JSON backend) has the same two writers: the agent appends a
+history entry per generation and rewrites the file from memory, the
+compactor sets ``manual_rating`` / ``best_score`` from reviews. The compactor
+folds with `update`, the agent commits with `merge_knowledge`, which appends
+its new entries to the current history instead of overwriting it.
+"""
+import os
+import copy
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # not on POSIX: in-process lock only
+    fcntl = None
+
+from eva_state.rating_journal import atomic_write_json, _load_json
+
+log = logging.getLogger("eva_state")
+
+LOCK_SUFFIX = ".lock"
+# Per-combo reward history kept by the bandit
+SCORES_KEEP = 20
+
+BANDIT_STATE_DEFAULT = {"version": 0, "combo_stats": {}, "t": 0, "banned_combos": []}
+KNOWLEDGE_DEFAULT = {"version": 0, "best_score": 0, "best_params": {}, "history": []}
+
+
+class VersionedState:
+    """One JSON document with a monotonically increasing ``version``."""
+
+    def __init__(self, path: str, default: Optional[Dict[str, Any]] = None,
+                 normalize: Optional[Callable[[Dict[str, Any]], Dict[str, Any]]] = None):
+        self.path = path
+        self.lock_path = path + LOCK_SUFFIX
+        self._default = default if default is not None else {"version": 0}
+        self._normalize = normalize
+        self._write_lock = threading.Lock()
+        self.writes = 0
+        self.merges = 0
+
+    @contextmanager
+    def _locked(self):
+        """Exclusive writer lock: threads of this process, then other processes via fcntl."""
+        with self._write_lock:
+            if fcntl is None:
+                yield
+                return
+            with open(self.lock_path, "a") as f:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    def read(self) -> Tuple[int, Dict[str, Any]]:
+        """(version, document) as currently on disk; never blocks on writers."""
+        try:
+            data = _load_json(self.path, None)
+        except ValueError as e:
+            log.warning(f"{self.path} is not valid JSON, starting from defaults: {e}")
+            data = None
+        if not isinstance(data, dict):
+            data = copy.deepcopy(self._default)
+        if self._normalize is not None:
+            data = self._normalize(data)
+        try:
+            version = int(data.get("version") or 0)
+        except (TypeError, ValueError):
+            version = 0
+        return version, data
+
+    def _write(self, version: int, data: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+        data = dict(data, version=version + 1)
+        atomic_write_json(self.path, data)
+        self.writes += 1
+        return version + 1, data
+
+    def update(self, fn: Callable[[Dict[str, Any]], Optional[Dict[str, Any]]]) -> Tuple[int, Dict[str, Any]]:
+        """Apply fn to the current document under the lock and write the result (fn may mutate in place)."""
+        with self._locked():
+            version, data = self.read()
+            result = fn(data)
+            return self._write(version, data if result is None else result)
+
+    def commit(self, base_version: int, base: Dict[str, Any], ours: Dict[str, Any],
+               merge: Callable[[Dict[str, Any], Dict[str, Any], Dict[str, Any]], Dict[str, Any]]
+               ) -> Tuple[int, Dict[str, Any]]:
+        """Write ``ours`` if the file is still at ``base_version``, else ``merge(base, ours, theirs)``.
+
+        Returns the new (version, document); the caller adopts it as its next base.
+        """
+        with self._locked():
+            version, theirs = self.read()
+            if version != base_version:
+                ours = merge(base, ours, theirs)
+                self.merges += 1
+            return self._write(version, ours)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"path": self.path, "version": self.read()[0], "writes": self.writes, "merges": self.merges}
+
+
+def combo_key(params: Dict[str, Any]) -> str:
+    """Bandit arm key of a parameter combination (sampler|scheduler|fps|cfg|steps|WxH)."""
+    return "|".join([
+        str(params.get("sampler", "unknown")),
+        str(params.get("scheduler", "unknown")),
+        str(params.get("fps", 20)),
+        str(params.get("cfg_scale", 7.0)),
+        str(params.get("steps", 25)),
+        f"{params.get('width', 768)}x{params.get('height', 432)}",
+    ])
+
+
+def _arm(stats: Any) -> Dict[str, Any]:
+    if not isinstance(stats, dict):
+        return {"N": 0, "S": 0.0, "scores": []}
+    if "total_reward" in stats and "count" in stats and "N" not in stats:
+        # Oldest combo_stats format: no per-attempt history, approximate it with the mean
+        count, total = stats["count"], stats["total_reward"]
+        return {"N": count, "S": total, "scores": [total / count] * min(count, SCORES_KEEP) if count else []}
+    return {"N": stats.get("N", stats.get("count", 0)),
+            "S": stats.get("S", stats.get("total_reward", 0.0)),
+            "scores": list(stats.get("scores", []))}
+
+
+def normalize_bandit_state(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Any bandit_state.json shape -> {"version", "combo_stats", "t", "banned_combos"} (plus unknown keys)."""
+    out = {k: v for k, v in data.items() if k not in ("arms", "N", "S")}
+    combo_stats = {key: _arm(stats) for key, stats in (data.get("combo_stats") or {}).items()}
+    arms = data.get("arms") or []
+    if arms:
+        # Single-dimension bandit: parallel arms / N / S lists
+        counts, sums = data.get("N") or [], data.get("S") or []
+        for i, arm in enumerate(arms):
+            key = combo_key(arm) if isinstance(arm, dict) else str(arm)
+            if key not in combo_stats:
+                n = counts[i] if i < len(counts) else 0
+                s = sums[i] if i < len(sums) else 0.0
+                combo_stats[key] = {"N": n, "S": s, "scores": [s / n] * min(n, SCORES_KEEP) if n else []}
+        log.info(f"bandit_state: migrated {len(arms)} legacy arms to combo_stats")
+    out["combo_stats"] = combo_stats
+    out["t"] = data.get("t", 0) or 0
+    out["banned_combos"] = list(dict.fromkeys(data.get("banned_combos") or []))
+    out.setdefault("version", 0)
+    return out
+
+
+def bandit_arm_count(data: Dict[str, Any]) -> int:
+    """Arms the bandit has statistics for (the ``learning_arms`` stat).
+
+    Counts ``combo_stats`` keys plus legacy ``arms`` not migrated yet, so the
+    number is the same before and after ``normalize_bandit_state``.
+    """
+    arms = {combo_key(arm) if isinstance(arm, dict) else str(arm) for arm in data.get("arms") or []}
+    return len(arms.union(data.get("combo_stats") or {}))
+
+
+def merge_bandit_state(base: Dict[str, Any], ours: Dict[str, Any], theirs: Dict[str, Any]) -> Dict[str, Any]:
+    """Replay the changes ``base`` -> ``ours`` on top of ``theirs``.
+
+    Counters add their deltas, new scores are appended (last SCORES_KEEP kept),
+    bans are a set merge (ours added/removed since base, everything else from theirs).
+    """
+    merged = dict(theirs)
+    merged["t"] = theirs.get("t", 0) + ours.get("t", 0) - base.get("t", 0)
+
+    base_stats = base.get("combo_stats") or {}
+    combo_stats = dict(theirs.get("combo_stats") or {})
+    for key, mine in (ours.get("combo_stats") or {}).items():
+        before = base_stats.get(key) or {"N": 0, "S": 0.0, "scores": []}
+        dn = mine.get("N", 0) - before.get("N", 0)
+        ds = mine.get("S", 0.0) - before.get("S", 0.0)
+        if not dn and not ds:
+            continue
+        current = combo_stats.get(key) or {"N": 0, "S": 0.0, "scores": []}
+        added = list(mine.get("scores", []))[-dn:] if dn > 0 else []
+        combo_stats[key] = dict(current, N=current.get("N", 0) + dn, S=current.get("S", 0.0) + ds,
+                                scores=(list(current.get("scores", [])) + added)[-SCORES_KEEP:])
+    merged["combo_stats"] = combo_stats
+
+    base_banned = set(base.get("banned_combos") or [])
+    our_banned = list(ours.get("banned_combos") or [])
+    removed = base_banned - set(our_banned)
+    banned = [k for k in theirs.get("banned_combos") or [] if k not in removed]
+    seen = set(banned)
+    banned.extend(k for k in our_banned if k not in base_banned and k not in seen)
+    merged["banned_combos"] = list(dict.fromkeys(banned))
+
+    managed = ("version", "t", "combo_stats", "banned_combos")
+    for key, value in ours.items():
+        if key not in managed and value != base.get(key):
+            merged[key] = value
+    return merged
+
+
+def merge_knowledge(base: Dict[str, Any], ours: Dict[str, Any], theirs: Dict[str, Any]) -> Dict[str, Any]:
+    """Replay the agent's changes ``base`` -> ``ours`` on top of ``theirs`` (knowledge.json).
+
+    The agent only appends to ``history``: entries past the base length go after the
+    current history, whose entries keep the ``manual_rating`` folded in meanwhile. A
+    best_score the agent raised wins only if it is still the highest.
+    """
+    merged = dict(theirs)
+    history = list(theirs.get("history") or [])
+    history.extend((ours.get("history") or [])[len(base.get("history") or []):])
+    merged["history"] = history
+    best = ours.get("best_score") or 0
+    if best != (base.get("best_score") or 0) and best > (theirs.get("best_score") or 0):
+        merged["best_score"] = ours["best_score"]
+        merged["best_params"] = ours.get("best_params", {})
+
+    managed = ("version", "history", "best_score", "best_params")
+    for key, value in ours.items():
+        if key not in managed and value != base.get(key):
+            merged[key] = value
+    return merged
+
+
+_states: Dict[str, VersionedState] = {}
+_states_lock = threading.Lock()
+
+
+def _get_state(path: str, default: Dict[str, Any], normalize=None) -> VersionedState:
+    key = os.path.abspath(path)
+    with _states_lock:
+        if key not in _states:
+            _states[key] = VersionedState(key, default, normalize)
+        return _states[key]
+
+
+def get_bandit_state(path: str) -> VersionedState:
+    """Process-wide VersionedState for a bandit_state.json (one thread lock per file)."""
+    return _get_state(path, BANDIT_STATE_DEFAULT, normalize_bandit_state)
+
+
+def get_knowledge_state(path: str) -> VersionedState:
+    """Process-wide VersionedState for a knowledge.json (JSON backend)."""
+    return _get_state(path, KNOWLEDGE_DEFAULT)
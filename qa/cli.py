@@ -18,7 +18,8 @@ except Exception:
 
 def main():
     parser = argparse.ArgumentParser()
-    parser.add_argument("--api", default="http://127.0.0.1:8188")
+    parser.add_argument("--api", default="http://127.0.0.1:8188",
+                        help="ComfyUI API; кілька бекендів через кому (або COMFY_ENDPOINTS) — пул з балансуванням навантаження")
     parser.add_argument("--workflow", required=False)
     parser.add_argument("--state-dir", default="/workspace/wan22_system/auto_state")
     parser.add_argument("--seconds", type=float, default=5.0)
@@ -28,6 +29,11 @@ def main():
     parser.add_argument("--train-improved", action="store_true")
     parser.add_argument("--reference-only", action="store_true", help="Використовувати тільки еталонні параметри з reference_params.json")
     parser.add_argument("--reference-file", type=str, help="Шлях до reference_params.json (опційно)")
+    parser.add_argument("--pipeline", action="store_true", default=None,
+                        help="Конвеєр: наступна генерація ставиться в ComfyUI, поки попереднє відео аналізується (або AGENT_PIPELINE=1)")
+    parser.add_argument("--analysis-workers", type=int, default=None, help="Потоків аналізу в режимі --pipeline (AGENT_ANALYSIS_WORKERS, 1)")
+    parser.add_argument("--queue-depth", type=int, default=None,
+                        help="Скільки задач тримати в черзі ComfyUI одночасно (AGENT_QUEUE_DEPTH, 1)")
 
     # Two-stage (T2I -> I2V) pipeline options
     parser.add_argument("--two-stage", action="store_true", help="Запуск двоетапного T2I→I2V пайплайна")
@@ -91,6 +97,13 @@ def main():
 
     stats = agent.get_stats_v4()
     agent_mod.log.info(f"📊 QA initial stats: {stats}")
-    agent.search_v4(iterations=args.iterations)
+    search_kwargs = {"pipelined": args.pipeline}
+    if args.analysis_workers:
+        search_kwargs["analysis_workers"] = args.analysis_workers
+    if args.queue_depth:
+        search_kwargs["queue_depth"] = args.queue_depth
+    run_stats = agent.search_v4(iterations=args.iterations, **search_kwargs)
+    if run_stats is not None:
+        agent_mod.log.info(f"⏱️ QA run stats: {run_stats.as_dict()}")
 
 
@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Stub ComfyUI server: the API subset the agent uses, without a GPU.
+
+  POST /prompt           queue a workflow → {"prompt_id", "number"}
+  GET  /queue            {"queue_running": [...], "queue_pending": [...]}
+  GET  /history[/<id>]   finished jobs with their outputs and status
+  GET  /system_stats     one fake device (--vram-gb, free VRAM drops while busy)
+  GET  /object_info      {}
+  POST /upload/image     multipart upload into --input-dir
+  GET  /view             an output (or input) file
+
+One worker thread plays the GPU: jobs run in queue order, each takes
+--render-s seconds and then writes a file for every node with a
+``filename_prefix`` input (``<prefix>_00001_.png`` for SaveImage,
+``<prefix>_00001_.mp4`` otherwise; the bytes of --sample if given). A
+fraction --fail-rate of the jobs ends with status "error" instead.
+
+Usage: python -m qa.stub_comfyui --port 8190 [--output-dir DIR] [--render-s 5] [--fail-rate 0.1]
+Several stubs on different ports make a pool: --api http://127.0.0.1:8190,http://127.0.0.1:8191
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import argparse
+import tempfile
+import threading
+from collections import deque
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+
+class StubComfyUI:
+    """Queue, fake GPU worker and history of one stub backend."""
+
+    def __init__(self, port: int = 0, host: str = "127.0.0.1", output_dir: str = None, input_dir: str = None,
+                 render_s: float = 5.0, fail_rate: float = 0.0, vram_gb: float = 48.0, sample: str = None,
+                 seed: int = None):
+        root = None if output_dir and input_dir else tempfile.mkdtemp(prefix="stub_comfyui_")
+        self.output_dir = output_dir or os.path.join(root, "output")
+        self.input_dir = input_dir or os.path.join(root, "input")
+        os.makedirs(self.output_dir, exist_ok=True)
+        os.makedirs(self.input_dir, exist_ok=True)
+        self.render_s = render_s
+        self.fail_rate = fail_rate
+        self.vram_total = int(vram_gb * 2 ** 30)
+        self.sample = sample
+        self._rnd = random.Random(seed)
+        self._cv = threading.Condition()
+        self._pending = deque()
+        self._running = None
+        self._history = {}
+        self._number = 0
+        self._counters = {}
+        self._stopped = False
+        self.completed = 0
+        self.failed = 0
+        self.server = ThreadingHTTPServer((host, port), self._handler_class())
+        self.server.daemon_threads = True
+        self.url = f"http://{host}:{self.server.server_address[1]}"
+        self._threads = [threading.Thread(target=self.server.serve_forever, daemon=True),
+                         threading.Thread(target=self._work, daemon=True)]
+
+    def start(self) -> "StubComfyUI":
+        for t in self._threads:
+            t.start()
+        return self
+
+    def stop(self):
+        """Shut the HTTP server down (like a pod going away); queued jobs are dropped."""
+        with self._cv:
+            self._stopped = True
+            self._cv.notify_all()
+        self.server.shutdown()
+        self.server.server_close()
+
+    # --- Queue / worker ------------------------------------------------------------
+    def submit(self, workflow: dict) -> dict:
+        with self._cv:
+            prompt_id = str(uuid.uuid4())
+            self._number += 1
+            self._pending.append((self._number, prompt_id, workflow))
+            self._cv.notify()
+            return {"prompt_id": prompt_id, "number": self._number, "node_errors": {}}
+
+    def queue_status(self) -> dict:
+        with self._cv:
+            running = [[n, pid, wf, {}, []] for n, pid, wf in ([self._running] if self._running else [])]
+            return {"queue_running": running, "queue_pending": [[n, pid, wf, {}, []] for n, pid, wf in self._pending]}
+
+    def system_stats(self) -> dict:
+        with self._cv:
+            busy = self._running is not None
+        return {
+            "system": {"os": os.name, "python_version": sys.version.split()[0], "comfyui_version": "stub"},
+            "devices": [{"name": "stub", "type": "cuda", "index": 0, "vram_total": self.vram_total,
+                         "vram_free": self.vram_total // 4 if busy else self.vram_total}],
+        }
+
+    def _work(self):
+        while True:
+            with self._cv:
+                while not self._pending and not self._stopped:
+                    self._cv.wait()
+                if self._stopped:
+                    return
+                self._running = self._pending.popleft()
+            number, prompt_id, workflow = self._running
+            time.sleep(self.render_s)
+            with self._cv:
+                if self._stopped:
+                    return
+                if self._rnd.random() < self.fail_rate:
+                    self.failed += 1
+                    status = {"status_str": "error", "completed": False,
+                              "messages": [["execution_error", {"exception_message": "stub failure"}]]}
+                    outputs = {}
+                else:
+                    self.completed += 1
+                    status = {"status_str": "success", "completed": True, "messages": []}
+                    outputs = self._write_outputs(workflow)
+                self._history[prompt_id] = {"prompt": [number, prompt_id, workflow, {}, []],
+                                            "outputs": outputs, "status": status}
+                self._running = None
+
+    def _write_outputs(self, workflow: dict) -> dict:
+        outputs = {}
+        for node_id, node in (workflow or {}).items():
+            inputs = node.get("inputs") if isinstance(node, dict) else None
+            if not isinstance(inputs, dict) or not isinstance(inputs.get("filename_prefix"), str):
+                continue
+            subfolder, base = os.path.split(inputs["filename_prefix"])
+            image = node.get("class_type") == "SaveImage"
+            key = (subfolder, base)
+            self._counters[key] = self._counters.get(key, 0) + 1
+            filename = f"{base}_{self._counters[key]:05d}_.{'png' if image else 'mp4'}"
+            path = os.path.join(self.output_dir, subfolder, filename)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            if self.sample and os.path.exists(self.sample):
+                with open(self.sample, "rb") as src, open(path, "wb") as dst:
+                    dst.write(src.read())
+            else:
+                with open(path, "wb") as f:
+                    f.write(b"stub comfyui output\n")
+            item = {"filename": filename, "subfolder": subfolder, "type": "output"}
+            outputs[node_id] = {"images": [item]} if image else {"gifs": [dict(item, format="video/h264-mp4")]}
+        return outputs
+
+    # --- HTTP ---------------------------------------------------------------------
+    def _handler_class(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _json(self, obj, code=200):
+                body = json.dumps(obj).encode("utf-8")
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _body(self) -> bytes:
+                return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                if url.path == "/queue":
+                    return self._json(stub.queue_status())
+                if url.path == "/system_stats":
+                    return self._json(stub.system_stats())
+                if url.path == "/object_info":
+                    return self._json({})
+                if url.path == "/history" or url.path.startswith("/history/"):
+                    prompt_id = url.path[len("/history/"):]
+                    with stub._cv:
+                        if prompt_id:
+                            entry = stub._history.get(prompt_id)
+                            return self._json({prompt_id: entry} if entry else {})
+                        return self._json(dict(stub._history))
+                if url.path == "/view":
+                    q = {k: v[0] for k, v in parse_qs(url.query).items()}
+                    base = stub.input_dir if q.get("type") == "input" else stub.output_dir
+                    path = os.path.abspath(os.path.join(base, q.get("subfolder", ""), q.get("filename", "")))
+                    if not path.startswith(os.path.abspath(base) + os.sep) or not os.path.isfile(path):
+                        return self._json({"error": "not found"}, 404)
+                    with open(path, "rb") as f:
+                        data = f.read()
+                    self.send_response(200)
+                    self.send_header("Content-Type", "application/octet-stream")
+                    self.send_header("Content-Length", str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+                    return
+                self._json({"error": "not found"}, 404)
+
+            def do_POST(self):
+                url = urlparse(self.path)
+                if url.path == "/prompt":
+                    try:
+                        data = json.loads(self._body() or b"{}")
+                    except ValueError:
+                        return self._json({"error": "invalid json"}, 400)
+                    if not isinstance(data.get("prompt"), dict):
+                        return self._json({"error": "no prompt"}, 400)
+                    return self._json(stub.submit(data["prompt"]))
+                if url.path == "/upload/image":
+                    head = f"Content-Type: {self.headers.get('Content-Type')}\r\n\r\n".encode("utf-8")
+                    msg = BytesParser(policy=HTTP).parsebytes(head + self._body())
+                    fields, upload = {}, None
+                    for part in msg.iter_parts():
+                        name = part.get_param("name", header="content-disposition")
+                        if part.get_filename():
+                            upload = (part.get_filename(), part.get_payload(decode=True))
+                        elif name:
+                            fields[name] = part.get_content().strip()
+                    if upload is None:
+                        return self._json({"error": "no image"}, 400)
+                    subfolder = fields.get("subfolder", "")
+                    filename = os.path.basename(upload[0])
+                    path = os.path.join(stub.input_dir, subfolder, filename)
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    with open(path, "wb") as f:
+                        f.write(upload[1])
+                    return self._json({"name": filename, "subfolder": subfolder, "type": "input"})
+                self._json({"error": "not found"}, 404)
+
+        return Handler
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Заглушка ComfyUI API для тестів агента без GPU")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8190)
+    ap.add_argument("--output-dir", help="Куди писати результати (за замовчуванням — тимчасова папка)")
+    ap.add_argument("--input-dir", help="Куди зберігати /upload/image")
+    ap.add_argument("--render-s", type=float, default=5.0, help="Тривалість однієї задачі, с")
+    ap.add_argument("--fail-rate", type=float, default=0.0, help="Частка задач, що завершуються помилкою")
+    ap.add_argument("--vram-gb", type=float, default=48.0)
+    ap.add_argument("--sample", help="Файл, який копіюється як результат кожної задачі (наприклад, справжнє mp4)")
+    args = ap.parse_args(argv)
+    stub = StubComfyUI(args.port, args.host, args.output_dir, args.input_dir, args.render_s, args.fail_rate,
+                       args.vram_gb, args.sample).start()
+    print(f"stub ComfyUI at {stub.url} (output {stub.output_dir}, input {stub.input_dir})", flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        stub.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -10,10 +10,17 @@ from typing import Dict, Any, List, Tuple
 
 from qa.agent_namespace import agent_mod
 from eva_p1.comfy_client import ComfyClient
+from eva_p1.comfy_pool import create_comfy_client
 from eva_p1.workflow import apply_t2i_params_to_workflow, apply_i2v_params_to_workflow
 from eva_p1.knowledge_analyzer import KnowledgeAnalyzer
 from eva_p1.prompt_generator import MegaEroticJSONPromptGenerator, EroticFullBodyPhotoPromptGenerator
 from eva_p1.scenario import build_video_prompt_from_photo
+from eva_state.sqlite_catalog import get_sqlite_catalog
+from eva_state.knowledge_segments import get_knowledge_segments
+from eva_state.prompt_store import compact_refs, expand_refs
+from eva_state.serializer import load_file
+from eva_state.stats_aggregates import record_generation
+from eva_state.versioned_state import get_knowledge_state
 
 
 def _ensure_dirs(root: str):
@@ -51,8 +58,7 @@ def _load_reference_params(path_hint: str | None) -> List[Dict[str, Any]]:
     for p in candidates:
         try:
             if p and os.path.exists(p):
-                with open(p, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
+                data = expand_refs(load_file(p), os.path.dirname(os.path.abspath(p)))
                 # normalize to list of params dicts
                 items: List[Dict[str, Any]] = []
                 def _norm_list(li):
@@ -141,6 +147,15 @@ def _choose_persona(i: int) -> Dict[str, Any]:
     }
 
 
+def _history_output(entry: Dict[str, Any], comfy_out: str, exts: Tuple[str, ...]) -> str | None:
+    """First output file of a finished job (ComfyUI /history entry) present under comfy_out."""
+    for item in ComfyClient.output_files(entry or {}):
+        path = os.path.join(comfy_out, item.get("subfolder") or "", item["filename"])
+        if path.lower().endswith(exts) and os.path.exists(path):
+            return path
+    return None
+
+
 def _save_json(path: str, obj: Any):
     os.makedirs(os.path.dirname(path), exist_ok=True)
     with open(path, 'w', encoding='utf-8') as f:
@@ -202,7 +217,8 @@ def run_t2i2v(args):
         agent_mod.log.warning("⚠️ reference_params.json порожній/відсутній — відео піде з дефолтами")
 
     sizes = _parse_sizes(args.i2v_widths)
-    client = ComfyClient(args.api)
+    # One endpoint, or a ComfyClientPool for a comma-separated --api / COMFY_ENDPOINTS (outputs land in comfy_out)
+    client = create_comfy_client(args.api, output_dir=comfy_out)
 
     for i in range(int(args.iterations)):
         iter_id = f"iter_{i+1:04d}"
@@ -246,17 +262,17 @@ def run_t2i2v(args):
         # Build and queue T2I
         wf_t2i = apply_t2i_params_to_workflow(base_t2i, t2i_params)
         pid_img = client.queue(wf_t2i)
-        _ = client.wait(pid_img, timeout_s=1200)
+        hist_img = client.wait(pid_img, timeout_s=1200)
 
-        # Resolve image path produced by SaveImage
-        produced_image = None
+        # Resolve image path produced by SaveImage (reported in history first)
+        produced_image = _history_output(hist_img, comfy_out, ('.png', '.jpg'))
         try:
             # best-effort: look for latest file matching prefix under comfy_out
             prefix_rel = t2i_params["prefix"].rstrip('/')
             prefix_name = os.path.basename(prefix_rel)
             # Walk output dir for files containing 'image' prefix folder
             cand_dir = os.path.join(comfy_out, os.path.dirname(prefix_rel))
-            if os.path.isdir(cand_dir):
+            if not produced_image and os.path.isdir(cand_dir):
                 for f in os.listdir(cand_dir):
                     if f.startswith(os.path.basename(prefix_rel)) or f.endswith('.png') or f.endswith('.jpg'):
                         produced_image = os.path.join(cand_dir, f)
@@ -315,14 +331,15 @@ def run_t2i2v(args):
         i2v_params_full.setdefault("sampler", "euler")
         i2v_params_full.setdefault("scheduler", "simple")
         wf_i2v = apply_i2v_params_to_workflow(base_i2v, i2v_params_full, input_basename)
-        pid_vid = client.queue(wf_i2v)
-        _ = client.wait(pid_vid, timeout_s=1800)
+        # The input image is uploaded to the backend first unless it shares this machine's ComfyUI dirs
+        pid_vid = client.queue(wf_i2v, inputs=[input_image_path])
+        hist_vid = client.wait(pid_vid, timeout_s=1800)
 
         # Resolve video path
-        produced_video = None
+        produced_video = _history_output(hist_vid, comfy_out, ('.mp4',))
         try:
             cand_dir = os.path.join(comfy_out, os.path.dirname(i2v_params_full["prefix"]))
-            if os.path.isdir(cand_dir):
+            if not produced_video and os.path.isdir(cand_dir):
                 for f in os.listdir(cand_dir):
                     if f.startswith(os.path.basename(i2v_params_full["prefix"])) and f.lower().endswith('.mp4'):
                         produced_video = os.path.join(cand_dir, f)
@@ -362,11 +379,6 @@ def run_t2i2v(args):
         # Update isolated knowledge under Agent_T2I2V/state
         try:
             knowledge_path = os.path.join(state_dir, "knowledge.json")
-            if os.path.exists(knowledge_path):
-                with open(knowledge_path, 'r', encoding='utf-8') as f:
-                    K = json.load(f)
-            else:
-                K = {"best_score": 0.0, "best_params": {}, "history": []}
             entry = {
                 "video": local_video,
                 "source_image": local_image,
@@ -380,9 +392,19 @@ def run_t2i2v(args):
                 "photo_prompt": t2i_pos,
                 "photo_negative": t2i_neg,
             }
-            K.setdefault("history", []).append(entry)
-            with open(knowledge_path, 'w', encoding='utf-8') as f:
-                json.dump(K, f, ensure_ascii=False, indent=2)
+            state_db = get_sqlite_catalog(state_dir)
+            segments = get_knowledge_segments(state_dir)
+            if state_db is not None:
+                # SQLite catalog: one row insert instead of re-reading and rewriting the whole history
+                state_db.add_generation(entry)
+            elif segments is not None:
+                # Segmented history: one line appended to the tail segment
+                segments.append(entry)
+            else:
+                # Under the knowledge.json lock the review server folds ratings with
+                get_knowledge_state(knowledge_path).update(
+                    lambda K: K.setdefault("history", []).append(compact_refs(entry, state_dir)))
+            record_generation(state_dir)
         except Exception:
             pass
 
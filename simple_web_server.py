@@ -6,15 +6,381 @@ Enhanced Video Review System - Виправлена версія (Quick Fix)
 
 import http.server
 import socketserver
+import base64
+import email.utils
+import gzip
+import hashlib
 import json
 import os
+import queue
+import selectors
+import socket
+import threading
 import time
-import glob
 import urllib.parse
+from collections import ChainMap
 from datetime import datetime
-from typing import Dict, List, Optional
+from typing import Callable, Dict, List, Optional
+
+from eva_state.store import get_state_store
+from eva_state.knowledge_index import KnowledgeIndex
+from eva_state.search_index import FACETS, get_search_index_updater
+from eva_state.output_catalog import get_output_catalog
+from eva_state.rating_journal import atomic_write_json, get_rating_journal
+from eva_state.event_bus import EventBus
+from eva_state.sqlite_catalog import get_sqlite_catalog
+from eva_state.knowledge_segments import get_knowledge_segments
+from eva_state.prompt_store import get_prompt_store
+from eva_state.versioned_state import BANDIT_STATE_DEFAULT, bandit_arm_count, get_bandit_state
+from eva_state.serializer import load_file
+from eva_state.stats_aggregates import StatsAggregates
+from eva_state.review_queue import ReviewQueueView, get_review_queue, item_id, review_queue_enabled
+
+# JSON-відповіді, менші за цей розмір, не стискаються (gzip-заголовок з'їдає виграш)
+GZIP_MIN_BYTES = 1024
+GZIP_LEVEL = 5
+
+# Поля елемента /api/videos за замовчуванням; важкий текст (промпти, debug) — через fields= або /api/video_details
+VIDEO_LIST_DEFAULT_FIELDS = (
+    'name', 'size_mb', 'created', 'fps', 'width', 'height', 'seconds', 'seed',
+    'combo', 'iteration', 'auto_metrics', 'photo_path', 'found_in_knowledge', 'match_method',
+)
+VIDEO_LIST_HEAVY_FIELDS = ('prompt', 'video_negative', 'photo_prompt', 'photo_negative', 'search_details')
+# Текстові поля запису knowledge, які /api/search може додати до елемента на запит (fields=prompt,...)
+SEARCH_TEXT_FIELDS = ('prompt', 'negative_prompt', 'photo_prompt', 'photo_negative')
+
+# Максимум дій в одному /api/rate_batch або /api/ban_combo_batch
+MAX_BATCH_ACTIONS = 1000
+# Найдовша оренда кліпу рецензентом через /api/review/lease (типова — REVIEW_LEASE_S)
+REVIEW_LEASE_MAX_S = 24 * 3600.0
+
+# Розмір блоку для потокової відправки відео/зображень, якщо sendfile недоступний
+STREAM_CHUNK_SIZE = 256 * 1024
+# /api/events: коментар-пінг раз на N секунд (тримає проксі RunPod і виявляє закриті вкладки)
+SSE_KEEPALIVE_S = 15.0
+# Пачка оцінок/нових файлів дає одну дельту статистики, а не по одній на подію
+SSE_STATS_DEBOUNCE_S = 0.5
+# SSE-клієнт, що не прийняв стільки байтів, відключається (EventSource перепідключиться з Last-Event-ID)
+SSE_CLIENT_BUFFER_MAX = 1024 * 1024
+
+# ReviewHTTPServer: фіксовані пули потоків замість потоку на кожне з'єднання.
+# Окрема смуга для довгих відповідей (відео, зображення), щоб API не чекало за ними;
+# відкриті /api/events не тримають жодного робочого потоку (їх пише один потік із селектором).
+SERVER_API_WORKERS = int(os.environ.get('SERVER_API_WORKERS', '8'))
+SERVER_STREAM_WORKERS = int(os.environ.get('SERVER_STREAM_WORKERS', '32'))
+SERVER_REQUEST_QUEUE_SIZE = 128
+# Простоююче keep-alive з'єднання закривається через стільки секунд
+KEEPALIVE_IDLE_S = 30.0
+SOCKET_TIMEOUT_S = 60.0
+STREAM_PATH_PREFIXES = ('/video/', '/image_file')
+
+
+def _requested_fields(query_params: dict, default: Optional[tuple]) -> Optional[tuple]:
+    """Розбір параметра fields= (через кому, можна повторювати).
+
+    Без параметра — `default`; `fields=all` або `fields=*` — None (повний елемент).
+    """
+    names = [f.strip() for raw in query_params.get('fields', []) for f in raw.split(',') if f.strip()]
+    if not names:
+        return default
+    if 'all' in names or '*' in names:
+        return None
+    return tuple(dict.fromkeys(names))
+
+
+def _project(item: dict, fields: Optional[tuple], keep: tuple = ('name',)) -> dict:
+    """Залишає в елементі лише `fields` (плюс `keep`); None — без змін."""
+    if fields is None:
+        return item
+    return {k: item[k] for k in keep + fields if k in item}
+
+
+def _cursor_param(query: str) -> Optional[str]:
+    """Параметр cursor= запиту: None — немає (стара offset-пагінація), '' — перша сторінка."""
+    values = urllib.parse.parse_qs(query, keep_blank_values=True).get('cursor')
+    return values[0] if values else None
+
+
+def _encode_cursor(entry) -> str:
+    """Непрозорий курсор пагінації: позиція (mtime, name) останнього відданого відео."""
+    raw = json.dumps([entry.mtime, entry.name], ensure_ascii=False, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def _decode_cursor(cursor: str):
+    """(mtime, name) з курсора; ValueError, якщо курсор пошкоджений."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        mtime, name = json.loads(raw.decode('utf-8'))
+        return float(mtime), str(name)
+    except Exception:
+        raise ValueError(f'invalid cursor: {cursor!r}')
+
+
+def _parse_byte_range(header: str, size: int):
+    """Розбір заголовка Range для одного діапазону.
+
+    Повертає (start, end) включно, None — якщо заголовок треба ігнорувати
+    (кілька діапазонів або інша одиниця), ValueError — якщо діапазон не задовольнити (416).
+    """
+    unit, _, spec = header.partition('=')
+    if unit.strip().lower() != 'bytes' or ',' in spec:
+        return None
+    first, sep, last = spec.strip().partition('-')
+    if not sep:
+        return None
+    first, last = first.strip(), last.strip()
+    if not (first or last) or (first and not first.isdigit()) or (last and not last.isdigit()):
+        return None
+    if not first:
+        # bytes=-N: останні N байт
+        suffix = int(last)
+        if suffix <= 0:
+            raise ValueError(f'unsatisfiable range: {header}')
+        return max(size - suffix, 0), size - 1
+    start = int(first)
+    end = int(last) if last else size - 1
+    if start >= size or end < start:
+        raise ValueError(f'unsatisfiable range: {header}')
+    return start, min(end, size - 1)
+
+def _sse_message(event_type: str, data, event_id: int) -> bytes:
+    """Одне повідомлення text/event-stream (JSON у рядку data)."""
+    payload = json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+    return f"id: {event_id}\nevent: {event_type}\ndata: {payload}\n\n".encode('utf-8')
+
+
+def _review_state_snapshot(state_store, journal, auto_state_dir: str):
+    """Знімок стейт-файлів + незлитого журналу (спільний для запитів і фіду подій)."""
+    # Журнал беремо ДО файлів: злиття між двома читаннями дасть дубль, а не пропуск
+    view = journal.view()
+    state_db = get_sqlite_catalog(auto_state_dir)
+    segments = get_knowledge_segments(auto_state_dir) if state_db is None else None
+    review_queue = get_review_queue(auto_state_dir) if state_db is None else None
+    if state_db is None:
+        files = {
+            "manual_ratings": (os.path.join(auto_state_dir, "manual_ratings.json"), {}),
+            "bandit_state": (os.path.join(auto_state_dir, "bandit_state.json"), BANDIT_STATE_DEFAULT),
+        }
+        if segments is None:
+            files["knowledge"] = (os.path.join(auto_state_dir, "knowledge.json"), {"best_score": 0, "best_params": {}, "history": []})
+        if review_queue is None:
+            files["review_queue"] = (os.path.join(auto_state_dir, "review_queue.json"), {"pending": [], "in_review": [], "completed": []})
+        snap = state_store.snapshot(files)
+        if segments is not None:
+            # Сегменти історії: перевіряється лише маніфест, перечитуються тільки змінені сегменти
+            version, knowledge = segments.document()
+            snap = snap.overlay({"knowledge": knowledge}, {"knowledge": f"seg:{version}"})
+        if review_queue is not None:
+            # Журнал черги: дочитуються лише нові рядки, пошук кліпу за іменем — O(1)
+            snap = snap.overlay({"review_queue": review_queue.view()}, {"review_queue": review_queue.version},
+                                {"review_queue": review_queue.signature()})
+    else:
+        # SQLite-каталог: на новий rev (агент додав генерацію або компактор злив журнал) дочитуються
+        # лише нові рядки та перезаписані оцінкою генерації; bandit_state лишається JSON
+        snap = state_store.snapshot({
+            "bandit_state": (os.path.join(auto_state_dir, "bandit_state.json"), BANDIT_STATE_DEFAULT),
+        })
+        rev, db_documents = state_db.documents()
+        snap = snap.overlay(db_documents, {name: f"db:{rev}" for name in db_documents})
+    prompts = get_prompt_store(auto_state_dir) if state_db is None else None
+    if prompts is not None:
+        # Посилання на prompt store → повні тексти, раз на версію документа
+        # (сегменти, журнал черги й рядки SQLite-каталогу розгортаються самі)
+        names = [name for name, own in (("knowledge", segments), ("review_queue", review_queue)) if own is None]
+        expanded = {name: state_store.derived(f"expanded:{name}", snap, [name], lambda s, n=name: prompts.expand(s[n]))
+                    for name in names}
+        snap = snap.overlay(expanded, {name: snap.versions.get(name) for name in names},
+                            {name: snap.signatures.get(name) for name in names})
+    documents = {"journal": view}
+    if view.ratings:
+        documents["manual_ratings"] = ChainMap(view.ratings, snap["manual_ratings"])
+    return snap.overlay(documents, {"journal": view.seq})
+
+
+def _compute_stats(totals: dict, bandit_state, view) -> dict:
+    """Зведена статистика: лічильники StatsAggregates + bandit t і незлиті оцінки журналу (O(1))."""
+    return dict(
+        totals,
+        bandit_iterations=bandit_state.get("t", 0) + view.rated_count,
+        learning_arms=bandit_arm_count(bandit_state),
+    )
+
+
+def _full_recount(state_store, catalog, journal, auto_state_dir: str):
+    """Повний перерахунок для перевірки лічильників: оцінки, файли в output, довжина історії, best_score."""
+    snap = _review_state_snapshot(state_store, journal, auto_state_dir)
+    knowledge = snap["knowledge"]
+    return (snap["manual_ratings"], list(catalog.snapshot(force=True).by_name),
+            len(knowledge.get("history", [])), knowledge.get("best_score", 0))
+
+
+_stats_aggregates: Dict[str, StatsAggregates] = {}
+_stats_aggregates_lock = threading.Lock()
+
+
+def get_stats_aggregates(state_store, catalog, journal, auto_state_dir: str) -> StatsAggregates:
+    """Лічильники статистики на процес: підписані на журнал і каталог, перевіряються повним перерахунком."""
+    key = os.path.abspath(auto_state_dir)
+    aggregates = _stats_aggregates.get(key)
+    if aggregates is None:
+        with _stats_aggregates_lock:
+            aggregates = _stats_aggregates.get(key)
+            if aggregates is None:
+                aggregates = StatsAggregates(auto_state_dir)
+                journal.add_listener(aggregates.on_journal_append)
+                catalog.add_listener(aggregates.on_catalog_change)
+                catalog.start()
+                aggregates.start(lambda: _full_recount(state_store, catalog, journal, auto_state_dir))
+                _stats_aggregates[key] = aggregates
+    return aggregates
+
+
+_review_queues_attached = set()
+_review_queues_lock = threading.Lock()
+
+
+def get_server_review_queue(state_store, journal, auto_state_dir: str):
+    """Черга рецензування процесу (None для review_queue.json / SQLite).
+
+    Оцінка чи бан із позначкою в журналі завершує кліп черги; при першому відкритті
+    завершуються кліпи, які вже мають оцінку (напр. після імпорту review_queue.json).
+    """
+    review_queue = get_review_queue(auto_state_dir)
+    key = os.path.abspath(auto_state_dir)
+    if review_queue is None or key in _review_queues_attached:
+        return review_queue
+    with _review_queues_lock:
+        if key not in _review_queues_attached:
+            journal.add_listener(review_queue.on_journal_append)
+            done = review_queue.reconcile(_review_state_snapshot(state_store, journal, auto_state_dir)["manual_ratings"])
+            if done:
+                print(f"📋 Черга рецензування: {done} вже оцінених кліпів позначено завершеними")
+            _review_queues_attached.add(key)
+    return review_queue
+
+
+def _review_queue_map(snap) -> dict:
+    """Ім'я кліпу → запис pending з документа review_queue (раз на версію документа)."""
+    rq_map = {}
+    for entry in snap["review_queue"].get("pending", []):
+        name = os.path.basename(entry.get("original_path", "")) if isinstance(entry, dict) else ""
+        if name:
+            rq_map[name] = entry
+    return rq_map
+
+
+def _current_stats(state_store, catalog, journal, auto_state_dir: str) -> dict:
+    aggregates = get_stats_aggregates(state_store, catalog, journal, auto_state_dir)
+    bandit_state = state_store.load(os.path.join(auto_state_dir, "bandit_state.json"), BANDIT_STATE_DEFAULT)
+    return _compute_stats(aggregates.totals(), bandit_state, journal.view())
+
+
+class ReviewEventFeed:
+    """Спільне для процесу джерело подій /api/events.
+
+    Каталог (новий файл у output) і журнал (оцінка/бан) публікують події в одну
+    шину; кожне SSE-з'єднання лише чекає на її condition variable. Статистика
+    перераховується один раз на пачку змін (з дебаунсом) і лише коли є
+    підписники, а клієнтам іде тільки дельта полів, що змінились.
+    """
+
+    def __init__(self, state_store, catalog, journal, auto_state_dir: str):
+        self.state_store = state_store
+        self.catalog = catalog
+        self.journal = journal
+        self.auto_state_dir = auto_state_dir
+        self.bus = EventBus()
+        self._lock = threading.Lock()
+        self._stats: Optional[dict] = None
+        self._stats_timer: Optional[threading.Timer] = None
+        catalog.add_listener(self._on_catalog_change)
+        journal.add_listener(self._on_journal_append)
+        # Без опитувань з вкладок каталог оновлює фоновий потік
+        catalog.start()
+
+    def current_stats(self) -> dict:
+        stats = _current_stats(self.state_store, self.catalog, self.journal, self.auto_state_dir)
+        with self._lock:
+            self._stats = stats
+        return stats
+
+    def _on_catalog_change(self, delta, snap):
+        if delta.added:
+            added = [snap.by_name[n] for n in delta.added if n in snap.by_name]
+            added.sort(key=lambda e: (-e.mtime, e.name))
+            self.bus.publish('video_added', {
+                'videos': [{'name': e.name, 'size_mb': round(e.size / (1024 * 1024), 2),
+                            'created': datetime.fromtimestamp(e.mtime).isoformat()} for e in added],
+            })
+        if delta.removed:
+            self.bus.publish('video_removed', {'videos': list(delta.removed)})
+        self._schedule_stats()
+
+    def _on_journal_append(self, records):
+        rated = [{'video': r['video'], 'overall_quality': (r['entry'].get('rating') or {}).get('overall_quality')}
+                 for r in records if r.get('op') == 'rate']
+        banned = [r for r in records if r.get('op') == 'ban']
+        if rated:
+            self.bus.publish('video_rated', {'videos': rated})
+        if banned:
+            self.bus.publish('combo_banned', {
+                'combos': list(dict.fromkeys(r['combo_key'] for r in banned)),
+                # Відео, позначені баном, теж зникають з черги неоцінених
+                'videos': [r['video'] for r in banned if r.get('entry') is not None],
+            })
+        if rated or banned:
+            self._schedule_stats()
+
+    def _schedule_stats(self):
+        with self._lock:
+            if self.bus.subscribers <= 0:
+                # Нікого слухати: не рахуємо, новий клієнт отримає повну статистику при підключенні
+                self._stats = None
+                return
+            if self._stats_timer is not None:
+                return
+            self._stats_timer = threading.Timer(SSE_STATS_DEBOUNCE_S, self._publish_stats)
+            self._stats_timer.daemon = True
+            self._stats_timer.start()
+
+    def _publish_stats(self):
+        with self._lock:
+            self._stats_timer = None
+            previous = self._stats
+        try:
+            stats = self.current_stats()
+        except Exception as e:
+            print(f"⚠️ Помилка розрахунку статистики для подій: {e}")
+            return
+        changed = {k: v for k, v in stats.items() if previous is None or previous.get(k) != v}
+        if changed:
+            self.bus.publish('stats', changed)
+
+
+_event_feeds: Dict[tuple, ReviewEventFeed] = {}
+_event_feeds_lock = threading.Lock()
+
+
+def get_event_feed(state_store, catalog, journal, auto_state_dir: str) -> ReviewEventFeed:
+    """Один фід подій на пару (output-директорія, auto_state) для всього процесу."""
+    key = (catalog.directory, os.path.abspath(auto_state_dir))
+    feed = _event_feeds.get(key)
+    if feed is None:
+        with _event_feeds_lock:
+            feed = _event_feeds.get(key)
+            if feed is None:
+                feed = ReviewEventFeed(state_store, catalog, journal, auto_state_dir)
+                _event_feeds[key] = feed
+    return feed
+
 
 class EnhancedVideoReviewHandler(http.server.SimpleHTTPRequestHandler):
+    # Постійні з'єднання: API-виклики й статика через проксі RunPod не відкривають нове TCP щоразу
+    protocol_version = 'HTTP/1.1'
+    # Повільний/завислий клієнт не тримає робочий потік вічно
+    timeout = SOCKET_TIMEOUT_S
+
     def __init__(self, *args, **kwargs):
         # Шляхи (конфігуруються через ENV)
         # COMFY_OUTPUT_DIR=/workspace/ComfyUI/output/
@@ -33,81 +399,197 @@ class EnhancedVideoReviewHandler(http.server.SimpleHTTPRequestHandler):
         # Забезпечуємо існування директорій
         os.makedirs(self.auto_state_dir, exist_ok=True)
         self._ensure_json_files()
+
+        # Спільний для всіх потоків кеш розпарсених JSON (перечитується лише при зміні файлу)
+        self.state_store = get_state_store(self.auto_state_dir)
+        # Спільний каталог output-директорії (os.scandir раз на інтервал замість glob+getmtime на кожен запит)
+        self.catalog = get_output_catalog(self.video_dir)
+        # Журнал оцінок/банів: POST лише дописує рядок, фоновий компактор зливає його у JSON-файли
+        self.journal = get_rating_journal(self.auto_state_dir)
+        # Черга рецензування: оренда кліпів рецензентами, оцінка завершує кліп
+        self.review_queue = get_server_review_queue(self.state_store, self.journal, self.auto_state_dir)
+        # Лічильники для /api/stats: оновлюються подіями журналу й каталогу з першого ж з'єднання
+        self.stats_aggregates = get_stats_aggregates(self.state_store, self.catalog, self.journal, self.auto_state_dir)
         
         super().__init__(*args, **kwargs)
     
+    def handle(self):
+        """Обробка запитів з'єднання.
+
+        Під ReviewHTTPServer простоююче keep-alive з'єднання не тримає робочий потік:
+        якщо наступний запит ще не прийшов, з'єднання повертається серверу (parked)
+        і знову потрапить у пул, коли клієнт щось надішле.
+        """
+        self.parked = False
+        self.sse_handoff = None
+        if not getattr(self.server, 'parks_idle_connections', False):
+            return super().handle()
+        self.close_connection = True
+        self.handle_one_request()
+        while not self.close_connection:
+            if not self._next_request_buffered():
+                self.parked = True
+                return
+            self.handle_one_request()
+
+    def _next_request_buffered(self) -> bool:
+        """Чи є вже байти наступного запиту (у буфері rfile або в сокеті), без блокування."""
+        try:
+            self.connection.setblocking(False)
+            try:
+                return bool(self.rfile.peek(1))
+            except (BlockingIOError, InterruptedError):
+                return False
+            finally:
+                self.connection.settimeout(self.timeout)
+        except OSError:
+            return False
+
     def _ensure_json_files(self):
         """Створення початкових JSON файлів, якщо вони не існують"""
         if not os.path.exists(self.manual_ratings_file):
             self._save_json(self.manual_ratings_file, {})
         
         if not os.path.exists(self.bandit_state_file):
-            self._save_json(self.bandit_state_file, {"arms": [], "N": [], "S": [], "t": 0})
+            # Під локом bandit_state: не затираємо файл, якщо агент саме створив його
+            get_bandit_state(self.bandit_state_file).update(lambda state: None)
         
         if not os.path.exists(self.knowledge_file):
             self._save_json(self.knowledge_file, {"best_score": 0, "best_params": {}, "history": []})
         
-        if not os.path.exists(self.review_queue_file):
+        if not os.path.exists(self.review_queue_file) and not review_queue_enabled(self.auto_state_dir):
             self._save_json(self.review_queue_file, {"pending": [], "in_review": [], "completed": []})
     
     def _load_json(self, filepath: str, default=None):
         """Безпечне завантаження JSON"""
         try:
             if os.path.exists(filepath):
-                with open(filepath, 'r', encoding='utf-8') as f:
-                    return json.load(f)
+                return load_file(filepath)
         except Exception as e:
             print(f"⚠️ Помилка завантаження {filepath}: {e}")
         return default if default is not None else {}
     
+    def _load_cached(self, filepath: str, default=None):
+        """Кешоване завантаження JSON лише для читання (документ спільний між запитами, не змінювати!)"""
+        return self.state_store.load(filepath, default if default is not None else {})
+
+    def _state_snapshot(self):
+        """Знімок усіх стейт-файлів для одного запиту (лише читання).
+
+        manual_ratings = файл + ще не злиті записи журналу; сам журнал доступний як snap["journal"].
+        """
+        return _review_state_snapshot(self.state_store, self.journal, self.auto_state_dir)
+
+    def _knowledge_index(self, snap):
+        """Індекс відео → запис knowledge, будується один раз на версію knowledge.json"""
+        return self.state_store.derived(
+            "knowledge_index", snap, ["knowledge"],
+            lambda s: KnowledgeIndex((s["knowledge"] or {}).get("history", []))
+        )
+
+    def _review_queue_lookup(self, snap):
+        """Функція ім'я кліпу → запис черги: O(1) з журналу черги, для документа — мапа раз на версію"""
+        rq = snap["review_queue"]
+        if isinstance(rq, ReviewQueueView):
+            return rq.lookup
+        return self.state_store.derived("review_queue_by_name", snap, ["review_queue"], _review_queue_map).get
+
+    def _search_index(self, snap, catalog, kindex):
+        """Колонковий індекс для /api/search; між версіями стейту оновлюються лише зачеплені рядки"""
+        token = (snap.versions.get("knowledge"), snap.versions.get("manual_ratings"),
+                 snap.versions.get("journal"), catalog.version)
+        knowledge = snap["knowledge"]
+        return get_search_index_updater(self.auto_state_dir, self.video_dir).index(
+            token, kindex.history, snap["manual_ratings"], catalog.by_name,
+            lambda name: self._enhanced_video_search(name, knowledge, kindex),
+        )
+
+    def _api_etag(self, snap, catalog=None, hidden=()) -> str:
+        """ETag відповіді API з версій стейт-файлів (mtime/size/inode) і вмісту каталогу відео.
+
+        Не залежить від процесу, тож переживає рестарт сервера; URL входить у тег,
+        бо різні параметри запиту дають різні відповіді. hidden — кліпи, орендовані
+        іншими рецензентами (оренда спливає без запису в журнал, тож входить у тег окремо).
+        """
+        h = hashlib.sha1()
+        h.update(f"{type(self).__name__}\0{self.path}\0".encode('utf-8', 'surrogateescape'))
+        for name in sorted(snap.signatures):
+            h.update(f"{name}={snap.signatures[name]!r};".encode('utf-8'))
+        if catalog is not None:
+            h.update(catalog.digest.encode('ascii'))
+        for name in sorted(hidden):
+            h.update(f"\0{name}".encode('utf-8', 'surrogateescape'))
+        return f'W/"{h.hexdigest()[:20]}"'
+
+    def _json_not_modified(self, etag: str) -> bool:
+        """Відповідає 304, якщо клієнт уже має цю версію (тіло навіть не будується)."""
+        if_none_match = self.headers.get('If-None-Match')
+        if not if_none_match:
+            return False
+        tags = [t.strip() for t in if_none_match.split(',')]
+        if '*' not in tags and etag not in tags and etag[2:] not in tags:
+            return False
+        self.send_response(304)
+        self.send_header('ETag', etag)
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Vary', 'Accept-Encoding')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+        return True
+
+    def _accepts_gzip(self) -> bool:
+        for part in (self.headers.get('Accept-Encoding') or '').split(','):
+            coding, _, params = part.strip().partition(';')
+            if coding.strip().lower() in ('gzip', '*'):
+                q = params.strip().lower()
+                if q.startswith('q='):
+                    try:
+                        return float(q[2:]) > 0
+                    except ValueError:
+                        return False
+                return True
+        return False
+
+    def _leased_to_others(self, query_params) -> frozenset:
+        """Кліпи, орендовані іншими рецензентами (reviewer= у запиті, інакше адреса клієнта)."""
+        if self.review_queue is None:
+            return frozenset()
+        reviewer = (query_params.get('reviewer') or [''])[0] or self.client_address[0]
+        return self.review_queue.leased_names(except_owner=reviewer)
+
+    def _unrated_page(self, catalog, rated, cursor: Optional[str], offset: int, limit: int, hidden=()):
+        """Сторінка неоцінених відео з каталогу (новіші першими), без кліпів із hidden.
+
+        З курсором старт шукається бінарним пошуком за (mtime, name), тож глибокі
+        сторінки коштують як перша, а оцінки між запитами не зсувають позицію.
+        Без курсора — стара пагінація offset/limit. Повертає (entries, next_cursor).
+        """
+        skip = (lambda name: name in rated or name in hidden) if hidden else (lambda name: name in rated)
+        if cursor is None:
+            unrated = [e for e in catalog.entries if not skip(e.name)]
+            return unrated[offset:offset + limit], None
+        entries = catalog.entries
+        i = catalog.index_after(*_decode_cursor(cursor)) if cursor else 0
+        page = []
+        while i < len(entries) and len(page) < limit:
+            if not skip(entries[i].name):
+                page.append(entries[i])
+            i += 1
+        # Курсор на наступну сторінку — лише якщо далі є хоч одне неоцінене відео
+        while i < len(entries) and skip(entries[i].name):
+            i += 1
+        next_cursor = _encode_cursor(page[-1]) if page and i < len(entries) else None
+        return page, next_cursor
+
     def _save_json(self, filepath: str, data):
         """Безпечне збереження JSON"""
         try:
-            with open(filepath, 'w', encoding='utf-8') as f:
-                json.dump(data, f, indent=2, ensure_ascii=False)
+            atomic_write_json(filepath, data)
             return True
         except Exception as e:
             print(f"❌ Помилка збереження {filepath}: {e}")
             return False
 
-    def _append_reference_params(self, params: dict):
-        """Додати запис у reference_params.json (масив об'єктів {"params": {...}})."""
-        try:
-            data = []
-            if os.path.exists(self.reference_params_file):
-                with open(self.reference_params_file, 'r', encoding='utf-8') as f:
-                    loaded = json.load(f)
-                    if isinstance(loaded, list):
-                        data = loaded
-                    elif isinstance(loaded, dict):
-                        for key in ("combos", "params_list", "list"):
-                            if isinstance(loaded.get(key), list):
-                                data = loaded.get(key)
-                                break
-            data.append({"params": params})
-            with open(self.reference_params_file, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
-            return True
-        except Exception as e:
-            print(f"⚠️ Не вдалось додати до reference_params.json: {e}")
-            return False
-
-    def _append_ban_history(self, record: dict):
-        """Додати запис у ban_history.json (масив подій)."""
-        path = os.path.join(self.auto_state_dir, "ban_history.json")
-        try:
-            hist = []
-            if os.path.exists(path):
-                with open(path, 'r', encoding='utf-8') as f:
-                    loaded = json.load(f)
-                    if isinstance(loaded, list):
-                        hist = loaded
-            hist.append(record)
-            with open(path, 'w', encoding='utf-8') as f:
-                json.dump(hist, f, ensure_ascii=False, indent=2)
-        except Exception as e:
-            print(f"⚠️ Не вдалось додати у ban_history.json: {e}")
-    
     def do_GET(self):
         # Парсимо URL та параметри
         url_parts = urllib.parse.urlparse(self.path)
@@ -124,22 +606,57 @@ class EnhancedVideoReviewHandler(http.server.SimpleHTTPRequestHandler):
             self.serve_stats_api()
         elif path == '/api/debug':
             self.serve_debug_api()
+        elif path == '/api/events':
+            self.serve_events()
+        elif path == '/api/review/queue':
+            self.serve_review_queue_api()
+        elif path == '/api/state_stats':
+            segments = get_knowledge_segments(self.auto_state_dir)
+            prompts = get_prompt_store(self.auto_state_dir)
+            lane_stats = getattr(self.server, 'lane_stats', None)
+            self.send_json_response(dict(self.state_store.stats(), journal=self.journal.stats(),
+                                         events=self._event_feed().bus.stats(),
+                                         search=get_search_index_updater(self.auto_state_dir, self.video_dir).stats(),
+                                         knowledge_segments=segments.stats() if segments else None,
+                                         prompt_store=prompts.stats() if prompts else None,
+                                         bandit_state=get_bandit_state(self.bandit_state_file).stats(),
+                                         stats_aggregates=self.stats_aggregates.stats(),
+                                         review_queue=self.review_queue.stats() if self.review_queue else None,
+                                         server=lane_stats() if lane_stats else None))
         elif path.startswith('/image_file'):
             self.serve_image_file()
         elif path.startswith('/video/'):
             self.serve_video()
         else:
             super().do_GET()
+
+    def do_HEAD(self):
+        path = urllib.parse.urlparse(self.path).path
+        if path.startswith('/video/'):
+            self.serve_video(head_only=True)
+        elif path.startswith('/image_file'):
+            self.serve_image_file(head_only=True)
+        else:
+            super().do_HEAD()
     
     def do_POST(self):
         if self.path == '/api/rate':
             self.handle_rating()
+        elif self.path == '/api/rate_batch':
+            self.handle_rating_batch()
+        elif self.path == '/api/review/lease':
+            self.handle_review_lease()
+        elif self.path == '/api/review/release':
+            self.handle_review_release()
         else:
+            # Тіло запиту не прочитане: з'єднання не можна використати повторно
+            self.close_connection = True
             self.send_error(404)
     
     def do_OPTIONS(self):
         # Preflight support for CORS
         self.send_response(204)
+        self.send_header('Content-Length', '0')
         self.send_header('Access-Control-Allow-Origin', '*')
         self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
         self.send_header('Access-Control-Allow-Headers', 'Content-Type')
@@ -880,10 +1397,7 @@ class EnhancedVideoReviewHandler(http.server.SimpleHTTPRequestHandler):
 </html>
         """
         
-        self.send_response(200)
-        self.send_header('Content-type', 'text/html; charset=utf-8')
-        self.end_headers()
-        self.wfile.write(html.encode('utf-8'))
+        self.send_html_response(html)
     
     def serve_videos_api(self):
         """API для отримання неоцінених відео з покращеним пошуком"""
@@ -892,43 +1406,44 @@ class EnhancedVideoReviewHandler(http.server.SimpleHTTPRequestHandler):
         query_params = urllib.parse.parse_qs(url_parts.query)
         offset = int(query_params.get('offset', ['0'])[0])
         limit = int(query_params.get('limit', ['50'])[0])
-        
-        print(f"🔍 API відео: offset={offset}, limit={limit}")
-        
-        # Завантажуємо оцінені відео
-        manual_ratings = self._load_json(self.manual_ratings_file, {})
-        rated_videos = set(manual_ratings.keys())
+        cursor = _cursor_param(url_parts.query)
+        fields = _requested_fields(query_params, VIDEO_LIST_DEFAULT_FIELDS)
+        
+        print(f"🔍 API відео: offset={offset}, limit={limit}, cursor={cursor!r}")
+        
+        # Завантажуємо оцінені відео (кешований знімок стану)
+        snap = self._state_snapshot()
+        # Отримуємо всі відео файли (каталог уже відсортований за mtime, новіші першими)
+        catalog = self.catalog.snapshot()
+        # Кліпи, які зараз рецензують інші, не показуємо (оренди черги рецензування)
+        hidden = self._leased_to_others(query_params)
+        etag = self._api_etag(snap, catalog, hidden)
+        if self._json_not_modified(etag):
+            return
+        manual_ratings = snap["manual_ratings"]
+        rated_videos = manual_ratings.keys()
         print(f"📊 Оцінені відео: {len(rated_videos)}")
         
-        # Отримуємо всі відео файли
-        video_files = glob.glob(f"{self.video_dir}*.mp4")
-        video_files.sort(key=os.path.getmtime, reverse=True)
-        print(f"🎬 Всього відео файлів: {len(video_files)}")
+        print(f"🎬 Всього відео файлів: {len(catalog)}")
         
         # Завантажуємо knowledge для отримання деталей
-        knowledge = self._load_json(self.knowledge_file, {"history": []})
+        knowledge = snap["knowledge"]
+        kindex = self._knowledge_index(snap)
         print(f"📚 Записів в knowledge.json: {len(knowledge.get('history', []))}")
         
-        # Фільтруємо неоцінені відео
-        unrated_videos = []
-        for video_path in video_files:
-            video_name = os.path.basename(video_path)
-            if video_name not in rated_videos:
-                unrated_videos.append(video_path)
-        
-        print(f"⏳ Неоцінених відео: {len(unrated_videos)}")
-        
-        # Застосовуємо пагінацію
-        paginated_videos = unrated_videos[offset:offset + limit]
+        # Фільтруємо неоцінені відео і застосовуємо пагінацію (курсор або offset)
+        try:
+            paginated_videos, next_cursor = self._unrated_page(catalog, rated_videos, cursor, offset, limit, hidden)
+        except ValueError as e:
+            return self.send_json_response({'status': 'error', 'message': str(e)})
         print(f"📦 Завантажуємо відео: {len(paginated_videos)}")
         
         result = []
-        for video_path in paginated_videos:
-            video_name = os.path.basename(video_path)
-            stat = os.stat(video_path)
+        for video_entry in paginated_videos:
+            video_name = video_entry.name
             
             # Покращений пошук деталей відео
-            video_details, match_info = self._enhanced_video_search(video_name, knowledge)
+            video_details, match_info = self._enhanced_video_search(video_name, knowledge, kindex)
             
             # Збираємо авто-метрики з knowledge (сумісно з новою структурою)
             auto_metrics = {}
@@ -967,8 +1482,8 @@ class EnhancedVideoReviewHandler(http.server.SimpleHTTPRequestHandler):
 
             video_info = {
                 'name': video_name,
-                'size_mb': round(stat.st_size / 1024 / 1024, 1),
-                'created': time.strftime("%Y-%m-%d %H:%M", time.localtime(stat.st_mtime)),
+                'size_mb': round(video_entry.size / 1024 / 1024, 1),
+                'created': time.strftime("%Y-%m-%d %H:%M", time.localtime(video_entry.mtime)),
                 'prompt': video_prompt or video_details.get('prompt', 'Промпт недоступний'),
                 'fps': video_details.get('params', {}).get('fps', 'N/A'),
                 'width': video_details.get('params', {}).get('width', 'N/A'),
@@ -989,31 +1504,37 @@ class EnhancedVideoReviewHandler(http.server.SimpleHTTPRequestHandler):
                 'search_details': match_info['details']
             }
             
-            result.append(video_info)
+            result.append(_project(video_info, fields))
         
         print(f"✅ Відправляємо {len(result)} відео")
-        self.send_json_response(result)
+        if cursor is not None:
+            return self.send_json_response({'items': result, 'next_cursor': next_cursor}, etag=etag)
+        self.send_json_response(result, etag=etag)
     
     def serve_debug_api(self):
         """Debug API для перевірки стану системи"""
-        knowledge = self._load_json(self.knowledge_file, {"history": []})
-        manual_ratings = self._load_json(self.manual_ratings_file, {})
+        snap = self._state_snapshot()
+        knowledge = snap["knowledge"]
+        manual_ratings = snap["manual_ratings"]
         
         # Приклади імен файлів для тестування
-        video_files = glob.glob(f"{self.video_dir}*.mp4")[:10]
+        video_files = [e.path for e in self.catalog.snapshot().entries[:10]]
         
         debug_info = {
             "knowledge_entries": len(knowledge.get('history', [])),
             "manual_ratings": len(manual_ratings),
             "sample_video_files": [os.path.basename(f) for f in video_files],
             "sample_knowledge_entries": knowledge.get('history', [])[:3] if knowledge.get('history') else [],
-            "sample_file_search": []
+            "sample_file_search": [],
+            "state_store": self.state_store.stats(),
+            "journal": self.journal.stats()
         }
         
         # Тестуємо пошук для кількох файлів
+        kindex = self._knowledge_index(snap)
         for video_file in video_files[:3]:
             video_name = os.path.basename(video_file)
-            details, match_info = self._enhanced_video_search(video_name, knowledge)
+            details, match_info = self._enhanced_video_search(video_name, knowledge, kindex)
             debug_info["sample_file_search"].append({
                 "video_name": video_name,
                 "found": match_info['found'],
@@ -1024,8 +1545,19 @@ class EnhancedVideoReviewHandler(http.server.SimpleHTTPRequestHandler):
         
         self.send_json_response(debug_info)
     
-    def _enhanced_video_search(self, video_name: str, knowledge: dict) -> tuple:
-        """Покращений пошук відео в knowledge.json з debug інформацією"""
+    def _enhanced_video_search(self, video_name: str, knowledge: dict, index: Optional[KnowledgeIndex] = None) -> tuple:
+        """Покращений пошук відео в knowledge.json з debug інформацією.
+
+        З `index` (KnowledgeIndex для цього ж knowledge) пошук O(1)/O(log n) без сканування history;
+        без нього — лінійний прохід (для щойно завантажених з диску документів).
+        """
+        if index is not None:
+            try:
+                return index.lookup(video_name)
+            except Exception as e:
+                print(f"❌ Помилка пошуку: {e}")
+                return {}, {'found': False, 'method': 'none', 'details': {'exception': str(e)}}
+
         match_info = {
             'found': False,
             'method': 'none',
@@ -1102,50 +1634,91 @@ class EnhancedVideoReviewHandler(http.server.SimpleHTTPRequestHandler):
         
         return {}, match_info
     
+    def _event_feed(self) -> ReviewEventFeed:
+        return get_event_feed(self.state_store, self.catalog, self.journal, self.auto_state_dir)
+
+    def serve_events(self):
+        """SSE-потік /api/events: video_added, video_removed, video_rated, combo_banned, stats.
+
+        Перша подія — повна статистика; далі лише дельти. Після розриву EventSource
+        сам надсилає Last-Event-ID і отримує пропущені події з буфера шини
+        (або 'resync' + свіжу статистику, якщо вони вже витіснені).
+        Під ReviewHTTPServer після першої порції сокет переходить до _SSEWriter і робочий
+        потік звільняється; інакше потік чекає на condition variable шини.
+        """
+        feed = self._event_feed()
+        bus = feed.bus
+        last_id = self.headers.get('Last-Event-ID')
+        if last_id is None:
+            query = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query)
+            last_id = query.get('last_id', [None])[0]
+        try:
+            last_id = int(last_id) if last_id is not None else None
+        except ValueError:
+            last_id = None
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream; charset=utf-8')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('X-Accel-Buffering', 'no')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        # Потік без Content-Length закінчується лише закриттям з'єднання
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+
+        def write_event(event_type, data, event_id):
+            self.wfile.write(_sse_message(event_type, data, event_id))
+
+        handoff = getattr(self.server, 'sse_writer', None) is not None
+        bus.subscribe()
+        try:
+            self.wfile.write(b"retry: 3000\n\n")
+            backlog = bus.since(last_id) if last_id is not None and last_id <= bus.last_id else None
+            if backlog is None:
+                # Новий клієнт (або надто старий Last-Event-ID): повна статистика як точка відліку
+                last_id = bus.last_id
+                write_event('resync' if self.headers.get('Last-Event-ID') else 'stats', feed.current_stats(), last_id)
+            else:
+                for event in backlog:
+                    write_event(event.type, event.data, event.id)
+                    last_id = event.id
+            self.wfile.flush()
+            if handoff:
+                # Далі з'єднання пише потік SSE-записувача сервера
+                self.sse_handoff = (feed, last_id)
+                return
+            while True:
+                events = bus.wait(last_id, SSE_KEEPALIVE_S)
+                if events is None:
+                    last_id = bus.last_id
+                    write_event('resync', feed.current_stats(), last_id)
+                elif not events:
+                    self.wfile.write(b": keepalive\n\n")
+                else:
+                    for event in events:
+                        write_event(event.type, event.data, event.id)
+                    last_id = events[-1].id
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError, ConnectionAbortedError, TimeoutError):
+            pass
+        finally:
+            bus.unsubscribe()
+
     def serve_stats_api(self):
         """API для отримання повної статистики системи"""
         try:
-            # Завантажуємо всі JSON файли
-            manual_ratings = self._load_json(self.manual_ratings_file, {})
-            knowledge = self._load_json(self.knowledge_file, {"history": [], "best_score": 0})
-            bandit_state = self._load_json(self.bandit_state_file, {"t": 0, "arms": []})
-            
-            # Підрахунок статистики
-            total_generated = len(knowledge.get("history", []))
-            total_rated = len(manual_ratings)
-            
-            # Підрахунок неоцінених відео
-            video_files = glob.glob(f"{self.video_dir}*.mp4")
-            rated_videos = set(manual_ratings.keys())
-            pending_count = len([f for f in video_files if os.path.basename(f) not in rated_videos])
-            
-            # Середня оцінка
-            avg_rating = 0
-            if manual_ratings:
-                overall_scores = []
-                for rating_data in manual_ratings.values():
-                    if isinstance(rating_data, dict) and 'rating' in rating_data:
-                        rating = rating_data['rating']
-                        if isinstance(rating, dict) and 'overall_quality' in rating:
-                            overall_scores.append(rating['overall_quality'])
-                
-                if overall_scores:
-                    avg_rating = sum(overall_scores) / len(overall_scores)
-            
-            stats = {
-                "total_generated": total_generated,
-                "total_rated": total_rated,
-                "pending_count": pending_count,
-                "avg_rating": avg_rating,
-                "best_score": knowledge.get("best_score", 0),
-                "bandit_iterations": bandit_state.get("t", 0),
-                "learning_arms": len(bandit_state.get("arms", []))
-            }
+            # Готові лічильники замість перерахунку оцінок і файлів; ETag — з самих чисел
+            stats = _current_stats(self.state_store, self.catalog, self.journal, self.auto_state_dir)
+            etag = 'W/"%s"' % hashlib.sha1(json.dumps(stats, sort_keys=True).encode('utf-8')).hexdigest()[:20]
+            if self._json_not_modified(etag):
+                return
             
-            print(f"📊 Статистика: Генеровано={total_generated}, Оцінено={total_rated}, Очікують={pending_count}")
+            print(f"📊 Статистика: Генеровано={stats['total_generated']}, Оцінено={stats['total_rated']}, Очікують={stats['pending_count']}")
             
         except Exception as e:
             print(f"⚠️ Помилка розрахунку статистики: {e}")
+            etag = None
             stats = {
                 "total_generated": 0,
                 "total_rated": 0,
@@ -1156,44 +1729,135 @@ class EnhancedVideoReviewHandler(http.server.SimpleHTTPRequestHandler):
                 "learning_arms": 0
             }
         
-        self.send_json_response(stats)
+        self.send_json_response(stats, etag=etag)
     
-    def serve_video(self):
-        """Відправка відео файлів"""
-        video_name = urllib.parse.unquote(self.path.split('/')[-1])
+    def serve_video(self, head_only: bool = False):
+        """Відправка відео файлів (Range/206, ETag/304, потоково без читання файлу в пам'ять)"""
+        url_path = urllib.parse.urlparse(self.path).path
+        video_name = urllib.parse.unquote(url_path.split('/')[-1])
         video_path = os.path.join(self.video_dir, video_name)
         
-        if os.path.exists(video_path):
-            self.send_response(200)
-            self.send_header('Content-type', 'video/mp4')
-            self.send_header('Content-Length', str(os.path.getsize(video_path)))
-            self.send_header('Accept-Ranges', 'bytes')
-            self.end_headers()
-            
-            with open(video_path, 'rb') as f:
-                self.wfile.write(f.read())
+        if os.path.isfile(video_path):
+            self._send_file(video_path, 'video/mp4', head_only=head_only)
         else:
-            self.send_error(404, f"Відео не знайдено: {video_name}")
+            # Статус-рядок лише latin-1: український текст — у тілі відповіді
+            self.send_error(404, "Video not found", f"Відео не знайдено: {video_name}")
 
-    def serve_image_file(self):
+    def serve_image_file(self, head_only: bool = False):
         """Відправка зображення за абсолютним шляхом (довірене середовище)."""
         try:
             url_parts = urllib.parse.urlparse(self.path)
             q = urllib.parse.parse_qs(url_parts.query)
             p = (q.get('path', [''])[0] or '').strip()
-            if not p or not os.path.exists(p):
+            if not p or not os.path.isfile(p):
                 return self.send_json_response({'status': 'error', 'message': 'image path not found'})
             ct = 'image/jpeg'
             if p.lower().endswith('.png'):
                 ct = 'image/png'
-            self.send_response(200)
-            self.send_header('Content-type', ct)
-            self.send_header('Content-Length', str(os.path.getsize(p)))
-            self.end_headers()
-            with open(p, 'rb') as f:
-                self.wfile.write(f.read())
+            self._send_file(p, ct, head_only=head_only)
         except Exception as e:
             self.send_json_response({'status': 'error', 'message': str(e)})
+
+    def _send_file(self, filepath: str, content_type: str, head_only: bool = False):
+        """Потокова відправка файлу: 200/206/304/416, тіло через socket.sendfile блоками.
+
+        Пам'ять на з'єднання не залежить від розміру файлу; повторні візити
+        з If-None-Match / If-Modified-Since отримують 304 без тіла.
+        """
+        with open(filepath, 'rb') as f:
+            st = os.fstat(f.fileno())
+            size = st.st_size
+            etag = f'"{st.st_mtime_ns:x}-{size:x}-{st.st_ino:x}"'
+            last_modified = email.utils.formatdate(st.st_mtime, usegmt=True)
+
+            if self._not_modified(etag, st.st_mtime):
+                self.send_response(304)
+                self.send_header('ETag', etag)
+                self.send_header('Last-Modified', last_modified)
+                self.send_header('Cache-Control', 'no-cache')
+                self.end_headers()
+                return
+
+            start, end = 0, size - 1
+            partial = False
+            range_header = self.headers.get('Range')
+            if range_header and size > 0 and self._if_range_matches(etag, st.st_mtime):
+                try:
+                    byte_range = _parse_byte_range(range_header, size)
+                except ValueError:
+                    self.send_response(416)
+                    self.send_header('Content-Range', f'bytes */{size}')
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                if byte_range is not None:
+                    start, end = byte_range
+                    partial = True
+            length = end - start + 1 if size > 0 else 0
+
+            self.send_response(206 if partial else 200)
+            self.send_header('Content-type', content_type)
+            self.send_header('Content-Length', str(length))
+            self.send_header('Accept-Ranges', 'bytes')
+            self.send_header('ETag', etag)
+            self.send_header('Last-Modified', last_modified)
+            self.send_header('Cache-Control', 'no-cache')
+            if partial:
+                self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+            self.end_headers()
+            if head_only or length <= 0:
+                return
+            try:
+                self._copy_file_range(f, start, length)
+            except (BrokenPipeError, ConnectionResetError):
+                # Браузер перериває завантаження при перемотуванні — це нормально
+                self.close_connection = True
+
+    def _copy_file_range(self, f, start: int, length: int):
+        """Тіло відповіді: zero-copy sendfile, або блоками, якщо сокет його не підтримує."""
+        self.wfile.flush()
+        sendfile = getattr(self.connection, 'sendfile', None)
+        if sendfile is not None:
+            # socket.sendfile сам відкочується на send() блоками, якщо os.sendfile недоступний
+            sendfile(f, offset=start, count=length)
+            return
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(STREAM_CHUNK_SIZE, length))
+            if not chunk:
+                break
+            self.wfile.write(chunk)
+            length -= len(chunk)
+
+    def _not_modified(self, etag: str, mtime: float) -> bool:
+        """Умовний GET: If-None-Match має пріоритет над If-Modified-Since."""
+        if_none_match = self.headers.get('If-None-Match')
+        if if_none_match:
+            tags = [t.strip() for t in if_none_match.split(',')]
+            return '*' in tags or etag in tags or f'W/{etag}' in tags
+        if_modified_since = self.headers.get('If-Modified-Since')
+        if if_modified_since:
+            try:
+                since = email.utils.parsedate_to_datetime(if_modified_since)
+            except (TypeError, ValueError, IndexError):
+                return False
+            if since is None:
+                return False
+            return int(mtime) <= since.timestamp()
+        return False
+
+    def _if_range_matches(self, etag: str, mtime: float) -> bool:
+        """If-Range: віддаємо частину лише якщо файл не змінився, інакше весь файл."""
+        if_range = (self.headers.get('If-Range') or '').strip()
+        if not if_range:
+            return True
+        if if_range.startswith('"') or if_range.startswith('W/'):
+            return if_range == etag
+        try:
+            since = email.utils.parsedate_to_datetime(if_range)
+        except (TypeError, ValueError, IndexError):
+            return False
+        return since is not None and int(mtime) <= since.timestamp()
     
     def handle_rating(self):
         """Обробка збереження оцінки з повною інтеграцією навчання"""
@@ -1205,119 +1869,209 @@ class EnhancedVideoReviewHandler(http.server.SimpleHTTPRequestHandler):
             video_name = data.get('video_name')
             rating = data.get('rating')
             
-            if not video_name or not rating:
+            if not video_name or not isinstance(rating, dict) or not rating:
                 self.send_json_response({"status": "error", "message": "Неповні дані"})
                 return
             
-            # Завантажуємо поточні оцінки
-            manual_ratings = self._load_json(self.manual_ratings_file, {})
-            
-            # Додаємо нову оцінку
-            manual_ratings[video_name] = {
-                "rating": rating,
-                "timestamp": time.time(),
-                "rated_at": time.strftime("%Y-%m-%d %H:%M:%S")
-            }
-            
-            # Зберігаємо оновлені оцінки
-            if self._save_json(self.manual_ratings_file, manual_ratings):
-                print(f"✅ Збережена оцінка для відео: {video_name}")
+            self.journal.append(self._rating_records(video_name, rating))
+            print(f"✅ Збережена оцінка для відео: {video_name}")
+            self.send_json_response({"status": "success"})
                 
-                # Оновлюємо систему навчання
-                self._update_learning_system(video_name, rating)
+        except Exception as e:
+            print(f"❌ Помилка обробки оцінки: {e}")
+            self.send_json_response({"status": "error", "message": str(e)})
 
-                # Якщо позначено як еталон — додамо у reference_params.json параметри з knowledge
-                try:
-                    if bool(rating.get('is_reference')):
-                        knowledge = self._load_json(self.knowledge_file, {"history": []})
-                        details, _mi = self._enhanced_video_search(video_name, knowledge)
-                        params = (details.get('params') or {}) if isinstance(details, dict) else {}
-                        # Fallback: пробуємо витягнути combo у вигляді полів
-                        if not params and isinstance(details, dict):
-                            combo = details.get('combo') or []
-                            if isinstance(combo, list) and len(combo) >= 2:
-                                params = {
-                                    'sampler': combo[0],
-                                    'scheduler': combo[1],
-                                }
-                        if isinstance(params, dict) and params:
-                            # Додаємо seconds як безпечний дефолт
-                            params.setdefault('seconds', 5.0)
-                            self._append_reference_params(params)
-                except Exception as e:
-                    print(f"⚠️ Reference append failed: {e}")
-                
-                self.send_json_response({"status": "success"})
+    def handle_rating_batch(self):
+        """Пакетне збереження оцінок: {"ratings": [{"video_name", "rating"}, ...]}.
+
+        Усі оцінки — один запис у журнал (один fsync) і одне злиття компактором;
+        якщо хоч один елемент некоректний, не зберігається жоден.
+        """
+        try:
+            items = self._read_batch_body('ratings')
+            if isinstance(items, str):
+                return self.send_json_response({"status": "error", "message": items})
+            snap = None
+            records = []
+            for i, item in enumerate(items):
+                video_name = item.get('video_name') if isinstance(item, dict) else None
+                rating = item.get('rating') if isinstance(item, dict) else None
+                if not video_name or not isinstance(rating, dict) or not rating:
+                    return self.send_json_response({"status": "error", "message": f"Неповні дані в елементі {i}", "index": i})
+                if rating.get('is_reference') and snap is None:
+                    snap = self._state_snapshot()
+                records.extend(self._rating_records(video_name, rating, snap))
+            self.journal.append(records)
+            print(f"✅ Збережено пакет оцінок: {len(items)}")
+            self.send_json_response({"status": "success", "accepted": len(items)})
+        except Exception as e:
+            print(f"❌ Помилка обробки пакету оцінок: {e}")
+            self.send_json_response({"status": "error", "message": str(e)})
+
+    def _read_json_body(self) -> dict:
+        content_length = int(self.headers.get('Content-Length', '0'))
+        post_data = self.rfile.read(content_length) if content_length > 0 else b'{}'
+        data = json.loads(post_data.decode('utf-8')) if post_data else {}
+        return data if isinstance(data, dict) else {}
+
+    def _reviewer(self, data: dict) -> str:
+        """Хто рецензує: поле reviewer, інакше адреса клієнта."""
+        return str(data.get('reviewer') or self.client_address[0])
+
+    def handle_review_lease(self):
+        """Оренда кліпів з черги: {"reviewer", "count", "lease_s"} → найтерміновіші вільні кліпи.
+
+        Паралельні рецензенти ніколи не отримують той самий кліп; свої ще не оцінені
+        кліпи рецензент отримує знову (оренда подовжується). Оцінка завершує кліп.
+        З "video_name" (або "video_id") орендується чи подовжується саме цей кліп — так
+        робить review_app.js для відео на екрані; якщо його тримає інший рецензент,
+        items порожній, а held_by — його ім'я.
+        """
+        try:
+            if self.review_queue is None:
+                return self.send_json_response({"status": "error", "message": "review queue log is not enabled"})
+            data = self._read_json_body()
+            count = min(max(int(data.get('count', 1)), 1), MAX_BATCH_ACTIONS)
+            lease_s = data.get('lease_s')
+            lease_s = min(max(float(lease_s), 10.0), REVIEW_LEASE_MAX_S) if lease_s is not None else None
+            reviewer = self._reviewer(data)
+            key = data.get('video_name') or data.get('video_id')
+            if key:
+                item = self.review_queue.lease_clip(reviewer, str(key), lease_s)
+                items = [item] if item else []
+                holder = None if item else (self.review_queue.status(str(key)) or {}).get('lease_owner')
             else:
-                self.send_json_response({"status": "error", "message": "Помилка збереження"})
-                
+                items, holder = self.review_queue.lease(reviewer, count, lease_s), None
+            for item in items:
+                item['video_name'] = os.path.basename(item.get('original_path') or '') or f"{item.get('video_id')}.mp4"
+            self.send_json_response({"status": "success", "items": items, "held_by": holder,
+                                     "counts": self.review_queue.counts()})
         except Exception as e:
-            print(f"❌ Помилка обробки оцінки: {e}")
             self.send_json_response({"status": "error", "message": str(e)})
-    
-    def _update_learning_system(self, video_name: str, rating: dict):
-        """Оновлення системи навчання на основі ручної оцінки"""
+
+    def handle_review_release(self):
+        """Повернення орендованого кліпу в чергу: {"reviewer", "video_name"|"video_id"}."""
         try:
-            # Завантажуємо поточний стан
-            bandit_state = self._load_json(self.bandit_state_file, {"arms": [], "N": [], "S": [], "t": 0})
-            knowledge = self._load_json(self.knowledge_file, {"best_score": 0, "best_params": {}, "history": []})
-            
-            # Обчислюємо загальну оцінку
-            overall_score = rating.get('overall_quality', 0)
-            
-            # Оновлюємо найкращий результат
-            if overall_score > knowledge.get('best_score', 0):
-                knowledge['best_score'] = overall_score
-                
-                # Знаходимо параметри цього відео
-                video_details, _ = self._enhanced_video_search(video_name, knowledge)
-                if video_details:
-                    knowledge['best_params'] = {
-                        'prompt': video_details.get('prompt', ''),
-                        'params': video_details.get('params', {}),
-                        'combo': video_details.get('combo', {}),
-                        'manual_rating': rating
-                    }
-            
-            # Оновлюємо bandit state
-            bandit_state['t'] = bandit_state.get('t', 0) + 1
-            
-            # Додаємо інформацію про ручну оцінку до history
-            for entry in knowledge.get("history", []):
-                if entry.get("video_path", "").endswith(video_name):
-                    entry['manual_rating'] = rating
-                    entry['manual_rated_at'] = time.strftime("%Y-%m-%d %H:%M:%S")
-                    break
-            
-            # Зберігаємо оновлені дані
-            self._save_json(self.bandit_state_file, bandit_state)
-            self._save_json(self.knowledge_file, knowledge)
-            
-            print(f"🎯 Оновлена система навчання для відео {video_name} з оцінкою {overall_score}")
-            
+            if self.review_queue is None:
+                return self.send_json_response({"status": "error", "message": "review queue log is not enabled"})
+            data = self._read_json_body()
+            key = data.get('video_name') or data.get('video_id')
+            if not key:
+                return self.send_json_response({"status": "error", "message": "video_name or video_id required"})
+            released = self.review_queue.release(str(key), self._reviewer(data))
+            self.send_json_response({"status": "success", "released": released})
+        except Exception as e:
+            self.send_json_response({"status": "error", "message": str(e)})
+
+    def serve_review_queue_api(self):
+        """Стан черги: лічильники, перші limit кліпів pending за пріоритетом і поточні оренди."""
+        if self.review_queue is None:
+            return self.send_json_response({"status": "error", "message": "review queue log is not enabled"})
+        query_params = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query)
+        limit = int(query_params.get('limit', ['20'])[0])
+        doc = self.review_queue.document()
+        brief = lambda item: {k: item.get(k) for k in ('video_id', 'priority', 'generated_at', 'original_path')}
+        self.send_json_response({
+            "counts": self.review_queue.counts(),
+            "pending": [brief(item) for item in doc["pending"][:limit]],
+            "in_review": [dict(brief(item), **(self.review_queue.status(item_id(item)) or {}))
+                          for item in doc["in_review"]],
+        })
+
+    def _read_batch_body(self, key: str):
+        """Список дій з тіла POST ({key: [...]} або просто [...]); рядок — текст помилки."""
+        content_length = int(self.headers.get('Content-Length', '0'))
+        post_data = self.rfile.read(content_length) if content_length > 0 else b'{}'
+        data = json.loads(post_data.decode('utf-8'))
+        items = data.get(key) if isinstance(data, dict) else data
+        if not isinstance(items, list) or not items:
+            return f"{key} list required"
+        if len(items) > MAX_BATCH_ACTIONS:
+            return f"too many actions: {len(items)} > {MAX_BATCH_ACTIONS}"
+        return items
+
+    def _rating_records(self, video_name: str, rating: dict, snap=None) -> list:
+        """Записи журналу для однієї оцінки: сама оцінка (+ параметри еталону, якщо позначено).
+
+        best_score/best_params, bandit t і позначки в history оновлює компактор журналу.
+        """
+        records = [{
+            "op": "rate",
+            "video": video_name,
+            "entry": {
+                "rating": rating,
+                "timestamp": time.time(),
+                "rated_at": time.strftime("%Y-%m-%d %H:%M:%S")
+            }
+        }]
+        # Якщо позначено як еталон — додамо у reference_params.json параметри з knowledge
+        try:
+            if bool(rating.get('is_reference')):
+                snap = snap or self._state_snapshot()
+                details, _mi = self._enhanced_video_search(video_name, snap["knowledge"], self._knowledge_index(snap))
+                # Копія: запис knowledge спільний між запитами
+                params = dict(details.get('params') or {}) if isinstance(details, dict) else {}
+                # Fallback: пробуємо витягнути combo у вигляді полів
+                if not params and isinstance(details, dict):
+                    combo = details.get('combo') or []
+                    if isinstance(combo, list) and len(combo) >= 2:
+                        params = {
+                            'sampler': combo[0],
+                            'scheduler': combo[1],
+                        }
+                if isinstance(params, dict) and params:
+                    # Додаємо seconds як безпечний дефолт
+                    params.setdefault('seconds', 5.0)
+                    records.append({"op": "reference", "params": params})
         except Exception as e:
-            print(f"⚠️ Помилка оновлення системи навчання: {e}")
+            print(f"⚠️ Reference append failed: {e}")
+        return records
     
-    def send_json_response(self, data):
-        """Відправка JSON відповіді"""
+    def send_json_response(self, data, etag: Optional[str] = None):
+        """Відправка JSON відповіді (компактно, gzip за Accept-Encoding, ETag для 304)"""
+        body = json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        encoding = None
+        if len(body) >= GZIP_MIN_BYTES and self._accepts_gzip():
+            body = gzip.compress(body, compresslevel=GZIP_LEVEL)
+            encoding = 'gzip'
         self.send_response(200)
         self.send_header('Content-type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
+        self.send_header('Vary', 'Accept-Encoding')
+        if etag:
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', 'no-cache')
         self.send_header('Access-Control-Allow-Origin', '*')
         self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
         self.send_header('Access-Control-Allow-Headers', 'Content-Type')
         self.end_headers()
-        self.wfile.write(json.dumps(data, ensure_ascii=False, indent=2).encode('utf-8'))
+        self.wfile.write(body)
+
+    def send_html_response(self, html: str):
+        """HTML-сторінка з Content-Length (потрібен для keep-alive у HTTP/1.1)"""
+        body = html.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
 
 class QAReviewHandler(EnhancedVideoReviewHandler):
     def do_POST(self):
         if self.path == '/api/ban_combo':
             self.handle_ban_combo()
             return
+        if self.path == '/api/ban_combo_batch':
+            self.handle_ban_combo_batch()
+            return
         return super().do_POST()
     
     def do_OPTIONS(self):
         # Preflight support for CORS
         self.send_response(204)
+        self.send_header('Content-Length', '0')
         self.send_header('Access-Control-Allow-Origin', '*')
         self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
         self.send_header('Access-Control-Allow-Headers', 'Content-Type')
@@ -1351,92 +2105,112 @@ class QAReviewHandler(EnhancedVideoReviewHandler):
             post_data = self.rfile.read(content_length) if content_length > 0 else b'{}'
             data = json.loads(post_data.decode('utf-8')) if post_data else {}
 
-            combo_key = data.get('combo_key')
-            params = data.get('params')
-            video_name = data.get('video_name')
-
-            bandit_path = self.bandit_state_file
-            state = self._load_json(bandit_path, {"combo_stats": {}, "t": 0, "banned_combos": []})
-
-            banned = set(state.get('banned_combos', []))
-
-            # Resolve from knowledge using video_name if provided
-            if not combo_key and video_name:
-                knowledge = self._load_json(self.knowledge_file, {"history": []})
-                history = knowledge.get("history", [])
-                # try exact match by video or video_path
-                for entry in history:
-                    v = entry.get("video") or entry.get("video_path") or ""
-                    if v.endswith(video_name):
-                        combo = entry.get("combo") or []
-                        entry_params = entry.get("params", {})
-                        sampler = (combo[0] if isinstance(combo, list) and len(combo) > 0 else entry_params.get("sampler", "unknown"))
-                        scheduler = (combo[1] if isinstance(combo, list) and len(combo) > 1 else entry_params.get("scheduler", "unknown"))
-                        fps = str(entry_params.get("fps", 20))
-                        cfg = str(entry_params.get("cfg_scale", entry_params.get("cfg", 7.0)))
-                        steps = str(entry_params.get("steps", 25))
-                        width = entry_params.get("width", 768)
-                        height = entry_params.get("height", 432)
-                        combo_key = f"{sampler}|{scheduler}|{fps}|{cfg}|{steps}|{width}x{height}"
-                        break
-
-            if not combo_key and params:
-                # Rebuild combo_key like agent does: sampler|scheduler|fps|cfg|steps|WIDTHxHEIGHT
-                sampler = params.get('sampler', 'unknown')
-                scheduler = params.get('scheduler', 'unknown')
-                fps = str(params.get('fps', 20))
-                cfg = str(params.get('cfg_scale', 7.0))
-                steps = str(params.get('steps', 25))
-                width = params.get('width', 768)
-                height = params.get('height', 432)
-                combo_key = f"{sampler}|{scheduler}|{fps}|{cfg}|{steps}|{width}x{height}"
-
-            if not combo_key:
+            snap = self._state_snapshot()
+            record = self._ban_record(snap, data)
+            if record is None:
                 self.send_json_response({"status": "error", "message": "combo_key or params required"})
                 return
 
-            banned.add(combo_key)
-            state['banned_combos'] = list(banned)
-
-            self._save_json(bandit_path, state)
+            self.journal.append([record])
 
-            # Also mark the video as handled (like rated) so it disappears
-            video_marked = False
-            if video_name:
-                try:
-                    manual_ratings = self._load_json(self.manual_ratings_file, {})
-                    if video_name not in manual_ratings:
-                        manual_ratings[video_name] = {
-                            "rating": {
-                                "banned": True,
-                                "overall_quality": 2,
-                                "visual_quality": 2,
-                                "motion_quality": 2,
-                                "prompt_adherence": 2,
-                                "creativity": 2,
-                                "technical_quality": 2,
-                                "comments": "Auto-banned via QA UI"
-                            },
-                            "timestamp": time.time(),
-                            "rated_at": time.strftime("%Y-%m-%d %H:%M:%S")
-                        }
-                        self._save_json(self.manual_ratings_file, manual_ratings)
-                        video_marked = True
-                except Exception:
-                    pass
+            banned = set(snap["bandit_state"].get('banned_combos', [])) | set(snap["journal"].banned)
+            banned.add(record["combo_key"])
+            self.send_json_response({"status": "success", "banned_combo": record["combo_key"], "total_banned": len(banned), "video_marked": record["entry"] is not None})
+        except Exception as e:
+            self.send_json_response({"status": "error", "message": str(e)})
 
-            # Append ban history
-            self._append_ban_history({
-                'timestamp': time.time(),
-                'video_name': video_name,
-                'combo_key': combo_key,
-                'params': params,
+    def handle_ban_combo_batch(self):
+        """Пакетний бан: {"bans": [{"combo_key"|"params"|"video_name"}, ...]} — один запис у журнал."""
+        try:
+            items = self._read_batch_body('bans')
+            if isinstance(items, str):
+                return self.send_json_response({"status": "error", "message": items})
+            snap = self._state_snapshot()
+            records = []
+            marked = set()
+            for i, item in enumerate(items):
+                record = self._ban_record(snap, item) if isinstance(item, dict) else None
+                if record is None:
+                    return self.send_json_response({"status": "error", "message": f"combo_key or params required (елемент {i})", "index": i})
+                # Одне відео в пакеті позначається лише раз
+                if record["entry"] is not None:
+                    if record["video"] in marked:
+                        record["entry"] = None
+                    else:
+                        marked.add(record["video"])
+                records.append(record)
+
+            self.journal.append(records)
+
+            banned = set(snap["bandit_state"].get('banned_combos', [])) | set(snap["journal"].banned)
+            banned.update(r["combo_key"] for r in records)
+            self.send_json_response({
+                "status": "success",
+                "accepted": len(records),
+                "total_banned": len(banned),
+                "results": [{"banned_combo": r["combo_key"], "video_name": r["video"], "video_marked": r["entry"] is not None} for r in records]
             })
-
-            self.send_json_response({"status": "success", "banned_combo": combo_key, "total_banned": len(banned), "video_marked": video_marked})
         except Exception as e:
             self.send_json_response({"status": "error", "message": str(e)})
 
+    def _ban_record(self, snap, data: dict) -> Optional[dict]:
+        """Запис журналу для бану комбо (None, якщо combo_key не вдалося визначити).
+
+        banned_combos, ban_history.json і позначку відео як обробленого застосовує компактор журналу.
+        """
+        combo_key = data.get('combo_key')
+        params = data.get('params')
+        video_name = data.get('video_name')
+
+        # Resolve from knowledge using video_name if provided
+        if not combo_key and video_name:
+            # try exact match by video or video_path (через індекс замість сканування history)
+            entry = self._knowledge_index(snap).exact(video_name)
+            if entry is not None:
+                combo = entry.get("combo") or []
+                entry_params = entry.get("params", {})
+                sampler = (combo[0] if isinstance(combo, list) and len(combo) > 0 else entry_params.get("sampler", "unknown"))
+                scheduler = (combo[1] if isinstance(combo, list) and len(combo) > 1 else entry_params.get("scheduler", "unknown"))
+                fps = str(entry_params.get("fps", 20))
+                cfg = str(entry_params.get("cfg_scale", entry_params.get("cfg", 7.0)))
+                steps = str(entry_params.get("steps", 25))
+                width = entry_params.get("width", 768)
+                height = entry_params.get("height", 432)
+                combo_key = f"{sampler}|{scheduler}|{fps}|{cfg}|{steps}|{width}x{height}"
+
+        if not combo_key and params:
+            # Rebuild combo_key like agent does: sampler|scheduler|fps|cfg|steps|WIDTHxHEIGHT
+            sampler = params.get('sampler', 'unknown')
+            scheduler = params.get('scheduler', 'unknown')
+            fps = str(params.get('fps', 20))
+            cfg = str(params.get('cfg_scale', 7.0))
+            steps = str(params.get('steps', 25))
+            width = params.get('width', 768)
+            height = params.get('height', 432)
+            combo_key = f"{sampler}|{scheduler}|{fps}|{cfg}|{steps}|{width}x{height}"
+
+        if not combo_key:
+            return None
+
+        # Also mark the video as handled (like rated) so it disappears
+        mark = None
+        if video_name and video_name not in snap["manual_ratings"]:
+            mark = {
+                "rating": {
+                    "banned": True,
+                    "overall_quality": 2,
+                    "visual_quality": 2,
+                    "motion_quality": 2,
+                    "prompt_adherence": 2,
+                    "creativity": 2,
+                    "technical_quality": 2,
+                    "comments": "Auto-banned via QA UI"
+                },
+                "timestamp": time.time(),
+                "rated_at": time.strftime("%Y-%m-%d %H:%M:%S")
+            }
+        return {"op": "ban", "combo_key": combo_key, "video": video_name, "params": params, "entry": mark}
+
     def serve_qa_page(self):
         html = """
 <!DOCTYPE html>
@@ -1455,6 +2229,12 @@ class QAReviewHandler(EnhancedVideoReviewHandler):
     button { background: #ff6b6b; color: #fff; border: none; padding: 8px 14px; border-radius: 6px; cursor: pointer; }
     button:hover { background: #ff4040; }
     .small { opacity: 0.8; font-size: 0.9rem; }
+    .card.queued { opacity: 0.5; }
+    #ban-queue-bar { display:none; position: sticky; top: 0; background:#0b1e39; padding: 8px 0; }
+    .facet { display:flex; gap:6px; flex-wrap:wrap; align-items:center; margin:4px 0; }
+    .chip { background: rgba(255,255,255,0.12); padding: 4px 10px; border-radius: 12px; font-size: 0.85rem; }
+    .chip:hover { background: rgba(255,255,255,0.25); }
+    .chip.active { background: #3949AB; }
   </style>
   <script src="/static/qa_console.js"></script>
 </head>
@@ -1466,14 +2246,16 @@ class QAReviewHandler(EnhancedVideoReviewHandler):
   </div>
   <h2>QA Ban Console</h2>
   <p class="small">Використовуйте, щоб забанити комбінацію параметрів за назвою відео. Список нижче — невідоцінені відео.</p>
+  <div id="ban-queue-bar">
+    <button onclick="flushBans()">🚫 Застосувати бани (<span id="ban-queue-count">0</span>)</button>
+    <button onclick="clearBanQueue()" style="background:#546E7A">Скасувати</button>
+  </div>
+  <div id="facets"></div>
   <div id="list">Завантаження...</div>
 </body>
 </html>
 """
-        self.send_response(200)
-        self.send_header('Content-type', 'text/html; charset=utf-8')
-        self.end_headers()
-        self.wfile.write(html.encode('utf-8'))
+        self.send_html_response(html)
 
     def serve_main_page_with_ban(self):
         # Wrapper page with ban toolbar over base UI
@@ -1507,10 +2289,7 @@ class QAReviewHandler(EnhancedVideoReviewHandler):
 </html>
 """
         if urllib.parse.urlparse(self.path).path == '/':
-            self.send_response(200)
-            self.send_header('Content-type', 'text/html; charset=utf-8')
-            self.end_headers()
-            self.wfile.write(wrapper.encode('utf-8'))
+            self.send_html_response(wrapper)
         else:
             return super().do_GET()
 
@@ -1520,40 +2299,38 @@ class QAReviewHandler(EnhancedVideoReviewHandler):
         query_params = urllib.parse.parse_qs(url_parts.query)
         offset = int(query_params.get('offset', ['0'])[0])
         limit = int(query_params.get('limit', ['50'])[0])
+        cursor = _cursor_param(url_parts.query)
+        fields = _requested_fields(query_params, VIDEO_LIST_DEFAULT_FIELDS)
+
+        snap = self._state_snapshot()
+        catalog = self.catalog.snapshot()
+        # Кліпи, які зараз рецензують інші, не показуємо (оренди черги рецензування)
+        hidden = self._leased_to_others(query_params)
+        etag = self._api_etag(snap, catalog, hidden)
+        if self._json_not_modified(etag):
+            return
+        manual_ratings = snap["manual_ratings"]
+        rated_videos = manual_ratings.keys()
 
-        manual_ratings = self._load_json(self.manual_ratings_file, {})
-        rated_videos = set(manual_ratings.keys())
-
-        video_files = glob.glob(f"{self.video_dir}*.mp4")
-        video_files.sort(key=os.path.getmtime, reverse=True)
-
-        knowledge = self._load_json(self.knowledge_file, {"history": []})
-        review_queue = self._load_json(self.review_queue_file, {"pending": []})
-        rq_map = {}
+        knowledge = snap["knowledge"]
+        kindex = self._knowledge_index(snap)
         try:
-            for entry in review_queue.get("pending", []):
-                name = os.path.basename(entry.get("original_path", ""))
-                if name:
-                    rq_map[name] = entry
+            rq_lookup = self._review_queue_lookup(snap)
         except Exception:
-            pass
+            rq_lookup = lambda name: None
 
-        unrated_videos = []
-        for video_path in video_files:
-            video_name = os.path.basename(video_path)
-            if video_name not in rated_videos:
-                unrated_videos.append(video_path)
-
-        paginated_videos = unrated_videos[offset:offset + limit]
+        try:
+            paginated_videos, next_cursor = self._unrated_page(catalog, rated_videos, cursor, offset, limit, hidden)
+        except ValueError as e:
+            return self.send_json_response({'status': 'error', 'message': str(e)})
 
         result = []
-        for video_path in paginated_videos:
-            video_name = os.path.basename(video_path)
-            stat = os.stat(video_path)
+        for video_entry in paginated_videos:
+            video_name = video_entry.name
 
-            video_details, match_info = self._enhanced_video_search(video_name, knowledge)
+            video_details, match_info = self._enhanced_video_search(video_name, knowledge, kindex)
 
-            rq = rq_map.get(video_name)
+            rq = rq_lookup(video_name)
             # Merge enhanced metrics from knowledge (metrics) with basic auto_metrics
             auto_metrics = {}
             if isinstance(video_details, dict):
@@ -1578,8 +2355,8 @@ class QAReviewHandler(EnhancedVideoReviewHandler):
 
             video_info = {
                 'name': video_name,
-                'size_mb': round(stat.st_size / 1024 / 1024, 1),
-                'created': time.strftime("%Y-%m-%d %H:%M", time.localtime(stat.st_mtime)),
+                'size_mb': round(video_entry.size / 1024 / 1024, 1),
+                'created': time.strftime("%Y-%m-%d %H:%M", time.localtime(video_entry.mtime)),
                 'prompt': video_details.get('prompt', 'Промпт недоступний') if isinstance(video_details, dict) else 'Промпт недоступний',
                 'fps': (video_details.get('params', {}) or {}).get('fps', 'N/A') if isinstance(video_details, dict) else 'N/A',
                 'width': (video_details.get('params', {}) or {}).get('width', 'N/A') if isinstance(video_details, dict) else 'N/A',
@@ -1593,16 +2370,19 @@ class QAReviewHandler(EnhancedVideoReviewHandler):
                 'match_method': match_info['method'],
                 'search_details': match_info['details']
             }
-            result.append(video_info)
+            result.append(_project(video_info, fields))
 
-        self.send_json_response(result)
+        if cursor is not None:
+            return self.send_json_response({'items': result, 'next_cursor': next_cursor}, etag=etag)
+        self.send_json_response(result, etag=etag)
 
     def serve_search_api(self):
         """Search across files + rated + knowledge params."""
         url_parts = urllib.parse.urlparse(self.path)
         q = urllib.parse.parse_qs(url_parts.query)
 
-        name_sub = (q.get('q', [''])[0] or '').lower()
+        text_query = q.get('q', [''])[0] or ''
+        name_sub = text_query.lower()
         rated_filter = (q.get('rated', ['all'])[0] or 'all')  # 'all'|'true'|'false'
         banned_filter = q.get('banned', [''])[0]
         ref_filter = q.get('reference', [''])[0]
@@ -1615,93 +2395,43 @@ class QAReviewHandler(EnhancedVideoReviewHandler):
         scheduler_filter = (q.get('scheduler', [''])[0] or '').lower()
         offset = int(q.get('offset', ['0'])[0] or 0)
         limit = int(q.get('limit', ['100'])[0] or 100)
+        fields = _requested_fields(q, None)
+        text_fields = tuple(f for f in SEARCH_TEXT_FIELDS if fields and f in fields)
+        # facets=1 → усі; facets=sampler,combo → лише ці (рахуються по всьому результату, не по сторінці)
+        facets_param = (q.get('facets', [''])[0] or '').strip().lower()
+        if facets_param in ('1', 'true', 'all'):
+            facet_names = FACETS
+        else:
+            facet_names = tuple(f for f in facets_param.split(',') if f in FACETS)
 
-        manual = self._load_json(self.manual_ratings_file, {})
-        knowledge = self._load_json(self.knowledge_file, {"history": []})
-
-        # Build candidate name set: files + rated keys
-        files = [os.path.basename(p) for p in glob.glob(f"{self.video_dir}*.mp4")]
-        names = set(files) | set(manual.keys())
-
-        def knowledge_entry_for(name: str):
-            det, _mi = self._enhanced_video_search(name, knowledge)
-            return det or {}
-
-        def get_score(det: dict):
-            if not isinstance(det, dict):
-                return None
-            if 'overall' in det:
-                return det.get('overall')
-            m = det.get('metrics', {}) or {}
-            for k in ('overall', 'overall_simple', 'blended_overall'):
-                if k in m:
-                    return m.get(k)
-            return None
-
-        def params_of(det: dict):
-            p = (det.get('params', {}) if isinstance(det, dict) else {}) or {}
-            return {
-                'fps': p.get('fps'), 'width': p.get('width'), 'height': p.get('height'),
-                'sampler': p.get('sampler') or (det.get('combo', [None, None])[0] if isinstance(det.get('combo'), list) else None),
-                'scheduler': p.get('scheduler') or (det.get('combo', [None, None])[1] if isinstance(det.get('combo'), list) else None),
-            }
-
-        results = []
-        for name in names:
-            det = knowledge_entry_for(name)
-            score = get_score(det)
-            p = params_of(det)
-            mr = manual.get(name)
-            is_rated = bool(mr)
-            rating = (mr or {}).get('rating', {})
-            is_banned = bool(rating.get('banned'))
-            is_ref = bool(rating.get('is_reference'))
-            overall_manual = rating.get('overall_quality')
-
-            # Filters
-            if name_sub and name_sub not in name.lower():
-                continue
-            if rated_filter == 'true' and not is_rated:
-                continue
-            if rated_filter == 'false' and is_rated:
-                continue
-            if banned_filter:
-                want = banned_filter.lower() == 'true'
-                if is_banned != want:
-                    continue
-            if ref_filter:
-                want = ref_filter.lower() == 'true'
-                if is_ref != want:
-                    continue
-            if min_score >= 0 and (score is None or float(score) < min_score):
-                continue
-            if min_overall >= 0 and (overall_manual is None or float(overall_manual) < min_overall):
-                continue
-            if fps_filter and str(p.get('fps')) != fps_filter:
-                continue
-            if width_filter and str(p.get('width')) != width_filter:
-                continue
-            if height_filter and str(p.get('height')) != height_filter:
-                continue
-            if sampler_filter and str(p.get('sampler') or '').lower() != sampler_filter:
-                continue
-            if scheduler_filter and str(p.get('scheduler') or '').lower() != scheduler_filter:
-                continue
-
-            results.append({
-                'name': name,
-                'score': score,
-                'manual_overall': overall_manual,
-                'rated': is_rated,
-                'banned': is_banned,
-                'reference': is_ref,
-                'params': p,
-                'exists': name in files
-            })
-
-        results.sort(key=lambda x: (x['rated'] is False, -(x['score'] or -1)))
-        paged = results[offset:offset + limit]
-        self.send_json_response({'total': len(results), 'items': paged})
+        snap = self._state_snapshot()
+        catalog = self.catalog.snapshot()
+        etag = self._api_etag(snap, catalog)
+        if self._json_not_modified(etag):
+            return
+        knowledge = snap["knowledge"]
+        kindex = self._knowledge_index(snap)
+        index = self._search_index(snap, catalog, kindex)
+
+        # q: підрядок назви АБО всі слова в промптах/персоні (neg:, persona:, prefix*), тоді — за релевантністю
+        positions, page = index.search(
+            offset, limit, text_query=text_query,
+            name_sub=name_sub, rated=rated_filter, banned=banned_filter, reference=ref_filter,
+            min_score=min_score, min_overall=min_overall, fps=fps_filter, width=width_filter,
+            height=height_filter, sampler=sampler_filter, scheduler=scheduler_filter,
+        )
+        paged = []
+        for row in page:
+            item = row.item()
+            if text_fields:
+                det = self._enhanced_video_search(row.name, knowledge, kindex)[0] or {}
+                for f in text_fields:
+                    item[f] = det.get(f)
+            paged.append(_project(item, fields))
+        result = {'total': len(positions), 'items': paged}
+        if facet_names:
+            result['facets'] = index.facets(positions, facet_names)
+        self.send_json_response(result, etag=etag)
 
     def serve_video_details_api(self):
         url_parts = urllib.parse.urlparse(self.path)
@@ -1709,10 +2439,16 @@ class QAReviewHandler(EnhancedVideoReviewHandler):
         name = q.get('name', [''])[0]
         if not name:
             return self.send_json_response({'status': 'error', 'message': 'name required'})
+        # fields= звужує 'details' (напр. лише промпти для лінивого підвантаження в списку)
+        fields = _requested_fields(q, None)
 
-        manual = self._load_json(self.manual_ratings_file, {})
-        knowledge = self._load_json(self.knowledge_file, {"history": []})
-        det, mi = self._enhanced_video_search(name, knowledge)
+        snap = self._state_snapshot()
+        etag = self._api_etag(snap, self.catalog.snapshot())
+        if self._json_not_modified(etag):
+            return
+        manual = snap["manual_ratings"]
+        knowledge = snap["knowledge"]
+        det, mi = self._enhanced_video_search(name, knowledge, self._knowledge_index(snap))
         mr = manual.get(name, {})
         info = {
             'name': name,
@@ -1722,22 +2458,24 @@ class QAReviewHandler(EnhancedVideoReviewHandler):
             'exists': os.path.exists(os.path.join(self.video_dir, name))
         }
         try:
-            rq = self._load_json(self.review_queue_file, {"pending": []})
-            for entry in rq.get("pending", []):
-                en = os.path.basename(entry.get("original_path", ""))
-                if en == name:
-                    d = info['details'] if isinstance(info['details'], dict) else {}
-                    if isinstance(entry.get('auto_metrics'), dict):
-                        d.setdefault('auto_metrics', {}).update(entry['auto_metrics'])
-                    if isinstance(entry.get('params'), dict):
-                        d.setdefault('params', {}).update(entry['params'])
-                    if isinstance(entry.get('combo'), list):
-                        d.setdefault('combo', entry['combo'])
-                    info['details'] = d
-                    break
+            entry = self._review_queue_lookup(snap)(name)
+            if entry is not None:
+                # Копіюємо запис knowledge: кешований документ спільний між запитами
+                d = dict(info['details']) if isinstance(info['details'], dict) else {}
+                if isinstance(entry.get('auto_metrics'), dict):
+                    d['auto_metrics'] = dict(d.get('auto_metrics') or {})
+                    d['auto_metrics'].update(entry['auto_metrics'])
+                if isinstance(entry.get('params'), dict):
+                    d['params'] = dict(d.get('params') or {})
+                    d['params'].update(entry['params'])
+                if isinstance(entry.get('combo'), list):
+                    d.setdefault('combo', entry['combo'])
+                info['details'] = d
         except Exception:
             pass
-        self.send_json_response(info)
+        if fields is not None and isinstance(info['details'], dict):
+            info['details'] = _project(info['details'], fields, keep=())
+        self.send_json_response(info, etag=etag)
 
     def serve_search_page(self):
         html = """
@@ -1760,6 +2498,10 @@ class QAReviewHandler(EnhancedVideoReviewHandler):
     table { width:100%; border-collapse:collapse; margin-top:12px; }
     th, td { padding:8px; border-bottom:1px solid rgba(255,255,255,0.2); text-align:left; }
     .pill { padding:2px 6px; border-radius:10px; background:rgba(255,255,255,0.15); font-size:12px; }
+    .facet { margin:4px 0; display:flex; gap:6px; flex-wrap:wrap; align-items:center; }
+    .facet-title { opacity:0.8; font-size:13px; min-width:110px; }
+    .facet-chip.clickable { cursor:pointer; }
+    .facet-chip.clickable:hover { background:rgba(33,150,243,0.5); }
     a { color:#90caf9; }
   </style>
 </head>
@@ -1771,7 +2513,7 @@ class QAReviewHandler(EnhancedVideoReviewHandler):
   </div>
   <h2>Пошук відео</h2>
   <div class="row">
-    <input id="q" placeholder="Назва містить..." />
+    <input id="q" placeholder="Назва або слова промпту (neg:, persona:)..." />
     <select id="rated"><option value="all">Всі</option><option value="true">Тільки оцінені</option><option value="false">Тільки неоцінені</option></select>
     <select id="banned"><option value="">Бан? (всі)</option><option value="true">Тільки бан</option><option value="false">Без бану</option></select>
     <select id="reference"><option value="">Еталон? (всі)</option><option value="true">Так</option><option value="false">Ні</option></select>
@@ -1785,16 +2527,15 @@ class QAReviewHandler(EnhancedVideoReviewHandler):
     <button onclick="runSearch()">Шукати</button>
   </div>
 
+  <div id="facets" class="card"></div>
+
   <table id="res"><thead><tr><th>Відео</th><th>Score</th><th>Manual</th><th>Статус</th><th>Параметри</th><th></th></tr></thead><tbody></tbody></table>
 
   <script src="/static/search_page.js"></script>
 </body>
 </html>
 """
-        self.send_response(200)
-        self.send_header('Content-type', 'text/html; charset=utf-8')
-        self.end_headers()
-        self.wfile.write(html.encode('utf-8'))
+        self.send_html_response(html)
 
     def serve_watch_page(self):
         url_parts = urllib.parse.urlparse(self.path)
@@ -1858,10 +2599,307 @@ class QAReviewHandler(EnhancedVideoReviewHandler):
 </body>
 </html>
 """
-        self.send_response(200)
-        self.send_header('Content-type', 'text/html; charset=utf-8')
-        self.end_headers()
-        self.wfile.write(html.encode('utf-8'))
+        self.send_html_response(html)
+
+class _WorkerLane:
+    """Фіксований набір daemon-потоків зі спільною чергою задач."""
+
+    def __init__(self, name: str, size: int):
+        self.name = name
+        self.size = max(1, int(size))
+        self._tasks: queue.SimpleQueue = queue.SimpleQueue()
+        self.busy = 0
+        self.handled = 0
+        self._lock = threading.Lock()
+        for i in range(self.size):
+            threading.Thread(target=self._run, name=f"http-{name}-{i}", daemon=True).start()
+
+    def submit(self, fn, *args):
+        self._tasks.put((fn, args))
+
+    def _run(self):
+        while True:
+            fn, args = self._tasks.get()
+            with self._lock:
+                self.busy += 1
+            try:
+                fn(*args)
+            finally:
+                with self._lock:
+                    self.busy -= 1
+                    self.handled += 1
+
+    def stats(self) -> dict:
+        return {"workers": self.size, "busy": self.busy, "queued": self._tasks.qsize(), "handled": self.handled}
+
+
+class _SSEClient:
+    __slots__ = ('sock', 'feed', 'last_id', 'out')
+
+    def __init__(self, sock, feed, last_id: int):
+        self.sock = sock
+        self.feed = feed
+        self.last_id = last_id
+        self.out = bytearray()
+
+
+class _SSEWriter:
+    """Один потік із селектором пише всі відкриті потоки /api/events.
+
+    Обробник надсилає заголовки й першу порцію подій і віддає сокет сюди, тож
+    простоююча вкладка — лише зареєстрований сокет, а не зайнятий робочий потік.
+    Публікація в шину будить потік; кожна подія кодується один раз для всіх
+    клієнтів, раз на SSE_KEEPALIVE_S усім іде пінг. Запис неблокувальний: клієнт,
+    у якого набралося понад SSE_CLIENT_BUFFER_MAX непрочитаних байтів, відключається.
+    """
+
+    def __init__(self, close: Callable[[socket.socket], None]):
+        self._close = close
+        self._selector = selectors.DefaultSelector()
+        self._clients: Dict[socket.socket, _SSEClient] = {}
+        self._added: queue.SimpleQueue = queue.SimpleQueue()
+        self._buses = set()
+        self._lock = threading.Lock()
+        self._wakeup_r, self._wakeup_w = socket.socketpair()
+        self._wakeup_r.setblocking(False)
+        self._wakeup_w.setblocking(False)
+        self._selector.register(self._wakeup_r, selectors.EVENT_READ)
+        self._closing = False
+        self.dropped = 0
+        threading.Thread(target=self._loop, name="http-sse", daemon=True).start()
+
+    def add(self, sock, feed, last_id: int):
+        bus = feed.bus
+        with self._lock:
+            if id(bus) not in self._buses:
+                self._buses.add(id(bus))
+                bus.add_listener(lambda _event: self._wake())
+        bus.subscribe()
+        sock.setblocking(False)
+        self._added.put(_SSEClient(sock, feed, last_id))
+        self._wake()
+
+    def _wake(self):
+        try:
+            self._wakeup_w.send(b'\0')
+        except OSError:
+            # Буфер пробудження повний — потік і так прокинеться
+            pass
+
+    def _loop(self):
+        next_ping = time.monotonic() + SSE_KEEPALIVE_S
+        while not self._closing:
+            try:
+                events = self._selector.select(timeout=max(0.0, next_ping - time.monotonic()))
+            except OSError:
+                continue
+            for key, mask in events:
+                if key.fileobj is self._wakeup_r:
+                    try:
+                        while self._wakeup_r.recv(4096):
+                            pass
+                    except (BlockingIOError, InterruptedError):
+                        pass
+                    continue
+                client = key.data
+                if mask & selectors.EVENT_READ:
+                    try:
+                        closed = not client.sock.recv(4096)
+                    except (BlockingIOError, InterruptedError):
+                        closed = False
+                    except OSError:
+                        closed = True
+                    if closed:
+                        # Вкладку закрито
+                        self._drop(client)
+                        continue
+                if mask & selectors.EVENT_WRITE:
+                    self._flush(client)
+            while not self._added.empty():
+                client = self._added.get()
+                try:
+                    self._selector.register(client.sock, selectors.EVENT_READ, client)
+                except (ValueError, OSError):
+                    self._drop(client)
+                    continue
+                self._clients[client.sock] = client
+            self._send_new_events()
+            if time.monotonic() >= next_ping:
+                next_ping = time.monotonic() + SSE_KEEPALIVE_S
+                for client in list(self._clients.values()):
+                    client.out += b": keepalive\n\n"
+                    self._flush(client)
+
+    def _send_new_events(self):
+        encoded: Dict[tuple, bytes] = {}
+        resyncs: Dict[int, tuple] = {}
+        for client in list(self._clients.values()):
+            bus = client.feed.bus
+            if bus.last_id <= client.last_id:
+                continue
+            events = bus.since(client.last_id)
+            if events is None:
+                # Клієнт відстав більше ніж на буфер шини: свіжа статистика як нова точка відліку
+                if id(bus) not in resyncs:
+                    last_id = bus.last_id
+                    resyncs[id(bus)] = (last_id, _sse_message('resync', client.feed.current_stats(), last_id))
+                client.last_id, message = resyncs[id(bus)]
+                client.out += message
+            else:
+                for event in events:
+                    key = (id(bus), event.id)
+                    if key not in encoded:
+                        encoded[key] = _sse_message(event.type, event.data, event.id)
+                    client.out += encoded[key]
+                if events:
+                    client.last_id = events[-1].id
+            self._flush(client)
+
+    def _flush(self, client: _SSEClient):
+        if client.sock not in self._clients:
+            return
+        try:
+            while client.out:
+                sent = client.sock.send(client.out)
+                del client.out[:sent]
+        except (BlockingIOError, InterruptedError):
+            pass
+        except OSError:
+            self._drop(client)
+            return
+        if len(client.out) > SSE_CLIENT_BUFFER_MAX:
+            self._drop(client)
+            return
+        mask = selectors.EVENT_READ | (selectors.EVENT_WRITE if client.out else 0)
+        if self._selector.get_key(client.sock).events != mask:
+            self._selector.modify(client.sock, mask, client)
+
+    def _drop(self, client: _SSEClient):
+        if self._clients.pop(client.sock, None) is not None:
+            self._selector.unregister(client.sock)
+            self.dropped += 1
+        client.feed.bus.unsubscribe()
+        self._close(client.sock)
+
+    def stats(self) -> dict:
+        return {"clients": len(self._clients), "dropped": self.dropped}
+
+    def close(self):
+        self._closing = True
+        self._wake()
+
+
+class ReviewHTTPServer(socketserver.TCPServer):
+    """HTTP-сервер рев'ю з обмеженими пулами потоків і keep-alive без простою потоків.
+
+    Прийняте з'єднання (і кожне keep-alive з'єднання між запитами) чекає в селекторі.
+    Коли клієнт надсилає запит, сервер підглядає рядок запиту (MSG_PEEK) і віддає
+    з'єднання в одну з двох смуг: 'stream' для відео/зображень і 'api' для решти.
+    Тож кілька довгих завантажень відео не затримують JSON API, а простоюючі
+    вкладки браузера не займають робочих потоків: ні keep-alive, ні відкритий
+    /api/events (його після першої порції подій пише _SSEWriter).
+    """
+
+    allow_reuse_address = True
+    request_queue_size = SERVER_REQUEST_QUEUE_SIZE
+    parks_idle_connections = True
+
+    def __init__(self, server_address, RequestHandlerClass, bind_and_activate=True,
+                 api_workers: int = SERVER_API_WORKERS, stream_workers: int = SERVER_STREAM_WORKERS):
+        super().__init__(server_address, RequestHandlerClass, bind_and_activate)
+        self.api_lane = _WorkerLane('api', api_workers)
+        self.stream_lane = _WorkerLane('stream', stream_workers)
+        self.sse_writer = _SSEWriter(self.shutdown_request)
+        self._selector = selectors.DefaultSelector()
+        self._parked: Dict[socket.socket, tuple] = {}
+        self._to_park: queue.SimpleQueue = queue.SimpleQueue()
+        self._wakeup_r, self._wakeup_w = socket.socketpair()
+        self._wakeup_r.setblocking(False)
+        self._selector.register(self._wakeup_r, selectors.EVENT_READ)
+        self._closing = False
+        threading.Thread(target=self._idle_loop, name="http-keepalive", daemon=True).start()
+
+    # socketserver викликає це з потоку accept: лише ставимо з'єднання в очікування запиту
+    def process_request(self, request, client_address):
+        self._park(request, client_address)
+
+    def _park(self, sock, client_address):
+        self._to_park.put((sock, client_address))
+        try:
+            self._wakeup_w.send(b'\0')
+        except OSError:
+            pass
+
+    def _idle_loop(self):
+        while not self._closing:
+            try:
+                events = self._selector.select(timeout=1.0)
+            except OSError:
+                continue
+            now = time.monotonic()
+            for key, _ in events:
+                if key.fileobj is self._wakeup_r:
+                    try:
+                        while self._wakeup_r.recv(4096):
+                            pass
+                    except (BlockingIOError, InterruptedError):
+                        pass
+                    continue
+                sock = key.fileobj
+                client_address, _since = self._parked.pop(sock)
+                self._selector.unregister(sock)
+                self._dispatch(sock, client_address)
+            while not self._to_park.empty():
+                sock, client_address = self._to_park.get()
+                try:
+                    self._selector.register(sock, selectors.EVENT_READ)
+                except (ValueError, OSError):
+                    self.shutdown_request(sock)
+                    continue
+                self._parked[sock] = (client_address, now)
+            for sock, (client_address, since) in list(self._parked.items()):
+                if now - since > KEEPALIVE_IDLE_S:
+                    del self._parked[sock]
+                    self._selector.unregister(sock)
+                    self.shutdown_request(sock)
+
+    def _dispatch(self, sock, client_address):
+        try:
+            head = sock.recv(256, socket.MSG_PEEK)
+        except OSError:
+            head = b''
+        if not head:
+            # Клієнт закрив keep-alive з'єднання
+            self.shutdown_request(sock)
+            return
+        parts = head.split(b' ', 2)
+        target = parts[1].decode('latin-1') if len(parts) > 1 else ''
+        lane = self.stream_lane if target.startswith(STREAM_PATH_PREFIXES) else self.api_lane
+        lane.submit(self._serve_connection, sock, client_address)
+
+    def _serve_connection(self, sock, client_address):
+        try:
+            handler = self.RequestHandlerClass(sock, client_address, self)
+        except Exception:
+            self.handle_error(sock, client_address)
+            self.shutdown_request(sock)
+            return
+        if getattr(handler, 'sse_handoff', None) is not None:
+            self.sse_writer.add(sock, *handler.sse_handoff)
+        elif getattr(handler, 'parked', False):
+            self._park(sock, client_address)
+        else:
+            self.shutdown_request(sock)
+
+    def lane_stats(self) -> dict:
+        return {"api": self.api_lane.stats(), "stream": self.stream_lane.stats(), "sse": self.sse_writer.stats(),
+                "idle_keepalive": len(self._parked)}
+
+    def server_close(self):
+        self._closing = True
+        self.sse_writer.close()
+        super().server_close()
+
 
 if __name__ == '__main__':
     # Порт з ENV (SERVER_PORT/PORT), дефолт 8189
@@ -1880,11 +2918,9 @@ if __name__ == '__main__':
     print("  ✅ Спрощений алгоритм пошуку відео")
     print("  ✅ Покращена обробка помилок")
 
-    # Дозволяємо перевикористання адреси та багатопоточність для кращої продуктивності
-    class ThreadingTCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
-        allow_reuse_address = True
-
-    with ThreadingTCPServer(("", PORT), QAReviewHandler) as httpd:
+    # Фіксовані пули потоків (API / відео), SSE-записувач і HTTP/1.1 keep-alive
+    print(f"🧵 Потоків: API={SERVER_API_WORKERS}, відео={SERVER_STREAM_WORKERS}, SSE — один потік із селектором")
+    with ReviewHTTPServer(("", PORT), QAReviewHandler) as httpd:
         try:
             httpd.serve_forever()
         except KeyboardInterrupt:
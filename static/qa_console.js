@@ -1,6 +1,12 @@
+// Фільтр списку з фасетів (комбо / роздільність / fps): видно, де найбільше кліпів, і можна банити пачкою
+let qaFilter = {};
+
 async function loadVideos() {
-  const res = await fetch('/api/search?rated=all&offset=0&limit=50');
+  const params = new URLSearchParams({ rated: 'all', offset: '0', limit: '50', facets: 'combo,resolution,fps' });
+  for (const [k, v] of Object.entries(qaFilter)) params.set(k, v);
+  const res = await fetch('/api/search?' + params.toString());
   const data = await res.json();
+  renderQaFacets(data.facets || {});
   const items = data.items || [];
   const box = document.getElementById('list');
   box.innerHTML = '';
@@ -20,12 +26,49 @@ async function loadVideos() {
         <div>
           <a href="/watch?name=${encodeURIComponent(v.name)}" style="margin-right:8px;color:#90caf9">Відкрити</a>
           <button onclick="banByVideo('${v.name}')">🚫 Ban combo</button>
+          <button onclick="queueBan('${v.name}', this)" style="background:#8E24AA">+ У чергу</button>
         </div>
       </div>`;
     box.appendChild(el);
   }
 }
 
+function renderQaFacets(facets) {
+  const box = document.getElementById('facets');
+  if (!box) return;
+  box.innerHTML = '';
+  const groups = [
+    ['combo', 'Комбо', v => v.sampler && v.scheduler ? { sampler: v.sampler, scheduler: v.scheduler } : null],
+    ['resolution', 'Роздільність', v => v.width && v.height ? { width: v.width, height: v.height } : null],
+    ['fps', 'FPS', v => v.value ? { fps: v.value } : null],
+  ];
+  for (const [name, title, toFilter] of groups) {
+    const values = facets[name] || [];
+    if (!values.length) continue;
+    const row = document.createElement('div');
+    row.className = 'facet';
+    row.innerHTML = `<span class="small">${title}:</span>`;
+    for (const v of values.slice(0, 10)) {
+      const filter = toFilter(v);
+      const chip = document.createElement('button');
+      chip.className = 'chip';
+      chip.textContent = `${v.value ?? '—'} · ${v.count}`;
+      if (filter && Object.entries(filter).every(([k, val]) => qaFilter[k] === val)) chip.classList.add('active');
+      chip.disabled = !filter;
+      chip.onclick = () => { qaFilter = Object.assign({}, qaFilter, filter); loadVideos(); };
+      row.appendChild(chip);
+    }
+    box.appendChild(row);
+  }
+  if (Object.keys(qaFilter).length) {
+    const reset = document.createElement('button');
+    reset.className = 'chip';
+    reset.textContent = '✕ Скинути фільтр';
+    reset.onclick = () => { qaFilter = {}; loadVideos(); };
+    box.appendChild(reset);
+  }
+}
+
 async function banByVideo(videoName) {
   const res = await fetch('/api/ban_combo', {
     method: 'POST',
@@ -42,6 +85,49 @@ async function banByVideo(videoName) {
   }
 }
 
+// Черга банів: збирається локально і застосовується одним запитом /api/ban_combo_batch
+let banQueue = [];
+
+function renderBanQueue() {
+  const bar = document.getElementById('ban-queue-bar');
+  if (!bar) return;
+  bar.style.display = banQueue.length ? 'block' : 'none';
+  document.getElementById('ban-queue-count').textContent = banQueue.length;
+}
+
+function queueBan(videoName, button) {
+  if (!banQueue.includes(videoName)) banQueue.push(videoName);
+  const card = button && button.closest('.card');
+  if (card) card.classList.add('queued');
+  renderBanQueue();
+}
+
+function clearBanQueue() {
+  banQueue = [];
+  document.querySelectorAll('.card.queued').forEach(el => el.classList.remove('queued'));
+  renderBanQueue();
+}
+
+async function flushBans() {
+  if (!banQueue.length) return;
+  const batch = banQueue.slice();
+  const res = await fetch('/api/ban_combo_batch', {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify({ bans: batch.map(name => ({ video_name: name })) })
+  });
+  const data = await res.json();
+  if (data.status === 'success') {
+    banQueue = banQueue.filter(name => !batch.includes(name));
+    renderBanQueue();
+    const marked = (data.results || []).filter(r => r.video_marked).length;
+    alert('✅ Забанено комбо: ' + data.accepted + '\nВідео позначено: ' + marked + '\nВсього в бані: ' + data.total_banned);
+    try { await loadVideos(); } catch(_) {}
+  } else {
+    alert('❌ Помилка: ' + (data.message || 'unknown'));
+  }
+}
+
 window.addEventListener('load', loadVideos);
 
 
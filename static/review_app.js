@@ -3,11 +3,82 @@ let videos = [];
 let stats = {};
 let videosPerPage = 50; // Зменшено для стабільності
 let loadedVideos = 0;
+let nextCursor = null; // непрозорий курсор наступної сторінки (null — сторінок більше немає)
+// Список віддає "легкі" елементи; промпти підвантажуються окремо для поточного відео
+const VIDEO_TEXT_FIELDS = 'prompt,negative_prompt,photo_prompt,photo_negative';
+const videoTextCache = new Map();
+// Черга оцінок: зберігається в localStorage і відправляється пачкою через /api/rate_batch
+const RATING_BATCH_SIZE = 10;
+const RATING_FLUSH_DELAY_MS = 5000;
+const RATING_QUEUE_KEY = 'eva_rating_queue';
+let ratingQueue = loadRatingQueue();
+let ratingFlushTimer = null;
+let ratingFlush = null;
+// Push-канал /api/events: нові відео, оцінки з інших вкладок і дельти статистики без опитувань
+let eventSource = null;
+let eventsConnected = false;
+let newVideosCount = 0;
+// Оренда відео на екрані в черзі рецензування (сервер з REVIEW_QUEUE=log): інші рецензенти його не отримують
+const REVIEWER_KEY = 'eva_reviewer_id';
+const LEASE_RENEW_MS = 120000; // оренда на сервері — REVIEW_LEASE_S (600 с)
+const reviewerId = loadReviewerId();
+let leaseEnabled = true; // false, якщо сервер без журналу черги
+let leasedVideo = null;
+let leaseTimer = null;
 
 // Завантаження початкових даних
 async function initializeApp() {
     console.log('🚀 Ініціалізація програми...');
+    // Оцінки, що не встигли відправитись у минулій сесії
+    await flushRatings();
     await Promise.all([loadStats(), loadVideos()]);
+    connectEvents();
+}
+
+function connectEvents() {
+    if (!window.EventSource || eventSource) return;
+    // Після розриву EventSource перепідключається сам і передає Last-Event-ID
+    eventSource = new EventSource('/api/events');
+    eventSource.onopen = () => { eventsConnected = true; };
+    eventSource.onerror = () => { eventsConnected = false; };
+    const on = (type, handler) => eventSource.addEventListener(type, event => handler(JSON.parse(event.data)));
+    on('stats', delta => {
+        Object.assign(stats, delta);
+        renderStats();
+    });
+    on('resync', fullStats => {
+        stats = fullStats;
+        renderStats();
+    });
+    on('video_added', data => {
+        if (videos.length === 0) {
+            loadVideos();
+        } else {
+            newVideosCount += data.videos.length;
+            renderStats();
+        }
+    });
+    on('video_rated', data => dropVideos(data.videos.map(item => item.video)));
+    on('combo_banned', data => dropVideos(data.videos));
+}
+
+// Відео, оцінені/забанені в іншій вкладці, прибираємо зі списку (крім того, що зараз на екрані)
+function dropVideos(names) {
+    const current = videos[currentVideoIndex];
+    const gone = new Set(names);
+    if (current) gone.delete(current.name);
+    const before = videos.length;
+    videos = videos.filter(video => !gone.has(video.name));
+    if (videos.length === before) return;
+    if (current) currentVideoIndex = videos.indexOf(current);
+    loadedVideos = videos.length;
+}
+
+async function showNewVideos() {
+    newVideosCount = 0;
+    currentVideoIndex = 0;
+    renderStats();
+    await loadVideos();
 }
 
 async function loadStats() {
@@ -22,10 +93,11 @@ async function loadStats() {
     }
 }
 
-async function loadVideos(offset = 0) {
+async function loadVideos(cursor = '') {
     try {
-        console.log(`🎬 Завантаження відео: offset=${offset}, limit=${videosPerPage}`);
-        const url = `/api/videos?offset=${offset}&limit=${videosPerPage}`;
+        const firstPage = !cursor;
+        console.log(`🎬 Завантаження відео: cursor=${cursor || '(перша сторінка)'}, limit=${videosPerPage}`);
+        const url = `/api/videos?cursor=${encodeURIComponent(cursor)}&limit=${videosPerPage}&reviewer=${encodeURIComponent(reviewerId)}`;
         console.log('🌐 URL запиту:', url);
         
         const response = await fetch(url);
@@ -35,24 +107,31 @@ async function loadVideos(offset = 0) {
             throw new Error(`HTTP ${response.status}: ${response.statusText}`);
         }
         
-        const newVideos = await response.json();
+        const page = await response.json();
+        if (page.status === 'error') {
+            throw new Error(page.message);
+        }
+        // Оцінені, але ще не відправлені відео не показуємо повторно
+        const queued = new Set(ratingQueue.map(item => item.video_name));
+        const newVideos = (page.items || []).filter(video => !queued.has(video.name));
+        nextCursor = page.next_cursor || null;
         console.log(`📦 Отримано відео: ${newVideos.length}`);
         
-        if (offset === 0) {
+        if (firstPage) {
             videos = newVideos;
         } else {
             videos = videos.concat(newVideos);
         }
         
-        loadedVideos = offset + newVideos.length;
+        loadedVideos = videos.length;
         console.log(`📈 Всього завантажено: ${loadedVideos}`);
         
         if (videos.length > 0) {
             renderVideoInterface();
-            if (offset === 0) {
+            if (firstPage) {
                 displayVideo(0);
             }
-        } else if (offset === 0) {
+        } else if (firstPage) {
             renderNoVideos();
         }
     } catch (error) {
@@ -89,12 +168,18 @@ function renderStats() {
             <div class="stat-value">${stats.learning_arms || 0}</div>
             <div class="stat-label">Варіантів навчання</div>
         </div>
+        ${newVideosCount ? `
+        <div class="stat-card" style="cursor: pointer;" onclick="showNewVideos()">
+            <div class="stat-value">🆕 ${newVideosCount}</div>
+            <div class="stat-label">Нові відео — показати</div>
+        </div>` : ''}
     `;
 }
 
 function renderVideoInterface() {
-    const loadMoreButton = loadedVideos < stats.pending_count ? 
-        `<button class="load-more-btn" onclick="loadMoreVideos()">Завантажити ще ${Math.min(videosPerPage, stats.pending_count - loadedVideos)} відео</button>` : '';
+    const remaining = Math.max((stats.pending_count || 0) - loadedVideos, 0);
+    const loadMoreButton = nextCursor ? 
+        `<button class="load-more-btn" onclick="loadMoreVideos()">Завантажити ще ${remaining ? Math.min(videosPerPage, remaining) : videosPerPage} відео</button>` : '';
     
     document.getElementById('video-section').innerHTML = `
         <div class="video-section">
@@ -112,8 +197,11 @@ function renderVideoInterface() {
 }
 
 async function loadMoreVideos() {
-    await loadVideos(loadedVideos);
+    if (!nextCursor) return;
+    const index = currentVideoIndex;
+    await loadVideos(nextCursor);
     renderVideoInterface();
+    displayVideo(index);
 }
 
 function renderNoVideos() {
@@ -157,12 +245,117 @@ function formatAutoMetrics(metrics) {
     return metricItems.length > 0 ? `<div class="auto-metrics">${metricItems.join('')}</div>` : '<div class="debug-info">⚠️ Немає числових метрик</div>';
 }
 
+function fetchVideoText(name) {
+    if (videoTextCache.has(name)) return videoTextCache.get(name);
+    const request = fetch(`/api/video_details?name=${encodeURIComponent(name)}&fields=${VIDEO_TEXT_FIELDS}`)
+        .then(response => response.ok ? response.json() : {})
+        .then(info => (info && info.details) || {})
+        .catch(error => {
+            console.error('❌ Помилка завантаження промпту:', error);
+            videoTextCache.delete(name);
+            return {};
+        });
+    videoTextCache.set(name, request);
+    return request;
+}
+
+async function showVideoPrompt(video) {
+    const details = await fetchVideoText(video.name);
+    if (videos[currentVideoIndex] !== video) return;
+    video.prompt = details.prompt || '';
+    const el = document.getElementById('video-prompt');
+    if (el) el.textContent = video.prompt || '⚠️ Промпт не знайдений в knowledge.json';
+}
+
+function loadReviewerId() {
+    const fresh = 'reviewer-' + Math.random().toString(36).slice(2, 10);
+    try {
+        let id = localStorage.getItem(REVIEWER_KEY);
+        if (!id) {
+            id = fresh;
+            localStorage.setItem(REVIEWER_KEY, id);
+        }
+        return id;
+    } catch (_) {
+        return fresh;
+    }
+}
+
+// Орендує (або подовжує) відео; false — його вже рецензує інший
+async function leaseVideo(video) {
+    if (!leaseEnabled) return true;
+    if (leasedVideo && leasedVideo !== video.name) releaseVideo(leasedVideo);
+    clearTimeout(leaseTimer);
+    try {
+        const response = await fetch('/api/review/lease', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ reviewer: reviewerId, video_name: video.name })
+        });
+        const result = await response.json();
+        if (result.status !== 'success') {
+            leaseEnabled = false;
+            return true;
+        }
+        if (result.held_by && result.held_by !== reviewerId) return false;
+        // Відео поза чергою (згенероване до неї) орендувати нічого
+        leasedVideo = result.items.length ? video.name : null;
+        if (leasedVideo) {
+            leaseTimer = setTimeout(() => {
+                const current = videos[currentVideoIndex];
+                if (current && current.name === leasedVideo) leaseVideo(current);
+            }, LEASE_RENEW_MS);
+        }
+    } catch (error) {
+        console.error('❌ Помилка оренди відео:', error);
+    }
+    return true;
+}
+
+function releaseVideo(name) {
+    if (leasedVideo === name) {
+        leasedVideo = null;
+        clearTimeout(leaseTimer);
+    }
+    fetch('/api/review/release', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ reviewer: reviewerId, video_name: name }),
+        keepalive: true
+    }).catch(() => {});
+}
+
+// Відео, яке тим часом узяв інший рецензент, прибираємо і показуємо наступне
+function claimVideo(video) {
+    leaseVideo(video).then(ok => {
+        const index = videos.indexOf(video);
+        if (ok || index < 0) return;
+        const current = videos[currentVideoIndex];
+        videos.splice(index, 1);
+        loadedVideos = videos.length;
+        if (current !== video) {
+            // Рецензент уже перейшов до іншого відео
+            currentVideoIndex = Math.max(0, videos.indexOf(current));
+            return;
+        }
+        if (videos.length > 0) {
+            displayVideo(Math.min(index, videos.length - 1));
+        } else if (nextCursor) {
+            currentVideoIndex = 0;
+            loadMoreVideos();
+        } else {
+            renderNoVideos();
+        }
+    });
+}
+
 function displayVideo(index) {
     if (index < 0 || index >= videos.length) return;
     
     currentVideoIndex = index;
     const video = videos[index];
     const videoUrl = `/video/${encodeURIComponent(video.name)}`;
+    claimVideo(video);
     
     // Debug інформація
     console.log('🎬 Відображення відео:', video);
@@ -178,7 +371,7 @@ function displayVideo(index) {
             <div class="video-info">
                 <div class="info-section">
                     <div class="info-title">📝 Промпт</div>
-                    <div class="info-content">${video.prompt && video.prompt !== 'Промпт недоступний' ? video.prompt : '⚠️ Промпт не знайдений в knowledge.json'}</div>
+                    <div class="info-content" id="video-prompt">${video.prompt === undefined ? '⏳ Завантаження промпту...' : (video.prompt && video.prompt !== 'Промпт недоступний' ? video.prompt : '⚠️ Промпт не знайдений в knowledge.json')}</div>
                 </div>
                 
                 <div class="info-section">
@@ -314,6 +507,10 @@ function displayVideo(index) {
     document.getElementById('current-index').textContent = index + 1;
     document.getElementById('prev-btn').disabled = index === 0;
     document.getElementById('next-btn').disabled = index === videos.length - 1;
+
+    // Промпт поточного відео + попереднє підвантаження наступного
+    if (video.prompt === undefined) showVideoPrompt(video);
+    if (index + 1 < videos.length) fetchVideoText(videos[index + 1].name);
 }
 
 function updateRatingValue(input) {
@@ -341,6 +538,76 @@ function skipVideo() {
     nextVideo();
 }
 
+function loadRatingQueue() {
+    try {
+        return JSON.parse(localStorage.getItem(RATING_QUEUE_KEY) || '[]');
+    } catch (_) {
+        return [];
+    }
+}
+
+function saveRatingQueue() {
+    try {
+        localStorage.setItem(RATING_QUEUE_KEY, JSON.stringify(ratingQueue));
+    } catch (_) {}
+}
+
+function queueRating(videoName, rating) {
+    ratingQueue.push({ video_name: videoName, rating: rating });
+    saveRatingQueue();
+    clearTimeout(ratingFlushTimer);
+    if (ratingQueue.length >= RATING_BATCH_SIZE) {
+        flushRatings();
+    } else {
+        ratingFlushTimer = setTimeout(flushRatings, RATING_FLUSH_DELAY_MS);
+    }
+}
+
+function flushRatings() {
+    clearTimeout(ratingFlushTimer);
+    if (ratingFlush) return ratingFlush;
+    if (ratingQueue.length === 0) return Promise.resolve();
+    const batch = ratingQueue.slice();
+    ratingFlush = (async () => {
+        try {
+            const response = await fetch('/api/rate_batch', {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ ratings: batch })
+            });
+            const result = await response.json();
+            if (result.status !== 'success') {
+                throw new Error(result.message || 'Невідома помилка');
+            }
+            ratingQueue = ratingQueue.slice(batch.length);
+            saveRatingQueue();
+            console.log(`💾 Відправлено оцінок: ${result.accepted}`);
+            // Зі з'єднаним /api/events статистика прийде дельтою сама
+            if (!eventsConnected) await loadStats();
+        } catch (error) {
+            console.error('❌ Помилка відправки оцінок, повтор пізніше:', error);
+            ratingFlushTimer = setTimeout(flushRatings, RATING_FLUSH_DELAY_MS);
+        } finally {
+            ratingFlush = null;
+        }
+    })();
+    return ratingFlush;
+}
+
+// Закриття вкладки: залишок черги віддаємо браузеру, щоб не чекати наступної сесії
+window.addEventListener('pagehide', () => {
+    if (leasedVideo && navigator.sendBeacon) {
+        const lease = new Blob([JSON.stringify({ reviewer: reviewerId, video_name: leasedVideo })], { type: 'application/json' });
+        navigator.sendBeacon('/api/review/release', lease);
+    }
+    if (ratingQueue.length === 0 || ratingFlush || !navigator.sendBeacon) return;
+    const body = new Blob([JSON.stringify({ ratings: ratingQueue })], { type: 'application/json' });
+    if (navigator.sendBeacon('/api/rate_batch', body)) {
+        ratingQueue = [];
+        saveRatingQueue();
+    }
+});
+
 async function submitRating(event) {
     event.preventDefault();
     
@@ -365,44 +632,34 @@ async function submitRating(event) {
     rating.rated_by = 'manual_review';
 
     try {
-        const response = await fetch('/api/rate', {
-            method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({
-                video_name: formData.get('video_name'),
-                rating: rating
-            })
-        });
+        queueRating(formData.get('video_name'), rating);
+
+        // Показати повідомлення про успіх
+        const successDiv = document.createElement('div');
+        successDiv.className = 'success-message';
+        successDiv.textContent = `✅ Оцінку збережено (у черзі на відправку: ${ratingQueue.length})`;
+        document.getElementById('video-content').prepend(successDiv);
         
-        const result = await response.json();
+        // Видалення оціненого відео зі списку; оренду не повертаємо — оцінка завершить кліп у черзі
+        videos.splice(currentVideoIndex, 1);
+        leasedVideo = null;
+        clearTimeout(leaseTimer);
         
-        if (result.status === 'success') {
-            // Показати повідомлення про успіх
-            const successDiv = document.createElement('div');
-            successDiv.className = 'success-message';
-            successDiv.textContent = '✅ Оцінка успішно збережена!';
-            document.getElementById('video-content').prepend(successDiv);
-            
-            // Видалення оціненого відео зі списку
-            videos.splice(currentVideoIndex, 1);
-            
-            // Оновлення статистики
-            await loadStats();
-            
-            setTimeout(() => {
-                if (videos.length === 0) {
-                    renderNoVideos();
-                } else {
-                    // Показ наступного відео або попереднього, якщо це було останнє
-                    if (currentVideoIndex >= videos.length) {
-                        currentVideoIndex = videos.length - 1;
-                    }
-                    displayVideo(currentVideoIndex);
+        setTimeout(async () => {
+            if (videos.length === 0 && nextCursor) {
+                // Курсор не залежить від оцінених відео: наступна сторінка без пропусків
+                currentVideoIndex = 0;
+                await loadMoreVideos();
+            } else if (videos.length === 0) {
+                renderNoVideos();
+            } else {
+                // Показ наступного відео або попереднього, якщо це було останнє
+                if (currentVideoIndex >= videos.length) {
+                    currentVideoIndex = videos.length - 1;
                 }
-            }, 1000);
-        } else {
-            throw new Error(result.message || 'Невідома помилка');
-        }
+                displayVideo(currentVideoIndex);
+            }
+        }, 1000);
     } catch (error) {
         console.error('❌ Помилка:', error);
         const errorDiv = document.createElement('div');
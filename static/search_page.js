@@ -3,8 +3,10 @@ async function runSearch() {
   const get = id => document.getElementById(id).value.trim();
   const fields = ['q','rated','banned','reference','min_score','min_overall','fps','width','height','sampler','scheduler'];
   for (const f of fields) { const v = get(f); if (v) params.set(f, v); }
+  params.set('facets', '1');
   const res = await fetch('/api/search?' + params.toString());
   const data = await res.json();
+  renderFacets(data.facets);
   const tb = document.querySelector('#res tbody');
   tb.innerHTML='';
   for (const it of data.items) {
@@ -22,6 +24,44 @@ async function runSearch() {
     tb.appendChild(tr);
   }
 }
+
+// Фасети: кількість кліпів на значення для поточних фільтрів; клік — додати значення у фільтр
+const FACET_TITLES = { combo: 'Комбо', sampler: 'Sampler', scheduler: 'Scheduler', fps: 'FPS', resolution: 'Роздільність', rating: 'Оцінка' };
+
+function facetFilter(name, v) {
+  if (name === 'combo') return v.sampler && v.scheduler ? { sampler: v.sampler, scheduler: v.scheduler } : null;
+  if (name === 'resolution') return v.width && v.height ? { width: v.width, height: v.height } : null;
+  if (name === 'rating') return v.value === 'unrated' ? { rated: 'false' } : { rated: 'true', min_overall: v.value.split('-')[0] };
+  return v.value ? { [name]: v.value } : null;
+}
+
+function renderFacets(facets) {
+  const box = document.getElementById('facets');
+  if (!box) return;
+  box.innerHTML = '';
+  for (const [name, values] of Object.entries(facets || {})) {
+    if (!values.length) continue;
+    const group = document.createElement('div');
+    group.className = 'facet';
+    group.innerHTML = `<span class="facet-title">${FACET_TITLES[name] || name}:</span>`;
+    for (const v of values.slice(0, 12)) {
+      const chip = document.createElement('span');
+      chip.className = 'pill facet-chip';
+      chip.textContent = `${v.value ?? '—'} (${v.count})`;
+      const filter = facetFilter(name, v);
+      if (filter) {
+        chip.classList.add('clickable');
+        chip.onclick = () => {
+          for (const [id, val] of Object.entries(filter)) document.getElementById(id).value = val;
+          runSearch();
+        };
+      }
+      group.appendChild(chip);
+    }
+    box.appendChild(group);
+  }
+}
+
 runSearch();
 
 